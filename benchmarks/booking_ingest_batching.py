@@ -0,0 +1,64 @@
+"""Validated booking submissions per second, one transaction each vs. batched.
+
+Run from the repository root: ``python -m benchmarks.booking_ingest_batching [bookings]``
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from booking_ingest import BookingIngestor
+from models import BookingData
+
+PAYLOAD = {
+    "jina_la_kwanza": "Asha", "jina_la_kati": "Juma", "jina_la_mwisho": "Said", "jinsia": "F",
+    "uraia": "TZ", "namba_ya_simu": "+255712345678", "barua_pepe": "asha@example.com",
+    "aina_ya_usafiri": "ONE_WAY", "uelekeo": "DAR_ZNZ", "idadi_ya_wasafiri": "2",
+    "tarehe_ya_kusafiri": "2025-07-01", "boti_ya_kusafiria": "KILIMANJARO_VI",
+    "daraja_la_kusafiria": "ECO", "wasafiri_wengine": "Juma Said", "aina_ya_malipo": "SIMU",
+    "namba_ya_malipo": "0712345678", "flow_token": "bench",
+}
+
+
+async def batched(db_path: str, n: int) -> None:
+    ingestor = BookingIngestor(db_path, max_queue=n)
+    started = time.perf_counter()
+    for i in range(n):
+        ingestor.submit(f"batched-{i}", BookingData.model_validate(PAYLOAD), "bench")
+        if i % 100 == 0:
+            await asyncio.sleep(0)  # let the writer pick up batches as a live server would
+    accept_s = time.perf_counter() - started
+    await ingestor.flush()
+    total_s = time.perf_counter() - started
+    assert ingestor.written == n
+    print(f"validate + queue (request): {n / accept_s:10,.0f} bookings/s")
+    print(f"validate + batched insert:  {n / total_s:10,.0f} bookings/s in {ingestor.batches} batches")
+    await ingestor.close()
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    workdir = tempfile.mkdtemp(prefix="bookings-")
+    try:
+        started = time.perf_counter()
+        for _ in range(n):
+            BookingData.model_validate(PAYLOAD)
+        print(f"validation only:            {n / (time.perf_counter() - started):10,.0f} bookings/s")
+
+        single = BookingIngestor(os.path.join(workdir, "single.db"))
+        started = time.perf_counter()
+        for i in range(n):
+            single._write_batch([(f"single-{i}", "bench", time.time(), BookingData.model_validate(PAYLOAD))])
+        print(f"validate + insert each:     {n / (time.perf_counter() - started):10,.0f} bookings/s")
+        asyncio.run(single.close())
+
+        asyncio.run(batched(os.path.join(workdir, "batched.db"), n))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
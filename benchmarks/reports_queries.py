@@ -0,0 +1,81 @@
+"""Report load and query costs over synthetic months of bookings, with and without NumPy.
+
+Run from the repository root: ``python -m benchmarks.reports_queries [legs]``
+"""
+
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import reports
+from reports import BookingReports
+
+ROUTES = ("DAR_ZNZ", "ZNZ_DAR", "ZNZ_PEM", "PEM_ZNZ", "DAR_PEM", "PEM_DAR")
+CLASSES = ("economy", "vip", "first_class")
+QUERIES = ((("day", "route"), {}), (("route",), {}), (("seat_class",), {}),
+           (("payment_method",), {}), (("month", "seat_class"), {"route": "DAR_ZNZ"}))
+
+
+def synthetic_bookings(n: int, today: date) -> list:
+    """Bookings adding up to at least ``n`` legs over the 120 days from ``today``."""
+    rng = random.Random(7)
+    bookings = []
+    legs = 0
+    while legs < n:
+        going = today + timedelta(days=rng.randrange(120))
+        round_trip = rng.random() < 0.3
+        legs += 2 if round_trip else 1
+        bookings.append({
+            "travel_details": {
+                "trip_type": "round_trip" if round_trip else "one_way",
+                "going_route": rng.choice(ROUTES),
+                "return_route": rng.choice(ROUTES),
+            },
+            "time_selections": {
+                "going_time": going.strftime("%Y_%m_%d$") + rng.choice(("08_00", "12_00", "16_00", "20_00")),
+                "return_time": (going + timedelta(days=3)).strftime("%Y_%m_%d$16_00"),
+            },
+            "seat_selections": {"seat_class": rng.choice(CLASSES), "adult_passengers": str(rng.randint(1, 3)),
+                                "child_passengers": str(rng.randint(0, 2))},
+            "fare": {"currency": "TZS", "total_minor": 10_000_000},
+            "payment": {"method": rng.choice(("SIMU", "KADI"))},
+        })
+    return bookings
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    today = date(2025, 7, 1)
+    directory = tempfile.mkdtemp(prefix="reports-")
+    saved = reports._numpy
+    try:
+        writer = BookingReports(directory, "w000")
+        writer.load()
+        bookings = synthetic_bookings(n, today)
+        started = time.perf_counter()
+        for booking in bookings:
+            writer.record(booking, tenant_id="255700000001")
+        record_s = time.perf_counter() - started
+        started = time.perf_counter()
+        writer.flush()
+        print(f"record: {record_s / writer.rows * 1e6:.2f} us/leg, flush {writer.rows:,} legs: "
+              f"{(time.perf_counter() - started) * 1000:.0f} ms, {writer.stats()['cube_cells']:,} cube cells")
+
+        for use_numpy in ((True, False) if saved() is not None else (False,)):
+            reports._numpy = saved if use_numpy else (lambda: None)
+            reader = BookingReports(directory, "w001")
+            print(f"numpy={use_numpy}: load other worker's {writer.rows:,} legs: {reader.load()['ms']:.0f} ms")
+            for group_by, options in QUERIES:
+                result = reader.report(group_by, start=today, end=today + timedelta(days=89), **options)
+                print(f"  group by {','.join(group_by):<20} {len(result['rows']):>5} rows, "
+                      f"{result['cells_scanned']:,} cells: {result['ms']:.1f} ms")
+    finally:
+        reports._numpy = saved
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Restore benchmark for 100k sessions.
+
+Run from the repository root: ``python -m benchmarks.session_store_restore [sessions]``
+"""
+
+import asyncio
+import shutil
+import sys
+import tempfile
+import time
+
+from session_store import SessionStore
+
+
+async def populate(directory: str, n: int) -> None:
+    store = SessionStore(directory, flush_interval=3600)
+    for i in range(n):
+        store.put(f"token-{i}", {
+            "flow_token": f"token-{i}",
+            "created_at": time.time(),
+            "status": "in_progress",
+            "user_data": {
+                "travel_details": {"trip_type": "one_way", "going_route": "DAR_ZNZ",
+                                   "going_no_passengers": "2", "going_date": "2025-08-01"},
+                "seat_selections": {"seat_class": "economy", "adult_passengers": "2"},
+            },
+        })
+    started = time.perf_counter()
+    store.flush()
+    print(f"flush {n:,} sessions to log: {(time.perf_counter() - started) * 1000:.0f} ms")
+    started = time.perf_counter()
+    await store.compact()
+    print(f"compact into snapshot:       {(time.perf_counter() - started) * 1000:.0f} ms")
+    for i in range(0, n, 10):
+        store.put(f"token-{i}", {"flow_token": f"token-{i}", "status": "updated", "user_data": {}})
+    store.flush()
+    await store.close()
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    directory = tempfile.mkdtemp(prefix="sessions-")
+    try:
+        asyncio.run(populate(directory, n))
+
+        store = SessionStore(directory)
+        started = time.perf_counter()
+        store.restore()
+        print(f"restore index of {len(store):,} sessions: {(time.perf_counter() - started) * 1000:.0f} ms")
+        started = time.perf_counter()
+        for i in range(1000):
+            store.get(f"token-{i * 97 % n}")
+        print(f"lazy get (first access):        {(time.perf_counter() - started) * 1000:.2f} us/session")
+        assert store.get("token-10")["status"] == "updated"
+        assert store.get("token-11")["status"] == "in_progress"
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
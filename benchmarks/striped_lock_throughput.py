@@ -0,0 +1,95 @@
+"""Lost updates and throughput, unlocked vs. striped, in one and in several processes.
+
+Run from the repository root: ``python -m benchmarks.striped_lock_throughput``
+"""
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+from utils.striped_lock import FileStripedLock, StripedLock
+
+TOKENS = 200
+UPDATES_PER_TOKEN = 50
+FILE_TOKENS = 20
+
+
+async def session_updates(store: Dict[str, int], lock: Optional[StripedLock]) -> float:
+    """Concurrent read-modify-write of per-token counters with an await in between, like a flow handler."""
+
+    async def update(token: str):
+        async with (lock.hold(token) if lock else nullcontext()):
+            value = store.get(token, 0)
+            await asyncio.sleep(0)
+            store[token] = value + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(update(f"tok{t}") for _ in range(UPDATES_PER_TOKEN) for t in range(TOKENS)))
+    return time.perf_counter() - started
+
+
+def worker(directory: str, lock_path: Optional[str], updates: int, ready) -> None:
+    """One uvicorn worker's share of the updates, each a read-modify-write of a file."""
+
+    async def run():
+        lock = FileStripedLock(lock_path) if lock_path else None
+
+        async def update(token: str):
+            async with (lock.hold(token) if lock else nullcontext()):
+                path = os.path.join(directory, token)
+                with open(path) as f:
+                    value = int(f.read() or 0)
+                await asyncio.sleep(0)
+                with open(path, "w") as f:
+                    f.write(str(value + 1))
+
+        ready.wait()
+        await asyncio.gather(*(update(f"tok{t}") for _ in range(updates) for t in range(FILE_TOKENS)))
+        if lock is not None:
+            lock.close()
+
+    asyncio.run(run())
+
+
+def main() -> None:
+    n = TOKENS * UPDATES_PER_TOKEN
+    for label, lock in (("unlocked", None), ("StripedLock", StripedLock())):
+        store: Dict[str, int] = {}
+        seconds = asyncio.run(session_updates(store, lock))
+        lost = n - sum(store.values())
+        print(f"in-process  {label:<16} {n / seconds:10,.0f} updates/s  lost updates: {lost}")
+
+    workers, per_worker = 4, 25
+    for label, use_lock in (("unlocked", False), ("FileStripedLock", True)):
+        directory = tempfile.mkdtemp(prefix="striped-lock-")
+        try:
+            for t in range(FILE_TOKENS):
+                open(os.path.join(directory, f"tok{t}"), "w").close()
+            ready = multiprocessing.Event()
+            lock_path = os.path.join(directory, "flow_tokens.lock") if use_lock else None
+            processes = [multiprocessing.Process(target=worker, args=(directory, lock_path, per_worker, ready))
+                         for _ in range(workers)]
+            for p in processes:
+                p.start()
+            started = time.perf_counter()
+            ready.set()
+            for p in processes:
+                p.join()
+            seconds = time.perf_counter() - started
+            total = 0
+            for t in range(FILE_TOKENS):
+                with open(os.path.join(directory, f"tok{t}")) as f:
+                    total += int(f.read() or 0)
+        finally:
+            shutil.rmtree(directory)
+        expected = workers * per_worker * FILE_TOKENS
+        print(f"{workers} workers   {label:<16} {expected / seconds:10,.0f} updates/s  lost updates: {expected - total}")
+
+
+if __name__ == "__main__":
+    main()
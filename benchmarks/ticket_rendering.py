@@ -0,0 +1,90 @@
+"""Ticket render throughput inline vs. in the pool, queue latency and event-loop stalls.
+
+Run from the repository root: ``python -m benchmarks.ticket_rendering [tickets]``
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+
+from delivery_status import LatencyHistogram
+from tickets import LocalMediaUploader, MediaCache, Ticket, TicketPipeline, render_ticket_pdf
+
+
+def sample(i: int) -> Ticket:
+    return Ticket(booking_id=f"BK-1MSW-CMYC-{i:05d}", passenger=1 + i % 3, passengers=3,
+                  passenger_name="Asha Juma Said", route="DAR_ZNZ", departure="2026-12-01 08:00",
+                  seat_class="Economy", total="TZS 150,000")
+
+
+async def stall_while(coro) -> float:
+    """Longest gap between event-loop ticks of 1 ms while ``coro`` runs."""
+    worst = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal worst
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            worst = max(worst, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.005)
+    await coro
+    done = True
+    await task
+    return worst
+
+
+async def bench(workdir: str, n: int) -> None:
+    async def on_loop():
+        for i in range(20):
+            render_ticket_pdf(asdict(sample(i)))
+            await asyncio.sleep(0)  # as if each render were its own request
+
+    print(f"loop stall rendering on the loop: {await stall_while(on_loop()) * 1000:8.1f} ms")
+
+    async def send(to, media_id, **kwargs):
+        return {}
+
+    for workers in (1, 2, 4):
+        uploader = LocalMediaUploader(os.path.join(workdir, f"pool-{workers}"))
+        pipeline = TicketPipeline(uploader, send, MediaCache(":memory:"), workers=workers, max_pending=n)
+        await pipeline.render(sample(0))  # start the workers
+        pipeline.queue_time = LatencyHistogram()
+        started = time.perf_counter()
+        stall = await stall_while(asyncio.gather(*(pipeline.deliver(sample(i), "255712345678") for i in range(n))))
+        seconds = time.perf_counter() - started
+        queue = pipeline.queue_time.summary()
+        print(f"pool x{workers}: {n / seconds:8.1f} tickets/s, queue p50 {queue['p50_s'] * 1000:.0f} ms "
+              f"p99 {queue['p99_s'] * 1000:.0f} ms, worst loop stall {stall * 1000:.1f} ms")
+        await asyncio.gather(*(pipeline.deliver(sample(i), "255712345678") for i in range(n)))
+        print(f"          resend: {pipeline.uploads} uploads for {pipeline.sent} sends, "
+              f"cache {pipeline.stats()['media_cache']}")
+        await pipeline.close()
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    started = time.perf_counter()
+    for i in range(n):
+        pdf, _, _ = render_ticket_pdf(asdict(sample(i)))
+    inline_s = time.perf_counter() - started
+    print(f"inline:         {n / inline_s:8.1f} tickets/s ({inline_s / n * 1000:.1f} ms each, {len(pdf):,} bytes)")
+
+    workdir = tempfile.mkdtemp(prefix="tickets-")
+    try:
+        asyncio.run(bench(workdir, n))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
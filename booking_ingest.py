@@ -0,0 +1,211 @@
+"""Bulk ingestion of bookings submitted on ``/flow-callback``.
+
+The endpoint validates the submission with ``models.BookingData`` (pydantic,
+Swahili field names accepted), assigns a booking reference and hands the
+validated model to ``BookingIngestor.submit``: a non-blocking ``put_nowait``
+onto a bounded queue, so the passenger gets the confirmation right away. A
+background consumer coalesces whatever is queued into one batch and inserts
+it into SQLite in a single transaction from a worker thread; serializing the
+models to JSON happens in that thread too.
+
+When the queue is full ``submit`` returns False and the endpoint answers 503
+so WhatsApp retries the submission later instead of it being lost silently.
+Once accepted, a booking is not dropped: the consumer is the only writer, and a
+batch whose transaction fails is retried with backoff until it is stored.
+``flush`` waits for the consumer to catch up and ``close`` stops it before
+closing the database.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from models import BookingData
+
+logger = logging.getLogger(__name__)
+
+
+class BookingIngestor:
+    """
+    Args:
+        db_path (str): SQLite database file (``":memory:"`` for tests).
+        max_queue (int): Bookings waiting for the writer at most.
+        batch_size (int): Bookings inserted per transaction at most.
+        retry_delay (float): First delay before retrying a failed batch; doubles up to ``max_retry_delay``.
+        max_retry_delay (float): Longest delay between retries of a failed batch.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bookings (
+            booking_id TEXT PRIMARY KEY,
+            flow_token TEXT,
+            received_at REAL NOT NULL,
+            direction TEXT,
+            travel_date TEXT,
+            number_of_travelers INTEGER,
+            phone_number TEXT,
+            data TEXT NOT NULL
+        )
+    """
+
+    _INSERT = """
+        INSERT OR IGNORE INTO bookings
+            (booking_id, flow_token, received_at, direction, travel_date, number_of_travelers, phone_number, data)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    def __init__(self, db_path: str = "bookings.db", max_queue: int = 10000, batch_size: int = 500,
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue: "asyncio.Queue[Tuple[str, Optional[str], float, BookingData]]" = asyncio.Queue(maxsize=max_queue)
+        self._consumer: Optional[asyncio.Task] = None
+        self._db: Optional[sqlite3.Connection] = None
+
+        self.accepted = 0
+        self.written = 0
+        self.rejected = 0
+        self.failed = 0  # failed transactions, each retried
+        self.batches = 0
+        # Bookings taken off the queue by the consumer but not stored yet
+        self._in_progress = 0
+
+    # ------------------------------------------------------------------ storage
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(self._SCHEMA)
+            self._db.commit()
+        return self._db
+
+    @staticmethod
+    def _row(item: Tuple[str, Optional[str], float, BookingData]) -> Tuple:
+        booking_id, flow_token, received_at, booking = item
+        return (
+            booking_id,
+            flow_token,
+            received_at,
+            booking.direction,
+            booking.travel_date,
+            booking.number_of_travelers,
+            booking.phone_number,
+            booking.model_dump_json(),
+        )
+
+    def _write_batch(self, batch: List[Tuple[str, Optional[str], float, BookingData]]) -> None:
+        rows = [self._row(item) for item in batch]
+        db = self._connect()
+        with db:
+            db.executemany(self._INSERT, rows)
+
+    async def close(self) -> None:
+        """Stop the consumer, then close the database; call ``flush`` first to store the queue."""
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+        unsaved = self._queue.qsize() + self._in_progress
+        if unsaved:
+            logger.error(f"Closing with {unsaved} accepted bookings not stored")
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # ------------------------------------------------------------------ ingest
+
+    def submit(self, booking_id: str, booking: BookingData, flow_token: Optional[str] = None) -> bool:
+        """
+        Queue a validated booking for storage. Never blocks.
+
+        Returns:
+            bool: False if the queue is full and the booking was not accepted.
+        """
+        self._ensure_consumer()
+        try:
+            self._queue.put_nowait((booking_id, flow_token, time.time(), booking))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def _ensure_consumer(self) -> None:
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.get_running_loop().create_task(self._consume())
+
+    async def _write(self, batch: List[Tuple[str, Optional[str], float, BookingData]]) -> None:
+        write = asyncio.ensure_future(asyncio.to_thread(self._write_batch, batch))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # The thread keeps using the connection; let it finish before close() does
+            await asyncio.wait([write])
+            raise
+
+    async def _store(self, batch: List[Tuple[str, Optional[str], float, BookingData]]) -> None:
+        """Write one batch, retrying with backoff until it is stored (INSERT OR IGNORE makes retries safe)."""
+        delay = self.retry_delay
+        while True:
+            try:
+                await self._write(batch)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Booking batch of {len(batch)} failed, retrying in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            else:
+                self.written += len(batch)
+                self.batches += 1
+                return
+
+    async def _consume(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            # Coalesce whatever else is already waiting into one transaction
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._in_progress = len(batch)
+            try:
+                await self._store(batch)
+                self._in_progress = 0
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def flush(self) -> None:
+        """Wait until everything queued so far is stored (used by tests and on shutdown)."""
+        if not self._queue.empty():
+            self._ensure_consumer()
+        await self._queue.join()
+
+    # ------------------------------------------------------------------ queries
+
+    def get(self, booking_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT booking_id, flow_token, received_at, data FROM bookings WHERE booking_id = ?",
+            (booking_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"booking_id": row[0], "flow_token": row[1], "received_at": row[2], **json.loads(row[3])}
+
+    def stats(self) -> Dict:
+        return {
+            "accepted": self.accepted,
+            "written": self.written,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "batches": self.batches,
+            "queued": self._queue.qsize() + self._in_progress,
+        }
@@ -1,14 +1,169 @@
 
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+_base_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Only pay for python-dotenv when there is a .env file to read
+for _env_file in (os.path.join(os.getcwd(), ".env"), os.path.join(_base_dir, ".env")):
+    if os.path.exists(_env_file):
+        from dotenv import load_dotenv
+
+        load_dotenv(_env_file)
+        break
 access_token= os.getenv("ACCESS_TOKEN")
 phone_number_id = os.getenv("PHONE_NUMBER_ID")
 whatsapp_api_version=os.getenv("WHATSAPP_API_VERSION")
+# Flow endpoint private key (defaults to private.pem next to this file)
+flow_private_key_path = os.getenv("FLOW_PRIVATE_KEY_PATH")
 
 flow_config = {
         "english": {"flow_id": "713784581492733", "flow_name": "azam_v2"},
         "swahili": {"flow_id": "552112574623758", "flow_name": "azam_v1"},
-        "flow_token": {"token":"flows-builder-b28d270e"}
     }
+
+# Flow endpoint time budget. Meta abandons a data exchange request after 10s,
+# so keep a little headroom for network transfer back to Meta.
+flow_response_deadline = float(os.getenv("FLOW_RESPONSE_DEADLINE_SECONDS", "8.5"))
+flow_max_concurrent = int(os.getenv("FLOW_MAX_CONCURRENT", "32"))
+flow_reserved_high_priority = int(os.getenv("FLOW_RESERVED_HIGH_PRIORITY", "4"))
+flow_max_queue = int(os.getenv("FLOW_MAX_QUEUE", "256"))
+
+# Outbound Graph API resilience
+graph_max_attempts = int(os.getenv("GRAPH_MAX_ATTEMPTS", "4"))
+graph_breaker_failure_threshold = int(os.getenv("GRAPH_BREAKER_FAILURE_THRESHOLD", "5"))
+graph_breaker_reset_timeout = float(os.getenv("GRAPH_BREAKER_RESET_SECONDS", "30"))
+
+# Template catalog: loaded from the Graph API, or from a local JSON file in offline mode
+whatsapp_business_account_id = os.getenv("WHATSAPP_BUSINESS_ACCOUNT_ID")
+template_catalog_file = os.getenv("TEMPLATE_CATALOG_FILE")
+template_catalog_ttl = float(os.getenv("TEMPLATE_CATALOG_TTL_SECONDS", "600"))
+
+# Delivery status tracking (webhook "statuses" events)
+delivery_db_path = os.getenv("DELIVERY_DB_PATH", os.path.join(_base_dir, "delivery_status.db"))
+
+# Remembered language choices of returning users
+language_preferences_db_path = os.getenv("LANGUAGE_PREFERENCES_DB_PATH", os.path.join(_base_dir, "language_preferences.db"))
+
+# How long an interactive prompt (e.g. language buttons) waits for its reply
+prompt_reply_ttl = float(os.getenv("PROMPT_REPLY_TTL_SECONDS", "3600"))
+
+# Flow JSON definitions compiled into lookup tables (see flow_compiler.py)
+flow_definition_files = [
+    os.path.join(_base_dir, path.strip())
+    for path in os.getenv("FLOW_DEFINITION_FILES", "floww.json").split(",")
+    if path.strip()
+]
+flow_artifact_path = os.getenv("FLOW_ARTIFACT_PATH", os.path.join(_base_dir, "flow_tables.marshal"))
+# Flow whose submissions arrive on /flow-callback
+callback_flow_name = os.getenv("CALLBACK_FLOW_NAME", "floww")
+
+# Flow sessions: kept in memory, persisted to an append-only log for warm restarts
+session_store_dir = os.getenv("SESSION_STORE_DIR", os.path.join(_base_dir, "session_data"))
+session_ttl = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+session_flush_interval = float(os.getenv("SESSION_FLUSH_INTERVAL_SECONDS", "1.0"))
+
+# Several business numbers from one deployment (see tenants.py). Without this
+# file the single number configured above is the only tenant.
+tenants_file = os.getenv("TENANTS_FILE", os.path.join(_base_dir, "tenants.json"))
+tenants_reload_interval = float(os.getenv("TENANTS_RELOAD_INTERVAL_SECONDS", "5"))
+
+# Journey tracing: OTLP/JSON lines file and the fraction of journeys recorded
+trace_file = os.getenv("TRACE_FILE", os.path.join(_base_dir, "traces.otlp.jsonl")) or None
+trace_sample_ratio = float(os.getenv("TRACE_SAMPLE_RATIO", "0.1"))
+
+# Admin endpoints (profiling) require "Authorization: Bearer <ADMIN_TOKEN>";
+# they are disabled when no token is set.
+admin_token = os.getenv("ADMIN_TOKEN")
+# Secret for signed X-Debug-Profile headers (per-request cProfile)
+profile_signing_key = os.getenv("PROFILE_SIGNING_KEY") or admin_token
+profile_dir = os.getenv("PROFILE_DIR", os.path.join(_base_dir, "profiles"))
+
+# Record decrypted, pseudonymized /flow-data and /webhook traffic for
+# traffic_replay.py; disabled unless TRAFFIC_RECORD_FILE is set.
+traffic_record_file = os.getenv("TRAFFIC_RECORD_FILE")
+traffic_record_sample_ratio = float(os.getenv("TRAFFIC_RECORD_SAMPLE_RATIO", "1.0"))
+traffic_record_max_bytes = int(os.getenv("TRAFFIC_RECORD_MAX_BYTES", str(50 * 1024 * 1024)))
+traffic_record_backups = int(os.getenv("TRAFFIC_RECORD_BACKUPS", "5"))
+# Key of the pseudonymization hash; random per process if unset
+traffic_redaction_salt = os.getenv("TRAFFIC_REDACTION_SALT")
+
+# Booking references (utils/booking_ids.py): each worker claims a free slot in
+# BOOKING_ID_SLOT_DIR unless BOOKING_ID_WORKER_ID pins it (0-255)
+booking_id_worker_id = int(os.environ["BOOKING_ID_WORKER_ID"]) if os.getenv("BOOKING_ID_WORKER_ID") else None
+booking_id_slot_dir = os.getenv("BOOKING_ID_SLOT_DIR", os.path.join(_base_dir, "booking_id_slots"))
+booking_id_check_symbol = os.getenv("BOOKING_ID_CHECK_SYMBOL", "true").lower() == "true"
+
+# Fare table (see pricing.py and fares.example.json); built-in fares without it
+fare_table_file = os.getenv("FARE_TABLE_FILE", os.path.join(_base_dir, "fares.json"))
+fares_reload_interval = float(os.getenv("FARES_RELOAD_INTERVAL_SECONDS", "5"))
+
+# Booking funnel analytics: minutes of per-minute counters kept (longest query window)
+funnel_history_minutes = int(os.getenv("FUNNEL_HISTORY_MINUTES", "1440"))
+
+# Bookings submitted on /flow-callback, written to SQLite in batches
+bookings_db_path = os.getenv("BOOKINGS_DB_PATH", os.path.join(_base_dir, "bookings.db"))
+bookings_max_queue = int(os.getenv("BOOKINGS_MAX_QUEUE", "10000"))
+bookings_batch_size = int(os.getenv("BOOKINGS_BATCH_SIZE", "500"))
+
+# Serialize /flow-data requests per flow_token; with FLOW_TOKEN_LOCK_FILE set the
+# lock is shared by all workers that use the same file
+flow_token_lock_stripes = int(os.getenv("FLOW_TOKEN_LOCK_STRIPES", "1024"))
+flow_token_lock_file = os.getenv("FLOW_TOKEN_LOCK_FILE")
+
+# Graceful shutdown: seconds to drain in-flight requests and flush buffers
+# (keep below the orchestrator's kill timeout)
+shutdown_timeout = float(os.getenv("SHUTDOWN_TIMEOUT_SECONDS", "25"))
+
+# Departure reminders sent ahead of each confirmed booking's departure
+reminders_db_path = os.getenv("REMINDERS_DB_PATH", os.path.join(_base_dir, "reminders.db"))
+reminder_offsets_hours = [
+    float(hours) for hours in os.getenv("REMINDER_OFFSETS_HOURS", "24,2").split(",") if hours.strip()
+]
+reminder_template = os.getenv("REMINDER_TEMPLATE", "departure_reminder")
+reminder_concurrency = int(os.getenv("REMINDER_CONCURRENCY", "8"))
+reminder_batch_size = int(os.getenv("REMINDER_BATCH_SIZE", "100"))
+# Departure times picked in the flow are local to this timezone
+departure_timezone = os.getenv("DEPARTURE_TIMEZONE", "Africa/Dar_es_Salaam")
+
+# Payments (SIMU/KADI) are charged asynchronously; the provider answers on
+# POST /payments/callback, signed with PAYMENT_CALLBACK_SECRET (HMAC-SHA256)
+payment_timeout = float(os.getenv("PAYMENT_TIMEOUT_SECONDS", "300"))
+payment_callback_secret = os.getenv("PAYMENT_CALLBACK_SECRET")
+# Pending and settled payments, shared by all workers so that any of them can settle a callback
+payments_db_path = os.getenv("PAYMENTS_DB_PATH", os.path.join(_base_dir, "payments.db"))
+# Development only: charge through a local stand-in provider (callback latency range
+# in seconds, decline and lost-callback rates). Without it payments are unavailable.
+mock_payments = os.getenv("MOCK_PAYMENTS", "false").lower() == "true"
+mock_payment_latency = tuple(float(s) for s in os.getenv("MOCK_PAYMENT_LATENCY_SECONDS", "2,8").split(","))
+mock_payment_failure_rate = float(os.getenv("MOCK_PAYMENT_FAILURE_RATE", "0"))
+mock_payment_lost_rate = float(os.getenv("MOCK_PAYMENT_LOST_RATE", "0"))
+
+# PDF tickets sent after payment: rendered in a process pool, media ids cached by content hash
+ticket_render_workers = int(os.getenv("TICKET_RENDER_WORKERS", "2"))
+ticket_max_pending = int(os.getenv("TICKET_MAX_PENDING", "64"))
+media_cache_db_path = os.getenv("MEDIA_CACHE_DB_PATH", os.path.join(_base_dir, "media_cache.db"))
+# With MEDIA_UPLOAD_DIR set, files are kept there instead of being uploaded to the Graph API
+media_upload_dir = os.getenv("MEDIA_UPLOAD_DIR")
+
+# Durable webhook log: /webhook appends the event and acks, a consumer processes it.
+# Each worker writes its own subdirectory, named after its booking id worker slot.
+webhook_log_dir = os.getenv("WEBHOOK_LOG_DIR", os.path.join(_base_dir, "webhook_log"))
+webhook_log_segment_bytes = int(os.getenv("WEBHOOK_LOG_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+webhook_log_fsync_interval = float(os.getenv("WEBHOOK_LOG_FSYNC_INTERVAL_SECONDS", "0.05"))
+# Consumed segments are kept up to this size for replays
+webhook_log_retention_bytes = int(os.getenv("WEBHOOK_LOG_RETENTION_BYTES", str(1024 * 1024 * 1024)))
+# Failed events are retried with backoff, then parked in the log's dead_letter subdirectory
+webhook_max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+# How often a worker looks for logs of workers that are gone (their slot is free) and drains them
+webhook_orphan_scan_interval = float(os.getenv("WEBHOOK_ORPHAN_SCAN_SECONDS", "60"))
+
+# Booking reports (/reports): columnar mirror of confirmed bookings, one subdirectory per worker
+reports_dir = os.getenv("REPORTS_DIR", os.path.join(_base_dir, "reports_data"))
+reports_flush_interval = float(os.getenv("REPORTS_FLUSH_INTERVAL_SECONDS", "5"))
+# Seats offered per departure for load factors, with per-route overrides ("DAR_ZNZ=400,ZNZ_PEM=150")
+seats_per_departure = int(os.getenv("SEATS_PER_DEPARTURE", "300"))
+route_seats = {
+    route.strip(): int(seats)
+    for route, _, seats in (item.partition("=") for item in os.getenv("ROUTE_SEATS", "").split(","))
+    if route.strip() and seats.strip()
+}
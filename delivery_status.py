@@ -0,0 +1,448 @@
+"""Delivery-status tracking from webhook ``statuses`` events.
+
+The webhook handler only has to call ``DeliveryTracker.ingest`` with the raw
+status dicts: that is a non-blocking ``put_nowait`` onto a bounded queue, so
+acks stay fast. A background consumer drains the queue in batches and
+
+- keeps compact per-message state in parallel arrays indexed by a slot per
+  wamid (a bitmask of the states seen plus sent/delivered/read timestamps);
+- updates per-broadcast and per-template rollups, including delivery and
+  read latency histograms for percentiles, the first time a message reaches
+  each state (so duplicate or out-of-order events are counted once);
+- upserts the batch into SQLite (in a worker thread) so state survives
+  restarts and individual messages can be looked up by wamid.
+
+The consumer is the only writer: it restores state before applying its first
+batch, and ``flush`` waits for it to drain the queue instead of writing
+alongside it.
+"""
+
+import asyncio
+import logging
+import math
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATUS_BITS = {"sent": 1, "delivered": 2, "read": 4, "failed": 8}
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+_RANK_NAMES = {rank: name for name, rank in STATUS_RANK.items()}
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram (about 10% relative error) for latency percentiles."""
+
+    __slots__ = ("counts", "total", "sum")
+
+    _BASE = 1.1
+    _MIN = 0.001  # 1 ms
+    _BUCKETS = 200  # up to ~ 1.1**200 ms, i.e. days
+
+    def __init__(self):
+        self.counts = array("l", [0]) * self._BUCKETS
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, seconds: float) -> None:
+        seconds = max(seconds, 0.0)
+        index = 0 if seconds <= self._MIN else int(math.log(seconds / self._MIN, self._BASE)) + 1
+        self.counts[min(index, self._BUCKETS - 1)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.total:
+            return None
+        target = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self._MIN * (self._BASE ** index)
+        return None
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.total,
+            "avg_s": (self.sum / self.total) if self.total else None,
+            "p50_s": self.percentile(50),
+            "p90_s": self.percentile(90),
+            "p99_s": self.percentile(99),
+        }
+
+
+class Rollup:
+    """Counters and latency histograms for one broadcast or template."""
+
+    __slots__ = ("counts", "errors", "delivery_latency", "read_latency")
+
+    def __init__(self):
+        self.counts = {name: 0 for name in STATUS_BITS}
+        self.errors: Dict[str, int] = {}
+        self.delivery_latency = LatencyHistogram()
+        self.read_latency = LatencyHistogram()
+
+    def summary(self) -> Dict:
+        sent = self.counts["sent"] or 0
+        return {
+            "counts": dict(self.counts),
+            "delivery_rate": (self.counts["delivered"] / sent) if sent else None,
+            "read_rate": (self.counts["read"] / sent) if sent else None,
+            "errors": dict(self.errors),
+            "delivery_latency": self.delivery_latency.summary(),
+            "read_latency": self.read_latency.summary(),
+        }
+
+
+class DeliveryTracker:
+    """
+    Bulk ingestion of status events into array-backed state, rollups and SQLite.
+
+    Args:
+        db_path (str): SQLite database file (``":memory:"`` for tests).
+        max_queue (int): Maximum buffered webhook status batches before dropping.
+        batch_size (int): Maximum status events applied per batch.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS message_status (
+            wamid TEXT PRIMARY KEY,
+            recipient TEXT,
+            broadcast_id TEXT,
+            template TEXT,
+            status INTEGER NOT NULL DEFAULT 0,
+            sent_at REAL,
+            delivered_at REAL,
+            read_at REAL,
+            failed_at REAL,
+            error_code TEXT
+        )
+    """
+
+    _UPSERT = """
+        INSERT INTO message_status
+            (wamid, recipient, broadcast_id, template, status, sent_at, delivered_at, read_at, failed_at, error_code)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(wamid) DO UPDATE SET
+            recipient = COALESCE(message_status.recipient, excluded.recipient),
+            broadcast_id = COALESCE(message_status.broadcast_id, excluded.broadcast_id),
+            template = COALESCE(message_status.template, excluded.template),
+            status = MAX(message_status.status, excluded.status),
+            sent_at = COALESCE(message_status.sent_at, excluded.sent_at),
+            delivered_at = COALESCE(message_status.delivered_at, excluded.delivered_at),
+            read_at = COALESCE(message_status.read_at, excluded.read_at),
+            failed_at = COALESCE(message_status.failed_at, excluded.failed_at),
+            error_code = COALESCE(excluded.error_code, message_status.error_code)
+    """
+
+    def __init__(self, db_path: str = "delivery_status.db", max_queue: int = 10000, batch_size: int = 2000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._queue: "asyncio.Queue[List[Dict]]" = asyncio.Queue(maxsize=max_queue)
+        self._consumer: Optional[asyncio.Task] = None
+        self._db: Optional[sqlite3.Connection] = None
+        # Lookups run in request threads while the consumer writes from its own; one at a time
+        self._db_lock = threading.Lock()
+        self._loaded = False
+
+        # Compact per-message state: one slot per wamid across parallel arrays
+        self._slots: Dict[str, int] = {}
+        self._seen = bytearray()
+        self._group = array("l")
+        self._sent_at = array("d")
+        self._delivered_at = array("d")
+        self._groups: List[Tuple[Optional[str], Optional[str]]] = [(None, None)]
+        self._group_index: Dict[Tuple[Optional[str], Optional[str]], int] = {(None, None): 0}
+
+        self.by_broadcast: Dict[str, Rollup] = {}
+        self.by_template: Dict[str, Rollup] = {}
+        self.overall = Rollup()
+
+        self.ingested = 0
+        self.applied = 0
+        self.dropped = 0
+        self.batches = 0
+
+    # ------------------------------------------------------------------ storage
+
+    def _connect(self) -> sqlite3.Connection:
+        """The shared connection; call with ``_db_lock`` held."""
+        if self._db is None:
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(self._SCHEMA)
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _write_rows(self, rows: List[Tuple]) -> None:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                db.executemany(self._UPSERT, rows)
+
+    def _read_rows(self) -> List[Tuple]:
+        with self._db_lock:
+            return self._connect().execute(
+                "SELECT wamid, broadcast_id, template, sent_at, delivered_at, read_at, failed_at, error_code "
+                "FROM message_status"
+            ).fetchall()
+
+    def load(self) -> None:
+        """Rebuild in-memory state and rollups from SQLite after a restart (blocking)."""
+        self._apply_rows(self._read_rows())
+
+    def _apply_rows(self, rows: List[Tuple]) -> None:
+        for wamid, broadcast_id, template, sent_at, delivered_at, read_at, failed_at, error_code in rows:
+            slot = self._slot(wamid, self._group_id(broadcast_id, template))
+            for name, ts in (("sent", sent_at), ("delivered", delivered_at), ("read", read_at), ("failed", failed_at)):
+                if ts is not None:
+                    self._apply_state(slot, name, ts, error_code)
+
+    async def close(self) -> None:
+        """Stop the consumer, then close the database."""
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # ---------------------------------------------------------- in-memory state
+
+    def _group_id(self, broadcast_id: Optional[str], template: Optional[str]) -> int:
+        key = (broadcast_id, template)
+        gid = self._group_index.get(key)
+        if gid is None:
+            gid = self._group_index[key] = len(self._groups)
+            self._groups.append(key)
+        return gid
+
+    def _slot(self, wamid: str, group: int = 0) -> int:
+        slot = self._slots.get(wamid)
+        if slot is None:
+            slot = self._slots[wamid] = len(self._seen)
+            self._seen.append(0)
+            self._group.append(group)
+            self._sent_at.append(0.0)
+            self._delivered_at.append(0.0)
+        elif group and not self._group[slot]:
+            self._group[slot] = group
+        return slot
+
+    def _rollups(self, slot: int) -> List[Rollup]:
+        broadcast_id, template = self._groups[self._group[slot]]
+        rollups = [self.overall]
+        if broadcast_id:
+            rollup = self.by_broadcast.get(broadcast_id)
+            if rollup is None:
+                rollup = self.by_broadcast[broadcast_id] = Rollup()
+            rollups.append(rollup)
+        if template:
+            rollup = self.by_template.get(template)
+            if rollup is None:
+                rollup = self.by_template[template] = Rollup()
+            rollups.append(rollup)
+        return rollups
+
+    def _apply_state(self, slot: int, name: str, ts: float, error_code: Optional[str] = None) -> bool:
+        bit = STATUS_BITS[name]
+        if self._seen[slot] & bit:
+            return False
+        self._seen[slot] |= bit
+        rollups = self._rollups(slot)
+        for rollup in rollups:
+            rollup.counts[name] += 1
+        if name == "sent":
+            self._sent_at[slot] = ts
+        elif name == "delivered":
+            self._delivered_at[slot] = ts
+            if self._sent_at[slot]:
+                for rollup in rollups:
+                    rollup.delivery_latency.add(ts - self._sent_at[slot])
+        elif name == "read":
+            if self._delivered_at[slot]:
+                for rollup in rollups:
+                    rollup.read_latency.add(ts - self._delivered_at[slot])
+        elif name == "failed" and error_code:
+            for rollup in rollups:
+                rollup.errors[error_code] = rollup.errors.get(error_code, 0) + 1
+        return True
+
+    # ---------------------------------------------------------------- ingestion
+
+    def register_outbound(self, wamid: str, recipient: str, template: Optional[str] = None,
+                          broadcast_id: Optional[str] = None) -> None:
+        """
+        Remember which broadcast/template a sent message belongs to.
+
+        Call this with the ``messages[0].id`` returned by the Graph API so
+        later status events roll up under the right broadcast and template.
+        """
+        self.ingest([{
+            "id": wamid,
+            "recipient_id": recipient,
+            "status": "sent",
+            "timestamp": time.time(),
+            "_template": template,
+            "_broadcast_id": broadcast_id,
+        }])
+
+    def ingest(self, statuses: List[Dict]) -> bool:
+        """
+        Queue raw webhook status events for processing. Never blocks.
+
+        Returns:
+            bool: False if the queue was full and the events were dropped.
+        """
+        if not statuses:
+            return True
+        self._ensure_consumer()
+        try:
+            self._queue.put_nowait(statuses)
+        except asyncio.QueueFull:
+            self.dropped += len(statuses)
+            return False
+        self.ingested += len(statuses)
+        return True
+
+    def _ensure_consumer(self) -> None:
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.get_running_loop().create_task(self._consume())
+
+    def apply_batch(self, statuses: Iterable[Dict]) -> List[Tuple]:
+        """Update in-memory state and rollups; return the rows to persist."""
+        rows = []
+        for status in statuses:
+            wamid = status.get("id")
+            name = status.get("status")
+            if not wamid or name not in STATUS_BITS:
+                continue
+            try:
+                ts = float(status.get("timestamp") or time.time())
+            except (TypeError, ValueError):
+                ts = time.time()
+            broadcast_id = status.get("_broadcast_id")
+            template = status.get("_template")
+            group = self._group_id(broadcast_id, template) if (broadcast_id or template) else 0
+            error_code = None
+            if name == "failed" and status.get("errors"):
+                error_code = str(status["errors"][0].get("code"))
+
+            slot = self._slot(wamid, group)
+            self._apply_state(slot, name, ts, error_code)
+            rows.append((
+                wamid,
+                status.get("recipient_id"),
+                broadcast_id,
+                template,
+                STATUS_RANK[name],
+                ts if name == "sent" else None,
+                ts if name == "delivered" else None,
+                ts if name == "read" else None,
+                ts if name == "failed" else None,
+                error_code,
+            ))
+        self.applied += len(rows)
+        return rows
+
+    async def _write(self, rows: List[Tuple]) -> None:
+        write = asyncio.ensure_future(asyncio.to_thread(self._write_rows, rows))
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # The thread keeps using the connection; let it finish before close() does
+            await asyncio.wait([write])
+            raise
+
+    async def _consume(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            try:
+                # Read in a thread, applied here: the loop reads the same state for summaries
+                self._apply_rows(await asyncio.to_thread(self._read_rows))
+            except Exception as e:
+                logger.error(f"Could not restore delivery status state: {str(e)}")
+        while True:
+            batch = await self._queue.get()
+            taken = 1
+            # Coalesce whatever else is already waiting into one transaction
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.extend(self._queue.get_nowait())
+                taken += 1
+            try:
+                rows = self.apply_batch(batch)
+                if rows:
+                    await self._write(rows)
+                self.batches += 1
+            except Exception as e:
+                logger.error(f"Delivery status batch failed: {str(e)}")
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    async def flush(self) -> None:
+        """Wait until everything queued so far is processed (used by tests and on shutdown)."""
+        if not self._queue.empty():
+            self._ensure_consumer()
+        await self._queue.join()
+
+    # ------------------------------------------------------------------ queries
+
+    def message_status(self, wamid: str) -> Optional[Dict]:
+        """Stored state of one message (blocking; call it from a thread)."""
+        with self._db_lock:
+            row = self._connect().execute(
+                "SELECT wamid, recipient, broadcast_id, template, status, sent_at, delivered_at, read_at, failed_at, "
+                "error_code FROM message_status WHERE wamid = ?",
+                (wamid,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("wamid", "recipient", "broadcast_id", "template", "status", "sent_at", "delivered_at", "read_at",
+                "failed_at", "error_code")
+        result = dict(zip(keys, row))
+        result["status"] = _RANK_NAMES.get(result["status"])
+        return result
+
+    def summary(self, broadcast_id: Optional[str] = None, template: Optional[str] = None) -> Dict:
+        if broadcast_id is not None:
+            rollup = self.by_broadcast.get(broadcast_id)
+            return {"broadcast_id": broadcast_id, **(rollup or Rollup()).summary()}
+        if template is not None:
+            rollup = self.by_template.get(template)
+            return {"template": template, **(rollup or Rollup()).summary()}
+        return {
+            "overall": self.overall.summary(),
+            "broadcasts": {k: v.summary()["counts"] for k, v in self.by_broadcast.items()},
+            "templates": {k: v.summary()["counts"] for k, v in self.by_template.items()},
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "tracked_messages": len(self._slots),
+            "ingested": self.ingested,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "queued_batches": self._queue.qsize(),
+        }
+
+
+def extract_statuses(webhook_body: Dict) -> List[Dict]:
+    """Collect every status event from all entries/changes of a webhook body."""
+    statuses: List[Dict] = []
+    for entry in webhook_body.get("entry", ()):
+        for change in entry.get("changes", ()):
+            statuses.extend(change.get("value", {}).get("statuses", ()))
+    return statuses
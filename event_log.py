@@ -0,0 +1,479 @@
+"""Durable append-only event log on local disk, with consumer offsets.
+
+``/webhook`` appends the raw request body and acks; a consumer task processes
+the events afterwards. The log is a directory of segment files named after
+the offset of their first byte (``00000000000000000000.seg``, ...); a record
+is a small header (payload length, crc32, append time) followed by the
+payload. Offsets are byte positions in the whole log, so finding a record is
+a binary search over the segment bases plus a slice of its memory map.
+
+Durability:
+
+- ``append`` writes the record with a single ``os.write`` before returning:
+  once the event is acked it is in the kernel's page cache and survives the
+  worker dying. A background task ``fsync``\\ s the active segment at most
+  every ``fsync_interval`` seconds (batched), so only a machine crash can lose
+  the last interval; ``await sync()`` waits for the data to be on disk.
+- On open the tail of the last segment is verified record by record and a
+  torn write is truncated.
+
+Consumers read through read-only memory maps of the segments and store the
+offset they have processed in ``offsets/<name>.offset`` (written to a temp
+file and renamed) after each batch, so processing is at-least-once: after a
+crash the batch in progress is processed again. A record whose handler fails
+is retried with backoff; after ``max_attempts`` it is appended to a
+dead-letter log (and synced) before the offset moves past it, so a failed
+event is never dropped and one bad event cannot stall the log. Moving a
+consumer's offset back replays the log from there, e.g. to reprocess events
+after a bug fix. Segments below every consumer's offset are deleted once the
+log exceeds ``retention_bytes``.
+"""
+
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<IId")  # payload length, crc32(payload), append time
+_SUFFIX = ".seg"
+
+
+class LogRecord(NamedTuple):
+    offset: int
+    next_offset: int
+    appended_at: float
+    payload: bytes
+
+
+class _Segment:
+    """One segment file; mapped read-only and remapped as it grows."""
+
+    def __init__(self, directory: str, base: int):
+        self.base = base
+        self.path = os.path.join(directory, f"{base:020d}{_SUFFIX}")
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+
+    @property
+    def end(self) -> int:
+        return self.base + self.size
+
+    def view(self) -> mmap.mmap:
+        if self._map is None or len(self._map) < self.size:
+            if self._map is not None:
+                self._map.close()
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self._map
+
+    def valid_end(self) -> int:
+        """Position after the last intact record (a torn tail is not counted)."""
+        if not self.size:
+            return 0
+        data = self.view()
+        position = 0
+        while position + _HEADER.size <= self.size:
+            length, crc, _ = _HEADER.unpack_from(data, position)
+            stop = position + _HEADER.size + length
+            if stop > self.size or zlib.crc32(data[position + _HEADER.size:stop]) != crc:
+                break
+            position = stop
+        return position
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class EventLog:
+    """
+    Args:
+        directory (str): Directory of the segment files and consumer offsets.
+        segment_bytes (int): Size at which a new segment is started.
+        fsync_interval (float): Longest time between appends and their fsync.
+        retention_bytes (int): Log size kept for replays before consumed segments are deleted.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024, fsync_interval: float = 0.05,
+                 retention_bytes: int = 1024 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.retention_bytes = retention_bytes
+        os.makedirs(os.path.join(directory, "offsets"), exist_ok=True)
+
+        bases = sorted(int(name[:-len(_SUFFIX)]) for name in os.listdir(directory) if name.endswith(_SUFFIX))
+        self._segments: List[_Segment] = [_Segment(directory, base) for base in bases] or [_Segment(directory, 0)]
+        active = self._segments[-1]
+        valid = active.valid_end()
+        if valid < active.size:
+            logger.warning(f"Event log {active.path}: truncating {active.size - valid} bytes of torn tail")
+            active.close()
+            os.truncate(active.path, valid)
+            active.size = valid
+        self._fd = os.open(active.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+        self._appended = asyncio.Event()
+        self._unsynced = 0
+        self._synced_to = self.end_offset
+        self._syncer: Optional[asyncio.Task] = None
+        self._sync_waiters: List[asyncio.Future] = []
+
+        self.appends = 0
+        self.appended_bytes = 0
+        self.fsyncs = 0
+        self.deleted_segments = 0
+
+    # ------------------------------------------------------------ writing
+
+    @property
+    def start_offset(self) -> int:
+        return self._segments[0].base
+
+    @property
+    def end_offset(self) -> int:
+        return self._segments[-1].end
+
+    def append(self, payload: bytes) -> int:
+        """
+        Append one event; returns its offset. The record is handed to the kernel
+        before returning, so it survives the process dying; fsync follows within
+        ``fsync_interval``.
+        """
+        record = _HEADER.pack(len(payload), zlib.crc32(payload), time.time()) + payload
+        active = self._segments[-1]
+        if active.size and active.size + len(record) > self.segment_bytes:
+            active = self._roll()
+        offset = active.end
+        os.write(self._fd, record)
+        active.size += len(record)
+        self.appends += 1
+        self.appended_bytes += len(record)
+        self._unsynced += 1
+        self._appended.set()
+        self._ensure_syncer()
+        return offset
+
+    def _roll(self) -> _Segment:
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._synced_to = self.end_offset
+        segment = _Segment(self.directory, self.end_offset)
+        self._fd = os.open(segment.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._segments.append(segment)
+        return segment
+
+    def _ensure_syncer(self) -> None:
+        if self._syncer is None or self._syncer.done():
+            self._syncer = asyncio.get_running_loop().create_task(self._sync_loop())
+
+    async def _sync_loop(self) -> None:
+        while self._unsynced or self._sync_waiters:
+            await asyncio.sleep(self.fsync_interval)
+            await self._fsync()
+
+    async def _fsync(self) -> None:
+        if not self._unsynced:
+            return
+        target, fd, waiters = self.end_offset, self._fd, self._sync_waiters
+        self._unsynced, self._sync_waiters = 0, []
+        try:
+            await asyncio.to_thread(os.fsync, fd)
+        except OSError:
+            if fd == self._fd:
+                raise
+            # The segment was rolled (and fsynced) while waiting for the thread
+        self.fsyncs += 1
+        self._synced_to = max(self._synced_to, target)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def sync(self) -> None:
+        """Wait until everything appended so far is on disk (joins the next batched fsync)."""
+        if self._synced_to >= self.end_offset:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._sync_waiters.append(waiter)
+        self._ensure_syncer()
+        await waiter
+
+    # ------------------------------------------------------------ reading
+
+    def _segment_at(self, offset: int) -> Optional[_Segment]:
+        index = bisect.bisect_right([segment.base for segment in self._segments], offset) - 1
+        return self._segments[index] if index >= 0 else None
+
+    def read(self, offset: int, max_records: int = 100) -> List[LogRecord]:
+        """
+        Records from ``offset`` on (at most ``max_records``). Offsets older than
+        the retained log start at the first record still kept.
+        """
+        self._appended.clear()
+        offset = max(offset, self.start_offset)
+        records: List[LogRecord] = []
+        while len(records) < max_records and offset < self.end_offset:
+            segment = self._segment_at(offset)
+            if segment is None or offset >= segment.end:
+                break
+            data = segment.view()
+            position = offset - segment.base
+            while len(records) < max_records and position + _HEADER.size <= segment.size:
+                length, crc, appended_at = _HEADER.unpack_from(data, position)
+                start = position + _HEADER.size
+                payload = data[start:start + length]
+                if zlib.crc32(payload) != crc:
+                    raise ValueError(f"Corrupt record at offset {segment.base + position} in {segment.path}")
+                records.append(LogRecord(segment.base + position, segment.base + start + length, appended_at, payload))
+                position = start + length
+            offset = segment.base + position
+        return records
+
+    def record_boundary(self, offset: int) -> int:
+        """Offset of the first record starting at or after ``offset``."""
+        offset = max(offset, self.start_offset)
+        segment = self._segment_at(offset)
+        if segment is None or offset >= segment.end:
+            return self.end_offset
+        data = segment.view()
+        position = 0
+        while segment.base + position < offset:
+            length = _HEADER.unpack_from(data, position)[0]
+            position += _HEADER.size + length
+        return segment.base + position
+
+    def offset_for_time(self, since: float) -> int:
+        """Offset of the first record appended at or after ``since`` (epoch seconds)."""
+        for segment in self._segments:
+            if segment.size == 0:
+                continue
+            data = segment.view()
+            position = 0
+            while position + _HEADER.size <= segment.size:
+                length, _, appended_at = _HEADER.unpack_from(data, position)
+                if appended_at >= since:
+                    return segment.base + position
+                position += _HEADER.size + length
+        return self.end_offset
+
+    async def wait_for_append(self, timeout: Optional[float] = None) -> None:
+        """Wait for an append since the last ``read`` (or ``timeout`` seconds)."""
+        try:
+            await asyncio.wait_for(self._appended.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # ------------------------------------------------------------ consumer offsets
+
+    def _offset_path(self, consumer: str) -> str:
+        return os.path.join(self.directory, "offsets", f"{consumer}.offset")
+
+    def committed(self, consumer: str) -> int:
+        """Offset up to which ``consumer`` has processed the log (its start if never committed)."""
+        try:
+            with open(self._offset_path(consumer)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return self.start_offset
+
+    def commit(self, consumer: str, offset: int) -> None:
+        path = self._offset_path(consumer)
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def _consumers(self) -> List[str]:
+        return [name[:-len(".offset")] for name in os.listdir(os.path.join(self.directory, "offsets"))
+                if name.endswith(".offset")]
+
+    def delete_consumed(self) -> int:
+        """Delete the oldest segments every consumer is past while the log exceeds ``retention_bytes``."""
+        floor = min((self.committed(name) for name in self._consumers()), default=self.start_offset)
+        deleted = 0
+        while (len(self._segments) > 1 and self._segments[0].end <= floor
+               and self.end_offset - self._segments[1].base >= self.retention_bytes):
+            segment = self._segments.pop(0)
+            segment.close()
+            os.remove(segment.path)
+            deleted += 1
+        self.deleted_segments += deleted
+        return deleted
+
+    # ------------------------------------------------------------ lifecycle
+
+    async def close(self) -> Dict:
+        """fsync what is pending and close the files."""
+        if self._syncer is not None:
+            self._syncer.cancel()
+        self._unsynced = max(self._unsynced, 1)
+        await self._fsync()
+        os.close(self._fd)
+        for segment in self._segments:
+            segment.close()
+        return {"end_offset": self.end_offset}
+
+    def stats(self) -> Dict:
+        return {
+            "segments": len(self._segments),
+            "start_offset": self.start_offset,
+            "end_offset": self.end_offset,
+            "synced_to": self._synced_to,
+            "appends": self.appends,
+            "appended_bytes": self.appended_bytes,
+            "fsyncs": self.fsyncs,
+            "deleted_segments": self.deleted_segments,
+            "consumers": {name: self.committed(name) for name in self._consumers()},
+        }
+
+
+class LogConsumer:
+    """
+    Processes an ``EventLog`` in order and commits its offset after each batch.
+
+    Args:
+        log (EventLog): Log to consume.
+        name (str): Consumer name; its offset is stored under this name.
+        handler (Callable[[LogRecord], Awaitable]): Processes one record. A record whose
+            handler raises is retried with backoff, then parked in ``dead_letter``.
+        batch_size (int): Records read and processed per commit.
+        dead_letter (Optional[EventLog]): Log for records that failed ``max_attempts``
+            times. Without one a failing record is retried until it succeeds.
+        max_attempts (int): Attempts per record before it is dead-lettered.
+        retry_delay (float): Seconds before the first retry, doubled per attempt.
+        max_retry_delay (float): Longest wait between retries.
+    """
+
+    def __init__(self, log: EventLog, name: str, handler: Callable[[LogRecord], Awaitable],
+                 batch_size: int = 100, dead_letter: Optional[EventLog] = None, max_attempts: int = 5,
+                 retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.log = log
+        self.name = name
+        self.handler = handler
+        self.batch_size = batch_size
+        self.dead_letter = dead_letter
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.offset = log.committed(name)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._stopped = asyncio.Event()
+        self.processed = 0
+        self.retries = 0
+        self.failed = 0
+        self.lag_seconds = 0.0
+
+    async def run_once(self) -> int:
+        """Process one batch; returns the number of records processed."""
+        records = self.log.read(self.offset, self.batch_size)
+        done = 0
+        for record in records:
+            if not await self._process(record):
+                break
+            done += 1
+            self.processed += 1
+            self.offset = record.next_offset
+            self.lag_seconds = time.time() - record.appended_at
+        if done:
+            await asyncio.to_thread(self.log.commit, self.name, self.offset)
+        return done
+
+    async def _process(self, record: LogRecord) -> bool:
+        """Handle one record, retrying failures; False if stopped before it was done."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await self.handler(record)
+                return True
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            if self.dead_letter is not None and attempt >= self.max_attempts:
+                self.failed += 1
+                logger.error(f"{self.name}: record at offset {record.offset} failed {attempt} times, "
+                             f"dead-lettered: {error}")
+                # On disk before the offset moves past the record
+                self.dead_letter.append(record.payload)
+                await self.dead_letter.sync()
+                return True
+            self.retries += 1
+            delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+            logger.warning(f"{self.name}: record at offset {record.offset} failed (attempt {attempt}), "
+                           f"retrying in {delay:.1f}s: {error}")
+            if self.offset > self.log.committed(self.name):
+                # Keep what is done if the worker dies while this record is retried
+                await asyncio.to_thread(self.log.commit, self.name, self.offset)
+            try:
+                await asyncio.wait_for(self._stopped.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return False
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                if await self.run_once():
+                    continue
+                await asyncio.to_thread(self.log.delete_consumed)
+            except Exception as e:
+                logger.error(f"{self.name}: consumer round failed: {str(e)}")
+            if not self._stopping:
+                await self.log.wait_for_append(timeout=1.0)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._stopped.clear()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def replay_from(self, offset: int) -> Dict:
+        """
+        Move the consumer to ``offset`` (back to reprocess events, forward to skip them).
+        An offset inside a record moves to the next record.
+        """
+        offset = self.log.record_boundary(offset)
+        running = self._task is not None and not self._task.done()
+        if running:
+            await self.close()
+        previous, self.offset = self.offset, offset
+        await asyncio.to_thread(self.log.commit, self.name, offset)
+        if running:
+            self.start()
+        return {"consumer": self.name, "from": previous, "to": offset, "pending_bytes": self.log.end_offset - offset}
+
+    async def close(self) -> Dict:
+        """Finish the batch in progress (its offset is committed) and stop."""
+        self._stopping = True
+        self._stopped.set()
+        self.log._appended.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        return {"pending_bytes": self.log.end_offset - self.offset}
+
+    def stats(self) -> Dict:
+        return {
+            "offset": self.offset,
+            "pending_bytes": self.log.end_offset - self.offset,
+            "processed": self.processed,
+            "retries": self.retries,
+            "failed": self.failed,
+            "lag_seconds": round(self.lag_seconds, 3),
+        }
@@ -0,0 +1,267 @@
+"""Compile WhatsApp Flow JSON definitions into validated lookup tables.
+
+A flow JSON (e.g. ``floww.json``) already defines the screens, the routing
+model and the dropdown ``data-source`` options (routes such as ``DAR_ZNZ``,
+classes ``ECO``/``VIP``/``ROY``, payment methods ``SIMU``/``KADI``). Instead
+of re-hardcoding those titles in the backend, this module
+
+- checks the routing model against the screens and their navigate actions,
+  and that ``${screen.X.field}`` references in payloads point at real fields;
+- emits frozen ``id -> title`` tables per dropdown field, so handlers build
+  summaries and confirmations with constant-time lookups;
+- serializes the tables to a ``marshal`` artifact tagged with the hash of the
+  source files, which loads much faster than re-parsing and re-validating.
+
+Run offline with::
+
+    python flow_compiler.py floww.json -o flow_tables.marshal
+"""
+
+import argparse
+import hashlib
+import json
+import marshal
+import os
+import re
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+ARTIFACT_VERSION = 1
+
+_REFERENCE = re.compile(r"\$\{screen\.([A-Za-z0-9_]+)\.([A-Za-z0-9_]+)\}")
+
+
+class FlowCompileError(ValueError):
+    """Raised when a flow definition is internally inconsistent."""
+
+    def __init__(self, flow: str, problems: List[str]):
+        super().__init__(f"{flow}: " + "; ".join(problems))
+        self.flow = flow
+        self.problems = problems
+
+
+class CompiledFlow:
+    """Immutable view of one compiled flow definition."""
+
+    __slots__ = ("name", "screens", "routing", "terminal_screens", "field_screens", "options", "completion_fields")
+
+    def __init__(self, name: str, tables: Dict):
+        self.name = name
+        self.screens: Tuple[str, ...] = tuple(tables["screens"])
+        self.routing: Mapping[str, Tuple[str, ...]] = MappingProxyType(
+            {screen: tuple(targets) for screen, targets in tables["routing"].items()}
+        )
+        self.terminal_screens = frozenset(tables["terminal_screens"])
+        self.field_screens: Mapping[str, str] = MappingProxyType(dict(tables["field_screens"]))
+        self.options: Mapping[str, Mapping[str, str]] = MappingProxyType(
+            {field: MappingProxyType(dict(choices)) for field, choices in tables["options"].items()}
+        )
+        self.completion_fields: Tuple[str, ...] = tuple(tables["completion_fields"])
+
+    def title(self, field: str, option_id: Optional[str], default: Optional[str] = None) -> Optional[str]:
+        """Return the display title of a dropdown option, e.g. ("uelekeo", "DAR_ZNZ")."""
+        choices = self.options.get(field)
+        if choices is None or option_id is None:
+            return default
+        return choices.get(option_id, default if default is not None else option_id)
+
+    def data_source(self, field: str) -> List[Dict[str, str]]:
+        """Rebuild a ``data-source`` list for a dropdown field."""
+        return [{"id": option_id, "title": title} for option_id, title in self.options.get(field, {}).items()]
+
+    def titles(self, values: Mapping[str, object]) -> Dict[str, str]:
+        """Map every dropdown value in a payload to its display title."""
+        return {
+            field: self.options[field].get(value, value)
+            for field, value in values.items()
+            if field in self.options and isinstance(value, str)
+        }
+
+    def previous_screen(self, screen: str) -> Optional[str]:
+        for source, targets in self.routing.items():
+            if screen in targets:
+                return source
+        return None
+
+
+def _walk(node, on_component):
+    if isinstance(node, dict):
+        on_component(node)
+        for value in node.values():
+            _walk(value, on_component)
+    elif isinstance(node, list):
+        for value in node:
+            _walk(value, on_component)
+
+
+def compile_definition(name: str, definition: Dict) -> Dict:
+    """
+    Validate one flow definition and build its plain-dict lookup tables.
+
+    Args:
+        name (str): Name of the flow (used in error messages and as table key).
+        definition (Dict): Parsed flow JSON.
+
+    Returns:
+        Dict: Tables made of builtins only, so they can be marshalled.
+
+    Raises:
+        FlowCompileError: If routing, navigation or references are inconsistent.
+    """
+    problems: List[str] = []
+    screens = [screen["id"] for screen in definition.get("screens", [])]
+    screen_set = set(screens)
+    routing = definition.get("routing_model", {})
+
+    for source, targets in routing.items():
+        if source not in screen_set:
+            problems.append(f"routing_model references unknown screen {source}")
+        for target in targets:
+            if target not in screen_set:
+                problems.append(f"routing_model {source} -> unknown screen {target}")
+
+    field_screens: Dict[str, str] = {}
+    options: Dict[str, Dict[str, str]] = {}
+    terminal_screens: List[str] = []
+    completion_fields: List[str] = []
+    references: List[Tuple[str, str, str]] = []
+
+    for screen in definition.get("screens", []):
+        screen_id = screen["id"]
+        if screen.get("terminal"):
+            terminal_screens.append(screen_id)
+
+        def on_component(node, screen_id=screen_id):
+            name_ = node.get("name")
+            if "type" in node and name_ and node.get("type") not in ("Form", "screen"):
+                field_screens[name_] = screen_id
+                if "data-source" in node and isinstance(node["data-source"], list):
+                    choices = options.setdefault(name_, {})
+                    for option in node["data-source"]:
+                        if option.get("id") in choices and choices[option["id"]] != option.get("title"):
+                            problems.append(f"{name_}: conflicting titles for option {option['id']}")
+                        choices[option["id"]] = option.get("title", option["id"])
+            action = node.get("on-click-action")
+            if isinstance(action, dict):
+                if action.get("name") == "navigate":
+                    target = action.get("next", {}).get("name")
+                    if target not in screen_set:
+                        problems.append(f"{screen_id} navigates to unknown screen {target}")
+                    elif target not in routing.get(screen_id, []):
+                        problems.append(f"{screen_id} navigates to {target}, which is not in its routing_model")
+                elif action.get("name") == "complete":
+                    if screen_id not in terminal_screens:
+                        problems.append(f"{screen_id} completes the flow but is not marked terminal")
+                    completion_fields.extend(action.get("payload", {}).keys())
+                for value in action.get("payload", {}).values():
+                    if isinstance(value, str):
+                        for ref_screen, ref_field in _REFERENCE.findall(value):
+                            references.append((screen_id, ref_screen, ref_field))
+
+        _walk(screen.get("layout", {}), on_component)
+
+    for screen_id, ref_screen, ref_field in references:
+        if ref_screen not in screen_set:
+            problems.append(f"{screen_id} references unknown screen {ref_screen}")
+        elif field_screens.get(ref_field) != ref_screen:
+            problems.append(f"{screen_id} references {ref_screen}.{ref_field}, which that screen does not define")
+
+    for screen_id in terminal_screens:
+        if routing.get(screen_id):
+            problems.append(f"terminal screen {screen_id} has outgoing routes")
+
+    if problems:
+        raise FlowCompileError(name, problems)
+
+    return {
+        "screens": screens,
+        "routing": {source: list(targets) for source, targets in routing.items()},
+        "terminal_screens": terminal_screens,
+        "field_screens": field_screens,
+        "options": options,
+        "completion_fields": completion_fields,
+    }
+
+
+def _source_hash(paths: Sequence[str]) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _flow_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def compile_files(paths: Sequence[str]) -> Dict:
+    """Compile flow JSON files into one marshal-able artifact dict."""
+    flows = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            flows[_flow_name(path)] = compile_definition(_flow_name(path), json.load(f))
+    return {"version": ARTIFACT_VERSION, "source_hash": _source_hash(paths), "flows": flows}
+
+
+def write_artifact(artifact: Dict, path: str) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        marshal.dump(artifact, f)
+    os.replace(tmp, path)
+
+
+def _read_artifact(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "rb") as f:
+            artifact = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(artifact, dict) or artifact.get("version") != ARTIFACT_VERSION:
+        return None
+    return artifact
+
+
+def load_flows(paths: Iterable[str], artifact_path: Optional[str] = None) -> Mapping[str, CompiledFlow]:
+    """
+    Load compiled flows, reusing the artifact when it matches the sources.
+
+    Args:
+        paths (Iterable[str]): Flow JSON files; missing files are skipped.
+        artifact_path (Optional[str]): Where the marshal artifact is read/written.
+
+    Returns:
+        Mapping[str, CompiledFlow]: Compiled flows keyed by file name without extension.
+
+    Raises:
+        FlowCompileError: If a flow definition is inconsistent.
+    """
+    paths = [p for p in paths if os.path.exists(p)]
+    artifact = None
+    if artifact_path:
+        artifact = _read_artifact(artifact_path)
+        if artifact is not None and artifact.get("source_hash") != _source_hash(paths):
+            artifact = None
+    if artifact is None:
+        artifact = compile_files(paths)
+        if artifact_path:
+            try:
+                write_artifact(artifact, artifact_path)
+            except OSError:
+                pass
+    return MappingProxyType({name: CompiledFlow(name, tables) for name, tables in artifact["flows"].items()})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate flow JSON files and write the lookup-table artifact.")
+    parser.add_argument("flows", nargs="+", help="Flow JSON files")
+    parser.add_argument("-o", "--output", default="flow_tables.marshal", help="Artifact path")
+    args = parser.parse_args()
+
+    compiled = compile_files(args.flows)
+    write_artifact(compiled, args.output)
+    for flow_name, tables in compiled["flows"].items():
+        print(f"{flow_name}: {len(tables['screens'])} screens, "
+              f"{sum(len(c) for c in tables['options'].values())} options in {len(tables['options'])} dropdowns")
+    print(f"wrote {args.output}")
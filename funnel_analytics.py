@@ -0,0 +1,263 @@
+"""Streaming booking-funnel analytics for the flow data exchange.
+
+Every ``/flow-data`` exchange is folded into per-minute counters as it
+happens, so funnel questions ("how many passengers who reached SEATS went on
+to DETAILS in the last hour, on DAR_ZNZ, in Swahili?") are answered from a
+few thousand integers instead of scanning logs:
+
+- transitions: (from screen, to screen, route, language);
+- validation failures: (screen, reason, route, language), with numbers in
+  the reason replaced by ``#`` so "3 passengers" and "4 passengers" add up;
+- abandonment: (last screen, route, language), counted when a flow session
+  expires (``SessionStore.on_expire``) before reaching SUCCESS.
+
+Each counter is a ring of one slot per minute (24 hours by default); a slot
+is zeroed for every key when the clock moves into it again. A query sums the
+slots of the requested window, so its cost depends on the number of keys and
+minutes, not on traffic. Counters are per worker, like ``/metrics``.
+
+The language of a journey is not part of the flow data exchange; it is
+remembered when the flow is sent (``journey_started``) and copied into the
+flow session at INIT.
+"""
+
+import re
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Screens of the booking journey in order; RETURN_DETAILS only on round trips
+FUNNEL_STEPS = ("PERSONAL_INFO", "AVAILABILITY", "SEATS", "DETAILS", "PAYMENT", "SUCCESS")
+_ORDER = {screen: i for i, screen in enumerate(
+    ("START", "PERSONAL_INFO", "AVAILABILITY", "SEATS", "DETAILS", "RETURN_DETAILS", "PAYMENT", "SUCCESS")
+)}
+START = "START"
+COMPLETED = "SUCCESS"
+UNKNOWN = "unknown"
+
+_NUMBER = re.compile(r"\d+")
+
+
+def _normalize_reason(reason) -> str:
+    return _NUMBER.sub("#", str(reason))[:120]
+
+
+class MinuteRing:
+    """
+    Counters keyed by tuples, bucketed per minute over a fixed number of minutes.
+
+    Args:
+        minutes (int): Minutes of history kept.
+        max_keys (int): Distinct keys kept at most; events for new keys beyond it are dropped.
+    """
+
+    def __init__(self, minutes: int = 1440, max_keys: int = 5000):
+        self.minutes = minutes
+        self.max_keys = max_keys
+        # Minute held by each slot; every key's array shares this clock
+        self._stamps = array("q", [-1]) * minutes
+        self._counts: Dict[Tuple, array] = {}
+        self.dropped = 0
+
+    def add(self, key: Tuple, minute: int, n: int = 1) -> None:
+        slot = minute % self.minutes
+        stamp = self._stamps[slot]
+        if stamp != minute:
+            if stamp > minute:
+                return  # older than the history kept
+            for counts in self._counts.values():
+                counts[slot] = 0
+            self._stamps[slot] = minute
+        counts = self._counts.get(key)
+        if counts is None:
+            if len(self._counts) >= self.max_keys:
+                self.dropped += n
+                return
+            counts = self._counts[key] = array("L", [0]) * self.minutes
+        counts[slot] += n
+
+    def totals(self, first_minute: int, last_minute: int) -> Dict[Tuple, int]:
+        """Sum of every key over the minutes ``first_minute..last_minute`` (inclusive)."""
+        slots = [i for i, stamp in enumerate(self._stamps) if first_minute <= stamp <= last_minute]
+        totals = {}
+        for key, counts in self._counts.items():
+            total = sum(counts[i] for i in slots)
+            if total:
+                totals[key] = total
+        return totals
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+class FunnelAnalytics:
+    """
+    Args:
+        minutes (int): Minutes of history kept (the longest queryable window).
+        max_keys (int): Distinct keys kept per counter.
+        max_pending_languages (int): Sent flows whose language is remembered until INIT.
+    """
+
+    def __init__(self, minutes: int = 1440, max_keys: int = 5000, max_pending_languages: int = 10000):
+        self.minutes = minutes
+        self._transitions = MinuteRing(minutes, max_keys)
+        self._failures = MinuteRing(minutes, max_keys)
+        self._abandoned = MinuteRing(minutes, max_keys)
+        self._languages: "OrderedDict[str, str]" = OrderedDict()
+        self.max_pending_languages = max_pending_languages
+        self.observed = 0
+
+    # ------------------------------------------------------------ events
+
+    def journey_started(self, flow_token: str, language: str) -> None:
+        """Remember the language a flow was sent in, for its INIT request."""
+        self._languages[flow_token] = language
+        self._languages.move_to_end(flow_token)
+        while len(self._languages) > self.max_pending_languages:
+            self._languages.popitem(last=False)
+
+    def observe(self, session: Dict, request: Dict, response: Dict, now: Optional[float] = None) -> bool:
+        """
+        Count one data exchange and note the journey's current screen in its session.
+
+        Args:
+            session (Dict): Flow session after the request was handled.
+            request (Dict): Decrypted flow request.
+            response (Dict): Unencrypted flow response.
+
+        Returns:
+            bool: True if ``session`` was changed and should be stored.
+        """
+        action = request.get("action")
+        if action not in ("INIT", "data_exchange", "BACK"):
+            return False
+        minute = int((now if now is not None else time.time()) // 60)
+        changed = False
+        if "language" not in session:
+            session["language"] = self._languages.get(request.get("flow_token"), UNKNOWN)
+            changed = True
+        route = session.get("user_data", {}).get("travel_details", {}).get("going_route") or UNKNOWN
+        language = session["language"]
+        from_screen = START if action == "INIT" else request.get("screen") or UNKNOWN
+        to_screen = response.get("screen") or UNKNOWN
+        self.observed += 1
+        self._transitions.add((from_screen, to_screen, route, language), minute)
+        for reason in _validation_errors(response):
+            self._failures.add((from_screen, _normalize_reason(reason), route, language), minute)
+        if session.get("funnel_screen") != to_screen:
+            session["funnel_screen"] = to_screen
+            changed = True
+        return changed
+
+    def on_session_expired(self, flow_token: str, session: Dict) -> None:
+        """``SessionStore.on_expire`` listener: an expired unfinished journey was abandoned."""
+        screen = session.get("funnel_screen")
+        if screen is None or screen == COMPLETED:
+            return
+        route = session.get("user_data", {}).get("travel_details", {}).get("going_route") or UNKNOWN
+        self._abandoned.add((screen, route, session.get("language") or UNKNOWN), int(time.time() // 60))
+
+    # ------------------------------------------------------------ queries
+
+    def funnel(self, minutes: int = 60, end: Optional[float] = None, route: Optional[str] = None,
+               language: Optional[str] = None, top_failures: int = 10) -> Dict:
+        """
+        Funnel conversion over a time window.
+
+        Args:
+            minutes (int): Window length, capped at the history kept.
+            end (Optional[float]): Epoch end of the window (now when None).
+            route (Optional[str]): Only journeys on this going route.
+            language (Optional[str]): Only journeys in this language.
+            top_failures (int): Validation failure reasons returned.
+
+        Returns:
+            Dict: Per-step entries, conversion and abandonment, plus the most
+            frequent validation failures.
+        """
+        end = end if end is not None else time.time()
+        minutes = max(1, min(minutes, self.minutes))
+        last = int(end // 60)
+        first = last - minutes + 1
+
+        def matching(totals: Dict[Tuple, int]) -> Iterable[Tuple[Tuple, int]]:
+            for key, count in totals.items():
+                if (route is None or key[-2] == route) and (language is None or key[-1] == language):
+                    yield key, count
+
+        entered = dict.fromkeys(FUNNEL_STEPS, 0)
+        failures_by_screen: Dict[str, int] = {}
+        abandoned = dict.fromkeys(FUNNEL_STEPS, 0)
+        for (from_screen, to_screen, _, _), count in matching(self._transitions.totals(first, last)):
+            # Forward moves only: retries after a failed validation and BACK do not re-enter a step
+            if to_screen in entered and _ORDER.get(to_screen, -1) > _ORDER.get(from_screen, len(_ORDER)):
+                entered[to_screen] += count
+        reasons: Dict[Tuple[str, str], int] = {}
+        for (screen, reason, _, _), count in matching(self._failures.totals(first, last)):
+            failures_by_screen[screen] = failures_by_screen.get(screen, 0) + count
+            reasons[(screen, reason)] = reasons.get((screen, reason), 0) + count
+        for (screen, _, _), count in matching(self._abandoned.totals(first, last)):
+            abandoned[screen] = abandoned.get(screen, 0) + count
+
+        started = entered[FUNNEL_STEPS[0]]
+        steps: List[Dict] = []
+        previous = None
+        for screen in FUNNEL_STEPS:
+            steps.append({
+                "screen": screen,
+                "entered": entered[screen],
+                "conversion_from_previous": _ratio(entered[screen], previous),
+                "conversion_from_start": _ratio(entered[screen], started),
+                "validation_failures": failures_by_screen.get(screen, 0),
+                "abandoned": abandoned.get(screen, 0),
+            })
+            previous = entered[screen]
+        return {
+            "window": {
+                "from": _iso(first * 60),
+                "to": _iso((last + 1) * 60),
+                "minutes": minutes,
+            },
+            "filters": {"route": route, "language": language},
+            "steps": steps,
+            "completed": entered[COMPLETED],
+            "abandoned": sum(abandoned.values()),
+            "top_validation_failures": [
+                {"screen": screen, "reason": reason, "count": count}
+                for (screen, reason), count in sorted(reasons.items(), key=lambda item: -item[1])[:top_failures]
+            ],
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "observed": self.observed,
+            "history_minutes": self.minutes,
+            "keys": {
+                "transitions": len(self._transitions),
+                "validation_failures": len(self._failures),
+                "abandoned": len(self._abandoned),
+            },
+            "dropped": self._transitions.dropped + self._failures.dropped + self._abandoned.dropped,
+            "pending_languages": len(self._languages),
+        }
+
+
+def _validation_errors(response: Dict) -> List:
+    data = response.get("data") or {}
+    if data.get("validation") == "failed":
+        return data.get("errors") or []
+    confirmation = data.get("booking_confirmation") or {}
+    if confirmation.get("status") == "failed":
+        message = confirmation.get("message")
+        return message if isinstance(message, list) else [message]
+    return []
+
+
+def _ratio(part: int, whole: Optional[int]) -> Optional[float]:
+    return round(part / whole, 4) if whole else None
+
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat()
@@ -0,0 +1,126 @@
+"""Per-user language preference store.
+
+Returning passengers should not have to answer the language prompt again.
+Preferences are keyed by the sender's WhatsApp id (E.164 without ``+``),
+learnt from the ``english_lang``/``swahili_lang`` button reply ids, and kept
+in SQLite. An in-memory LRU sits in front so the hot path is a dict lookup.
+Misses are only remembered for ``miss_ttl`` seconds: another worker sharing the
+database may store the user's choice in the meantime.
+"""
+
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Button reply ids sent by send_language_selection_prompt
+REPLY_ID_LANGUAGES = {"english_lang": "english", "swahili_lang": "swahili"}
+
+_MISSING = object()
+
+
+class LanguagePreferenceStore:
+    """
+    LRU-fronted SQLite store of user language choices.
+
+    Args:
+        db_path (str): SQLite database file (``":memory:"`` for tests).
+        capacity (int): Maximum known users, and separately misses, kept in memory.
+        miss_ttl (float): Seconds an unknown user is answered from memory.
+    """
+
+    def __init__(self, db_path: str = "language_preferences.db", capacity: int = 100_000, miss_ttl: float = 30.0):
+        self.db_path = db_path
+        self.capacity = capacity
+        self.miss_ttl = miss_ttl
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        # wa_id -> monotonic time until which it is known to have no preference
+        self._misses: "OrderedDict[str, float]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        # Lookups that found a stored language, i.e. language prompts skipped
+        self.known = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS language_preferences ("
+                "wa_id TEXT PRIMARY KEY, language TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _remember(self, wa_id: str, language: Optional[str]) -> None:
+        if language is None:
+            self._misses[wa_id] = time.monotonic() + self.miss_ttl
+            self._misses.move_to_end(wa_id)
+            if len(self._misses) > self.capacity:
+                self._misses.popitem(last=False)
+            return
+        self._misses.pop(wa_id, None)
+        self._cache[wa_id] = language
+        self._cache.move_to_end(wa_id)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def _load(self, wa_id: str) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT language FROM language_preferences WHERE wa_id = ?", (wa_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _store(self, wa_id: str, language: str) -> None:
+        db = self._connect()
+        with db:
+            db.execute(
+                "INSERT INTO language_preferences (wa_id, language, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(wa_id) DO UPDATE SET language = excluded.language, updated_at = excluded.updated_at",
+                (wa_id, language, time.time()),
+            )
+
+    async def get(self, wa_id: str) -> Optional[str]:
+        """
+        Return the stored language for a user, or None if unknown.
+
+        Args:
+            wa_id (str): WhatsApp id of the user (E.164 without "+").
+
+        Returns:
+            Optional[str]: "english" or "swahili", or None.
+        """
+        language = self._cache.get(wa_id, _MISSING)
+        if language is not _MISSING:
+            self.hits += 1
+            self._cache.move_to_end(wa_id)
+        elif self._misses.get(wa_id, 0.0) > time.monotonic():
+            self.hits += 1
+            language = None
+        else:
+            self.misses += 1
+            language = await asyncio.to_thread(self._load, wa_id)
+            self._remember(wa_id, language)
+        if language is not None:
+            self.known += 1
+        return language
+
+    async def set(self, wa_id: str, language: str) -> None:
+        """Persist a user's language choice and update the cache."""
+        if self._cache.get(wa_id, _MISSING) == language:
+            return
+        self._remember(wa_id, language)
+        await asyncio.to_thread(self._store, wa_id, language)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "cached_misses": len(self._misses),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else None,
+            "known_user_rate": (self.known / lookups) if lookups else None,
+        }
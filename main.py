@@ -1,33 +1,497 @@
-from fastapi import FastAPI, Query, HTTPException, Request ,Response,status
-from typing import Optional, Dict
+from fastapi import FastAPI, Query, HTTPException, Request ,Response,status, Depends
+from typing import Optional, Dict, Tuple
 
 import json
-
-from config import flow_config
+import asyncio
+import os
+import time
+import uuid
+
+from config import (
+    flow_response_deadline,
+    flow_max_concurrent,
+    flow_reserved_high_priority,
+    flow_max_queue,
+    delivery_db_path,
+    language_preferences_db_path,
+    prompt_reply_ttl,
+    flow_definition_files,
+    flow_artifact_path,
+    callback_flow_name,
+    session_store_dir,
+    session_ttl,
+    session_flush_interval,
+    admin_token,
+    profile_signing_key,
+    profile_dir,
+    traffic_record_file,
+    traffic_record_sample_ratio,
+    traffic_record_max_bytes,
+    traffic_record_backups,
+    traffic_redaction_salt,
+    booking_id_worker_id,
+    booking_id_slot_dir,
+    booking_id_check_symbol,
+    fare_table_file,
+    fares_reload_interval,
+    funnel_history_minutes,
+    bookings_db_path,
+    bookings_max_queue,
+    bookings_batch_size,
+    flow_token_lock_stripes,
+    flow_token_lock_file,
+    shutdown_timeout,
+    reminders_db_path,
+    reminder_offsets_hours,
+    reminder_template,
+    reminder_concurrency,
+    reminder_batch_size,
+    departure_timezone,
+    payment_timeout,
+    payment_callback_secret,
+    payments_db_path,
+    mock_payments,
+    mock_payment_latency,
+    mock_payment_failure_rate,
+    mock_payment_lost_rate,
+    ticket_render_workers,
+    ticket_max_pending,
+    media_cache_db_path,
+    media_upload_dir,
+    webhook_log_dir,
+    webhook_log_segment_bytes,
+    webhook_log_fsync_interval,
+    webhook_log_retention_bytes,
+    webhook_max_attempts,
+    webhook_orphan_scan_interval,
+    reports_dir,
+    reports_flush_interval,
+    seats_per_departure,
+    route_seats,
+)
 from fastapi.responses import JSONResponse
 from utils.security import Security
+from utils.deadline import (
+    AdmissionController,
+    Deadline,
+    DeadlineExceeded,
+    LoadShed,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    deadline_scope,
+)
 
-from models import BookingData
-from datetime import datetime, timedelta
+from models import BookingData, BulkTemplateRequest
+from template_catalog import TemplateNotFound, TemplateParameterError
+from delivery_status import DeliveryTracker, extract_statuses
+from utils.phone import InvalidPhoneNumber, normalize_batch, normalize_phone, to_wa_id
+from language_preferences import LanguagePreferenceStore, REPLY_ID_LANGUAGES
+from pending_prompts import PendingPrompt, PendingPromptIndex
+from flow_compiler import load_flows
+from session_store import SessionStore
+from traffic_recorder import Redactor, TrafficRecorder
+from utils.readiness import Readiness
+from utils.booking_ids import BookingIdGenerator, hold_idle_slot
+from utils.striped_lock import FileStripedLock, LockTimeout, StripedLock
+from utils.shutdown import DrainMiddleware, GracefulShutdown
+from utils.profiling import (
+    DebugHeaderSigner,
+    MemoryProfiler,
+    ProfilerBusy,
+    RequestProfilerMiddleware,
+    SamplingProfiler,
+)
+import hmac
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import date, datetime, timedelta
 import traceback
 
 import logging
 from whatsapp import (
     send_text_message,
+    send_media_message,
+    upload_media,
     send_template_message,
     send_template_message_with_no_params,
     send_flow_message,
     send_language_selection_prompt,
-    register_business_encryption
+    register_business_encryption,
+    send_catalog_template,
+    send_template_bulk,
+    tenant_registry,
+    tracer,
 )
+from utils.tracing import NOOP_SPAN
+from tenants import Tenant, UnknownTenant
+from pricing import PricingEngine, PricingError
+from funnel_analytics import FunnelAnalytics
+from booking_ingest import BookingIngestor
+from reminders import ReminderJob, ReminderScheduler
+from payments import MockPaymentProvider, Payment, PaymentError, PaymentOrchestrator, SUCCEEDED
+import hashlib
+from tickets import LocalMediaUploader, MediaCache, Ticket, TicketPipeline
+from event_log import EventLog, LogConsumer, LogRecord
+from reports import BookingReports
+from zoneinfo import ZoneInfo
+from pydantic import ValidationError
+
+# Expensive components are warmed up after startup instead of at import
+readiness = Readiness()
+
+# Drains in-flight requests and flushes write-behind buffers on shutdown
+shutdown = GracefulShutdown(timeout=shutdown_timeout)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _start_worker()
+    readiness.start()
+    tenant_registry.start_watching()
+    pricing.start_watching()
+    reminders.start()
+    webhook_consumer.start()
+    _start_orphan_drain()
+    booking_reports.start()
+    payments.start_expiring()
+    yield
+    await shutdown.run()
+
 
 # Initialize FastAPI app
-app = FastAPI(title="WhatsApp Flow Testing API", version="1.0.0")
+app = FastAPI(title="WhatsApp Flow Testing API", version="1.0.0", lifespan=lifespan)
+
+# Per-request cProfile for requests with a signed X-Debug-Profile header
+app.add_middleware(
+    RequestProfilerMiddleware,
+    signer=DebugHeaderSigner(profile_signing_key),
+    directory=profile_dir,
+)
+# Outermost: counts every request and turns new ones away while draining
+app.add_middleware(DrainMiddleware, shutdown=shutdown)
+cpu_profiler = SamplingProfiler(profile_dir)
+memory_profiler = MemoryProfiler(profile_dir)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Admission control for the flow data exchange endpoint
+admission = AdmissionController(
+    max_concurrent=flow_max_concurrent,
+    reserved_high=flow_reserved_high_priority,
+    max_queue=flow_max_queue,
+)
+
+# Requests for the same flow_token (double taps, Meta retries) run one at a time
+flow_token_locks = (
+    FileStripedLock(flow_token_lock_file, stripes=flow_token_lock_stripes)
+    if flow_token_lock_file else StripedLock(stripes=flow_token_lock_stripes)
+)
+
+# Delivery status rollups fed by webhook "statuses" events
+delivery_tracker = DeliveryTracker(db_path=delivery_db_path)
+
+# Bookings from /flow-callback, validated in the request and stored in batches
+booking_ingestor = BookingIngestor(db_path=bookings_db_path, max_queue=bookings_max_queue,
+                                   batch_size=bookings_batch_size)
+
+# Language chosen by returning users, so they skip the language prompt
+language_preferences = LanguagePreferenceStore(db_path=language_preferences_db_path)
+
+FLOW_LANGUAGES = ("english", "swahili")
+
+
+def get_tenant(tenant_id: Optional[str] = Query(None, description="Business number to act for (default tenant if omitted)")) -> Tenant:
+    """Resolve the tenant of a request from the current (hot-reloadable) tenant snapshot."""
+    try:
+        return tenant_registry.get(tenant_id)
+    except UnknownTenant:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant {tenant_id}")
+
+# Interactive prompts we sent that are still waiting for a reply, keyed by wamid
+pending_prompts = PendingPromptIndex(ttl=prompt_reply_ttl)
+LANGUAGE_SELECTION = "language_selection"
+
+
+@lru_cache(maxsize=1)
+def get_compiled_flows():
+    """Validated id -> title tables compiled from the flow JSON definitions, loaded on first use."""
+    return load_flows(flow_definition_files, flow_artifact_path)
+
+
+# Flow sessions keyed by flow_token, restored lazily after a restart
+session_store = SessionStore(
+    directory=session_store_dir,
+    ttl=session_ttl,
+    flush_interval=session_flush_interval,
+)
+
+# Per-minute funnel counters; an expired unfinished session counts as abandoned
+funnel = FunnelAnalytics(minutes=funnel_history_minutes)
+session_store.on_expire(funnel.on_session_expired)
+
+# Pseudonymized /flow-data and /webhook traffic for traffic_replay.py
+traffic_recorder = TrafficRecorder(
+    path=traffic_record_file,
+    max_bytes=traffic_record_max_bytes,
+    backups=traffic_record_backups,
+    sample_ratio=traffic_record_sample_ratio,
+    redactor=Redactor(traffic_redaction_salt.encode("utf-8") if traffic_redaction_salt else None),
+)
+
+# Fares by route, class, passenger type and date; hot-reloaded like the tenants file
+pricing = PricingEngine(fare_table_file, reload_interval=fares_reload_interval)
+
+# Template languages of the departure reminder per flow language
+REMINDER_LANG_CODES = {"english": "en_US", "swahili": "sw"}
+
+
+async def send_departure_reminder(job: ReminderJob) -> None:
+    """Send one due departure reminder; raising makes the scheduler retry it."""
+    result = await send_template_message(
+        to=job.recipient,
+        template_name=reminder_template,
+        lang_code=job.payload.get("lang_code", "en_US"),
+        parameters=[job.payload["booking_id"], job.payload["departure"]],
+        expected_params=2,
+        idempotency_key=job.job_id,
+        tenant=tenant_registry.get(job.tenant_id),
+    )
+    if "error" in result:
+        raise RuntimeError(result["error"].get("message", "send failed"))
+    _track_sent(result, job.recipient, template=reminder_template)
+
+
+# Reminders ahead of departure, kept in SQLite so the schedule survives restarts
+reminders = ReminderScheduler(
+    db_path=reminders_db_path,
+    sender=send_departure_reminder,
+    batch_size=reminder_batch_size,
+    concurrency=reminder_concurrency,
+)
+
+# Charges run in the background; the PAYMENT screen only starts them
+payments = PaymentOrchestrator(
+    MockPaymentProvider(
+        latency=mock_payment_latency,
+        failure_rate=mock_payment_failure_rate,
+        lost_rate=mock_payment_lost_rate,
+    ) if mock_payments else None,
+    db_path=payments_db_path,
+    timeout=payment_timeout,
+)
+
+# Tickets are rendered in worker processes and uploaded once per content hash
+ticket_pipeline = TicketPipeline(
+    upload=LocalMediaUploader(media_upload_dir) if media_upload_dir else upload_media,
+    send=send_media_message,
+    cache=MediaCache(media_cache_db_path),
+    workers=ticket_render_workers,
+    max_pending=ticket_max_pending,
+)
+ticket_pipeline.on_sent = lambda result, to: _track_sent(result, to)
+
+
+def _webhook_record_handler(worker: str):
+    """Process records of ``worker``'s webhook log; failures propagate so the consumer retries them."""
+    async def handle(record: LogRecord) -> None:
+        # The record's place in the log identifies the event across retries and replays
+        await process_webhook_event(json.loads(record.payload), event_key=f"webhook:{worker}:{record.offset}")
+    return handle
+
+
+def _open_webhook_log(worker: str) -> Tuple[EventLog, EventLog, LogConsumer]:
+    """Open ``worker``'s webhook log, its dead-letter log and the consumer processing it."""
+    directory = f"{webhook_log_dir}/{worker}"
+    log = EventLog(
+        directory,
+        segment_bytes=webhook_log_segment_bytes,
+        fsync_interval=webhook_log_fsync_interval,
+        retention_bytes=webhook_log_retention_bytes,
+    )
+    dead_letter = EventLog(f"{directory}/dead_letter", segment_bytes=webhook_log_segment_bytes)
+    consumer = LogConsumer(log, "webhook", _webhook_record_handler(worker), dead_letter=dead_letter,
+                           max_attempts=webhook_max_attempts)
+    return log, dead_letter, consumer
+
+
+async def _drain_orphaned_webhook_logs() -> None:
+    """
+    Process what workers that are gone left in their webhook logs.
+
+    A log belongs to the booking id slot it is named after; while nobody holds
+    that slot, this worker holds it, drains the log and lets it go again.
+    """
+    own = f"w{booking_ids.worker_id:03d}"
+    while True:
+        names = sorted(os.listdir(webhook_log_dir)) if os.path.isdir(webhook_log_dir) else []
+        for name in names:
+            if name == own or not (name.startswith("w") and name[1:].isdigit()):
+                continue
+            slot = hold_idle_slot(booking_id_slot_dir, int(name[1:]))
+            if slot is None:
+                continue
+            try:
+                log, dead_letter, consumer = _open_webhook_log(name)
+                try:
+                    if consumer.offset < log.end_offset:
+                        logger.info(f"Draining webhook log of stopped worker {name}: "
+                                    f"{log.end_offset - consumer.offset} bytes")
+                    while await consumer.run_once():
+                        pass
+                finally:
+                    await dead_letter.close()
+                    await log.close()
+            except Exception as e:
+                logger.error(f"Draining webhook log of stopped worker {name} failed: {str(e)}")
+            finally:
+                slot.close()
+        await asyncio.sleep(webhook_orphan_scan_interval)
+
+
+# Per-worker state, created by _start_worker() when the worker starts rather than at
+# import, since it claims a booking id slot and creates files named after it
+booking_ids: Optional[BookingIdGenerator] = None
+webhook_log: Optional[EventLog] = None
+webhook_dead_letter: Optional[EventLog] = None
+webhook_consumer: Optional[LogConsumer] = None
+webhook_orphan_drain: Optional[asyncio.Task] = None
+booking_reports: Optional[BookingReports] = None
+
+
+def _start_worker() -> None:
+    """Claim this worker's booking id slot and open the logs and stores named after it."""
+    global booking_ids, webhook_log, webhook_dead_letter, webhook_consumer, booking_reports
+    # Booking references minted locally; each worker claims its own slot
+    booking_ids = BookingIdGenerator(
+        worker_id=booking_id_worker_id,
+        slot_dir=booking_id_slot_dir,
+        check_symbol=booking_id_check_symbol,
+    )
+    worker = f"w{booking_ids.worker_id:03d}"
+    # Webhook events are appended to a durable log and acked; the consumer processes them.
+    # The directory follows the worker's slot, so a restarted worker resumes its log.
+    webhook_log, webhook_dead_letter, webhook_consumer = _open_webhook_log(worker)
+    # Columnar mirror of confirmed bookings for /reports; each worker appends to its own directory
+    booking_reports = BookingReports(
+        reports_dir,
+        worker=worker,
+        seats_per_departure=seats_per_departure,
+        route_seats=route_seats,
+        flush_interval=reports_flush_interval,
+        format_amount=lambda minor: pricing.table.format(minor),
+    )
+    readiness.register("reports", booking_reports.load)
+
+
+def _start_orphan_drain() -> None:
+    global webhook_orphan_drain
+    if booking_id_slot_dir:
+        webhook_orphan_drain = asyncio.get_running_loop().create_task(_drain_orphaned_webhook_logs())
+
+
+readiness.register("tenants", tenant_registry.warm_up)
+readiness.register("compiled_flows", get_compiled_flows)
+readiness.register("sessions", session_store.restore)
+readiness.register("ticket_renderer", ticket_pipeline.warm_up)
+
+
+async def _flush_bookings() -> Dict:
+    try:
+        await booking_ingestor.flush()
+    finally:
+        # Also stops the consumer if the flush ran out of shutdown time
+        await booking_ingestor.close()
+    stats = booking_ingestor.stats()
+    return {"queued": stats["queued"], "failed": stats["failed"]}
+
+
+async def _flush_delivery_statuses() -> Dict:
+    try:
+        await delivery_tracker.flush()
+    finally:
+        await delivery_tracker.close()
+    return {"queued_batches": delivery_tracker.stats()["queued_batches"]}
+
+
+async def _flush_traffic_recording() -> Dict:
+    await traffic_recorder.flush()
+    return {"queued": traffic_recorder.stats()["queued"]}
+
+
+async def _close_webhook_consumer() -> Dict:
+    if webhook_orphan_drain is not None:
+        # An interrupted orphaned log is drained again by whoever picks it up next
+        webhook_orphan_drain.cancel()
+        await asyncio.wait([webhook_orphan_drain])
+    return await webhook_consumer.close()
+
+
+async def _close_webhook_log() -> Dict:
+    await webhook_dead_letter.close()
+    await webhook_log.close()
+    return {"pending_bytes": webhook_consumer.stats()["pending_bytes"]}
+
+
+async def _close_reports() -> Dict:
+    return await booking_reports.close()
+
+
+def _close_booking_ids() -> None:
+    booking_ids.close()
+
+
+async def _flush_spans() -> Dict:
+    await tracer.flush()
+    return {"buffered": tracer.stats()["spans_buffered"]}
+
+
+# Shutdown steps, in order: write-behind queues, session state, outbound clients, spans last
+shutdown.add_step("fare_watcher", pricing.stop_watching)
+shutdown.add_step("webhook_consumer", _close_webhook_consumer)
+shutdown.add_step("webhook_log", _close_webhook_log)
+shutdown.add_step("bookings", _flush_bookings)
+shutdown.add_step("payments", payments.close)
+shutdown.add_step("reports", _close_reports)
+shutdown.add_step("tickets", ticket_pipeline.close)
+shutdown.add_step("reminders", reminders.close)
+shutdown.add_step("delivery_statuses", _flush_delivery_statuses)
+shutdown.add_step("sessions", session_store.close)
+shutdown.add_step("traffic_recording", _flush_traffic_recording)
+shutdown.add_step("graph_clients", tenant_registry.aclose)
+shutdown.add_step("booking_ids", _close_booking_ids)
+shutdown.add_step("flow_token_locks", flow_token_locks.close)
+shutdown.add_step("tracing", _flush_spans)
+
+
+def _recipient(to: str) -> str:
+    """Normalize a recipient number to E.164 or reject the request."""
+    try:
+        return normalize_phone(to)
+    except InvalidPhoneNumber as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _sender_wa_id(sender: str) -> str:
+    """
+    Canonical wa_id of a webhook sender.
+
+    Meta already sends E.164 digits, so a sender our country rules reject is
+    kept as sent rather than dropping the reply.
+    """
+    try:
+        return to_wa_id(normalize_phone(sender))
+    except InvalidPhoneNumber:
+        return sender
+
+
+def _track_sent(result: Dict, to: str, template: Optional[str] = None, broadcast_id: Optional[str] = None) -> None:
+    """Register the wamid of a successful send so its status events roll up."""
+    for message in result.get("messages", ()):
+        if message.get("id"):
+            delivery_tracker.register_outbound(message["id"], to, template=template, broadcast_id=broadcast_id)
+
 @app.get("/")
 async def root() -> Dict:
     """
@@ -41,7 +505,8 @@ async def root() -> Dict:
 @app.post("/send-text")
 async def send_text(
     to: str = Query(..., description="WhatsApp number with country code (e.g., +1234567890)"),
-    message: str = Query(..., description="Text message content")
+    message: str = Query(..., description="Text message content"),
+    tenant: Tenant = Depends(get_tenant)
 ) -> Dict:
     """
     Send a text message via WhatsApp.
@@ -54,10 +519,11 @@ async def send_text(
         Dict: JSON response from the WhatsApp API.
 
     Raises:
-        HTTPException: If the message sending fails.
+        HTTPException: If the number is invalid or the message sending fails.
     """
+    to = _recipient(to)
     try:
-        return await send_text_message(to, message)
+        return await send_text_message(to, message, tenant=tenant)
     except Exception as e:
         logger.error(f"Error sending text message: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to send text message")
@@ -66,7 +532,8 @@ async def send_text(
 async def send_template_no_params(
     to: str = Query(..., description="WhatsApp number with country code"),
     template_name: str = Query(..., description="Approved WhatsApp template name"),
-    lang_code: str = Query(..., description="Language code registered at Meta (e.g., en_US)")
+    lang_code: str = Query(..., description="Language code registered at Meta (e.g., en_US)"),
+    tenant: Tenant = Depends(get_tenant)
 ) -> Dict:
     """
     Send a WhatsApp template message without parameters.
@@ -80,10 +547,11 @@ async def send_template_no_params(
         Dict: JSON response from the WhatsApp API.
 
     Raises:
-        HTTPException: If the template sending fails.
+        HTTPException: If the number is invalid or the template sending fails.
     """
+    to = _recipient(to)
     try:
-        return await send_template_message_with_no_params(to, template_name, lang_code)
+        return await send_template_message_with_no_params(to, template_name, lang_code, tenant=tenant)
     except Exception as e:
         logger.error(f"Error sending template without parameters: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to send template")
@@ -93,18 +561,22 @@ async def send_template(
     to: str = Query(..., description="WhatsApp number with country code"),
     template_name: str = Query(..., description="Approved WhatsApp template name"),
     lang_code: str = Query(..., description="Language code registered at Meta (e.g., en_US)"),
-    expected_params: int = Query(0, description="Number of parameters the template expects"),
+    expected_params: Optional[int] = Query(None, description="Number of parameters the template expects (derived from the template catalog if omitted)"),
     param1: Optional[str] = Query(None, description="First template parameter"),
-    param2: Optional[str] = Query(None, description="Second template parameter")
+    param2: Optional[str] = Query(None, description="Second template parameter"),
+    tenant: Tenant = Depends(get_tenant)
 ) -> Dict:
     """
     Send a WhatsApp template message with optional parameters.
 
+    When ``expected_params`` is omitted the template is looked up in the
+    template catalog, which knows its parameter count.
+
     Args:
         to (str): Recipient phone number with country code.
         template_name (str): Name of the approved WhatsApp template.
         lang_code (str): Language code for the template.
-        expected_params (int): Number of parameters the template expects.
+        expected_params (Optional[int]): Number of parameters the template expects.
         param1 (Optional[str]): First template parameter.
         param2 (Optional[str]): Second template parameter.
 
@@ -114,6 +586,21 @@ async def send_template(
     Raises:
         HTTPException: If parameter validation fails or the template sending fails.
     """
+    to = _recipient(to)
+    if expected_params is None:
+        parameters = [p for p in [param1, param2] if p is not None]
+        try:
+            result = await send_catalog_template(to, template_name, lang_code, parameters, tenant=tenant)
+            _track_sent(result, to, template=template_name)
+            return result
+        except TemplateNotFound:
+            raise HTTPException(status_code=404, detail=f"Unknown template {template_name} ({lang_code})")
+        except TemplateParameterError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            logger.error(f"Error sending template: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to send template")
+
     parameters = [p for p in [param1, param2][:expected_params] if p is not None]
 
     try:
@@ -122,31 +609,121 @@ async def send_template(
             template_name=template_name,
             lang_code=lang_code,
             parameters=parameters,
-            expected_params=expected_params
+            expected_params=expected_params,
+            tenant=tenant
         )
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
+        _track_sent(result, to, template=template_name)
         return result
     except Exception as e:
         logger.error(f"Error sending template: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to send template")
 
+@app.post("/send-template-bulk")
+async def send_template_bulk_endpoint(request: BulkTemplateRequest, tenant: Tenant = Depends(get_tenant)) -> Dict:
+    """
+    Send one approved template to many recipients using its compiled skeleton.
+
+    Args:
+        request (BulkTemplateRequest): Recipients, template and parameters.
+
+    Returns:
+        Dict: Per-recipient results and a sent/failed summary.
+
+    Raises:
+        HTTPException: If the template is unknown.
+    """
+    recipients, invalid = normalize_batch(request.recipients)
+    per_recipient_parameters = None
+    if request.per_recipient_parameters:
+        per_recipient_parameters = {}
+        for raw, params in request.per_recipient_parameters.items():
+            try:
+                per_recipient_parameters[normalize_phone(raw)] = params
+            except InvalidPhoneNumber:
+                pass
+    try:
+        results = await send_template_bulk(
+            recipients=recipients,
+            template_name=request.template_name,
+            lang_code=request.lang_code,
+            parameters=request.parameters,
+            per_recipient_parameters=per_recipient_parameters,
+            idempotency_prefix=request.broadcast_id,
+            tenant=tenant,
+        )
+    except TemplateNotFound:
+        raise HTTPException(status_code=404, detail=f"Unknown template {request.template_name} ({request.lang_code})")
+    for r in results:
+        if "response" in r:
+            _track_sent(r["response"], r["to"], template=request.template_name, broadcast_id=request.broadcast_id)
+    failed = sum(1 for r in results if "error" in r)
+    return {
+        "sent": len(results) - failed,
+        "failed": failed,
+        "duplicates_removed": len(request.recipients) - len(recipients) - len(invalid),
+        "invalid": invalid,
+        "results": results,
+    }
+
+@app.get("/templates")
+async def list_templates(tenant: Tenant = Depends(get_tenant)) -> Dict:
+    """List the approved templates in the catalog with their derived parameter counts."""
+    template_catalog = tenant.template_catalog
+    if template_catalog.stats()["age_seconds"] is None:
+        await template_catalog.refresh()
+    return {**template_catalog.stats(), "templates": template_catalog.list()}
+
 
 
 # =============================================================================LETS START FROM HERE==============================================
 
 
 @app.post("/register-encryption")
-async def register():
-    return await register_business_encryption()
+async def register(tenant: Tenant = Depends(get_tenant)):
+    return await register_business_encryption(tenant)
 """ THIS DID NOT WORK WELL THEN I HAD TO USE curl-x POST\ FILE WHICH RESEMBLED META DOCUMENTATION """
 
 
 
 
+def _flow_priority(decrypted_data: Dict) -> int:
+    """Pings and the final PAYMENT step jump the admission queue."""
+    if decrypted_data.get("action") == "ping" or decrypted_data.get("screen") == "PAYMENT":
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+def _shed_response(reason: str) -> JSONResponse:
+    """Fast error returned when a flow request cannot be answered in time."""
+    return JSONResponse(
+        content={"error": "Service overloaded", "reason": reason},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.post("/flow-data")
 async def flow_data(request: Request):
-    """Flow data exchange endpoint for booking system."""
+    """Flow data exchange endpoint for booking system (default tenant)."""
+    return await _flow_data(request, tenant_registry.default())
+
+
+@app.post("/flow-data/{tenant_id}")
+async def tenant_flow_data(request: Request, tenant_id: str):
+    """Flow data exchange endpoint of one tenant; each tenant's flows point at their own URL and key."""
+    try:
+        tenant = tenant_registry.get(tenant_id)
+    except UnknownTenant:
+        return JSONResponse(content={"error": "Unknown tenant"}, status_code=status.HTTP_404_NOT_FOUND)
+    return await _flow_data(request, tenant)
+
+
+async def _flow_data(request: Request, tenant: Tenant):
+    arrived_at = time.time()
+    deadline = Deadline.from_now(flow_response_deadline)
+    span = NOOP_SPAN
     try:
         # Load and decrypt incoming data
         data = await request.json()
@@ -154,268 +731,319 @@ async def flow_data(request: Request):
         encrypted_aes_key = data.get("encrypted_aes_key")
         initial_vector = data.get("initial_vector")
 
+        # Shed before the RSA decrypt, the most expensive step, when the request cannot be admitted in time
+        admission.shed_early(deadline)
+        deadline.check("decrypt")
         decrypted_data, aes_key, iv = Security.decrypt_request(
             encrypted_flow_data_b64=encrypted_flow_data,
             encrypted_aes_key_b64=encrypted_aes_key,
             initial_vector_b64=initial_vector,
+            private_key=tenant.private_key,
         )
         
-        print(f"\nDecrypted data: {decrypted_data}")
+        decrypted_at = time.time()
         
-        # Handle health check (ping)
-        if decrypted_data.get("action") == "ping":
-            print("Ping received - Flow is active")
-            response = {
-                "screen": None,
-                "data": {
-                    "status": "active",
-                },
-            }
-            encrypted_response = Security.encrypt_response(
-                response=response, aes_key=aes_key, iv=iv
-            )
-            return Response(
-                content=encrypted_response,
-                media_type="text/plain",
-                status_code=status.HTTP_200_OK,
-            )
+        print(f"\nDecrypted data: {decrypted_data}")
+
+        # The trace is only known once the flow_token is decrypted; pings carry none and are not traced
+        span = tracer.span("flow_data", key=decrypted_data.get("flow_token"), start=arrived_at, attributes={
+            "tenant": tenant.tenant_id,
+            "flow.action": decrypted_data.get("action"),
+            "flow.screen": decrypted_data.get("screen"),
+        })
+        with span:
+            tracer.span("flow_data.decrypt", start=arrived_at).end(end_time=decrypted_at)
+            # Waiting for the same journey's previous request does not hold an admission slot
+            async with deadline_scope(deadline), \
+                    flow_token_locks.hold(decrypted_data.get("flow_token"), timeout=max(deadline.remaining(), 0)), \
+                    admission.admit(deadline, _flow_priority(decrypted_data)):
+                span.set("admission_wait_ms", round((time.time() - decrypted_at) * 1000, 3))
+                deadline.check("handler")
+                with tracer.span("flow_data.handler"):
+                    response = await handle_flow_request(decrypted_data, tenant)
+                _track_funnel(decrypted_data, response)
+
+                # Encrypt and return response
+                deadline.check("encrypt")
+                print(f"Response before encryption: {response}")
+                with tracer.span("flow_data.encrypt"):
+                    encrypted_response = Security.encrypt_response(
+                        response=response, aes_key=aes_key, iv=iv
+                    )
+            span.set("flow.next_screen", response.get("screen"))
+
+        traffic_recorder.record(
+            "flow_data", decrypted_data,
+            tenant=tenant.tenant_id,
+            latency_ms=round((time.time() - arrived_at) * 1000, 3),
+            next_screen=response.get("screen"),
+        )
+
+        return Response(
+            content=encrypted_response,
+            media_type="text/plain",
+            status_code=status.HTTP_200_OK,
+        )
+
+    except LoadShed as e:
+        logger.warning(str(e))
+        span.set("shed", e.reason)
+        return _shed_response(e.reason)
+    except LockTimeout as e:
+        logger.warning(str(e))
+        span.set("shed", "flow_token_busy")
+        return _shed_response("flow_token_busy")
+    except DeadlineExceeded as e:
+        logger.warning(str(e))
+        admission.record_deadline_miss(e.phase)
+        span.set("deadline_exceeded", e.phase)
+        return _shed_response(f"deadline_exceeded:{e.phase}")
+    except Exception as e:
+        print(f"Error processing flow data: {str(e)}")
+        return JSONResponse(
+            content={"error": "Internal server error"},
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        )
 
-        # Handle INIT action - Flow initialization
-        if decrypted_data.get("action") == "INIT":
-            flow_token = decrypted_data.get("flow_token")
-            print(f"Flow initialization - Token: {flow_token}")
-            
-            initialize_flow_session(flow_token)
-            
-            response = {
-                "screen": "PERSONAL_INFO",
-                "data": {
-                    "initialized": True,
-                    "welcome_message": "Welcome to our booking system!"
-                }
-            }
-            encrypted_response = Security.encrypt_response(
-                response=response, aes_key=aes_key, iv=iv
-            )
-            return Response(
-                content=encrypted_response,
-                media_type="text/plain",
-                status_code=status.HTTP_200_OK,
-            )
 
-        # Handle screen navigation and data requests
-        current_screen = decrypted_data.get("screen")
-        action = decrypted_data.get("action")
+def _track_funnel(decrypted_data: Dict, response: Dict) -> None:
+    """Fold one data exchange into the funnel counters."""
+    flow_token = decrypted_data.get("flow_token")
+    session_data = session_store.get(flow_token) if flow_token else None
+    if session_data is not None and funnel.observe(session_data, decrypted_data, response):
+        session_store.put(flow_token, session_data)
+
+
+async def handle_flow_request(decrypted_data: Dict, tenant: Optional[Tenant] = None) -> Dict:
+    """Build the (unencrypted) response for a decrypted flow data exchange request."""
+    # Handle health check (ping)
+    if decrypted_data.get("action") == "ping":
+        print("Ping received - Flow is active")
+        return {
+            "screen": None,
+            "data": {
+                "status": "active",
+            },
+        }
+
+    # Handle INIT action - Flow initialization
+    if decrypted_data.get("action") == "INIT":
         flow_token = decrypted_data.get("flow_token")
+        print(f"Flow initialization - Token: {flow_token}")
+        
+        initialize_flow_session(flow_token)
         
-        print(f"Current screen: {current_screen}, Action: {action}")
+        return {
+            "screen": "PERSONAL_INFO",
+            "data": {
+                "initialized": True,
+                "welcome_message": "Welcome to our booking system!"
+            }
+        }
 
-        # Handle data_exchange actions
-        if action == "data_exchange":
-            form_data = decrypted_data.get("data", {})
-            
-            if current_screen == "PERSONAL_INFO":
-                # Validate form data
-                errors = validate_travel_details(form_data)
-                if errors:
-                    response = {
-                        "screen": "PERSONAL_INFO",
-                        "data": {
-                            "validation": "failed",
-                            "errors": errors
-                        }
+    # Handle screen navigation and data requests
+    current_screen = decrypted_data.get("screen")
+    action = decrypted_data.get("action")
+    flow_token = decrypted_data.get("flow_token")
+    
+    print(f"Current screen: {current_screen}, Action: {action}")
+
+    # Handle data_exchange actions
+    if action == "data_exchange":
+        form_data = decrypted_data.get("data", {})
+        
+        if current_screen == "PERSONAL_INFO":
+            # Validate form data
+            errors = validate_travel_details(form_data)
+            if errors:
+                response = {
+                    "screen": "PERSONAL_INFO",
+                    "data": {
+                        "validation": "failed",
+                        "errors": errors
                     }
+                }
+            else:
+                # Fetch availability slots
+                trip_type = form_data.get("trip_type")
+                going_route = form_data.get("going_route")
+                going_no_passengers = int(form_data.get("going_no_passengers"))
+                going_date = form_data.get("going_date")
+                return_route = form_data.get("return_route")
+                return_no_passengers = int(form_data.get("return_no_passengers")) if form_data.get("return_no_passengers") else None
+                return_date = form_data.get("return_date")
+                
+                if trip_type == "round_trip":
+                    availability_data = get_available_time_slots_round(
+                        going_route=going_route,
+                        going_date=going_date,
+                        going_no_passengers=going_no_passengers,
+                        return_route=return_route,
+                        return_date=return_date,
+                        return_no_passengers=return_no_passengers
+                    )
                 else:
-                    # Fetch availability slots
-                    trip_type = form_data.get("trip_type")
-                    going_route = form_data.get("going_route")
-                    going_no_passengers = int(form_data.get("going_no_passengers"))
-                    going_date = form_data.get("going_date")
-                    return_route = form_data.get("return_route")
-                    return_no_passengers = int(form_data.get("return_no_passengers")) if form_data.get("return_no_passengers") else None
-                    return_date = form_data.get("return_date")
-                    
-                    if trip_type == "round_trip":
-                        availability_data = get_available_time_slots_round(
-                            going_route=going_route,
-                            going_date=going_date,
-                            going_no_passengers=going_no_passengers,
-                            return_route=return_route,
-                            return_date=return_date,
-                            return_no_passengers=return_no_passengers
-                        )
-                    else:
-                        availability_data = {
-                            "going_availability_slots": get_available_time_slots(
-                                route=going_route,
-                                date=going_date,
-                                passengers=going_no_passengers
-                            ),
-                            "return_availability_slots": []
-                        }
-                    
-                    # Store form data in session
-                    update_flow_session(flow_token, {"travel_details": form_data})
-                    
-                    response = {
-                        "screen": "AVAILABILITY",
-                        "data": availability_data
+                    availability_data = {
+                        "going_availability_slots": get_available_time_slots(
+                            route=going_route,
+                            date=going_date,
+                            passengers=going_no_passengers
+                        ),
+                        "return_availability_slots": []
                     }
                 
-            elif current_screen == "AVAILABILITY":
-                # Validate and store time selections
-                going_time = form_data.get("going_time")
-                return_time = form_data.get("return_time")
+                # Store form data in session
+                update_flow_session(flow_token, {"travel_details": form_data})
                 
-                errors = []
-                if not going_time:
-                    errors.append("Going time is required")
-                if form_data.get("trip_type") == "round_trip" and not return_time:
-                    errors.append("Return time is required")
+                response = {
+                    "screen": "AVAILABILITY",
+                    "data": availability_data
+                }
+            
+        elif current_screen == "AVAILABILITY":
+            # Validate and store time selections
+            going_time = form_data.get("going_time")
+            return_time = form_data.get("return_time")
+            
+            errors = []
+            if not going_time:
+                errors.append("Going time is required")
+            if form_data.get("trip_type") == "round_trip" and not return_time:
+                errors.append("Return time is required")
+            
+            if errors:
+                response = {
+                    "screen": "AVAILABILITY",
+                    "data": {
+                        "validation": "failed",
+                        "errors": errors
+                    }
+                }
+            else:
+                # Store time selections in session
+                session_data = update_flow_session(flow_token, {"time_selections": form_data})
                 
-                if errors:
-                    response = {
-                        "screen": "AVAILABILITY",
-                        "data": {
-                            "validation": "failed",
-                            "errors": errors
-                        }
+                # Fetch seat categories priced for the going route and date
+                travel_details = session_data["user_data"].get("travel_details", {})
+                seat_categories = get_seat_categories(travel_details.get("going_route"), travel_details.get("going_date"))
+                response = {
+                    "screen": "SEATS",
+                    "data": {
+                        "seat_categories": seat_categories
                     }
-                else:
-                    # Store time selections in session
-                    update_flow_session(flow_token, {"time_selections": form_data})
-                    
-                    # Fetch seat categories
-                    seat_categories = get_seat_categories()
-                    response = {
-                        "screen": "SEATS",
-                        "data": {
-                            "seat_categories": seat_categories
-                        }
+                }
+            
+        elif current_screen == "SEATS":
+            # Validate seat class and passenger counts
+            seat_class = form_data.get("seat_class")
+            adult_passengers = int(form_data.get("adult_passengers")) if form_data.get("adult_passengers") else 0
+            child_passengers = int(form_data.get("child_passengers")) if form_data.get("child_passengers") else 0
+            
+            # Retrieve travel details from session
+            session_data = get_flow_session(flow_token)
+            travel_details = session_data["user_data"].get("travel_details", {})
+            going_no_passengers = int(travel_details.get("going_no_passengers", 0))
+            return_no_passengers = int(travel_details.get("return_no_passengers", 0)) if travel_details.get("return_no_passengers") else 0
+            
+            errors = []
+            if not seat_class:
+                errors.append("Seat class is required")
+            total_passengers = adult_passengers + child_passengers
+            if total_passengers != going_no_passengers:
+                errors.append(f"Total adult and child passengers ({total_passengers}) must match going passengers ({going_no_passengers})")
+            if travel_details.get("trip_type") == "round_trip" and total_passengers != return_no_passengers:
+                errors.append(f"Total adult and child passengers ({total_passengers}) must match return passengers ({return_no_passengers})")
+            if not errors:
+                try:
+                    quote = pricing.quote(travel_details, seat_class, adult_passengers, child_passengers)
+                except PricingError as e:
+                    errors.append(str(e))
+            
+            if errors:
+                response = {
+                    "screen": "SEATS",
+                    "data": {
+                        "validation": "failed",
+                        "errors": errors
                     }
+                }
+            else:
+                # Store seat selections and the fare in session
+                update_flow_session(flow_token, {"seat_selections": form_data, "fare": quote.to_dict()})
                 
-            elif current_screen == "SEATS":
-                # Validate seat class and passenger counts
-                seat_class = form_data.get("seat_class")
-                adult_passengers = int(form_data.get("adult_passengers")) if form_data.get("adult_passengers") else 0
-                child_passengers = int(form_data.get("child_passengers")) if form_data.get("child_passengers") else 0
-                
-                # Retrieve travel details from session
-                session_data = get_flow_session(flow_token)
-                travel_details = session_data.get("travel_details", {})
-                going_no_passengers = int(travel_details.get("going_no_passengers", 0))
-                return_no_passengers = int(travel_details.get("return_no_passengers", 0)) if travel_details.get("return_no_passengers") else 0
-                
-                errors = []
-                if not seat_class:
-                    errors.append("Seat class is required")
-                total_passengers = adult_passengers + child_passengers
-                if total_passengers != going_no_passengers:
-                    errors.append(f"Total adult and child passengers ({total_passengers}) must match going passengers ({going_no_passengers})")
-                if travel_details.get("trip_type") == "round_trip" and total_passengers != return_no_passengers:
-                    errors.append(f"Total adult and child passengers ({total_passengers}) must match return passengers ({return_no_passengers})")
-                
-                if errors:
-                    response = {
-                        "screen": "SEATS",
-                        "data": {
-                            "validation": "failed",
-                            "errors": errors
-                        }
+                response = {
+                    "screen": "DETAILS",
+                    "data": {
+                        "validation": "success"
                     }
-                else:
-                    # Store seat selections in session
-                    update_flow_session(flow_token, {"seat_selections": form_data})
-                    
+                }
+            
+        elif current_screen == "DETAILS":
+            # Validate personal details
+            validation_result = validate_personal_details(form_data)
+            if validation_result["valid"]:
+                # Store personal details in session
+                update_flow_session(flow_token, {"personal_details": form_data})
+                if form_data.get("trip_type")== "round_trip":
                     response = {
-                        "screen": "DETAILS",
-                        "data": {
-                            "validation": "success"
+                        "screen": "RETURN_DETAILS",
+                        "data":{
+                            "validation":"success"
                         }
                     }
-                
-            elif current_screen == "DETAILS":
-                # Validate personal details
-                validation_result = validate_personal_details(form_data)
-                if validation_result["valid"]:
-                    # Store personal details in session
-                    update_flow_session(flow_token, {"personal_details": form_data})
-                    if form_data.get("trip_type")== "round_trip":
-                        response = {
-                            "screen": "RETURN_DETAILS",
-                            "data":{
-                                "validation":"success"
-                            }
-                        }
-                    else:           
-                        response = {
-                            "screen": "PAYMENT",
-                            "data": {
-                                "booking_confirmation": 
-                            {
-                                "booking_id": "7436rjfd",
-                                "status": "paid",
-                                "message": "Thanks"
-
-                            }
-                            }
-                        }
-                else:
+                else:           
                     response = {
-                        "screen": "DETAILS",
+                        "screen": "PAYMENT",
                         "data": {
-                            "booking_confirmation": {
-                                "booking_id": "7436rjfd",
-                                "status": "failed",
-                                "message":  validation_result["errors"]
-                            },
-                            
+                            "booking_confirmation": 
+                        {
+                            "booking_id": booking_reference(flow_token),
+                            "status": "paid",
+                            "message": "Thanks",
+                            "total": booking_total(flow_token)
+
                         }
-                    }
-            elif current_screen == "RETURN_DETAILS":
-                # Validate personal details
-                validation_result = validate_personal_details(form_data)
-                if validation_result["valid"]:
-                    # Store personal details in session
-                    update_flow_session(flow_token, {"personal_details": form_data})
-                    response = {
-                            "screen": "PAYMENT",
-                            "data": {
-                                "booking_confirmation": 
-                            {
-                                "booking_id": "7436rjfd",
-                                "status": "paid",
-                                "message": "Thanks"
-
-                            }
-                            }
                         }
-
-            elif current_screen == "PAYMENT":
-                # Process payment and complete booking
-                booking_result = process_booking(form_data, flow_token)
-                response = {
-                    "screen": "SUCCESS",
-                    "data": {
-                        "booking_confirmation": booking_result
                     }
-                }
-                
             else:
                 response = {
-                    "screen": current_screen,
+                    "screen": "DETAILS",
                     "data": {
-                        "error_message": "Unknown screen"
+                        "booking_confirmation": {
+                            "booking_id": booking_reference(flow_token),
+                            "status": "failed",
+                            "message":  validation_result["errors"]
+                        },
+                        
                     }
                 }
-                
-        # Handle BACK navigation
-        elif action == "BACK":
-            previous_screen = get_previous_screen(current_screen)
+        elif current_screen == "RETURN_DETAILS":
+            # Validate personal details
+            validation_result = validate_personal_details(form_data)
+            if validation_result["valid"]:
+                # Store personal details in session
+                update_flow_session(flow_token, {"personal_details": form_data})
+                response = {
+                        "screen": "PAYMENT",
+                        "data": {
+                            "booking_confirmation": 
+                        {
+                            "booking_id": booking_reference(flow_token),
+                            "status": "paid",
+                            "message": "Thanks",
+                            "total": booking_total(flow_token)
+
+                        }
+                        }
+                    }
+
+        elif current_screen == "PAYMENT":
+            # Start the charge; the booking is confirmed when the provider answers
+            booking_result = await start_payment(form_data, flow_token, tenant.tenant_id if tenant else None)
             response = {
-                "screen": previous_screen,
+                "screen": "SUCCESS",
                 "data": {
-                    "message": "Navigated back successfully"
+                    "booking_confirmation": booking_result
                 }
             }
             
@@ -423,28 +1051,206 @@ async def flow_data(request: Request):
             response = {
                 "screen": current_screen,
                 "data": {
-                    "error_message": "Unknown action"
+                    "error_message": "Unknown screen"
                 }
             }
-
-        # Encrypt and return response
-        print(f"Response before encryption: {response}")
-        encrypted_response = Security.encrypt_response(
-            response=response, aes_key=aes_key, iv=iv
-        )
-        
-        return Response(
-            content=encrypted_response,
-            media_type="text/plain",
-            status_code=status.HTTP_200_OK,
-        )
+            
+    # Handle BACK navigation
+    elif action == "BACK":
+        previous_screen = get_previous_screen(current_screen)
+        response = {
+            "screen": previous_screen,
+            "data": {
+                "message": "Navigated back successfully"
+            }
+        }
         
-    except Exception as e:
-        print(f"Error processing flow data: {str(e)}")
-        return JSONResponse(
-            content={"error": "Internal server error"},
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        )
+    else:
+        response = {
+            "screen": current_screen,
+            "data": {
+                "error_message": "Unknown action"
+            }
+        }
+
+    return response
+
+
+@app.get("/metrics")
+async def metrics() -> Dict:
+    """Expose in-process counters (admission control, outbound Graph API calls)."""
+    return {
+        "flow_admission": admission.stats(),
+        "flow_token_locks": flow_token_locks.stats(),
+        "tenants": tenant_registry.stats(),
+        "delivery_status": delivery_tracker.stats(),
+        "bookings": booking_ingestor.stats(),
+        "language_preferences": language_preferences.stats(),
+        "pending_prompts": pending_prompts.stats(),
+        "sessions": session_store.stats(),
+        "tracing": tracer.stats(),
+        "traffic_recorder": traffic_recorder.stats(),
+        "booking_ids": booking_ids.stats(),
+        "pricing": pricing.stats(),
+        "funnel": funnel.stats(),
+        "profiling": {"cpu_profiles": cpu_profiler.profiles, "memory": memory_profiler.stats()},
+        "reminders": reminders.stats(),
+        "payments": payments.stats(),
+        "tickets": ticket_pipeline.stats(),
+        "reports": booking_reports.stats(),
+        "webhook_log": {**webhook_log.stats(), "consumer": webhook_consumer.stats()},
+        "startup": readiness.stats(),
+        "shutdown": shutdown.stats(),
+    }
+
+
+@app.get("/analytics/funnel")
+async def funnel_report(
+    minutes: int = Query(60, ge=1, description="Window length in minutes, ending at `end`"),
+    end: Optional[datetime] = Query(None, description="End of the window (ISO 8601, default now)"),
+    route: Optional[str] = Query(None, description="Only journeys on this going route, e.g. DAR_ZNZ"),
+    language: Optional[str] = Query(None, description="Only journeys in this language (english/swahili)"),
+) -> Dict:
+    """
+    Booking funnel conversion, validation failures and abandonment for a time window.
+
+    Answered from this worker's per-minute counters; windows longer than the
+    history kept (FUNNEL_HISTORY_MINUTES) are truncated.
+    """
+    return funnel.funnel(
+        minutes=minutes,
+        end=end.timestamp() if end else None,
+        route=route,
+        language=language,
+    )
+
+
+def require_admin(request: Request) -> None:
+    """Allow admin endpoints only with ``Authorization: Bearer <ADMIN_TOKEN>``."""
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    supplied = request.headers.get("authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {admin_token}".encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.get("/tenants", dependencies=[Depends(require_admin)])
+async def list_tenants() -> Dict:
+    """Active tenant configuration version with per-tenant pool, breaker and rate limit stats."""
+    return tenant_registry.stats()
+
+
+@app.post("/tenants/reload", dependencies=[Depends(require_admin)])
+async def reload_tenants() -> Dict:
+    """Re-read the tenants file now instead of waiting for the file watcher."""
+    if not tenant_registry.reload():
+        raise HTTPException(status_code=400, detail=tenant_registry.last_error)
+    return {"status": "reloaded", "version": tenant_registry.snapshot.version}
+
+
+@app.post("/admin/profile/cpu", dependencies=[Depends(require_admin)])
+async def profile_cpu(
+    seconds: float = Query(10.0, gt=0, le=120, description="How long to sample this worker"),
+    interval_ms: float = Query(5.0, ge=1, le=100, description="Sampling interval")
+) -> Dict:
+    """
+    Sample the stacks of this worker for a while and write collapsed stacks.
+
+    Returns:
+        Dict: Path of the ``.collapsed`` file (flamegraph.pl / speedscope input) and the hottest stacks.
+
+    Raises:
+        HTTPException: 409 if a CPU profile is already running in this worker.
+    """
+    try:
+        return await asyncio.to_thread(cpu_profiler.run, seconds, interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/profile/memory/start", dependencies=[Depends(require_admin)])
+async def profile_memory_start(frames: int = Query(25, ge=1, le=100)) -> Dict:
+    """Start tracemalloc in this worker (allocations get slower while it runs)."""
+    return memory_profiler.start(frames)
+
+
+@app.post("/admin/profile/memory/snapshot", dependencies=[Depends(require_admin)])
+async def profile_memory_snapshot(
+    top: int = Query(20, ge=1, le=200),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$")
+) -> Dict:
+    """Dump a tracemalloc snapshot and report growth since the previous snapshot."""
+    try:
+        return await asyncio.to_thread(memory_profiler.snapshot, top, group_by)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/profile/memory/stop", dependencies=[Depends(require_admin)])
+async def profile_memory_stop() -> Dict:
+    return memory_profiler.stop()
+
+
+@app.post("/admin/drain", dependencies=[Depends(require_admin)])
+async def drain() -> Dict:
+    """Stop taking new requests ahead of a deploy; /ready turns 503 so traffic moves away."""
+    shutdown.start_draining()
+    return shutdown.stats()
+
+
+@app.post("/admin/webhook-log/replay", dependencies=[Depends(require_admin)])
+async def replay_webhook_log(
+    offset: Optional[int] = Query(None, ge=0, description="Log offset to reprocess from"),
+    since: Optional[float] = Query(None, description="Reprocess events appended at or after this epoch time"),
+) -> Dict:
+    """
+    Move this worker's webhook consumer back (or forward) and reprocess the log from there,
+    e.g. after fixing a bug in event processing. Events are processed again, so sends to
+    users are only deduplicated where the processing path is idempotent.
+
+    Raises:
+        HTTPException: 400 unless exactly one of ``offset`` and ``since`` is given.
+    """
+    if (offset is None) == (since is None):
+        raise HTTPException(status_code=400, detail="Give either offset or since")
+    if since is not None:
+        offset = await asyncio.to_thread(webhook_log.offset_for_time, since)
+    return await webhook_consumer.replay_from(offset)
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once every warm-up step has finished, 503 while any is pending or failed or while draining."""
+    body = readiness.stats()
+    body["draining"] = shutdown.draining
+    return JSONResponse(status_code=200 if body["ready"] and not shutdown.draining else 503, content=body)
+
+
+@app.get("/delivery-stats")
+async def delivery_stats(
+    broadcast_id: Optional[str] = Query(None, description="Roll up a single broadcast"),
+    template: Optional[str] = Query(None, description="Roll up a single template")
+) -> Dict:
+    """
+    Delivery funnel (sent/delivered/read/failed) and latency percentiles.
+
+    Args:
+        broadcast_id (Optional[str]): Restrict to one broadcast.
+        template (Optional[str]): Restrict to one template.
+
+    Returns:
+        Dict: Rollup counts, rates, error codes and latency percentiles.
+    """
+    return delivery_tracker.summary(broadcast_id=broadcast_id, template=template)
+
+
+@app.get("/delivery-status/{wamid}", dependencies=[Depends(require_admin)])
+async def delivery_status(wamid: str) -> Dict:
+    """Return the latest known delivery state of one message, including its recipient (admin only)."""
+    result = await asyncio.to_thread(delivery_tracker.message_status, wamid)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Unknown message id")
+    return result
 
 # Helper functions for business logic
 def get_available_time_slots(route, date, passengers):
@@ -467,13 +1273,13 @@ def get_available_time_slots_round(going_route, going_date, going_no_passengers,
         "return_availability_slots": return_slots
     }
 
-def get_seat_categories():
-    """Get available seat categories with pricing."""
-    return [
-        {"id": "economy", "title": "🌟 Economy Class price: 50000"},
-        {"id": "vip", "title": "💺 VIP Class price: 75000"},
-        {"id": "first_class", "title": "👑 First Class price: 100000"}
-    ]
+def get_seat_categories(route, date):
+    """Get available seat categories with pricing for a route and travel date."""
+    try:
+        return pricing.seat_categories(route, date)
+    except PricingError as e:
+        logger.warning(f"No seat categories for {route} on {date}: {str(e)}")
+        return []
 
 def validate_travel_details(form_data):
     """Validate travel details form."""
@@ -511,29 +1317,194 @@ def validate_personal_details(form_data):
         "errors": errors
     }
 
-def process_booking(form_data, flow_token):
+def process_booking(form_data, flow_token, tenant_id=None):
     """Process the final booking."""
     booking_id = create_booking_in_database(form_data, flow_token)
+    booking_reports.record(get_flow_session(flow_token)["user_data"], tenant_id)
+    schedule_departure_reminders(flow_token, booking_id, tenant_id)
     return {
         "booking_id": booking_id,
         "status": "confirmed",
-        "message": "Your booking has been confirmed!"
+        "message": "Your booking has been confirmed!",
+        "total": booking_total(flow_token)
+    }
+
+async def start_payment(form_data, flow_token, tenant_id=None):
+    """Start charging the quoted fare and answer with a pending confirmation."""
+    booking_id = booking_reference(flow_token)
+    user_data = get_flow_session(flow_token)["user_data"]
+    fare = user_data.get("fare") or {}
+    contact = booking_contact(user_data)
+    if user_data.get("payment", {}).get("state") == SUCCEEDED:
+        # A retried PAYMENT request after the charge went through must not charge again
+        return {
+            "booking_id": booking_id,
+            "status": "confirmed",
+            "message": "Your booking has been confirmed!",
+            "total": booking_total(flow_token)
+        }
+    try:
+        payment = await payments.start(
+            booking_id=booking_id,
+            method=form_data.get("payment_method"),
+            amount_minor=fare.get("total_minor", 0),
+            currency=fare.get("currency", "TZS"),
+            account=form_data.get("payment_number") or contact,
+            flow_token=flow_token,
+            tenant_id=tenant_id,
+            contact=contact,
+            details=user_data,
+        )
+    except PaymentError as e:
+        return {
+            "booking_id": booking_id,
+            "status": "failed",
+            "message": str(e),
+            "total": booking_total(flow_token)
+        }
+    update_flow_session(flow_token, {"payment": {"reference": payment.reference, "state": payment.state,
+                                                 "method": payment.method}})
+    return {
+        "booking_id": booking_id,
+        "status": "pending",
+        "message": "Approve the payment request; we will send you a message once it is confirmed.",
+        "total": booking_total(flow_token)
     }
 
+async def on_payment_settled(payment: Payment):
+    """Confirm the booking of a successful payment or release it, and tell the passenger."""
+    if payment.flow_token and session_store.get(payment.flow_token) is None and payment.details:
+        # The callback reached a worker that never saw the flow: settle from the payment's copy
+        session_store.put(payment.flow_token, {**_new_flow_session(payment.flow_token), "user_data": payment.details})
+    if payment.flow_token and session_store.get(payment.flow_token) is not None:
+        update_flow_session(payment.flow_token, {"payment": {"reference": payment.reference, "state": payment.state,
+                                                             "method": payment.method}})
+    if payment.state == SUCCEEDED:
+        message = process_booking({}, payment.flow_token, payment.tenant_id)["message"]
+        text = f"{message} Booking {payment.booking_id}, paid {pricing.table.format(payment.amount_minor)}."
+    else:
+        # No seats are reserved ahead of payment yet; releasing the hold means the
+        # booking is not confirmed and a new payment can be started for it
+        text = f"Payment for booking {payment.booking_id} did not go through ({payment.reason}). Please try again."
+    if payment.contact is None:
+        return
+    tenant = tenant_registry.get(payment.tenant_id)
+    try:
+        await send_text_message(payment.contact, text, idempotency_key=f"{payment.reference}:{payment.state}",
+                                tenant=tenant)
+    except Exception as e:
+        logger.error(f"Payment notification for {payment.reference} failed: {str(e)}")
+    if payment.state == SUCCEEDED and payment.flow_token:
+        ticket_pipeline.enqueue(booking_tickets(payment.flow_token, payment.booking_id), payment.contact, tenant)
+
+def booking_tickets(flow_token, booking_id):
+    """One ticket per passenger and leg of a paid booking."""
+    user_data = get_flow_session(flow_token)["user_data"]
+    travel_details = user_data.get("travel_details", {})
+    time_selections = user_data.get("time_selections", {})
+    seat_class = (user_data.get("seat_selections", {}).get("seat_class") or "").replace("_", " ").title()
+    lead_name = user_data.get("personal_details", {}).get("full_name") or "Passenger"
+    tickets = []
+    for leg in ("going", "return"):
+        route = travel_details.get(f"{leg}_route")
+        departure = departure_time(time_selections.get(f"{leg}_time"))
+        if not route or departure is None:
+            continue
+        passengers = int(travel_details.get(f"{leg}_no_passengers") or 1)
+        for passenger in range(1, passengers + 1):
+            tickets.append(Ticket(
+                booking_id=booking_id,
+                passenger=passenger,
+                passengers=passengers,
+                passenger_name=lead_name if passenger == 1 else f"Passenger {passenger}",
+                route=route,
+                departure=departure.strftime("%Y-%m-%d %H:%M"),
+                seat_class=seat_class,
+                total=booking_total(flow_token) if passenger == 1 and leg == "going" else "",
+                leg=leg,
+            ))
+    return tickets
+
+payments.on_settled(on_payment_settled)
+
 def create_booking_in_database(form_data, flow_token):
     """Create booking record in your database."""
     # Implement actual database logic here
-    return "BK12345"
+    return booking_reference(flow_token)
 
-def initialize_flow_session(flow_token):
-    """Initialize flow session data."""
-    session_data = {
+def booking_reference(flow_token):
+    """Booking reference of a journey, generated once and kept in its flow session."""
+    session_data = get_flow_session(flow_token)
+    booking_id = session_data["user_data"].get("booking_id")
+    if booking_id is None:
+        booking_id = booking_ids.next_id()
+        update_flow_session(flow_token, {"booking_id": booking_id})
+    return booking_id
+
+def booking_contact(user_data):
+    """WhatsApp id of the phone number given on the DETAILS screen (None if missing or invalid)."""
+    try:
+        return to_wa_id(normalize_phone(user_data.get("personal_details", {}).get("phone_input") or ""))
+    except InvalidPhoneNumber:
+        return None
+
+def departure_time(slot_id):
+    """Local departure time of a time slot id such as "2025_07_01$08_00" (None if malformed)."""
+    try:
+        return datetime.strptime(slot_id, "%Y_%m_%d$%H_%M").replace(tzinfo=ZoneInfo(departure_timezone))
+    except (TypeError, ValueError):
+        return None
+
+def schedule_departure_reminders(flow_token, booking_id, tenant_id=None):
+    """Schedule the reminders of each leg of a confirmed booking; offsets already past are skipped."""
+    session_data = get_flow_session(flow_token)
+    user_data = session_data["user_data"]
+    recipient = booking_contact(user_data)
+    if recipient is None:
+        logger.warning(f"No departure reminders for {booking_id}: no valid phone number")
+        return
+    time_selections = user_data.get("time_selections", {})
+    now = time.time()
+    for leg in ("going", "return"):
+        departure = departure_time(time_selections.get(f"{leg}_time"))
+        if departure is None:
+            continue
+        departs_at = departure.timestamp()
+        for hours in reminder_offsets_hours:
+            due_at = departs_at - hours * 3600
+            if due_at <= now:
+                continue
+            reminders.schedule(ReminderJob(
+                job_id=f"{booking_id}:{leg}:{hours:g}h",
+                due_at=due_at,
+                expires_at=departs_at,
+                kind="departure_reminder",
+                tenant_id=tenant_id,
+                recipient=recipient,
+                payload={
+                    "booking_id": booking_id,
+                    "departure": departure.strftime("%Y-%m-%d %H:%M"),
+                    "lang_code": REMINDER_LANG_CODES.get(session_data.get("language"), "en_US"),
+                },
+            ))
+
+def booking_total(flow_token):
+    """Display total of the fare quoted on the SEATS screen ("" if none was quoted)."""
+    fare = get_flow_session(flow_token)["user_data"].get("fare")
+    return fare["total"] if fare else ""
+
+def _new_flow_session(flow_token):
+    return {
         "flow_token": flow_token,
-        "created_at": datetime.now(),
+        "created_at": datetime.now().timestamp(),
         "status": "initialized",
         "user_data": {}
     }
-    # Save to database/cache (implement actual storage)
+
+def initialize_flow_session(flow_token):
+    """Initialize flow session data."""
+    with tracer.span("session.put"):
+        session_data = session_store.put(flow_token, _new_flow_session(flow_token))
     print(f"Flow session initialized: {flow_token}")
     return session_data
 
@@ -541,19 +1512,20 @@ def update_flow_session(flow_token, data):
     """Update session data with new information."""
     session_data = get_flow_session(flow_token)
     session_data["user_data"].update(data)
-    # Save to database/cache (implement actual storage)
+    session_data["status"] = "in_progress"
+    with tracer.span("session.put"):
+        session_store.put(flow_token, session_data)
     print(f"Updated session for token {flow_token}: {session_data}")
     return session_data
 
 def get_flow_session(flow_token):
-    """Retrieve session data."""
-    # Implement actual retrieval from database/cache
-    return {
-        "flow_token": flow_token,
-        "created_at": datetime.now(),
-        "status": "initialized",
-        "user_data": {}
-    }
+    """Retrieve session data (a fresh session if the token is unknown or expired)."""
+    with tracer.span("session.get") as span:
+        session_data = session_store.get(flow_token)
+        span.set("session.found", session_data is not None)
+    if session_data is None:
+        session_data = _new_flow_session(flow_token)
+    return session_data
 
 def get_previous_screen(current_screen):
     """Determine the previous screen based on routing model."""
@@ -572,70 +1544,150 @@ def get_previous_screen(current_screen):
 @app.post("/webhook")
 async def webhook(request: Request) -> Dict:
     """
-    Handle incoming WhatsApp webhook events.
+    Accept incoming WhatsApp webhook events.
+
+    The raw body is appended to the durable webhook log before answering, so
+    an acknowledged event survives the worker dying; the log consumer runs
+    ``process_webhook_event`` on it shortly after.
 
     Args:
         request (Request): FastAPI request object containing webhook data.
 
     Returns:
-        Dict: Response indicating the action taken or error details.
+        Dict: The accepted event's log offset, or error details.
+    """
+    body = await request.body()
+    try:
+        offset = webhook_log.append(body)
+    except OSError as e:
+        # Not acked, so Meta retries the delivery
+        logger.error(f"Webhook log append failed: {str(e)}")
+        return JSONResponse(status_code=503, content={"status": "error", "message": "Event log unavailable"})
+    return {"status": "accepted", "offset": offset}
+
+
+async def process_webhook_event(data: Dict, event_key: Optional[str] = None) -> Dict:
+    """
+    Process one WhatsApp webhook event from the webhook log.
+
+    Args:
+        data (Dict): Decoded webhook body.
+        event_key (Optional[str]): Identifies the event; used as the idempotency key of
+            the messages it sends, so a retried event does not send them twice.
+
+    Returns:
+        Dict: Response indicating the action taken.
 
     Raises:
-        HTTPException: If webhook processing fails.
+        Exception: Failures propagate so that the log consumer retries the event.
     """
-    try:
-        data = await request.json()
-        logger.info(f"Received webhook data: {data}")
-
-        message = data["entry"][0]["changes"][0]["value"]["messages"][0]
-        sender = message["from"]
-        button_reply = message.get("button", {}).get("text")
-
-        if button_reply:
-            if "English" in button_reply:
-                return await send_flow_message(
-                    to=sender,
-                    flow_name="azam_v1_english",
-                    flow_id="english_flow_id"
-                )
-            elif "Swahili" in button_reply:
-                return await send_flow_message(
-                    to=sender,
-                    flow_name="azam_v1_swahili",
-                    flow_id="swahili_flow_id"
-                )
-        return {"status": "no action taken"}
-    except Exception as e:
-        logger.error(f"Webhook processing error: {str(e)}")
-        return {"status": "error", "message": str(e)}
+    logger.info(f"Received webhook data: {data}")
+    traffic_recorder.record("webhook", data)
 
-# I want to create a button that gives a user language choice the select a given flow 
-import random
+    # Status events are handed off to the delivery tracker without waiting
+    statuses = extract_statuses(data)
+    if statuses:
+        delivery_tracker.ingest(statuses)
 
-def get_mocked_language_choice():
-    return random.choice(["swahili", "english"])
+    try:
+        value = data["entry"][0]["changes"][0]["value"]
+    except (KeyError, IndexError, TypeError):
+        # Not an event we act on; retrying it would not change that
+        return {"status": "no action taken"}
+    messages = value.get("messages")
+    if not messages:
+        return {"status": "statuses received" if statuses else "no action taken"}
+    message = messages[0]
+    sender = message["from"]
+    if message.get("type") not in ("interactive", "button"):
+        return {"status": "no action taken"}
 
+    # Find the prompt this reply answers: O(1) by the replied-to wamid
+    context_wamid = message.get("context", {}).get("id")
+    prompt = pending_prompts.resolve(context_wamid, _sender_wa_id(sender))
+    # A language reply to an expired/unknown prompt still expresses a clear choice
+    kind = prompt.kind if prompt is not None else LANGUAGE_SELECTION
+    handler = PROMPT_REPLY_HANDLERS.get(kind)
+    if handler is None:
+        return {"status": "no action taken"}
+    # Reply from the business number the event was delivered to
+    tenant = tenant_registry.for_phone_number_id(value.get("metadata", {}).get("phone_number_id"))
+    # Same trace as the prompt it answers
+    with tracer.span("webhook.reply", key=context_wamid or message.get("id"), attributes={
+        "tenant": tenant.tenant_id, "prompt.kind": kind, "prompt.matched": prompt is not None,
+    }):
+        return await handler(message, sender, prompt, tenant, idempotency_key=event_key)
+
+def get_reply_language(message: Dict) -> Optional[str]:
+    """
+    Map a language button reply to "english"/"swahili".
 
+    Interactive button replies carry the reply id we set in
+    ``send_language_selection_prompt``; template quick replies carry a payload.
+    Matching on the visible text is only a fallback.
+    """
+    reply_id = (
+        message.get("interactive", {}).get("button_reply", {}).get("id")
+        or message.get("button", {}).get("payload")
+    )
+    if reply_id in REPLY_ID_LANGUAGES:
+        return REPLY_ID_LANGUAGES[reply_id]
+
+    text = (
+        message.get("interactive", {}).get("button_reply", {}).get("title")
+        or message.get("button", {}).get("text")
+        or ""
+    )
+    if "English" in text:
+        return "english"
+    if "Swahili" in text:
+        return "swahili"
+    return None
+
+async def on_language_selected(message: Dict, sender: str, prompt: Optional[PendingPrompt], tenant: Tenant,
+                               idempotency_key: Optional[str] = None) -> Dict:
+    """Remember the chosen language and start the flow in that language."""
+    language = get_reply_language(message)
+    if not language:
+        return {"status": "no action taken"}
+    wa_id = _sender_wa_id(sender)
+    await language_preferences.set(wa_id, language)
+    return await start_language_flow(language, f"+{wa_id}", tenant, idempotency_key=idempotency_key)
 
 
+# Next action for a reply, by the kind of prompt it answers
+PROMPT_REPLY_HANDLERS = {
+    LANGUAGE_SELECTION: on_language_selected,
+}
 
 
+# I want to create a button that gives a user language choice the select a given flow 
 @app.post("/send-buttons")
-async def buttons(to: str = Query(..., description="Recipient's WhatsApp number")):
-    # Step 1: Properly validate phone number (e.g., must be digits only and correct length)
-    if not to.isdigit() or len(to) < 10:
-        raise HTTPException(status_code=400, detail="Invalid phone number format")
-
-    recipient = to
+async def buttons(
+    to: str = Query(..., description="Recipient's WhatsApp number"),
+    tenant: Tenant = Depends(get_tenant)
+):
+    # Step 1: Properly validate phone number (normalized to E.164)
+    recipient = _recipient(to)
+
+    # Returning users go straight to the flow in their language
+    known_language = await language_preferences.get(to_wa_id(recipient))
+    if known_language:
+        return await start_language_flow(known_language, recipient, tenant)
 
     # Step 2: Send the language selection prompt (button template)
-    await send_language_selection_prompt(to=recipient,text="Please select a language\nTatadhali chagua Lugha")
-
-    # Step 3: Wait for a language selection (here we mock it)
-    language = get_mocked_language_choice()
+    started_at = time.time()
+    result = await send_language_selection_prompt(to=recipient,text="Please select a language\nTatadhali chagua Lugha", tenant=tenant)
+    messages = result.get("messages") or []
+    if not messages:
+        raise HTTPException(status_code=502, detail={"message": "Failed to send language prompt", "response": result})
 
-    # Step 4: Trigger the flow based on selected language
-    return await trigger_language_flow(language, recipient)
+    # Step 3: The flow is started by /webhook when the reply to this prompt arrives
+    wamid = messages[0]["id"]
+    # The prompt's wamid starts the journey trace the reply will continue
+    tracer.span("send_buttons", key=wamid, start=started_at, attributes={"tenant": tenant.tenant_id}).end()
+    pending_prompts.add(wamid, to_wa_id(recipient), LANGUAGE_SELECTION)
+    return {"status": "language_prompt_sent", "message_id": wamid}
 
 
      
@@ -643,7 +1695,8 @@ async def buttons(to: str = Query(..., description="Recipient's WhatsApp number"
 @app.get("/send-language-choice")
 async def trigger_language_flow(
     language: str = Query(..., description="Language choice (english/swahili)"),
-    recipient: str = Query(..., description="Recipient's WhatsApp number")
+    recipient: str = Query(..., description="Recipient's WhatsApp number"),
+    tenant: Tenant = Depends(get_tenant)
 ) -> Dict:
     """
     Trigger a WhatsApp flow message based on language selection.
@@ -651,6 +1704,7 @@ async def trigger_language_flow(
     Args:
         language (str): Language choice ("english" or "swahili").
         recipient (str): Recipient's WhatsApp number with country code.
+        tenant (Tenant): Business number whose flows are sent.
 
     Returns:
         Dict: JSON response from the WhatsApp API.
@@ -658,20 +1712,45 @@ async def trigger_language_flow(
     Raises:
         HTTPException: If the language is invalid or the flow message fails.
     """
-    language = language.lower()
-    
-    if language not in flow_config:
+    return await start_language_flow(language.lower(), _recipient(recipient), tenant)
+
+
+async def start_language_flow(language: str, recipient: str, tenant: Tenant,
+                              idempotency_key: Optional[str] = None) -> Dict:
+    """
+    Send the tenant's flow for ``language`` to an already validated recipient.
+
+    Args:
+        language (str): Language choice ("english" or "swahili").
+        recipient (str): Recipient in E.164 format.
+        tenant (Tenant): Business number whose flows are sent.
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+
+    Returns:
+        Dict: JSON response from the WhatsApp API.
+
+    Raises:
+        HTTPException: If the language is invalid or the flow message fails.
+    """
+    flows = tenant.config.flows
+    if language not in FLOW_LANGUAGES or language not in flows:
         raise HTTPException(
             status_code=400,
-            detail="Invalid language parameter. Choose 'english' or 'swahili'"
+            detail=f"Invalid language parameter. Choose one of: {', '.join(flows)}"
         )
 
+    # Sessions, locks, payments and booking references are all keyed by the flow_token,
+    # so every journey needs its own
+    flow_token = uuid.uuid4().hex
+    funnel.journey_started(flow_token, language)
     try:
         return await send_flow_message(
             to=recipient,
-            flow_name=flow_config[language]["flow_name"],
-            flow_id=flow_config[language]["flow_id"],
-            flow_token=flow_config["token"]
+            flow_name=flows[language]["flow_name"],
+            flow_id=flows[language]["flow_id"],
+            flow_token=flow_token,
+            idempotency_key=idempotency_key,
+            tenant=tenant
         )
     except Exception as e:
         # logger.error(f"Error sending {language} flow message: {str(e)}")
@@ -683,6 +1762,82 @@ async def trigger_language_flow(
 
 
 
+@app.post("/payments/callback")
+async def payment_callback(request: Request) -> Dict:
+    """
+    Payment provider callback: settles the payment with the given reference.
+
+    The body (``reference``, ``status``, optional ``provider_reference`` and
+    ``reason``) must be signed in ``X-Payment-Signature`` as the hex
+    HMAC-SHA256 of the raw body with ``PAYMENT_CALLBACK_SECRET``.
+
+    Raises:
+        HTTPException: 404 if callbacks are disabled or the reference is unknown, 403 on a bad signature,
+            400 if a signed body is not a JSON object.
+    """
+    if not payment_callback_secret:
+        raise HTTPException(status_code=404, detail="Payment callbacks are disabled")
+    body = await request.body()
+    expected = hmac.new(payment_callback_secret.encode(), body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(request.headers.get("x-payment-signature", "").encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Callback body is not valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Callback body must be a JSON object")
+    payment = await payments.handle_callback(
+        data.get("reference", ""),
+        data.get("status", ""),
+        provider_reference=data.get("provider_reference"),
+        reason=data.get("reason"),
+    )
+    if payment is None:
+        raise HTTPException(status_code=404, detail="Unknown payment reference")
+    return {"reference": payment.reference, "state": payment.state}
+
+
+@app.get("/payments/{reference}", dependencies=[Depends(require_admin)])
+async def payment_status(reference: str) -> Dict:
+    """Return a pending or settled payment."""
+    payment = await asyncio.to_thread(payments.get, reference)
+    if payment is None:
+        raise HTTPException(status_code=404, detail="Unknown payment reference")
+    return payment.to_dict()
+
+
+@app.get("/reports", dependencies=[Depends(require_admin)])
+async def booking_report(
+    group_by: str = Query("route", description="Comma-separated dimensions: day, month, departure, route, "
+                                               "seat_class, payment_method, tenant, leg, currency"),
+    start: Optional[date] = Query(None, description="First departure date (YYYY-MM-DD)"),
+    end: Optional[date] = Query(None, description="Last departure date (YYYY-MM-DD)"),
+    route: Optional[str] = Query(None, description="Only legs on this route, e.g. DAR_ZNZ"),
+    seat_class: Optional[str] = Query(None),
+    payment_method: Optional[str] = Query(None, description="SIMU or KADI"),
+    tenant: Optional[str] = Query(None, description="Business number"),
+    leg: Optional[str] = Query(None, pattern="^(going|return)$"),
+) -> Dict:
+    """
+    Booking analytics over confirmed bookings of all workers: passengers, revenue,
+    load factor and shares per group. For example ``group_by=day,route`` gives daily
+    load factors, ``route`` revenue per route, ``seat_class`` the class mix and
+    ``payment_method`` the payment method split.
+
+    Raises:
+        HTTPException: 400 for an unknown dimension.
+    """
+    try:
+        return booking_reports.report(
+            [dimension.strip() for dimension in group_by.split(",") if dimension.strip()],
+            start=start, end=end, route=route, seat_class=seat_class,
+            payment_method=payment_method, tenant=tenant, leg=leg,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/flow-callback")
 async def handle_flow_submission(request: Request):
     data = await request.json()
@@ -692,20 +1847,41 @@ async def handle_flow_submission(request: Request):
     if not payload:
         return {"error": "Missing payload"}
 
-    # Auto-fill travel date (e.g., tomorrow)
-    travel_date = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d")
+    flow_token = data.get("flow_token") or payload.get("flow_token")
+    with tracer.span("flow_callback", key=flow_token) as span:
+        try:
+            booking = BookingData.model_validate(payload)
+        except ValidationError as e:
+            span.set("invalid", True)
+            return JSONResponse(
+                content={"error": "Invalid booking", "details": e.errors(include_url=False, include_context=False, include_input=False)},
+                status_code=422,
+            )
+
+        # Auto-fill travel date (e.g., tomorrow) if the flow did not ask for one
+        if not booking.travel_date:
+            booking.travel_date = (datetime.utcnow() + timedelta(days=1)).strftime("%Y-%m-%d")
+
+        # Stored by the background writer; a full queue is answered with 503 so the submission is retried
+        booking_id = booking_ids.next_id()
+        if not booking_ingestor.submit(booking_id, booking, flow_token):
+            return _shed_response("booking_queue_full")
+        span.set("booking_id", booking_id)
+
+        # Human readable titles for the dropdown ids (route, class, payment method, ...)
+        flow = get_compiled_flows().get(callback_flow_name)
+        summary = flow.titles(payload) if flow is not None else {}
 
-    # Simulate storing or processing booking
     booking_info = {
         **payload,
-        "travel_date": travel_date
+        "travel_date": booking.travel_date
     }
-
-    # Log the booking or save to DB here
-    print("Booking received:", booking_info)
+    print("Booking received:", booking_id)
 
     return {
         "status": "success",
         "message": "Booking received successfully",
-        "booking_details": booking_info
+        "booking_id": booking_id,
+        "booking_details": booking_info,
+        "summary": summary
     }        
\ No newline at end of file
@@ -1,18 +1,33 @@
-from pydantic import BaseModel
+from pydantic import AliasChoices, BaseModel, ConfigDict, Field
+
 
 class BookingData(BaseModel):
-    first_name: str
-    middle_name: str
-    last_name: str
-    gender: str
-    citizenship: str
-    phone_number: str
-    email: str | None
-    travel_type: str
-    direction: str
-    number_of_travelers: int
-    ferry: str
-    class_: str
-    other_travelers: str | None
-    payment_method: str
-    payment_number: str
\ No newline at end of file
+    """Booking submitted by a flow's complete action; the Swahili field names of floww.json are accepted too."""
+
+    model_config = ConfigDict(populate_by_name=True, str_strip_whitespace=True)
+
+    first_name: str = Field(validation_alias=AliasChoices("first_name", "jina_la_kwanza"))
+    middle_name: str = Field(validation_alias=AliasChoices("middle_name", "jina_la_kati"))
+    last_name: str = Field(validation_alias=AliasChoices("last_name", "jina_la_mwisho"))
+    gender: str = Field(validation_alias=AliasChoices("gender", "jinsia"))
+    citizenship: str = Field(validation_alias=AliasChoices("citizenship", "uraia"))
+    phone_number: str = Field(validation_alias=AliasChoices("phone_number", "namba_ya_simu"))
+    email: str | None = Field(None, validation_alias=AliasChoices("email", "barua_pepe"))
+    travel_type: str = Field(validation_alias=AliasChoices("travel_type", "aina_ya_usafiri"))
+    direction: str = Field(validation_alias=AliasChoices("direction", "uelekeo"))
+    number_of_travelers: int = Field(gt=0, validation_alias=AliasChoices("number_of_travelers", "idadi_ya_wasafiri"))
+    travel_date: str | None = Field(None, validation_alias=AliasChoices("travel_date", "tarehe_ya_kusafiri"))
+    ferry: str = Field(validation_alias=AliasChoices("ferry", "boti_ya_kusafiria"))
+    class_: str = Field(validation_alias=AliasChoices("class_", "class", "daraja_la_kusafiria"))
+    other_travelers: str | None = Field(None, validation_alias=AliasChoices("other_travelers", "wasafiri_wengine"))
+    payment_method: str = Field(validation_alias=AliasChoices("payment_method", "aina_ya_malipo"))
+    payment_number: str = Field(validation_alias=AliasChoices("payment_number", "namba_ya_malipo"))
+
+
+class BulkTemplateRequest(BaseModel):
+    recipients: list[str]
+    template_name: str
+    lang_code: str
+    parameters: list[str] | None = None
+    per_recipient_parameters: dict[str, list[str]] | None = None
+    broadcast_id: str | None = None
@@ -0,0 +1,430 @@
+"""Asynchronous payment orchestration for mobile money (SIMU) and card (KADI).
+
+Charging a passenger takes seconds to minutes (the passenger approves a push
+prompt on their phone, or completes 3-D Secure), far beyond the flow
+response deadline. The PAYMENT screen therefore only *starts* the charge:
+
+1. ``PaymentOrchestrator.start`` stores a ``Payment`` under a fresh
+   reference in SQLite, hands the charge request to the provider in a
+   background task and returns at once; the flow answers with a pending
+   confirmation.
+2. The provider reports the outcome on its callback, which may reach any
+   worker. ``handle_callback`` settles the payment with one conditional
+   ``UPDATE ... WHERE state = 'pending'``, so exactly one worker settles it
+   and duplicate or late callbacks for a settled payment are ignored.
+3. Payments without a callback within ``timeout`` expire: every worker
+   periodically settles the pending payments past their ``expires_at`` the
+   same way, so payments started by a worker that restarted or died still
+   expire and a lost callback never holds a booking forever.
+4. Settlement listeners, in the worker that settled the payment, confirm the
+   booking (or release it) and notify the passenger outside the flow. The
+   payment carries a snapshot of the booking details for that worker.
+
+A booking has at most one payment in flight (a partial unique index on
+pending payments): starting it again (a double tap, a Meta retry) returns the
+pending payment. Payments are kept in the database for status lookups.
+
+``MockPaymentProvider`` stands in for a real provider in development and
+tests, with configurable latency, failure rate and lost callbacks.
+"""
+
+import asyncio
+import json
+import itertools
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_METHODS = ("SIMU", "KADI")
+
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+EXPIRED = "expired"
+
+
+class PaymentError(ValueError):
+    """Raised when a payment cannot be started (unknown method, nothing to charge)."""
+
+
+@dataclass
+class Payment:
+    reference: str
+    booking_id: str
+    flow_token: Optional[str]
+    method: str
+    amount_minor: int
+    currency: str
+    account: Optional[str] = None
+    contact: Optional[str] = None
+    tenant_id: Optional[str] = None
+    state: str = PENDING
+    provider_reference: Optional[str] = None
+    reason: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    settled_at: Optional[float] = None
+    expires_at: Optional[float] = None
+    # What settling needs to know about the booking, for a worker without its flow session
+    details: Dict = field(default_factory=dict)
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def to_row(self) -> Tuple:
+        return tuple(
+            json.dumps(self.details, separators=(",", ":")) if name == "details" else getattr(self, name)
+            for name in _COLUMNS
+        )
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "Payment":
+        values = dict(zip(_COLUMNS, row))
+        values["details"] = json.loads(values["details"] or "{}")
+        return cls(**values)
+
+
+_COLUMNS = tuple(f.name for f in fields(Payment))
+_SELECT = f"SELECT {', '.join(_COLUMNS)} FROM payments"
+
+
+class MockPaymentProvider:
+    """
+    Local stand-in for a payment provider: every charge is answered on the
+    callback after a random latency.
+
+    Args:
+        latency (Tuple[float, float]): Seconds between the charge and its callback (uniform range).
+        failure_rate (float): Share of charges that are declined.
+        lost_rate (float): Share of charges whose callback never arrives.
+        seed (Optional[int]): Seed for reproducible runs.
+    """
+
+    def __init__(self, latency: Tuple[float, float] = (2.0, 8.0), failure_rate: float = 0.0,
+                 lost_rate: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.lost_rate = lost_rate
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._callbacks: set = set()
+        self.callback: Optional[Callable[..., Awaitable]] = None
+        self.charges = 0
+
+    async def charge(self, payment: Payment) -> str:
+        """Accept a charge request; returns the provider's own reference."""
+        self.charges += 1
+        provider_reference = f"MOCK{next(self._ids):08d}"
+        roll = self._random.random()
+        if roll >= self.lost_rate:
+            status = FAILED if roll < self.lost_rate + self.failure_rate else SUCCEEDED
+            delay = self._random.uniform(*self.latency)
+            task = asyncio.get_running_loop().create_task(
+                self._answer(payment.reference, provider_reference, status, delay)
+            )
+            self._callbacks.add(task)
+            task.add_done_callback(self._callbacks.discard)
+        return provider_reference
+
+    async def _answer(self, reference: str, provider_reference: str, status: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        reason = "Declined by the mock provider" if status == FAILED else None
+        await self.callback(reference, status, provider_reference=provider_reference, reason=reason)
+
+    def close(self) -> None:
+        for task in list(self._callbacks):
+            task.cancel()
+
+
+class PaymentOrchestrator:
+    """
+    Args:
+        provider: Object with ``async charge(payment) -> provider_reference``;
+            its ``callback`` attribute (if any) is pointed at ``handle_callback``.
+            None disables payments: ``start`` raises ``PaymentError``.
+        db_path (str): SQLite database shared by all workers (``":memory:"`` for tests).
+        timeout (float): Seconds a payment waits for its callback before it expires.
+        tick (float): Seconds between sweeps for expired payments.
+    """
+
+    _SCHEMA = (
+        f"""
+        CREATE TABLE IF NOT EXISTS payments (
+            reference TEXT PRIMARY KEY,
+            booking_id TEXT NOT NULL,
+            flow_token TEXT,
+            method TEXT NOT NULL,
+            amount_minor INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            account TEXT,
+            contact TEXT,
+            tenant_id TEXT,
+            state TEXT NOT NULL,
+            provider_reference TEXT,
+            reason TEXT,
+            created_at REAL NOT NULL,
+            settled_at REAL,
+            expires_at REAL,
+            details TEXT
+        )
+        """,
+        # One payment in flight per booking, across all workers
+        f"CREATE UNIQUE INDEX IF NOT EXISTS payments_pending_booking ON payments (booking_id) WHERE state = '{PENDING}'",
+        f"CREATE INDEX IF NOT EXISTS payments_pending_expiry ON payments (expires_at) WHERE state = '{PENDING}'",
+    )
+
+    _INSERT = f"INSERT INTO payments ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})"
+
+    _SETTLE = f"""
+        UPDATE payments SET state = ?, reason = ?, settled_at = ?, provider_reference = COALESCE(?, provider_reference)
+        WHERE reference = ? AND state = '{PENDING}'
+        RETURNING {', '.join(_COLUMNS)}
+    """
+
+    _EXPIRE = f"""
+        UPDATE payments SET state = '{EXPIRED}', reason = ?, settled_at = ?
+        WHERE state = '{PENDING}' AND expires_at <= ?
+        RETURNING {', '.join(_COLUMNS)}
+    """
+
+    def __init__(self, provider, db_path: str = "payments.db", timeout: float = 300.0, tick: float = 1.0):
+        self.provider = provider
+        if provider is not None and hasattr(provider, "callback"):
+            provider.callback = self.handle_callback
+        self.db_path = db_path
+        self.timeout = timeout
+        self.tick = tick
+        self._db: Optional[sqlite3.Connection] = None
+        # Database calls run in worker threads; one at a time on the shared connection
+        self._db_lock = threading.Lock()
+        self._listeners: List[Callable[[Payment], Optional[Awaitable]]] = []
+        self._charges: set = set()
+        self._expirer: Optional[asyncio.Task] = None
+
+        self.started = 0
+        self.duplicate_starts = 0
+        self.callbacks = 0
+        self.unknown_callbacks = 0
+        self.settled = {SUCCEEDED: 0, FAILED: 0, EXPIRED: 0}
+        # Pending payments of all workers as of the last expiry sweep
+        self.pending = 0
+
+    def on_settled(self, listener: Callable[[Payment], Optional[Awaitable]]) -> None:
+        """Call ``listener(payment)`` (sync or async) once a payment succeeded, failed or expired."""
+        self._listeners.append(listener)
+
+    # ------------------------------------------------------------ storage
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            # Another worker may hold the write lock
+            self._db.execute("PRAGMA busy_timeout=5000")
+            for statement in self._SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+        return self._db
+
+    def _insert(self, payment: Payment) -> Optional[Payment]:
+        """Store a new pending payment, or return the pending payment the booking already has."""
+        with self._db_lock:
+            db = self._connect()
+            while True:
+                try:
+                    with db:
+                        db.execute(self._INSERT, payment.to_row())
+                    return None
+                except sqlite3.IntegrityError:
+                    row = db.execute(
+                        f"{_SELECT} WHERE booking_id = ? AND state = '{PENDING}'", (payment.booking_id,)
+                    ).fetchone()
+                    if row is not None:
+                        return Payment.from_row(row)
+                    # The other payment was settled in between: try again
+
+    def _update_provider_reference(self, reference: str, provider_reference: str) -> None:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                db.execute(
+                    "UPDATE payments SET provider_reference = ? WHERE reference = ? AND provider_reference IS NULL",
+                    (provider_reference, reference),
+                )
+
+    def _settle_row(self, reference: str, state: str, reason: Optional[str],
+                    provider_reference: Optional[str]) -> Tuple[Optional[Payment], bool]:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                row = db.execute(self._SETTLE, (state, reason, time.time(), provider_reference, reference)).fetchone()
+            if row is not None:
+                return Payment.from_row(row), True
+            row = db.execute(f"{_SELECT} WHERE reference = ?", (reference,)).fetchone()
+            return (Payment.from_row(row) if row is not None else None), False
+
+    def _expire_due(self, now: float) -> List[Payment]:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                rows = db.execute(self._EXPIRE, ("No answer from the payment provider", now, now)).fetchall()
+            self.pending = db.execute(f"SELECT COUNT(*) FROM payments WHERE state = '{PENDING}'").fetchone()[0]
+        return [Payment.from_row(row) for row in rows]
+
+    def get(self, reference: str) -> Optional[Payment]:
+        """Return a payment by reference (blocking; call it from a thread)."""
+        with self._db_lock:
+            row = self._connect().execute(f"{_SELECT} WHERE reference = ?", (reference,)).fetchone()
+        return Payment.from_row(row) if row is not None else None
+
+    # ------------------------------------------------------------ lifecycle
+
+    async def start(self, booking_id: str, method: str, amount_minor: int, currency: str,
+                    account: Optional[str] = None, flow_token: Optional[str] = None,
+                    tenant_id: Optional[str] = None, contact: Optional[str] = None,
+                    details: Optional[Dict] = None) -> Payment:
+        """
+        Start charging a booking without waiting for the provider.
+
+        Args:
+            booking_id (str): Booking being paid for.
+            method (str): ``SIMU`` (mobile money) or ``KADI`` (card).
+            amount_minor (int): Amount in minor units of ``currency``.
+            currency (str): ISO currency code.
+            account (Optional[str]): Mobile money number or card token to charge.
+            flow_token (Optional[str]): Flow session of the booking.
+            tenant_id (Optional[str]): Business number the booking was made on.
+            contact (Optional[str]): WhatsApp id to tell about the outcome.
+            details (Optional[Dict]): JSON-serializable booking details handed to
+                the settlement listeners.
+
+        Returns:
+            Payment: The new pending payment, or the one already in flight for the booking.
+
+        Raises:
+            PaymentError: If payments are disabled, the method is unknown or there is nothing to charge.
+        """
+        if self.provider is None:
+            raise PaymentError("Payments are not available right now")
+        if method not in PAYMENT_METHODS:
+            raise PaymentError(f"Unknown payment method {method!r}")
+        if amount_minor <= 0:
+            raise PaymentError("Nothing to charge: no fare was quoted")
+        now = time.time()
+        payment = Payment(
+            reference=f"PAY{uuid.uuid4().hex[:20].upper()}",
+            booking_id=booking_id,
+            flow_token=flow_token,
+            method=method,
+            amount_minor=amount_minor,
+            currency=currency,
+            account=account,
+            contact=contact,
+            tenant_id=tenant_id,
+            created_at=now,
+            expires_at=now + self.timeout,
+            details=details or {},
+        )
+        # Stored before the charge so that any worker can settle its callback
+        existing = await asyncio.to_thread(self._insert, payment)
+        if existing is not None:
+            self.duplicate_starts += 1
+            return existing
+        self.started += 1
+        self.start_expiring()
+        task = asyncio.get_running_loop().create_task(self._charge(payment))
+        self._charges.add(task)
+        task.add_done_callback(self._charges.discard)
+        return payment
+
+    async def _charge(self, payment: Payment) -> None:
+        try:
+            payment.provider_reference = await self.provider.charge(payment)
+        except Exception as e:
+            logger.error(f"Charge {payment.reference} was not accepted: {str(e)}")
+            await self._settle(payment.reference, FAILED, f"Payment could not be started: {type(e).__name__}")
+            return
+        try:
+            await asyncio.to_thread(self._update_provider_reference, payment.reference, payment.provider_reference)
+        except Exception as e:
+            logger.error(f"Could not record provider reference of {payment.reference}: {str(e)}")
+
+    async def handle_callback(self, reference: str, status: str, provider_reference: Optional[str] = None,
+                              reason: Optional[str] = None) -> Optional[Payment]:
+        """
+        Settle a payment from the provider's callback.
+
+        Returns:
+            Optional[Payment]: The payment, or None if the reference is unknown.
+        """
+        self.callbacks += 1
+        payment = await self._settle(reference, SUCCEEDED if status == SUCCEEDED else FAILED, reason,
+                                     provider_reference)
+        if payment is None:
+            self.unknown_callbacks += 1
+        # A duplicate or late callback gets the payment as first settled: the first outcome stands
+        return payment
+
+    async def _settle(self, reference: str, state: str, reason: Optional[str] = None,
+                      provider_reference: Optional[str] = None) -> Optional[Payment]:
+        payment, settled = await asyncio.to_thread(self._settle_row, reference, state, reason, provider_reference)
+        if settled:
+            await self._notify(payment)
+        return payment
+
+    async def _notify(self, payment: Payment) -> None:
+        self.settled[payment.state] += 1
+        for listener in self._listeners:
+            try:
+                result = listener(payment)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Payment listener failed for {payment.reference}: {str(e)}")
+
+    def start_expiring(self) -> None:
+        """Sweep for expired payments in the background, including those left by earlier processes."""
+        if self._expirer is None or self._expirer.done():
+            self._expirer = asyncio.get_running_loop().create_task(self._expire_loop())
+
+    async def _expire_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                expired = await asyncio.to_thread(self._expire_due, time.time())
+            except Exception as e:
+                logger.error(f"Payment expiry sweep failed: {str(e)}")
+                continue
+            for payment in expired:
+                await self._notify(payment)
+
+    async def close(self) -> Dict:
+        """Stop expiring and charging; pending payments stay in the database for the next process."""
+        if self._expirer is not None:
+            self._expirer.cancel()
+        for task in list(self._charges):
+            task.cancel()
+        if self.provider is not None and hasattr(self.provider, "close"):
+            self.provider.close()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+        return {"pending": self.pending}
+
+    def stats(self) -> Dict:
+        return {
+            "pending": self.pending,
+            "started": self.started,
+            "duplicate_starts": self.duplicate_starts,
+            "callbacks": self.callbacks,
+            "unknown_callbacks": self.unknown_callbacks,
+            **self.settled,
+        }
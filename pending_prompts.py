@@ -0,0 +1,110 @@
+"""Index of interactive prompts that are still waiting for a reply.
+
+When we send an interactive prompt (e.g. the language selection buttons) we
+record it under the wamid returned by the Graph API. A reply arriving on
+``/webhook`` carries that wamid in ``message["context"]["id"]``, so it is
+resolved with a single dict lookup. Replies without context fall back to the
+latest prompt sent to the same recipient.
+
+Outstanding prompts expire through a ``TimerWheel`` that is advanced on every
+access, so stale prompts are dropped without periodic full scans.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from utils.timer_wheel import TimerWheel
+
+
+@dataclass
+class PendingPrompt:
+    wamid: str
+    recipient: str
+    kind: str
+    context: Dict = field(default_factory=dict)
+    sent_at: float = field(default_factory=time.time)
+
+
+class PendingPromptIndex:
+    """
+    Args:
+        ttl (float): Seconds a prompt waits for its reply before it expires.
+        tick (float): Expiry resolution of the timer wheel.
+    """
+
+    def __init__(self, ttl: float = 3600.0, tick: float = 1.0):
+        self.ttl = ttl
+        self._by_wamid: Dict[str, PendingPrompt] = {}
+        self._by_recipient: Dict[str, str] = {}
+        self._wheel = TimerWheel(tick=tick, slots=max(64, int(ttl / tick) + 1))
+        self.registered = 0
+        self.resolved = 0
+        self.expired = 0
+        self.unmatched = 0
+
+    def __len__(self) -> int:
+        return len(self._by_wamid)
+
+    def _expire(self) -> None:
+        for wamid in self._wheel.advance():
+            prompt = self._by_wamid.pop(wamid, None)
+            if prompt is None:
+                continue
+            self.expired += 1
+            if self._by_recipient.get(prompt.recipient) == wamid:
+                del self._by_recipient[prompt.recipient]
+
+    def add(self, wamid: str, recipient: str, kind: str, context: Optional[Dict] = None) -> PendingPrompt:
+        """
+        Record a prompt we just sent.
+
+        Args:
+            wamid (str): Message id returned by the Graph API for the prompt.
+            recipient (str): WhatsApp id of the recipient (E.164 without "+").
+            kind (str): What the prompt asks for, used to pick the reply handler.
+            context (Optional[Dict]): Anything the reply handler will need.
+
+        Returns:
+            PendingPrompt: The stored prompt.
+        """
+        self._expire()
+        prompt = PendingPrompt(wamid=wamid, recipient=recipient, kind=kind, context=context or {})
+        self._by_wamid[wamid] = prompt
+        self._by_recipient[recipient] = wamid
+        self._wheel.schedule(wamid, self.ttl)
+        self.registered += 1
+        return prompt
+
+    def resolve(self, context_wamid: Optional[str], recipient: str) -> Optional[PendingPrompt]:
+        """
+        Pop the prompt a reply answers.
+
+        Args:
+            context_wamid (Optional[str]): ``context.id`` of the incoming reply.
+            recipient (str): WhatsApp id of the user who replied.
+
+        Returns:
+            Optional[PendingPrompt]: The prompt, or None if it is unknown or expired.
+        """
+        self._expire()
+        wamid = context_wamid if context_wamid in self._by_wamid else self._by_recipient.get(recipient)
+        prompt = self._by_wamid.pop(wamid, None) if wamid else None
+        if prompt is None:
+            self.unmatched += 1
+            return None
+        self._wheel.cancel(wamid)
+        if self._by_recipient.get(prompt.recipient) == wamid:
+            del self._by_recipient[prompt.recipient]
+        self.resolved += 1
+        return prompt
+
+    def stats(self) -> Dict:
+        self._expire()
+        return {
+            "pending": len(self._by_wamid),
+            "registered": self.registered,
+            "resolved": self.resolved,
+            "expired": self.expired,
+            "unmatched": self.unmatched,
+        }
@@ -0,0 +1,333 @@
+"""Fare table and pricing for the booking flow.
+
+Fares are looked up by route, seat class and passenger type (adult/child) and
+may change by travel date. They are kept in an immutable ``FareTable`` built
+from ``fares.json`` (see ``fares.example.json``), or from ``DEFAULT_FARES``
+when that file does not exist:
+
+- amounts are converted once, at load time, to integer minor units (cents of
+  the currency), so totals are exact and cheap to add up;
+- each (route, class) maps to date ranges sorted by start day, searched with
+  ``bisect``; a route of ``"*"`` applies to every route without its own fare;
+- the seat category list shown on the SEATS screen is rendered once per
+  (route, date) and cached on the table.
+
+The file is polled for changes like the tenants file. A reload builds a new
+table and publishes it with a single reference assignment, which also drops
+every cached category list priced with the old fares.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PASSENGER_TYPES = ("adult", "child")
+ANY_ROUTE = "*"
+
+# Used when there is no fares file: the prices the SEATS screen always showed
+DEFAULT_FARES = {
+    "currency": "TZS",
+    "exponent": 2,
+    "classes": [
+        {"id": "economy", "title": "🌟 Economy Class"},
+        {"id": "vip", "title": "💺 VIP Class"},
+        {"id": "first_class", "title": "👑 First Class"},
+    ],
+    "fares": [
+        {"route": ANY_ROUTE, "class": "economy", "adult": "50000", "child": "50000"},
+        {"route": ANY_ROUTE, "class": "vip", "adult": "75000", "child": "75000"},
+        {"route": ANY_ROUTE, "class": "first_class", "adult": "100000", "child": "100000"},
+    ],
+}
+
+
+class PricingError(ValueError):
+    """Raised for an invalid fare table or when no fare applies to a trip."""
+
+
+@lru_cache(maxsize=1024)
+def parse_travel_date(value: str) -> date:
+    """
+    Parse a flow DatePicker value: ``YYYY-MM-DD``, or epoch milliseconds as
+    sent by older flow JSON versions.
+
+    Raises:
+        PricingError: If the value is not a date.
+    """
+    try:
+        if value.isdigit():
+            return datetime.fromtimestamp(int(value) / 1000, tz=timezone.utc).date()
+        return date.fromisoformat(value)
+    except (ValueError, OverflowError, AttributeError) as e:
+        raise PricingError(f"Invalid travel date: {value}") from e
+
+
+@dataclass(frozen=True)
+class QuoteLine:
+    leg: str
+    route: str
+    seat_class: str
+    passenger_type: str
+    count: int
+    unit_minor: int
+
+    @property
+    def amount_minor(self) -> int:
+        return self.count * self.unit_minor
+
+
+@dataclass(frozen=True)
+class Quote:
+    currency: str
+    total_minor: int
+    lines: Tuple[QuoteLine, ...]
+    display: str
+
+    def to_dict(self) -> Dict:
+        legs_minor: Dict[str, int] = {}
+        for line in self.lines:
+            legs_minor[line.leg] = legs_minor.get(line.leg, 0) + line.amount_minor
+        return {"currency": self.currency, "total_minor": self.total_minor, "total": self.display,
+                "legs_minor": legs_minor}
+
+
+class FareTable:
+    """
+    Args:
+        raw (Dict): Parsed fares file (``currency``, ``exponent``, ``classes``, ``fares``).
+        version (int): Increases with every reload.
+        source_mtime (Optional[float]): Modification time of the file it was read from.
+        cache_size (int): Rendered category lists kept per table.
+
+    Raises:
+        PricingError: If the table is malformed or date ranges of a fare overlap.
+    """
+
+    def __init__(self, raw: Dict, version: int = 1, source_mtime: Optional[float] = None,
+                 cache_size: int = 4096):
+        self.version = version
+        self.source_mtime = source_mtime
+        self.loaded_at = time.time()
+        self.currency = raw.get("currency", "TZS")
+        self.exponent = int(raw.get("exponent", 2))
+        self._scale = 10 ** self.exponent
+        self.classes: Tuple[Tuple[str, str], ...] = tuple(
+            (entry["id"], entry.get("title", entry["id"])) for entry in raw.get("classes", [])
+        )
+        if not self.classes:
+            raise PricingError("fare table defines no seat classes")
+        class_ids = {class_id for class_id, _ in self.classes}
+
+        ranges: Dict[Tuple[str, str], List[Tuple[int, int, Dict[str, int]]]] = {}
+        for entry in raw.get("fares", []):
+            seat_class = entry.get("class")
+            if seat_class not in class_ids:
+                raise PricingError(f"fare for unknown seat class {seat_class}")
+            start = date.fromisoformat(entry["from"]).toordinal() if entry.get("from") else date.min.toordinal()
+            end = date.fromisoformat(entry["until"]).toordinal() if entry.get("until") else date.max.toordinal()
+            if end < start:
+                raise PricingError(f"fare {entry} ends before it starts")
+            prices = {ptype: self.to_minor(entry[ptype]) for ptype in PASSENGER_TYPES if ptype in entry}
+            if "adult" not in prices:
+                raise PricingError(f"fare {entry} has no adult price")
+            # Children pay the adult fare unless a child fare is given
+            prices.setdefault("child", prices["adult"])
+            ranges.setdefault((entry.get("route", ANY_ROUTE), seat_class), []).append((start, end, prices))
+
+        self._starts: Dict[Tuple[str, str], List[int]] = {}
+        self._ranges: Dict[Tuple[str, str], List[Tuple[int, int, Dict[str, int]]]] = {}
+        for key, entries in ranges.items():
+            entries.sort(key=lambda r: r[0])
+            for previous, current in zip(entries, entries[1:]):
+                if current[0] <= previous[1]:
+                    raise PricingError(f"overlapping date ranges for route {key[0]} class {key[1]}")
+            self._ranges[key] = entries
+            self._starts[key] = [r[0] for r in entries]
+
+        self.seat_categories = lru_cache(maxsize=cache_size)(self._render_categories)
+
+    def to_minor(self, amount) -> int:
+        """Convert a major-unit amount ("50000", "12.50", 75000) to integer minor units."""
+        try:
+            minor = Decimal(str(amount)) * self._scale
+        except InvalidOperation as e:
+            raise PricingError(f"invalid amount {amount!r}") from e
+        if minor != minor.to_integral_value():
+            raise PricingError(f"amount {amount} has more than {self.exponent} decimals")
+        return int(minor)
+
+    def format(self, minor: int) -> str:
+        """Format minor units for display, e.g. ``TZS 50,000`` or ``TZS 12.50``."""
+        major, fraction = divmod(minor, self._scale)
+        if fraction:
+            return f"{self.currency} {major:,}.{fraction:0{self.exponent}d}"
+        return f"{self.currency} {major:,}"
+
+    def fare(self, route: str, seat_class: str, day: date) -> Dict[str, int]:
+        """
+        Per-passenger-type prices in minor units for one leg.
+
+        Raises:
+            PricingError: If no fare covers the route, class and date.
+        """
+        ordinal = day.toordinal()
+        for key in ((route, seat_class), (ANY_ROUTE, seat_class)):
+            starts = self._starts.get(key)
+            if starts is None:
+                continue
+            i = bisect_right(starts, ordinal) - 1
+            if i >= 0:
+                start, end, prices = self._ranges[key][i]
+                if ordinal <= end:
+                    return prices
+        raise PricingError(f"No {seat_class} fare for {route} on {day.isoformat()}")
+
+    def _render_categories(self, route: str, travel_date: str) -> List[Dict]:
+        day = parse_travel_date(travel_date)
+        categories = []
+        for class_id, title in self.classes:
+            try:
+                prices = self.fare(route, class_id, day)
+            except PricingError:
+                continue  # class not sold on this route/date
+            category = {"id": class_id, "title": f"{title} · {self.format(prices['adult'])}"}
+            if prices["child"] != prices["adult"]:
+                category["description"] = f"Child {self.format(prices['child'])}"
+            categories.append(category)
+        return categories
+
+    def quote(self, travel_details: Dict, seat_class: str, adults: int, children: int) -> Quote:
+        """
+        Price a booking: every passenger on the going leg, and on the return leg
+        of a round trip, at the fare valid on that leg's date.
+
+        Args:
+            travel_details (Dict): PERSONAL_INFO screen data (routes, dates, trip type).
+            seat_class (str): Chosen seat class id.
+            adults (int): Adult passengers.
+            children (int): Child passengers.
+
+        Raises:
+            PricingError: If a leg has no fare.
+        """
+        legs = [("going", travel_details.get("going_route"), travel_details.get("going_date"))]
+        if travel_details.get("trip_type") == "round_trip":
+            legs.append(("return", travel_details.get("return_route"), travel_details.get("return_date")))
+        lines = []
+        total = 0
+        for leg, route, travel_date in legs:
+            prices = self.fare(route, seat_class, parse_travel_date(travel_date))
+            for ptype, count in (("adult", adults), ("child", children)):
+                if count:
+                    line = QuoteLine(leg, route, seat_class, ptype, count, prices[ptype])
+                    lines.append(line)
+                    total += line.amount_minor
+        return Quote(self.currency, total, tuple(lines), self.format(total))
+
+
+class PricingEngine:
+    """
+    Args:
+        path (Optional[str]): Fares JSON file; ``DEFAULT_FARES`` are used when it does not exist.
+        reload_interval (float): Seconds between checks of the file's modification time.
+    """
+
+    def __init__(self, path: Optional[str], reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._watcher: Optional[asyncio.Task] = None
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        self._table = self._build(version=1)
+
+    @property
+    def table(self) -> FareTable:
+        return self._table
+
+    def seat_categories(self, route: str, travel_date: str) -> List[Dict]:
+        """SEATS screen categories with prices for a route and date (cached; do not mutate)."""
+        return self._table.seat_categories(route, travel_date)
+
+    def quote(self, travel_details: Dict, seat_class: str, adults: int, children: int) -> Quote:
+        return self._table.quote(travel_details, seat_class, adults, children)
+
+    # ------------------------------------------------------------ loading
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            return None
+
+    def _build(self, version: int) -> FareTable:
+        mtime = self._mtime()
+        if mtime is None:
+            return FareTable(DEFAULT_FARES, version=version)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            raise PricingError(f"cannot read {self.path}: {str(e)}") from e
+        return FareTable(raw, version=version, source_mtime=mtime)
+
+    def reload(self) -> bool:
+        """
+        Re-read the fares file and publish it if it is valid.
+
+        Returns:
+            bool: True if a new table was published, False if the file was
+            invalid (the error is kept in ``last_error``).
+        """
+        previous = self._table
+        try:
+            table = self._build(version=previous.version + 1)
+        except (PricingError, KeyError, ValueError) as e:
+            self.reload_errors += 1
+            self.last_error = str(e)
+            logger.error(f"Fare reload failed, keeping version {previous.version}: {str(e)}")
+            return False
+        self._table = table
+        self.reloads += 1
+        self.last_error = None
+        logger.info(f"Loaded fare table version {table.version}")
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if self._mtime() != self._table.source_mtime:
+                self.reload()
+
+    def start_watching(self) -> None:
+        """Start polling the fares file for changes (needs a running event loop)."""
+        if self.path and (self._watcher is None or self._watcher.done()):
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    def stats(self) -> Dict:
+        table = self._table
+        cache = table.seat_categories.cache_info()
+        return {
+            "version": table.version,
+            "loaded_at": table.loaded_at,
+            "from_file": table.source_mtime is not None,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "category_cache": {"hits": cache.hits, "misses": cache.misses, "size": cache.currsize},
+        }
@@ -0,0 +1,299 @@
+"""Persistent scheduler for departure reminders (and other future sends).
+
+Jobs live in a SQLite table indexed on ``due_at``. The B-tree index is the
+priority queue: inserting and cancelling a job are O(log n), and finding the
+due jobs is a range scan from the start of the index, whatever the number of
+jobs scheduled further ahead. Millions of pending reminders therefore cost
+disk, not memory, and the schedule survives restarts: after a restart the
+scheduler simply continues from the index, without reading bookings again.
+
+A single background task does all database work in a worker thread:
+
+1. jobs added with ``schedule``/``cancel`` (non-blocking, callable from a
+   request handler) are written in one transaction;
+2. up to ``batch_size`` due jobs are claimed by moving their ``due_at`` one
+   ``lease`` ahead, so a worker that dies mid-send leaves them to be fired
+   again later, and several uvicorn workers sharing the database never claim
+   the same job;
+3. the claimed jobs are sent with at most ``concurrency`` sends in flight;
+   sent jobs are deleted, failed ones are retried with exponential backoff
+   up to ``max_attempts``, and jobs past their ``expires_at`` (e.g. the
+   departure) are dropped unsent;
+4. it sleeps until the next job is due (at most ``poll_interval``), or until
+   ``schedule`` adds a job due earlier than that.
+
+Sends are at-least-once; the job id is passed on as the send's idempotency
+key.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ReminderJob:
+    job_id: str
+    due_at: float
+    recipient: str
+    kind: str = "reminder"
+    tenant_id: Optional[str] = None
+    payload: Dict = field(default_factory=dict)
+    expires_at: Optional[float] = None
+    attempts: int = 0
+
+
+class ReminderScheduler:
+    """
+    Args:
+        db_path (str): SQLite database file (``":memory:"`` for tests).
+        sender (Callable[[ReminderJob], Awaitable]): Sends one due job; raising marks the attempt failed.
+        batch_size (int): Jobs claimed and fired per round at most.
+        concurrency (int): Sends in flight at most.
+        poll_interval (float): Longest sleep between rounds (other workers may add jobs).
+        lease (float): Seconds before a claimed but unfinished job is fired again.
+        max_attempts (int): Sends tried per job before it is dropped.
+        retry_delay (float): Delay before the first retry; doubles per attempt.
+    """
+
+    _SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS reminder_jobs (
+            job_id TEXT PRIMARY KEY,
+            due_at REAL NOT NULL,
+            expires_at REAL,
+            kind TEXT NOT NULL,
+            tenant_id TEXT,
+            recipient TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS reminder_jobs_due ON reminder_jobs (due_at)",
+    )
+
+    _UPSERT = """
+        INSERT OR REPLACE INTO reminder_jobs
+            (job_id, due_at, expires_at, kind, tenant_id, recipient, payload, attempts)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+    """
+
+    _CLAIM = """
+        UPDATE reminder_jobs SET due_at = ?, attempts = attempts + 1
+        WHERE job_id IN (SELECT job_id FROM reminder_jobs WHERE due_at <= ? ORDER BY due_at LIMIT ?)
+        RETURNING job_id, due_at, expires_at, kind, tenant_id, recipient, payload, attempts
+    """
+
+    def __init__(self, db_path: str = "reminders.db",
+                 sender: Optional[Callable[[ReminderJob], Awaitable]] = None,
+                 batch_size: int = 100, concurrency: int = 8, poll_interval: float = 30.0,
+                 lease: float = 300.0, max_attempts: int = 5, retry_delay: float = 60.0):
+        self.db_path = db_path
+        self.sender = sender
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple] = []
+        self._pending_cancels: List[str] = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Due time of the earliest stored job as of the last round (None: nothing stored)
+        self._next_due: Optional[float] = None
+
+        self.scheduled = 0
+        self.cancelled = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.expired = 0
+        self.rounds = 0
+
+    # ------------------------------------------------------------------ storage
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            # Another worker may hold the write lock for a batch
+            self._db.execute("PRAGMA busy_timeout=5000")
+            for statement in self._SCHEMA:
+                self._db.execute(statement)
+            self._db.commit()
+        return self._db
+
+    def _write(self, rows: List[Tuple], cancels: List[str]) -> None:
+        db = self._connect()
+        with db:
+            if rows:
+                db.executemany(self._UPSERT, rows)
+            if cancels:
+                db.executemany("DELETE FROM reminder_jobs WHERE job_id = ?", [(job_id,) for job_id in cancels])
+
+    def _claim(self, now: float) -> List[ReminderJob]:
+        db = self._connect()
+        with db:
+            rows = db.execute(self._CLAIM, (now + self.lease, now, self.batch_size)).fetchall()
+        return [
+            ReminderJob(job_id=row[0], due_at=row[1], expires_at=row[2], kind=row[3], tenant_id=row[4],
+                        recipient=row[5], payload=json.loads(row[6]), attempts=row[7])
+            for row in rows
+        ]
+
+    def _settle(self, done: List[str], retries: List[Tuple[float, str]]) -> None:
+        db = self._connect()
+        with db:
+            db.executemany("DELETE FROM reminder_jobs WHERE job_id = ?", [(job_id,) for job_id in done])
+            db.executemany("UPDATE reminder_jobs SET due_at = ? WHERE job_id = ?", retries)
+
+    def _earliest_due(self) -> Optional[float]:
+        row = self._connect().execute("SELECT MIN(due_at) FROM reminder_jobs").fetchone()
+        return row[0]
+
+    def pending_count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM reminder_jobs").fetchone()[0]
+
+    def close_db(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    # ------------------------------------------------------------------ scheduling
+
+    def schedule(self, job: ReminderJob) -> None:
+        """
+        Schedule a job, replacing any job with the same id. Never blocks; the
+        job is stored by the background task within the current round.
+        """
+        self._pending.append((
+            job.job_id, job.due_at, job.expires_at, job.kind, job.tenant_id, job.recipient,
+            json.dumps(job.payload, separators=(",", ":")),
+        ))
+        self.scheduled += 1
+        if self._next_due is None or job.due_at < self._next_due:
+            self._next_due = job.due_at
+            self._wake.set()
+
+    def cancel(self, job_ids: Iterable[str]) -> None:
+        """Drop scheduled jobs (unknown ids are ignored)."""
+        job_ids = list(job_ids)
+        self._pending_cancels.extend(job_ids)
+        self.cancelled += len(job_ids)
+        self._wake.set()
+
+    async def _write_pending(self) -> None:
+        if not self._pending and not self._pending_cancels:
+            return
+        rows, self._pending = self._pending, []
+        cancels, self._pending_cancels = self._pending_cancels, []
+        try:
+            await asyncio.to_thread(self._write, rows, cancels)
+        except Exception as e:
+            # Put them back for the next round rather than lose the schedule
+            self._pending[:0] = rows
+            self._pending_cancels[:0] = cancels
+            logger.error(f"Storing {len(rows)} reminder jobs failed: {str(e)}")
+            raise
+
+    # ------------------------------------------------------------------ firing
+
+    async def _fire(self, job: ReminderJob, slots: asyncio.Semaphore) -> Optional[float]:
+        """Send one job; returns when to retry it, or None when it is finished."""
+        if job.expires_at is not None and job.expires_at <= time.time():
+            self.expired += 1
+            return None
+        async with slots:
+            try:
+                await self.sender(job)
+                self.sent += 1
+                return None
+            except Exception as e:
+                if job.attempts >= self.max_attempts:
+                    self.failed += 1
+                    logger.error(f"Reminder {job.job_id} dropped after {job.attempts} attempts: {str(e)}")
+                    return None
+                self.retried += 1
+                logger.warning(f"Reminder {job.job_id} attempt {job.attempts} failed: {str(e)}")
+                return time.time() + self.retry_delay * 2 ** (job.attempts - 1)
+
+    async def run_once(self, now: Optional[float] = None) -> int:
+        """
+        Store pending changes and fire one batch of due jobs.
+
+        Returns:
+            int: Number of jobs claimed in this round.
+        """
+        await self._write_pending()
+        jobs = await asyncio.to_thread(self._claim, now if now is not None else time.time())
+        if jobs:
+            slots = asyncio.Semaphore(self.concurrency)
+            outcomes = await asyncio.gather(*(self._fire(job, slots) for job in jobs))
+            done = [job.job_id for job, retry_at in zip(jobs, outcomes) if retry_at is None]
+            retries = [(retry_at, job.job_id) for job, retry_at in zip(jobs, outcomes) if retry_at is not None]
+            await asyncio.to_thread(self._settle, done, retries)
+        self.rounds += 1
+        return len(jobs)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                if await self.run_once() == self.batch_size:
+                    continue  # more may be due already
+                self._next_due = await asyncio.to_thread(self._earliest_due)
+            except Exception as e:
+                logger.error(f"Reminder round failed: {str(e)}")
+                self._next_due = None
+            if self._stopping:
+                break
+            delay = self.poll_interval
+            if self._next_due is not None:
+                delay = min(delay, max(self._next_due - time.time(), 0.0))
+            self._wake.clear()
+            if self._pending or self._pending_cancels:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """Start the background task (from the application lifespan)."""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> Dict:
+        """Let the current round finish, store pending changes and close the database."""
+        self._stopping = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self._write_pending()
+        self.close_db()
+        return {"pending_writes": len(self._pending) + len(self._pending_cancels)}
+
+    def stats(self) -> Dict:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "next_due": self._next_due,
+            "pending_writes": len(self._pending) + len(self._pending_cancels),
+            "scheduled": self.scheduled,
+            "cancelled": self.cancelled,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "expired": self.expired,
+            "rounds": self.rounds,
+        }
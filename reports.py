@@ -0,0 +1,675 @@
+"""Columnar booking analytics for operations reports.
+
+Every confirmed booking is recorded by ``process_booking`` as one row per
+leg (going, and return on round trips) in a column store: one ``array`` per
+field, dictionary-encoded strings (route, seat class, payment method, tenant,
+currency) and one append-only file per column, so loading months of bookings
+is a ``fromfile`` per column instead of parsing records.
+
+Queries do not scan the rows. Each store keeps a cube, itself a set of
+columns: per combination of departure (day, time, route), seat class,
+payment method, tenant, currency and leg, the number of legs, passengers and
+revenue. The cube is folded incrementally as rows are appended, and a report
+rolls its cells up to the requested dimensions. With NumPy installed, both
+bulk folds (startup) and reports are vectorized (masks and ``bincount`` over
+the cube columns); without it the same arrays are walked in Python. NumPy is
+imported on the first fold or report, so it does not slow ``import main``.
+
+The reports operations asked for:
+
+- daily load factors: ``group_by=day,route``;
+- revenue per route: ``group_by=route``;
+- class mix: ``group_by=seat_class``;
+- payment method split: ``group_by=payment_method``.
+
+Each worker appends to its own subdirectory and flushes it every few seconds;
+a report also folds what the other workers have flushed since the last one,
+so every worker answers for all of them (other workers' latest bookings show
+up after their next flush). Load factors count departures with at least one
+booking, as the timetable is not known here.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from datetime import date, timedelta
+from functools import lru_cache
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEGS = ("going", "return")
+UNKNOWN = "unknown"
+_EPOCH = date(1970, 1, 1)
+
+# Stored columns and their array typecodes
+_COLUMNS = (
+    ("booked_at", "d"),
+    ("day", "i"),  # departure date, days since 1970-01-01
+    ("minute", "h"),  # departure minute of the day, -1 if unknown
+    ("route", "H"),
+    ("seat_class", "H"),
+    ("payment_method", "H"),
+    ("tenant", "H"),
+    ("currency", "H"),
+    ("leg", "B"),
+    ("adults", "H"),
+    ("children", "H"),
+    ("revenue_minor", "q"),
+)
+_ENCODED = ("route", "seat_class", "payment_method", "tenant", "currency")
+# Cube key and the metrics summed per key
+_KEY = ("day", "minute", "route", "seat_class", "payment_method", "tenant", "currency", "leg")
+_METRICS = ("adults", "children", "revenue_minor")
+_CELL_METRICS = ("legs", "adults", "children", "revenue_minor")
+_TYPECODES = dict(_COLUMNS)
+_POSITION = {name: i for i, name in enumerate(_KEY)}
+_DIMENSION_POSITIONS = {"day": (0,), "month": (0,), "departure": (0, 1)}
+
+DIMENSIONS = ("day", "month", "departure", "route", "seat_class", "payment_method", "tenant", "leg", "currency")
+FILTERS = ("route", "seat_class", "payment_method", "tenant", "leg")
+
+# Below this many new rows the cube is folded in Python even with NumPy
+_NUMPY_MIN_ROWS = 2000
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    """NumPy, or None if it is not installed. Imported on first fold or report, not with the app."""
+    try:
+        import numpy
+    except ImportError:  # the cube is folded row by row instead
+        return None
+    return numpy
+
+
+class ColumnStore:
+    """
+    Booking legs of one worker: columns in memory, mirrored to one file per column.
+
+    Args:
+        directory (str): Directory of the column files.
+        writable (bool): Whether this process appends to it (a store of another worker is read-only).
+    """
+
+    def __init__(self, directory: str, writable: bool = False):
+        self.directory = directory
+        self.writable = writable
+        self.columns: Dict[str, array] = {name: array(code) for name, code in _COLUMNS}
+        self.values: Dict[str, List[str]] = {name: [] for name in _ENCODED}
+        self._codes: Dict[str, Dict[str, int]] = {name: {} for name in _ENCODED}
+        self.rows = 0
+        self._flushed = 0
+        self._dictionaries_flushed = 0
+        self._dictionaries_mtime = 0.0
+        # Cube: one cell per distinct key (see _KEY), as parallel arrays; cells maps a key to its index
+        self.cells: Dict[Tuple, int] = {}
+        self.cube: Dict[str, array] = {name: array(_TYPECODES[name]) for name in _KEY}
+        self.cube.update((name, array("q")) for name in _CELL_METRICS)
+        self._folded = 0
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.col")
+
+    @property
+    def _dictionaries_path(self) -> str:
+        return os.path.join(self.directory, "dictionaries.json")
+
+    # ------------------------------------------------------------ reading
+
+    def load(self) -> int:
+        """Read rows flushed since the last call and fold them into the cube; returns the rows added."""
+        sizes = []
+        for name, code in _COLUMNS:
+            try:
+                sizes.append(os.path.getsize(self._path(name)) // self.columns[name].itemsize)
+            except FileNotFoundError:
+                sizes.append(0)
+        # A crash during a flush can leave some columns longer than others
+        available = min(sizes)
+        if self.writable and max(sizes) > available:
+            for name, _ in _COLUMNS:
+                os.truncate(self._path(name), available * self.columns[name].itemsize)
+        if available <= self.rows:
+            return 0
+        # Dictionaries are written before the columns, so they cover every row counted above
+        self._load_dictionaries()
+        for name, _ in _COLUMNS:
+            column = self.columns[name]
+            with open(self._path(name), "rb") as f:
+                f.seek(self.rows * column.itemsize)
+                column.fromfile(f, available - self.rows)
+        added = available - self.rows
+        self.rows = self._flushed = available
+        self._fold()
+        return added
+
+    def _load_dictionaries(self) -> None:
+        try:
+            mtime = os.path.getmtime(self._dictionaries_path)
+        except FileNotFoundError:
+            return
+        if mtime == self._dictionaries_mtime:
+            return
+        with open(self._dictionaries_path) as f:
+            values = json.load(f)
+        for name in _ENCODED:
+            self.values[name] = list(values.get(name, []))
+            self._codes[name] = {value: code for code, value in enumerate(self.values[name])}
+        self._dictionaries_mtime = mtime
+        self._dictionaries_flushed = sum(len(v) for v in self.values.values())
+
+    def decode(self, name: str, code: int) -> str:
+        values = self.values[name]
+        return values[code] if code < len(values) else UNKNOWN
+
+    # ------------------------------------------------------------ writing
+
+    def _code(self, name: str, value: Optional[str]) -> int:
+        value = value or UNKNOWN
+        code = self._codes[name].get(value)
+        if code is None:
+            code = self._codes[name][value] = len(self.values[name])
+            self.values[name].append(value)
+        return code
+
+    def append(self, row: Dict) -> None:
+        """Append one booking leg (strings of the encoded columns, numbers otherwise)."""
+        for name in _ENCODED:
+            row[name] = self._code(name, row[name])
+        for name, _ in _COLUMNS:
+            self.columns[name].append(row[name])
+        # Counted last: a flush in another thread only writes complete rows
+        self.rows += 1
+        if self._folded == self.rows - 1:
+            self._add(tuple([row[name] for name in _KEY]), 1, row["adults"], row["children"], row["revenue_minor"])
+            self._folded = self.rows
+        else:
+            self._fold()
+
+    def flush(self) -> int:
+        """Append unflushed rows to the column files; returns the rows written."""
+        rows = self.rows
+        if rows == self._flushed:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        values = {name: list(self.values[name]) for name in _ENCODED}
+        if sum(len(v) for v in values.values()) != self._dictionaries_flushed:
+            temporary = f"{self._dictionaries_path}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(values, f)
+            os.replace(temporary, self._dictionaries_path)
+            self._dictionaries_flushed = sum(len(v) for v in values.values())
+        for name, _ in _COLUMNS:
+            with open(self._path(name), "ab") as f:
+                self.columns[name][self._flushed:rows].tofile(f)
+        written, self._flushed = rows - self._flushed, rows
+        return written
+
+    @property
+    def unflushed(self) -> int:
+        return self.rows - self._flushed
+
+    # ------------------------------------------------------------ cube
+
+    def _fold(self) -> None:
+        start, end = self._folded, self.rows
+        if end <= start:
+            return
+        if end - start >= _NUMPY_MIN_ROWS and _numpy() is not None:
+            self._fold_numpy(start, end)
+        else:
+            self._fold_python(start, end)
+        self._folded = end
+
+    def _add(self, key: Tuple, legs: int, adults: int, children: int, revenue: int) -> None:
+        cube = self.cube
+        index = self.cells.get(key)
+        if index is None:
+            self.cells[key] = len(self.cells)
+            for name, value in zip(_KEY, key):
+                cube[name].append(value)
+            for name, value in zip(_CELL_METRICS, (legs, adults, children, revenue)):
+                cube[name].append(value)
+        else:
+            cube["legs"][index] += legs
+            cube["adults"][index] += adults
+            cube["children"][index] += children
+            cube["revenue_minor"][index] += revenue
+
+    def _fold_python(self, start: int, end: int) -> None:
+        keys = zip(*(self.columns[name][start:end] for name in _KEY))
+        metrics = zip(*(self.columns[name][start:end] for name in _METRICS))
+        for key, (adults, children, revenue) in zip(keys, metrics):
+            self._add(key, 1, adults, children, revenue)
+
+    def _fold_numpy(self, start: int, end: int) -> None:
+        numpy = _numpy()
+
+        def column(name):
+            return numpy.frombuffer(self.columns[name], dtype=self.columns[name].typecode)[start:end].astype(numpy.int64)
+
+        packed = _pack([column(name) for name in _KEY])
+        if packed is None:
+            return self._fold_python(start, end)
+        unique, inverse, counts = numpy.unique(packed[0], return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        sums = [_sum(inverse, column(name), len(unique)) for name in _METRICS]
+        for key, legs, adults, children, revenue in zip(zip(*_unpack(unique, *packed[1:])), counts.tolist(), *sums):
+            self._add(key, legs, adults, children, revenue)
+
+
+def _pack(parts: List) -> Optional[Tuple]:
+    """
+    Mixed-radix pack of integer NumPy columns into one int64 column, so grouping
+    by several columns is a 1-D ``unique``. None if the key space does not fit.
+    """
+    numpy = _numpy()
+    lows = [int(part.min()) for part in parts]
+    radixes = [int(part.max()) - low + 1 for part, low in zip(parts, lows)]
+    if float(numpy.prod(numpy.array(radixes, dtype=float))) >= 2 ** 62:
+        return None
+    packed = numpy.zeros(len(parts[0]), dtype=numpy.int64)
+    for part, low, radix in zip(parts, lows, radixes):
+        packed = packed * radix + (part - low)
+    return packed, lows, radixes
+
+
+def _unpack(packed, lows: List[int], radixes: List[int]) -> List[List[int]]:
+    numpy = _numpy()
+    columns = []
+    for low, radix in zip(reversed(lows), reversed(radixes)):
+        packed, digit = numpy.divmod(packed, radix)
+        columns.append((digit + low).tolist())
+    return columns[::-1]
+
+
+def _sum(inverse, weights, groups: int) -> List[int]:
+    # bincount sums in float64: exact below 2**53, far above any revenue in minor units
+    return [int(round(total)) for total in _numpy().bincount(inverse, weights=weights, minlength=groups).tolist()]
+
+
+def _departure(slot_id: Optional[str], travel_date: Optional[str]) -> Tuple[Optional[int], int]:
+    """Day number and minute of the day of a leg, from its time slot id or else its date."""
+    try:
+        # "2025_07_01$08_00"; sliced rather than strptime'd, this runs on the booking path
+        day = date(int(slot_id[0:4]), int(slot_id[5:7]), int(slot_id[8:10]))
+        if slot_id[10] == "$":
+            return (day - _EPOCH).days, int(slot_id[11:13]) * 60 + int(slot_id[14:16])
+    except (TypeError, ValueError, IndexError):
+        pass
+    try:
+        return (date.fromisoformat(travel_date) - _EPOCH).days, -1
+    except (TypeError, ValueError):
+        return None, -1
+
+
+def _to_int(value) -> int:
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+class BookingReports:
+    """
+    Args:
+        directory (str): Reports directory shared by the workers.
+        worker (str): Subdirectory this worker appends to.
+        seats_per_departure (int): Seats offered per departure, for load factors.
+        route_seats (Optional[Dict[str, int]]): Per-route overrides of ``seats_per_departure``.
+        flush_interval (float): Seconds between flushes of new rows to disk.
+        format_amount (Optional[Callable[[int], str]]): Renders minor units for display.
+    """
+
+    def __init__(self, directory: str, worker: str, seats_per_departure: int = 300,
+                 route_seats: Optional[Dict[str, int]] = None, flush_interval: float = 5.0,
+                 format_amount: Optional[Callable[[int], str]] = None):
+        self.directory = directory
+        self.worker = worker
+        self.seats_per_departure = seats_per_departure
+        self.route_seats = route_seats or {}
+        self.flush_interval = flush_interval
+        self.format_amount = format_amount
+        self._own = ColumnStore(os.path.join(directory, worker), writable=True)
+        self._others: Dict[str, ColumnStore] = {}
+        # Bookings recorded before load() has read the rows of a previous run
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded = False
+        self._pending: List[Dict] = []
+        self._flusher = None
+
+        self.recorded = 0
+        self.reports = 0
+
+    # ------------------------------------------------------------ recording
+
+    def record(self, user_data: Dict, tenant_id: Optional[str] = None, booked_at: Optional[float] = None) -> int:
+        """
+        Record the legs of a confirmed booking from its flow session data.
+
+        Returns:
+            int: Legs recorded.
+        """
+        travel = user_data.get("travel_details", {})
+        times = user_data.get("time_selections", {})
+        seats = user_data.get("seat_selections", {})
+        fare = user_data.get("fare") or {}
+        legs = ["going"] + (["return"] if travel.get("trip_type") == "round_trip" else [])
+        total = _to_int(fare.get("total_minor"))
+        legs_minor = fare.get("legs_minor") or {}
+        rows = []
+        for i, leg in enumerate(legs):
+            day, minute = _departure(times.get(f"{leg}_time"), travel.get(f"{leg}_date"))
+            if day is None:
+                continue
+            if leg in legs_minor:
+                revenue = _to_int(legs_minor[leg])
+            else:  # fares quoted before per-leg amounts were kept: split evenly
+                revenue = total // len(legs) + (total % len(legs) if i == 0 else 0)
+            rows.append({
+                "booked_at": booked_at if booked_at is not None else time.time(),
+                "day": day,
+                "minute": minute,
+                "route": travel.get(f"{leg}_route"),
+                "seat_class": seats.get("seat_class"),
+                "payment_method": user_data.get("payment", {}).get("method"),
+                "tenant": tenant_id,
+                "currency": fare.get("currency"),
+                "leg": LEGS.index(leg),
+                "adults": _to_int(seats.get("adult_passengers")),
+                "children": _to_int(seats.get("child_passengers")),
+                "revenue_minor": revenue,
+            })
+        with self._lock:
+            for row in rows:
+                if self._loaded:
+                    self._own.append(row)
+                else:
+                    self._pending.append(row)
+        self.recorded += len(rows)
+        return len(rows)
+
+    # ------------------------------------------------------------ lifecycle
+
+    def load(self) -> Dict:
+        """Read this worker's rows from a previous run and the other workers' rows (blocking)."""
+        started = time.perf_counter()
+        with self._lock:
+            self._own.load()
+            for row in self._pending:
+                self._own.append(row)
+            self._pending = []
+            self._loaded = True
+        self.refresh()
+        return {"rows": self.rows, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    def refresh(self) -> int:
+        """Fold rows the other workers have flushed since the last refresh; returns the rows added."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        added = 0
+        for name in names:
+            if name == self.worker or not os.path.isdir(os.path.join(self.directory, name)):
+                continue
+            store = self._others.get(name)
+            if store is None:
+                store = self._others[name] = ColumnStore(os.path.join(self.directory, name))
+            try:
+                added += store.load()
+            except (OSError, ValueError) as e:
+                logger.error(f"Reports: could not read {store.directory}: {str(e)}")
+        return added
+
+    def flush(self) -> int:
+        with self._lock:
+            if not self._loaded:
+                return 0
+        return self._own.flush()
+
+    def start(self) -> None:
+        import asyncio
+
+        async def flush_loop():
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    await asyncio.to_thread(self.flush)
+                except OSError as e:
+                    logger.error(f"Reports flush failed: {str(e)}")
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(flush_loop())
+
+    async def close(self) -> Dict:
+        import asyncio
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+        await asyncio.to_thread(self.flush)
+        return {"unflushed": self._own.unflushed}
+
+    @property
+    def rows(self) -> int:
+        return self._own.rows + sum(store.rows for store in self._others.values())
+
+    # ------------------------------------------------------------ queries
+
+    def _seats(self, route: str) -> int:
+        return self.route_seats.get(route, self.seats_per_departure)
+
+    def report(self, group_by: Sequence[str] = ("route",), start: Optional[date] = None,
+               end: Optional[date] = None, **filters: Optional[str]) -> Dict:
+        """
+        Aggregate the bookings of all workers.
+
+        Args:
+            group_by (Sequence[str]): Dimensions from ``DIMENSIONS`` (empty for grand totals).
+                Revenue is always kept apart per currency.
+            start (Optional[date]): First departure date included.
+            end (Optional[date]): Last departure date included.
+            **filters: Only legs whose ``FILTERS`` dimension has this value, e.g. ``route="DAR_ZNZ"``.
+
+        Returns:
+            Dict: One row per group with bookings (going legs), legs, passengers,
+            revenue, departures, seats offered, load factor and shares of the totals.
+
+        Raises:
+            ValueError: If a dimension or filter is unknown.
+        """
+        started = time.perf_counter()
+        unknown = [d for d in group_by if d not in DIMENSIONS] + [f for f in filters if f not in FILTERS]
+        if unknown:
+            raise ValueError(f"Unknown dimensions {unknown}; group by {DIMENSIONS}, filter on {FILTERS}")
+        group_by = list(dict.fromkeys(list(group_by) + ["currency"]))
+        self.refresh()
+        first = (start - _EPOCH).days if start else -(1 << 31)
+        last = (end - _EPOCH).days if end else 1 << 31
+        wanted = {name: value for name, value in filters.items() if value is not None}
+        # Cube key positions the groups are made of (day for day/month, day and minute for departure)
+        positions = list(dict.fromkeys(p for d in group_by for p in _DIMENSION_POSITIONS.get(d, (_POSITION.get(d),))))
+
+        # group -> [bookings, legs, adults, children, revenue_minor, departures]
+        groups: Dict[Tuple, list] = {}
+        day_names: Dict[int, str] = {}
+        cells = 0
+        for store in self._stores():
+            # Filters as codes of this store; a value it has never seen matches nothing
+            codes = []
+            for name, wanted_value in wanted.items():
+                code = LEGS.index(wanted_value) if name == "leg" and wanted_value in LEGS else (
+                    store._codes[name].get(wanted_value) if name != "leg" else None)
+                codes.append((_POSITION[name], code))
+            if any(code is None for _, code in codes):
+                continue
+            numpy = _numpy()
+            with self._lock:
+                if numpy is not None:
+                    cube = {name: numpy.array(column) for name, column in store.cube.items()}
+                else:
+                    cube = {name: column[:] for name, column in store.cube.items()}
+            # Aggregate in this store's codes, decode the (few) groups afterwards
+            if numpy is not None and len(cube["legs"]):
+                partial, scanned = self._aggregate_numpy(cube, positions, first, last, codes)
+            else:
+                partial, scanned = self._aggregate_python(cube, positions, first, last, codes)
+            cells += scanned
+            routes = [store.decode("route", code) for code in range(len(store.values["route"]) + 1)]
+            for group, entry in partial.items():
+                values = dict(zip(positions, group))
+                name = tuple(self._dimension(dimension, values, store, day_names) for dimension in group_by)
+                merged = groups.get(name)
+                if merged is None:
+                    merged = groups[name] = [0, 0, 0, 0, 0, set()]
+                for i in range(5):
+                    merged[i] += entry[i]
+                merged[5].update((day, minute, routes[route]) for day, minute, route in entry[5])
+
+        total_passengers = sum(entry[2] + entry[3] for entry in groups.values()) or 1
+        total_revenue: Dict[str, int] = {}
+        currency_index = group_by.index("currency")
+        for group, entry in groups.items():
+            total_revenue[group[currency_index]] = total_revenue.get(group[currency_index], 0) + entry[4]
+        rows = []
+        seats: Dict[str, int] = {}
+        for group in sorted(groups):
+            bookings, legs, adults, children, revenue, departures = groups[group]
+            passengers = adults + children
+            seats_offered = sum(seats[route] if route in seats else seats.setdefault(route, self._seats(route))
+                                for _, _, route in departures)
+            row = dict(zip(group_by, group))
+            row.update({
+                "bookings": bookings,
+                "legs": legs,
+                "passengers": passengers,
+                "adults": adults,
+                "children": children,
+                "revenue_minor": revenue,
+                "departures": len(departures),
+                "seats_offered": seats_offered,
+                "load_factor": round(passengers / seats_offered, 4) if seats_offered else None,
+                "passenger_share": round(passengers / total_passengers, 4),
+                "revenue_share": round(revenue / (total_revenue[row["currency"]] or 1), 4),
+            })
+            if self.format_amount is not None:
+                row["revenue"] = self.format_amount(revenue)
+            rows.append(row)
+        self.reports += 1
+        return {
+            "group_by": group_by,
+            "start": start.isoformat() if start else None,
+            "end": end.isoformat() if end else None,
+            "filters": wanted,
+            "rows": rows,
+            "cells_scanned": cells,
+            "legs_covered": self.rows,
+            "ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    @staticmethod
+    def _aggregate_python(cube: Dict[str, array], positions: List[int], first: int, last: int,
+                          codes: List[Tuple[int, int]]) -> Tuple[Dict, int]:
+        """Group -> [bookings, legs, adults, children, revenue_minor, departures] over the matching cells."""
+        pick = itemgetter(*positions) if len(positions) > 1 else lambda key: (key[positions[0]],)
+        partial: Dict[Tuple, list] = {}
+        scanned = 0
+        keys = zip(*(cube[name] for name in _KEY))
+        for key, legs, adults, children, revenue in zip(keys, *(cube[name] for name in _CELL_METRICS)):
+            day = key[0]
+            if day < first or day > last:
+                continue
+            if codes and any(key[position] != code for position, code in codes):
+                continue
+            scanned += 1
+            group = pick(key)
+            entry = partial.get(group)
+            if entry is None:
+                entry = partial[group] = [0, 0, 0, 0, 0, set()]
+            if not key[7]:
+                entry[0] += legs
+            entry[1] += legs
+            entry[2] += adults
+            entry[3] += children
+            entry[4] += revenue
+            entry[5].add(key[:3])
+        return partial, scanned
+
+    @staticmethod
+    def _aggregate_numpy(cube: Dict, positions: List[int], first: int, last: int,
+                         codes: List[Tuple[int, int]]) -> Tuple[Dict, int]:
+        """``_aggregate_python`` with masks and ``bincount`` over the cell arrays."""
+        numpy = _numpy()
+        day = cube["day"]
+        mask = (day >= first) & (day <= last)
+        for position, code in codes:
+            mask &= cube[_KEY[position]] == code
+        selected = numpy.nonzero(mask)[0]
+        if not len(selected):
+            return {}, 0
+
+        def column(name):
+            return cube[name][selected].astype(numpy.int64)
+
+        packed = _pack([column(_KEY[position]) for position in positions])
+        departure = [column(name) for name in ("day", "minute", "route")]
+        if packed is None:
+            return BookingReports._aggregate_python(
+                {name: array(_TYPECODES.get(name, "q"), values[selected].tolist()) for name, values in cube.items()},
+                positions, first, last, codes)
+        unique, inverse = numpy.unique(packed[0], return_inverse=True)
+        inverse = inverse.reshape(-1)
+        groups = len(unique)
+        legs = column("legs")
+        sums = [_sum(inverse, legs * (column("leg") == 0), groups), _sum(inverse, legs, groups)]
+        sums += [_sum(inverse, column(name), groups) for name in ("adults", "children", "revenue_minor")]
+        keys = list(zip(*_unpack(unique, *packed[1:])))
+        partial = {key: [*totals, set()] for key, *totals in zip(keys, *sums)}
+        # Distinct departures per group: unique (group, day, minute, route)
+        pairs = _pack([inverse.astype(numpy.int64)] + departure)
+        if pairs is not None:
+            for index, day, minute, route in zip(*_unpack(numpy.unique(pairs[0]), *pairs[1:])):
+                partial[keys[index]][5].add((day, minute, route))
+        return partial, len(selected)
+
+    @staticmethod
+    def _dimension(dimension: str, values: Dict[int, int], store: ColumnStore, day_names: Dict[int, str]) -> str:
+        if dimension in ("day", "month", "departure"):
+            day = values[0]
+            name = day_names.get(day)
+            if name is None:
+                name = day_names[day] = (_EPOCH + timedelta(days=day)).isoformat()
+            if dimension == "month":
+                return name[:7]
+            if dimension == "departure" and values[1] >= 0:
+                return f"{name} {values[1] // 60:02d}:{values[1] % 60:02d}"
+            return name
+        if dimension == "leg":
+            return LEGS[values[_POSITION["leg"]]]
+        return store.decode(dimension, values[_POSITION[dimension]])
+
+    def _stores(self) -> Iterable[ColumnStore]:
+        yield self._own
+        yield from self._others.values()
+
+    def stats(self) -> Dict:
+        return {
+            "loaded": self._loaded,
+            "rows": self.rows,
+            "cube_cells": sum(len(store.cells) for store in self._stores()),
+            "workers": 1 + len(self._others),
+            "unflushed": self._own.unflushed,
+            "recorded": self.recorded,
+            "reports": self.reports,
+            "numpy": _numpy() is not None,
+        }
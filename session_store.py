@@ -0,0 +1,400 @@
+"""In-memory flow session store with an on-disk change log and warm restart.
+
+Flow sessions (one per ``flow_token``) live in memory so the handlers in
+``/flow-data`` never wait on a database. To survive deploys and crashes the
+store persists them incrementally:
+
+- every change marks the session dirty; a background task periodically
+  appends the latest state of each dirty session to ``sessions.log``
+  (several updates between flushes cost one record);
+- when the log grows past a multiple of the live data it is compacted into
+  ``sessions.snap`` and truncated;
+- records are ``marshal``-encoded and framed with a small binary header and a
+  CRC, so a torn write at the tail is detected and ignored.
+
+On startup only the record headers of the snapshot and log are scanned to
+build an index of ``flow_token -> (offset, length)``; the sessions themselves
+are decoded on first access, so the app accepts traffic right away.
+
+Sessions expire ``ttl`` seconds after their last update through a
+``TimerWheel``; expiry listeners (e.g. funnel analytics) are notified.
+"""
+
+import asyncio
+import logging
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.deadline import check_deadline
+from utils.timer_wheel import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<BHII")  # op, token length, payload length, crc32(payload)
+_OP_PUT = 1
+_OP_DELETE = 2
+
+
+def _encode(op: int, token: str, payload: bytes = b"") -> bytes:
+    token_bytes = token.encode("utf-8")
+    return _HEADER.pack(op, len(token_bytes), len(payload), zlib.crc32(payload)) + token_bytes + payload
+
+
+class _Segment:
+    """Read-only memory map of a snapshot or log file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def scan(self, index: Dict[str, Tuple["_Segment", int, int]], verify: bool = True) -> int:
+        """
+        Add this segment's records to ``index``; return the offset of the valid end.
+
+        Snapshots are written to a temporary file and renamed into place, so
+        they are scanned with ``verify=False`` and their CRCs are checked when
+        a session is actually decoded.
+        """
+        data = self.data
+        offset = 0
+        end = len(data)
+        while offset + _HEADER.size <= end:
+            op, token_len, payload_len, crc = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            payload_start = start + token_len
+            stop = payload_start + payload_len
+            if op not in (_OP_PUT, _OP_DELETE) or stop > end:
+                break
+            if verify and zlib.crc32(data[payload_start:stop]) != crc:
+                break
+            token = bytes(data[start:payload_start]).decode("utf-8")
+            if op == _OP_PUT:
+                index[token] = (self, payload_start, payload_len)
+            else:
+                index.pop(token, None)
+            offset = stop
+        return offset
+
+    def read(self, offset: int, length: int) -> bytes:
+        return bytes(self.data[offset:offset + length])
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._file.close()
+
+
+class SessionStore:
+    """
+    Args:
+        directory (Optional[str]): Where ``sessions.snap``/``sessions.log`` live;
+            None keeps sessions in memory only.
+        ttl (float): Seconds of inactivity after which a session expires.
+        flush_interval (float): Seconds between incremental log flushes.
+        compact_ratio (float): Compact once the log is this many times larger
+            than the estimated size of the live sessions.
+    """
+
+    def __init__(self, directory: Optional[str] = None, ttl: float = 1800.0, flush_interval: float = 1.0,
+                 compact_ratio: float = 2.0):
+        self.directory = directory
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.compact_ratio = compact_ratio
+
+        self._sessions: Dict[str, Dict] = {}
+        # Sessions restored from disk but not decoded yet
+        self._lazy: Dict[str, Tuple[_Segment, int, int]] = {}
+        self._segments: List[_Segment] = []
+        self._dirty: Dict[str, bool] = {}  # token -> True for put, False for delete
+        self._wheel = TimerWheel(tick=1.0, slots=max(64, int(ttl) + 1))
+        self._expiry_listeners: List[Callable[[str, Dict], None]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._log = None
+        self._log_size = 0
+        self._avg_record = 256.0
+        self._restored = False
+        # restore() may run in a warm-up thread while a request also needs it
+        self._restore_lock = threading.Lock()
+        # Appends, compaction and close take turns on the log; their file work runs in threads
+        self._io_lock = asyncio.Lock()
+
+        self.restored_count = 0
+        self.restore_seconds = 0.0
+        self.lazy_loads = 0
+        self.expired = 0
+        self.flushes = 0
+        self.compactions = 0
+
+    # -------------------------------------------------------------- paths
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # ------------------------------------------------------------ restore
+
+    def restore(self) -> None:
+        """
+        Index sessions persisted by a previous process.
+
+        Only record headers are read; payloads are decoded on first access.
+        """
+        with self._restore_lock:
+            if not self._restored:
+                if self.directory:
+                    self._restore()
+                self._restored = True
+
+    def _restore(self) -> None:
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        index: Dict[str, Tuple[_Segment, int, int]] = {}
+        for name in ("sessions.snap", "sessions.log"):
+            path = self._path(name)
+            if not os.path.exists(path):
+                continue
+            segment = _Segment(path)
+            valid_end = segment.scan(index, verify=(name == "sessions.log"))
+            self._segments.append(segment)
+            if name == "sessions.log" and valid_end < len(segment.data):
+                logger.warning(f"Ignoring {len(segment.data) - valid_end} torn bytes at end of session log")
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+        self._lazy = index
+        # Restored sessions get a fresh TTL rather than decoding each one to read its timestamp
+        self._wheel.schedule_many(index, self.ttl)
+        self.restored_count = len(index)
+        self.restore_seconds = time.perf_counter() - started
+
+    def _open_log(self):
+        if self._log is None and self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._log = open(self._path("sessions.log"), "ab")
+            self._log_size = self._log.tell()
+        return self._log
+
+    # ------------------------------------------------------------ access
+
+    def _expire(self) -> None:
+        for token in self._wheel.advance():
+            session = self._load(token)
+            self._sessions.pop(token, None)
+            self._lazy.pop(token, None)
+            self._mark_dirty(token, False)
+            self.expired += 1
+            for listener in self._expiry_listeners:
+                try:
+                    listener(token, session or {})
+                except Exception as e:
+                    logger.error(f"Session expiry listener failed: {str(e)}")
+
+    def _load(self, token: str) -> Optional[Dict]:
+        session = self._sessions.get(token)
+        if session is not None:
+            return session
+        location = self._lazy.pop(token, None)
+        if location is None:
+            return None
+        segment, offset, length = location
+        payload = segment.read(offset, length)
+        crc = _HEADER.unpack_from(segment.data, offset - len(token.encode("utf-8")) - _HEADER.size)[3]
+        if zlib.crc32(payload) != crc:
+            logger.error(f"Discarding corrupt persisted session {token}")
+            return None
+        session = marshal.loads(payload)
+        self._sessions[token] = session
+        self.lazy_loads += 1
+        return session
+
+    def get(self, token: str) -> Optional[Dict]:
+        """Return the session for ``token`` (decoding it from disk if needed), or None."""
+        if not self._restored:
+            check_deadline("session_restore")
+            self.restore()
+        self._expire()
+        if token in self._lazy:
+            # Decoding pages the record in from disk; don't start it for a request that is already late
+            check_deadline("session_load")
+        return self._load(token)
+
+    def put(self, token: str, session: Dict) -> Dict:
+        """Store ``session`` (a marshal-able dict) and reset its TTL."""
+        if not self._restored:
+            check_deadline("session_restore")
+            self.restore()
+        self._expire()
+        session["updated_at"] = time.time()
+        self._sessions[token] = session
+        self._lazy.pop(token, None)
+        self._wheel.schedule(token, self.ttl)
+        self._mark_dirty(token, True)
+        return session
+
+    def delete(self, token: str) -> None:
+        self._sessions.pop(token, None)
+        self._lazy.pop(token, None)
+        self._wheel.cancel(token)
+        self._mark_dirty(token, False)
+
+    def on_expire(self, listener: Callable[[str, Dict], None]) -> None:
+        """Register ``listener(flow_token, session)`` to be called when a session expires."""
+        self._expiry_listeners.append(listener)
+
+    def __len__(self) -> int:
+        return len(self._sessions) + len(self._lazy)
+
+    # ------------------------------------------------------------ persistence
+
+    def _mark_dirty(self, token: str, present: bool) -> None:
+        if not self.directory:
+            return
+        self._dirty[token] = present
+        if self._flusher is None or self._flusher.done():
+            try:
+                self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                # No event loop (offline tooling): flush() must be called explicitly
+                pass
+
+    def _collect_dirty(self) -> bytes:
+        dirty, self._dirty = self._dirty, {}
+        records = []
+        for token, present in dirty.items():
+            session = self._sessions.get(token) if present else None
+            if session is not None:
+                records.append(_encode(_OP_PUT, token, marshal.dumps(session)))
+            elif token not in self._lazy:
+                records.append(_encode(_OP_DELETE, token))
+        return b"".join(records)
+
+    def _append(self, chunk: bytes) -> None:
+        log = self._open_log()
+        log.write(chunk)
+        log.flush()
+        os.fsync(log.fileno())
+        self._log_size += len(chunk)
+
+    def flush(self) -> int:
+        """
+        Synchronously append all dirty sessions to the log; returns bytes written.
+        For offline tooling: with an event loop running the flusher does this.
+        """
+        chunk = self._collect_dirty()
+        if chunk and self.directory:
+            self._append(chunk)
+            self.flushes += 1
+        return len(chunk)
+
+    def _snapshot_records(self) -> Tuple[List[bytes], List[Tuple[str, _Segment, int, int]]]:
+        encoded = [_encode(_OP_PUT, token, marshal.dumps(s)) for token, s in self._sessions.items()]
+        raw = [(token, segment, offset, length) for token, (segment, offset, length) in self._lazy.items()]
+        return encoded, raw
+
+    def _write_snapshot(self, encoded: List[bytes], raw: List[Tuple[str, _Segment, int, int]]) -> Dict[str, Tuple[int, int]]:
+        tmp = self._path("sessions.snap.tmp")
+        positions: Dict[str, Tuple[int, int]] = {}
+        with open(tmp, "wb") as f:
+            f.write(b"".join(encoded))
+            for token, segment, offset, length in raw:
+                record = _encode(_OP_PUT, token, segment.read(offset, length))
+                f.write(record)
+                positions[token] = (f.tell() - length, length)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path("sessions.snap"))
+        # The snapshot now holds everything; start a fresh log
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        # Replace rather than truncate: the old log may still be memory-mapped
+        with open(self._path("sessions.log.tmp"), "wb") as f:
+            os.fsync(f.fileno())
+        os.replace(self._path("sessions.log.tmp"), self._path("sessions.log"))
+        self._log_size = 0
+        return positions
+
+    async def compact(self) -> None:
+        """Rewrite all live sessions into a new snapshot and truncate the log."""
+        if not self.directory:
+            return
+        async with self._io_lock:
+            await self._compact()
+
+    async def _compact(self) -> None:
+        self._expire()
+        await asyncio.to_thread(self._append, self._collect_dirty())
+        encoded, raw = self._snapshot_records()
+        positions = await asyncio.to_thread(self._write_snapshot, encoded, raw)
+        old_segments, self._segments = self._segments, []
+        snapshot = _Segment(self._path("sessions.snap"))
+        self._segments.append(snapshot)
+        for token, (offset, length) in positions.items():
+            if token in self._lazy:
+                self._lazy[token] = (snapshot, offset, length)
+        for segment in old_segments:
+            segment.close()
+        total = sum(len(r) for r in encoded) + sum(length for _, _, _, length in raw)
+        self._avg_record = total / max(len(encoded) + len(raw), 1)
+        self.compactions += 1
+
+    def _needs_compaction(self) -> bool:
+        live = max(len(self) * self._avg_record, 1 << 20)
+        return self._log_size > live * self.compact_ratio
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                async with self._io_lock:
+                    self._expire()
+                    chunk = self._collect_dirty()
+                    if chunk:
+                        await asyncio.to_thread(self._append, chunk)
+                        self.flushes += 1
+                    if self._needs_compaction():
+                        await self._compact()
+            except Exception as e:
+                logger.error(f"Session flush failed: {str(e)}")
+
+    async def close(self) -> None:
+        """Stop the background flusher and persist everything still dirty."""
+        # An append or compaction in progress finishes first: cancelling it would
+        # leave its thread replacing the log under the final flush
+        async with self._io_lock:
+            if self._flusher is not None:
+                self._flusher.cancel()
+                try:
+                    await self._flusher
+                except asyncio.CancelledError:
+                    pass
+                self._flusher = None
+            if self.directory:
+                chunk = self._collect_dirty()
+                if chunk:
+                    await asyncio.to_thread(self._append, chunk)
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": len(self),
+            "decoded": len(self._sessions),
+            "pending_lazy_load": len(self._lazy),
+            "dirty": len(self._dirty),
+            "restored": self.restored_count,
+            "restore_ms": round(self.restore_seconds * 1000, 2),
+            "lazy_loads": self.lazy_loads,
+            "expired": self.expired,
+            "log_bytes": self._log_size,
+            "flushes": self.flushes,
+            "compactions": self.compactions,
+        }
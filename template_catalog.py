@@ -0,0 +1,236 @@
+"""Catalog of approved WhatsApp message templates.
+
+Template definitions are loaded from the Graph API
+(``/{waba_id}/message_templates``) or, in offline mode, from a local JSON file
+holding the same ``{"data": [...]}`` shape. They are cached with a TTL and
+refreshed in the background, so lookups never wait on Meta once warm.
+
+For every (template, language) a ``TemplateSkeleton`` is compiled once: the
+JSON body of the send request is pre-serialized into static fragments, so a
+send only has to splice in the recipient and the parameter values. Bulk
+sends therefore skip per-message dict construction and ``json.dumps`` of the
+whole payload.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"\{\{\s*(\d+)\s*\}\}")
+_PARAMETERISED_COMPONENTS = ("HEADER", "BODY")
+
+
+class TemplateNotFound(KeyError):
+    """Raised when a template/language pair is not in the catalog."""
+
+
+class TemplateParameterError(ValueError):
+    """Raised when the number of parameters does not match the template."""
+
+
+def _count_placeholders(text: str) -> int:
+    indexes = {int(m) for m in _PLACEHOLDER.findall(text or "")}
+    return max(indexes) if indexes else 0
+
+
+class TemplateSkeleton:
+    """Pre-serialized send payload for one template in one language."""
+
+    __slots__ = ("name", "language", "status", "component_params", "param_count", "_head", "_tail", "_fragments")
+
+    def __init__(self, definition: Dict):
+        self.name = definition["name"]
+        self.language = definition["language"]
+        self.status = definition.get("status", "APPROVED")
+
+        # (component type, number of text parameters) for components that take parameters
+        self.component_params: List[Tuple[str, int]] = []
+        for component in definition.get("components", []):
+            ctype = component.get("type", "").upper()
+            if ctype not in _PARAMETERISED_COMPONENTS:
+                continue
+            if ctype == "HEADER" and component.get("format", "TEXT").upper() != "TEXT":
+                continue
+            count = _count_placeholders(component.get("text", ""))
+            if count:
+                self.component_params.append((ctype.lower(), count))
+        self.param_count = sum(count for _, count in self.component_params)
+
+        template = {"name": self.name, "language": {"code": self.language}}
+        self._head = '{"messaging_product":"whatsapp","to":'
+        if not self.component_params:
+            self._tail = ',"type":"template","template":' + json.dumps(template, separators=(",", ":")) + "}"
+            self._fragments: List[Tuple[str, int]] = []
+            return
+
+        template_prefix = json.dumps(template, separators=(",", ":"))[:-1]
+        self._tail = ',"type":"template","template":' + template_prefix + ',"components":['
+        self._fragments = [
+            (('' if i == 0 else ',') + '{"type":"' + ctype + '","parameters":[', count)
+            for i, (ctype, count) in enumerate(self.component_params)
+        ]
+
+    def render(self, to: str, parameters: Optional[List[str]] = None) -> bytes:
+        """
+        Build the request body for one recipient.
+
+        Args:
+            to (str): Recipient phone number.
+            parameters (Optional[List[str]]): Values for the template
+                placeholders, header parameters first, then body parameters.
+
+        Returns:
+            bytes: UTF-8 encoded JSON request body.
+
+        Raises:
+            TemplateParameterError: If the parameter count does not match.
+        """
+        parameters = parameters or []
+        if len(parameters) != self.param_count:
+            raise TemplateParameterError(
+                f"Template {self.name} ({self.language}) expects {self.param_count} parameters, got {len(parameters)}"
+            )
+        parts = [self._head, json.dumps(to), self._tail]
+        if self._fragments:
+            index = 0
+            for prefix, count in self._fragments:
+                parts.append(prefix)
+                parts.append(",".join(
+                    '{"type":"text","text":' + json.dumps(str(value).strip()) + "}"
+                    for value in parameters[index:index + count]
+                ))
+                parts.append("]}")
+                index += count
+            parts.append("]}}")
+        return "".join(parts).encode("utf-8")
+
+    def describe(self) -> Dict:
+        return {
+            "name": self.name,
+            "language": self.language,
+            "status": self.status,
+            "param_count": self.param_count,
+            "components": [{"type": c, "param_count": n} for c, n in self.component_params],
+        }
+
+
+class TemplateCatalog:
+    """
+    TTL-cached mapping of (template name, language) to compiled skeletons.
+
+    Args:
+        client: ``ResilientClient`` used to call the Graph API; unused offline.
+        graph_url (Optional[str]): ``https://graph.facebook.com/{version}/{waba_id}``.
+        headers (Optional[Dict]): Authorization headers for the Graph API.
+        offline_file (Optional[str]): JSON file to load instead of calling Meta.
+        ttl (float): Seconds before a refresh is triggered.
+    """
+
+    def __init__(self, client=None, graph_url: Optional[str] = None, headers: Optional[Dict] = None,
+                 offline_file: Optional[str] = None, ttl: float = 600.0):
+        self.client = client
+        self.graph_url = graph_url
+        self.headers = headers or {}
+        self.offline_file = offline_file
+        self.ttl = ttl
+        self._skeletons: Dict[Tuple[str, str], TemplateSkeleton] = {}
+        self._loaded_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @property
+    def offline(self) -> bool:
+        return bool(self.offline_file) or not self.graph_url
+
+    def load_definitions(self, definitions: List[Dict]) -> None:
+        """Compile definitions and atomically replace the cached skeletons."""
+        skeletons = {}
+        for definition in definitions:
+            if definition.get("status", "APPROVED") != "APPROVED":
+                continue
+            skeleton = TemplateSkeleton(definition)
+            skeletons[(skeleton.name, skeleton.language)] = skeleton
+        self._skeletons = skeletons
+        self._loaded_at = time.monotonic()
+
+    async def _fetch_remote(self) -> List[Dict]:
+        definitions: List[Dict] = []
+        url = f"{self.graph_url}/message_templates"
+        params = {"fields": "name,language,status,components", "limit": 250}
+        while url:
+            response = await self.client.request(
+                "GET", url, endpoint="message_templates", headers=self.headers, params=params
+            )
+            response.raise_for_status()
+            body = response.json()
+            definitions.extend(body.get("data", []))
+            # The "next" cursor URL already carries the query string
+            url = body.get("paging", {}).get("next")
+            params = None
+        return definitions
+
+    def _read_offline(self) -> List[Dict]:
+        if not self.offline_file or not os.path.exists(self.offline_file):
+            return []
+        with open(self.offline_file, encoding="utf-8") as f:
+            body = json.load(f)
+        return body.get("data", body) if isinstance(body, dict) else body
+
+    async def refresh(self) -> None:
+        """Reload template definitions from the Graph API or the offline file."""
+        async with self._lock:
+            try:
+                if self.offline:
+                    definitions = self._read_offline()
+                else:
+                    definitions = await self._fetch_remote()
+            except Exception as e:
+                # Keep serving the previous catalog; retry on the next lookup after the TTL
+                self.refresh_errors += 1
+                self._loaded_at = time.monotonic()
+                logger.error(f"Template catalog refresh failed: {str(e)}")
+                return
+            self.load_definitions(definitions)
+            self.refreshes += 1
+
+    def _stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    async def get(self, template_name: str, lang_code: str) -> TemplateSkeleton:
+        """
+        Return the compiled skeleton for a template.
+
+        The first call loads the catalog; afterwards a stale catalog is
+        refreshed in the background while the cached entry is served.
+
+        Raises:
+            TemplateNotFound: If the template/language is unknown or not approved.
+        """
+        if self._loaded_at is None:
+            await self.refresh()
+        elif self._stale() and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+        skeleton = self._skeletons.get((template_name, lang_code))
+        if skeleton is None:
+            raise TemplateNotFound(f"{template_name} ({lang_code})")
+        return skeleton
+
+    def list(self) -> List[Dict]:
+        return [s.describe() for s in self._skeletons.values()]
+
+    def stats(self) -> Dict:
+        return {
+            "templates": len(self._skeletons),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "age_seconds": None if self._loaded_at is None else round(time.monotonic() - self._loaded_at, 1),
+        }
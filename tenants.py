@@ -0,0 +1,390 @@
+"""Tenant registry: several WhatsApp business numbers served by one deployment.
+
+Each tenant is a business phone number with its own access token, flows,
+flow endpoint private key, pooled Graph API client and send rate limiter.
+Tenants are read from a JSON file (see ``tenants.example.json``)::
+
+    {
+      "default": "azam",
+      "tenants": [
+        {
+          "tenant_id": "azam",
+          "phone_number_id": "1234567890",
+          "access_token_env": "AZAM_ACCESS_TOKEN",
+          "flows": {"english": {"flow_id": "...", "flow_name": "azam_v2"}},
+          "private_key_path": "keys/azam.pem",
+          "rate_limit_per_second": 80
+        }
+      ]
+    }
+
+Secrets may be given inline (``access_token``) or by environment variable
+name (``access_token_env``). Without a tenants file the single tenant from
+``config.py`` (``ACCESS_TOKEN``/``PHONE_NUMBER_ID``/``flow_config``) is used.
+
+The registry holds one immutable snapshot of all tenants. A reload builds a
+complete new snapshot off to the side and publishes it with a single
+reference assignment, so request handlers read tenants without any lock and
+never see a half-applied file. Tenants whose settings did not change keep
+their runtime (connection pool, rate limiter, breakers, cached key); clients
+of removed or changed tenants are closed after a grace period so in-flight
+sends can finish.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional
+
+from utils.rate_limit import TokenBucket
+from utils.resilience import ResilientClient, RetryPolicy
+from utils.security import forget_private_key, load_private_key
+
+if TYPE_CHECKING:
+    from template_catalog import TemplateCatalog
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BASE_URL = "https://graph.facebook.com"
+
+
+class TenantConfigError(ValueError):
+    """Raised when the tenants file is invalid; the previous snapshot stays active."""
+
+
+class UnknownTenant(KeyError):
+    """Raised when a tenant id or phone number id is not configured."""
+
+
+@dataclass(frozen=True)
+class TenantConfig:
+    """Static settings of one business phone number."""
+
+    tenant_id: str
+    phone_number_id: str
+    access_token: str
+    api_version: str
+    flows: Mapping[str, Mapping[str, str]] = field(default_factory=dict)
+    business_account_id: Optional[str] = None
+    private_key_path: Optional[str] = None
+    private_key_password: Optional[str] = None
+    template_catalog_file: Optional[str] = None
+    rate_limit_per_second: float = 80.0
+    rate_limit_burst: Optional[float] = None
+    max_connections: int = 20
+
+    @property
+    def api_url(self) -> str:
+        return f"{GRAPH_BASE_URL}/{self.api_version}/{self.phone_number_id}"
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json"}
+
+    @classmethod
+    def from_dict(cls, raw: Dict, defaults: Dict, base_dir: str) -> "TenantConfig":
+        """
+        Build a tenant from one entry of the tenants file.
+
+        Args:
+            raw (Dict): The tenant entry.
+            defaults (Dict): Values used when the entry omits them (e.g. ``api_version``).
+            base_dir (str): Directory relative paths are resolved against.
+
+        Raises:
+            TenantConfigError: If a required setting is missing.
+        """
+        values = {**defaults, **raw}
+        tenant_id = values.get("tenant_id")
+        if not tenant_id:
+            raise TenantConfigError("tenant entry without tenant_id")
+        if values.pop("flow_token", None) is not None:
+            # Every journey now gets its own token when its flow is sent
+            logger.warning(f"tenant {tenant_id}: ignoring obsolete flow_token setting")
+        for secret in ("access_token", "private_key_password"):
+            env_name = values.pop(f"{secret}_env", None)
+            if env_name and not values.get(secret):
+                values[secret] = os.getenv(env_name)
+        missing = [key for key in ("phone_number_id", "access_token", "api_version") if not values.get(key)]
+        if missing:
+            raise TenantConfigError(f"tenant {tenant_id}: missing {', '.join(missing)}")
+        for path_key in ("private_key_path", "template_catalog_file"):
+            if values.get(path_key) and not os.path.isabs(values[path_key]):
+                values[path_key] = os.path.join(base_dir, values[path_key])
+        unknown = set(values) - set(cls.__dataclass_fields__)
+        if unknown:
+            raise TenantConfigError(f"tenant {tenant_id}: unknown settings {', '.join(sorted(unknown))}")
+        values["phone_number_id"] = str(values["phone_number_id"])
+        values["flows"] = MappingProxyType(
+            {language: MappingProxyType(dict(flow)) for language, flow in values.get("flows", {}).items()}
+        )
+        return cls(**values)
+
+
+class Tenant:
+    """Runtime state of one tenant: pooled client, rate limiter, key and template catalog."""
+
+    def __init__(self, config: TenantConfig, graph_max_attempts: int = 4,
+                 breaker_failure_threshold: int = 5, breaker_reset_timeout: float = 30.0,
+                 template_catalog_ttl: float = 600.0):
+        self.config = config
+        self.client = ResilientClient(
+            policy=RetryPolicy(max_attempts=graph_max_attempts),
+            failure_threshold=breaker_failure_threshold,
+            reset_timeout=breaker_reset_timeout,
+            max_connections=config.max_connections,
+        )
+        self.limiter = TokenBucket(config.rate_limit_per_second, config.rate_limit_burst)
+        self._template_catalog_ttl = template_catalog_ttl
+        self._template_catalog: Optional["TemplateCatalog"] = None
+
+    @property
+    def tenant_id(self) -> str:
+        return self.config.tenant_id
+
+    @property
+    def private_key(self):
+        """Flow endpoint private key, parsed on first use and cached."""
+        return load_private_key(self.config.private_key_path, self.config.private_key_password)
+
+    @property
+    def template_catalog(self) -> "TemplateCatalog":
+        if self._template_catalog is None:
+            from template_catalog import TemplateCatalog
+
+            config = self.config
+            self._template_catalog = TemplateCatalog(
+                client=self.client,
+                graph_url=(
+                    f"{GRAPH_BASE_URL}/{config.api_version}/{config.business_account_id}"
+                    if config.business_account_id else None
+                ),
+                headers=config.headers,
+                offline_file=config.template_catalog_file,
+                ttl=self._template_catalog_ttl,
+            )
+        return self._template_catalog
+
+    def warm_up(self) -> None:
+        """Parse the private key and create the connection pool ahead of the first request."""
+        self.private_key
+        self.client.client
+
+    def stats(self) -> Dict:
+        stats = {
+            "phone_number_id": self.config.phone_number_id,
+            "graph_api": self.client.stats(),
+            "rate_limit": self.limiter.stats(),
+        }
+        if self._template_catalog is not None:
+            stats["template_catalog"] = self._template_catalog.stats()
+        return stats
+
+
+@dataclass(frozen=True)
+class TenantSnapshot:
+    """One immutable, fully validated generation of the tenant configuration."""
+
+    by_id: Mapping[str, Tenant]
+    by_phone_number_id: Mapping[str, Tenant]
+    default_id: str
+    version: int
+    loaded_at: float
+    source_mtime: Optional[float] = None
+
+
+class TenantRegistry:
+    """
+    Args:
+        path (Optional[str]): Tenants JSON file; if it does not exist ``fallback`` is the only tenant.
+        fallback (TenantConfig): Tenant built from the single-number settings in config.py.
+        reload_interval (float): Seconds between checks of the file's modification time.
+        close_grace (float): Seconds before the client of a removed tenant is closed.
+        **runtime_options: Passed to every ``Tenant`` (retry and breaker settings).
+    """
+
+    def __init__(self, path: Optional[str], fallback: TenantConfig, reload_interval: float = 5.0,
+                 close_grace: float = 60.0, **runtime_options):
+        self.path = path
+        self.fallback = fallback
+        self.reload_interval = reload_interval
+        self.close_grace = close_grace
+        self.runtime_options = runtime_options
+        self._watcher: Optional[asyncio.Task] = None
+        self._closing: List[asyncio.Task] = []
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error: Optional[str] = None
+        self._snapshot = self._build(self._read(), version=1, previous=None)
+
+    # ------------------------------------------------------------ reading
+
+    @property
+    def snapshot(self) -> TenantSnapshot:
+        return self._snapshot
+
+    def get(self, tenant_id: Optional[str] = None) -> Tenant:
+        """
+        Return a tenant by id, or the default tenant when ``tenant_id`` is None.
+
+        Raises:
+            UnknownTenant: If the id is not configured.
+        """
+        snapshot = self._snapshot
+        tenant = snapshot.by_id.get(tenant_id or snapshot.default_id)
+        if tenant is None:
+            raise UnknownTenant(tenant_id)
+        return tenant
+
+    def default(self) -> Tenant:
+        return self.get(None)
+
+    def for_phone_number_id(self, phone_number_id: Optional[str]) -> Tenant:
+        """Return the tenant a webhook event belongs to (``metadata.phone_number_id``), else the default."""
+        snapshot = self._snapshot
+        return snapshot.by_phone_number_id.get(str(phone_number_id)) or snapshot.by_id[snapshot.default_id]
+
+    def __iter__(self):
+        return iter(self._snapshot.by_id.values())
+
+    # ------------------------------------------------------------ loading
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime if self.path else None
+        except OSError:
+            return None
+
+    def _read(self) -> Optional[Dict]:
+        if self._mtime() is None:
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            raise TenantConfigError(f"cannot read {self.path}: {str(e)}") from e
+
+    def _build(self, raw: Optional[Dict], version: int, previous: Optional[TenantSnapshot]) -> TenantSnapshot:
+        mtime = self._mtime()
+        if raw is None:
+            configs = [self.fallback]
+            default_id = self.fallback.tenant_id
+        else:
+            defaults = {"api_version": self.fallback.api_version, **raw.get("defaults", {})}
+            base_dir = os.path.dirname(os.path.abspath(self.path))
+            configs = [TenantConfig.from_dict(entry, defaults, base_dir) for entry in raw.get("tenants", [])]
+            if not configs:
+                raise TenantConfigError(f"{self.path} defines no tenants")
+            default_id = raw.get("default", configs[0].tenant_id)
+
+        by_id: Dict[str, Tenant] = {}
+        by_phone: Dict[str, Tenant] = {}
+        for config in configs:
+            if config.tenant_id in by_id:
+                raise TenantConfigError(f"duplicate tenant_id {config.tenant_id}")
+            if config.phone_number_id in by_phone:
+                raise TenantConfigError(f"phone_number_id {config.phone_number_id} used by several tenants")
+            existing = previous.by_id.get(config.tenant_id) if previous else None
+            # Unchanged tenants keep their pool, limiter and breakers across reloads
+            tenant = existing if existing is not None and existing.config == config else Tenant(
+                config, **self.runtime_options
+            )
+            by_id[config.tenant_id] = by_phone[config.phone_number_id] = tenant
+        if default_id not in by_id:
+            raise TenantConfigError(f"default tenant {default_id} is not defined")
+        return TenantSnapshot(
+            by_id=MappingProxyType(by_id),
+            by_phone_number_id=MappingProxyType(by_phone),
+            default_id=default_id,
+            version=version,
+            loaded_at=time.time(),
+            source_mtime=mtime,
+        )
+
+    def reload(self) -> bool:
+        """
+        Re-read the tenants file and publish it if it is valid.
+
+        Returns:
+            bool: True if a new snapshot was published, False if the file was
+            invalid (the error is kept in ``last_error``).
+        """
+        previous = self._snapshot
+        try:
+            snapshot = self._build(self._read(), version=previous.version + 1, previous=previous)
+        except TenantConfigError as e:
+            self.reload_errors += 1
+            self.last_error = str(e)
+            logger.error(f"Tenant reload failed, keeping version {previous.version}: {str(e)}")
+            return False
+        # Publishing is a single reference assignment: readers see the old or the new snapshot
+        self._snapshot = snapshot
+        self.reloads += 1
+        self.last_error = None
+        retired = [t for t in previous.by_id.values() if snapshot.by_id.get(t.tenant_id) is not t]
+        for tenant in retired:
+            # A rotated key file is re-read by the replacing tenant
+            if tenant.config.private_key_path:
+                forget_private_key(tenant.config.private_key_path)
+        if retired:
+            self._retire(retired)
+        logger.info(f"Loaded tenant configuration version {snapshot.version}: {', '.join(snapshot.by_id)}")
+        return True
+
+    def _retire(self, tenants: List[Tenant]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        async def close_later():
+            await asyncio.sleep(self.close_grace)
+            for tenant in tenants:
+                await tenant.client.aclose()
+
+        task = loop.create_task(close_later())
+        self._closing.append(task)
+        task.add_done_callback(self._closing.remove)
+
+    def warm_up(self) -> None:
+        for tenant in self:
+            tenant.warm_up()
+
+    # ------------------------------------------------------------ watching
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if self._mtime() != self._snapshot.source_mtime:
+                self.reload()
+
+    def start_watching(self) -> None:
+        """Start polling the tenants file for changes (needs a running event loop)."""
+        if self.path and (self._watcher is None or self._watcher.done()):
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def aclose(self) -> None:
+        """Stop watching and close every tenant's HTTP client."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        for task in list(self._closing):
+            task.cancel()
+        for tenant in self:
+            await tenant.client.aclose()
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "default": snapshot.default_id,
+            "loaded_at": snapshot.loaded_at,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "tenants": {tenant_id: tenant.stats() for tenant_id, tenant in snapshot.by_id.items()},
+        }
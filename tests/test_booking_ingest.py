@@ -0,0 +1,77 @@
+import asyncio
+import sqlite3
+
+from booking_ingest import BookingIngestor
+from models import BookingData
+
+PAYLOAD = {
+    "jina_la_kwanza": "Asha", "jina_la_kati": "Juma", "jina_la_mwisho": "Said", "jinsia": "F",
+    "uraia": "TZ", "namba_ya_simu": "+255712345678", "barua_pepe": "asha@example.com",
+    "aina_ya_usafiri": "ONE_WAY", "uelekeo": "DAR_ZNZ", "idadi_ya_wasafiri": "2",
+    "tarehe_ya_kusafiri": "2025-07-01", "boti_ya_kusafiria": "KILIMANJARO_VI",
+    "daraja_la_kusafiria": "ECO", "wasafiri_wengine": "Juma Said", "aina_ya_malipo": "SIMU",
+    "namba_ya_malipo": "0712345678", "flow_token": "token-1",
+}
+
+
+def test_submitted_bookings_are_stored_in_batches(tmp_path):
+    booking = BookingData.model_validate(PAYLOAD)
+
+    async def run():
+        ingestor = BookingIngestor(str(tmp_path / "bookings.db"))
+        for i in range(1000):
+            assert ingestor.submit(f"BK{i}", booking, "token-1")
+        # A retried submission is stored once
+        ingestor.submit("BK1", booking, "token-1")
+        await ingestor.flush()
+        stored = ingestor.get("BK1")
+        count = ingestor._connect().execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+        await ingestor.close()
+        return stored, count, ingestor.stats()
+
+    stored, count, stats = asyncio.run(run())
+    assert count == 1000
+    assert stored["flow_token"] == "token-1"
+    assert stored["direction"] == booking.direction
+    assert stats["written"] == 1001 and stats["queued"] == 0
+    assert stats["batches"] < 1001
+
+
+def test_full_queue_rejects_without_blocking(tmp_path):
+    booking = BookingData.model_validate(PAYLOAD)
+
+    async def run():
+        ingestor = BookingIngestor(str(tmp_path / "bookings.db"), max_queue=2)
+        accepted = [ingestor.submit(f"BK{i}", booking) for i in range(3)]
+        await ingestor.flush()
+        await ingestor.close()
+        return accepted, ingestor.stats()
+
+    accepted, stats = asyncio.run(run())
+    assert accepted == [True, True, False]
+    assert stats["rejected"] == 1 and stats["written"] == 2
+
+
+def test_failed_batches_are_retried_until_stored(tmp_path):
+    booking = BookingData.model_validate(PAYLOAD)
+    failures = [sqlite3.OperationalError("database is locked")] * 2
+
+    async def run():
+        ingestor = BookingIngestor(str(tmp_path / "bookings.db"), retry_delay=0.001)
+        write_batch = ingestor._write_batch
+
+        def flaky(batch):
+            if failures:
+                raise failures.pop()
+            write_batch(batch)
+
+        ingestor._write_batch = flaky
+        ingestor.submit("BK1", booking)
+        await ingestor.flush()
+        stored = ingestor.get("BK1")
+        await ingestor.close()
+        return stored, ingestor.stats()
+
+    stored, stats = asyncio.run(run())
+    assert stored is not None
+    assert stats["failed"] == 2 and stats["written"] == 1
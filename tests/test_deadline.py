@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from utils.deadline import (
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    AdmissionController,
+    Deadline,
+    DeadlineExceeded,
+    LoadShed,
+    check_deadline,
+    current_deadline,
+    deadline_scope,
+)
+
+
+def test_deadline_only_binds_the_task_that_opened_the_scope():
+    async def run():
+        seen = {}
+
+        async def background():
+            await asyncio.sleep(0.02)  # outlives the request's budget
+            seen["background"] = current_deadline()
+            check_deadline("background")
+            seen["thread"] = await asyncio.to_thread(current_deadline)
+
+        async with deadline_scope(Deadline.from_now(0.01)) as deadline:
+            task = asyncio.get_running_loop().create_task(background())
+            seen["request"] = current_deadline() is deadline
+        await task
+        await asyncio.sleep(0.02)
+        async with deadline_scope(Deadline.from_now(0)):
+            with pytest.raises(DeadlineExceeded):
+                check_deadline("handler")
+        seen["after"] = current_deadline()
+        return seen
+
+    assert asyncio.run(run()) == {"request": True, "background": None, "thread": None, "after": None}
+
+
+def test_free_slot_is_granted_at_once_and_learns_service_time():
+    async def run():
+        admission = AdmissionController(max_concurrent=2, reserved_high=1)
+        async with admission.admit(Deadline.from_now(1.0)):
+            await asyncio.sleep(0.05)
+        return admission.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["admitted"], stats["in_flight"], stats["shed_total"]) == (1, 0, 0)
+    # EWMA moved from its 10 ms prior towards the 50 ms observed
+    assert 10 < stats["service_time_ewma_ms"] < 50
+
+
+def test_reserved_slots_and_priority_order():
+    async def run():
+        admission = AdmissionController(max_concurrent=2, reserved_high=1)
+        order = []
+        release = asyncio.Event()
+
+        async def request(name, priority):
+            async with admission.admit(Deadline.from_now(5.0), priority):
+                order.append(name)
+                await release.wait()
+
+        # Normal traffic may only use the unreserved slot
+        first = asyncio.ensure_future(request("normal-1", PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(request("normal-2", PRIORITY_NORMAL))
+        await asyncio.sleep(0)
+        ping = asyncio.ensure_future(request("ping", PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        queued = admission.stats()["queued"]
+        release.set()
+        await asyncio.gather(first, second, ping)
+        return order, queued
+
+    order, queued = asyncio.run(run())
+    assert order == ["normal-1", "ping", "normal-2"]
+    assert queued == 1
+
+
+def test_requests_that_cannot_finish_in_time_are_shed():
+    async def run():
+        admission = AdmissionController(max_concurrent=1, reserved_high=0)
+        admission._service_ewma = 0.5
+        busy = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.admit(Deadline.from_now(5.0)):
+                busy.set()
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await busy.wait()
+        reasons = []
+        for budget in (0, 0.2):
+            try:
+                async with admission.admit(Deadline.from_now(budget)):
+                    pass
+            except LoadShed as e:
+                reasons.append(e.reason)
+        # Predicted in time, but the slot is not freed before the deadline
+        admission._service_ewma = 0.01
+        try:
+            async with admission.admit(Deadline.from_now(0.05)):
+                pass
+        except LoadShed as e:
+            reasons.append(e.reason)
+        # Shed before decrypting, whatever its priority turns out to be
+        admission._service_ewma = 0.5
+        try:
+            admission.shed_early(Deadline.from_now(0.2))
+        except LoadShed as e:
+            reasons.append(e.reason)
+        release.set()
+        await holder
+        admission.shed_early(Deadline.from_now(0.2))  # idle: nothing to wait for
+        return reasons, admission.stats()
+
+    reasons, stats = asyncio.run(run())
+    assert reasons == ["expired_on_arrival", "predicted_late", "expired_in_queue", "predicted_late"]
+    assert stats["shed"] == {"expired_on_arrival": 1, "predicted_late": 2, "expired_in_queue": 1}
+    assert stats["in_flight"] == 0
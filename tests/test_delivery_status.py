@@ -0,0 +1,90 @@
+import asyncio
+
+from delivery_status import DeliveryTracker, extract_statuses
+
+
+def _status(wamid, status, timestamp, **extra):
+    return {"id": wamid, "status": status, "timestamp": timestamp, "recipient_id": "255712345678", **extra}
+
+
+def test_out_of_order_and_duplicate_events_count_once(tmp_path):
+    db_path = str(tmp_path / "delivery.db")
+
+    async def run():
+        tracker = DeliveryTracker(db_path)
+        tracker.ingest([_status("wamid.1", "sent", 100, _broadcast_id="b1", _template="ferry_reminder")])
+        tracker.ingest([_status("wamid.1", "read", 130), _status("wamid.1", "delivered", 110)])
+        tracker.ingest([_status("wamid.1", "delivered", 111), _status("wamid.2", "failed", 120,
+                                                                        errors=[{"code": 131026}])])
+        await tracker.flush()
+        summary = tracker.summary(broadcast_id="b1")
+        message = tracker.message_status("wamid.1")
+        await tracker.close()
+        return summary, message, tracker.stats()
+
+    summary, message, stats = asyncio.run(run())
+    assert summary["counts"] == {"sent": 1, "delivered": 1, "read": 1, "failed": 0}
+    assert summary["delivery_rate"] == 1.0
+    assert message["status"] == "read"
+    assert (message["sent_at"], message["delivered_at"], message["read_at"]) == (100, 110, 130)
+    assert stats["tracked_messages"] == 2
+    assert stats["queued_batches"] == 0
+
+
+def test_state_is_restored_from_sqlite(tmp_path):
+    db_path = str(tmp_path / "delivery.db")
+
+    async def run():
+        first = DeliveryTracker(db_path)
+        first.ingest([_status("wamid.1", "sent", 100, _template="ferry_reminder"),
+                      _status("wamid.1", "delivered", 104)])
+        await first.flush()
+        await first.close()
+
+        second = DeliveryTracker(db_path)
+        # The duplicate is recognised once the consumer has restored the earlier state
+        second.ingest([_status("wamid.1", "delivered", 105), _status("wamid.1", "read", 110)])
+        await second.flush()
+        await second.close()
+        return second.summary(template="ferry_reminder")
+
+    summary = asyncio.run(run())
+    assert summary["counts"] == {"sent": 1, "delivered": 1, "read": 1, "failed": 0}
+    assert summary["delivery_latency"]["count"] == 1
+
+
+def test_extract_statuses_reads_every_change():
+    body = {"entry": [
+        {"changes": [{"value": {"statuses": [{"id": "wamid.1"}]}}, {"value": {"messages": []}}]},
+        {"changes": [{"value": {"statuses": [{"id": "wamid.2"}, {"id": "wamid.3"}]}}]},
+    ]}
+    assert [status["id"] for status in extract_statuses(body)] == ["wamid.1", "wamid.2", "wamid.3"]
+    assert extract_statuses({}) == []
+
+
+def test_lookups_from_threads_while_the_consumer_writes(tmp_path):
+    async def run():
+        tracker = DeliveryTracker(str(tmp_path / "delivery.db"), batch_size=50)
+
+        async def lookups():
+            found = 0
+            for i in range(200):
+                if await asyncio.to_thread(tracker.message_status, f"wamid.{i % 50}") is not None:
+                    found += 1
+                await asyncio.sleep(0)
+            return found
+
+        reader = asyncio.ensure_future(lookups())
+        for i in range(200):
+            tracker.ingest([_status(f"wamid.{i % 50}", "sent", 100), _status(f"wamid.{i % 50}", "delivered", 101)])
+            await asyncio.sleep(0)
+        await tracker.flush()
+        found = await reader
+        last = tracker.message_status("wamid.49")
+        await tracker.close()
+        return found, last, tracker.stats()
+
+    found, last, stats = asyncio.run(run())
+    assert found > 0
+    assert last["status"] == "delivered"
+    assert stats["tracked_messages"] == 50
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+
+from event_log import _HEADER, EventLog, LogConsumer
+
+
+def test_append_read_and_roll_segments(tmp_path):
+    async def run():
+        log = EventLog(str(tmp_path), segment_bytes=200)
+        offsets = [log.append(f"event {i}".encode() * 4) for i in range(10)]
+        await log.sync()
+        records = log.read(0, max_records=100)
+        middle = log.read(offsets[5], max_records=2)
+        stats = log.stats()
+        await log.close()
+        return offsets, records, middle, stats
+
+    offsets, records, middle, stats = asyncio.run(run())
+    assert [record.offset for record in records] == offsets
+    assert records[3].payload == b"event 3" * 4
+    assert all(record.next_offset == following.offset for record, following in zip(records, records[1:]))
+    assert [record.payload for record in middle] == [b"event 5" * 4, b"event 6" * 4]
+    assert stats["segments"] > 1
+    assert stats["synced_to"] == stats["end_offset"]
+
+
+def test_torn_tail_is_truncated_on_reopen(tmp_path):
+    async def run():
+        log = EventLog(str(tmp_path))
+        log.append(b'{"entry": []}')
+        end = log.end_offset
+        await log.close()
+        [segment] = [name for name in os.listdir(tmp_path) if name.endswith(".seg")]
+        with open(tmp_path / segment, "ab") as f:
+            f.write(_HEADER.pack(100, 0, 0.0) + b"{")
+
+        reopened = EventLog(str(tmp_path))
+        reopened_end = reopened.end_offset
+        offset = reopened.append(b'{"entry": [1]}')
+        payloads = [record.payload for record in reopened.read(0)]
+        await reopened.close()
+        return end, reopened_end, offset, payloads
+
+    end, reopened_end, offset, payloads = asyncio.run(run())
+    assert reopened_end == end == offset
+    assert payloads == [b'{"entry": []}', b'{"entry": [1]}']
+
+
+def test_consumer_commits_and_replays(tmp_path):
+    async def run():
+        log = EventLog(str(tmp_path))
+        seen = []
+
+        async def handler(record):
+            seen.append(record.payload)
+
+        for i in range(5):
+            log.append(b"event %d" % i)
+        consumer = LogConsumer(log, "webhooks", handler, batch_size=2)
+        while await consumer.run_once():
+            pass
+        committed = log.committed("webhooks")
+        # A restarted consumer continues from the committed offset
+        assert await LogConsumer(log, "webhooks", handler).run_once() == 0
+
+        records = log.read(0)
+        # An offset inside a record moves to the next record
+        replay = await consumer.replay_from(records[2].offset + 1)
+        seen.clear()
+        await consumer.run_once()
+        since = log.offset_for_time(time.time() + 60)
+        await log.close()
+        return seen, committed, replay, records, since
+
+    seen, committed, replay, records, since = asyncio.run(run())
+    assert committed == records[-1].next_offset
+    assert replay["to"] == records[3].offset
+    assert seen == [b"event 3", b"event 4"]
+    assert since == committed
+
+
+def test_failing_record_is_retried_then_dead_lettered(tmp_path):
+    async def run():
+        log = EventLog(str(tmp_path / "log"))
+        dead_letter = EventLog(str(tmp_path / "log" / "dead_letter"))
+        attempts = {}
+
+        async def handler(record):
+            attempts[record.payload] = attempts.get(record.payload, 0) + 1
+            if record.payload == b"bad" or attempts[record.payload] == 1:
+                raise ValueError(record.payload)
+
+        for payload in (b"flaky", b"bad", b"good"):
+            log.append(payload)
+        consumer = LogConsumer(log, "webhooks", handler, dead_letter=dead_letter, max_attempts=3,
+                               retry_delay=0.001)
+        processed = await consumer.run_once()
+        parked = [record.payload for record in dead_letter.read(0)]
+        stats = consumer.stats()
+        await dead_letter.close()
+        await log.close()
+        return processed, attempts, parked, stats
+
+    processed, attempts, parked, stats = asyncio.run(run())
+    assert processed == 3
+    assert attempts == {b"flaky": 2, b"bad": 3, b"good": 2}
+    assert parked == [b"bad"]
+    assert (stats["retries"], stats["failed"], stats["pending_bytes"]) == (4, 1, 0)
+
+
+def test_close_stops_retrying_and_keeps_progress(tmp_path):
+    async def run():
+        log = EventLog(str(tmp_path))
+
+        async def handler(record):
+            if record.payload == b"bad":
+                raise ValueError("no dead letter: retried until it succeeds")
+
+        first = log.append(b"good")
+        second = log.append(b"bad")
+        consumer = LogConsumer(log, "webhooks", handler, retry_delay=60)
+        consumer.start()
+        await asyncio.sleep(0.1)
+        closed = await asyncio.wait_for(consumer.close(), 5)
+        committed = log.committed("webhooks")
+        await log.close()
+        return first, second, closed, committed
+
+    first, second, closed, committed = asyncio.run(run())
+    # The good record is committed while the bad one waits for its retry
+    assert committed == second != first
+    assert closed["pending_bytes"] > 0
@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+
+from flow_compiler import FlowCompileError, compile_definition, load_flows
+
+FLOW_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "floww.json")
+
+
+def _dropdowns(node, found):
+    """Every component with a data-source list in the raw JSON, by field name."""
+    if isinstance(node, dict):
+        if node.get("name") and isinstance(node.get("data-source"), list):
+            found[node["name"]] = {option["id"]: option["title"] for option in node["data-source"]}
+        for value in node.values():
+            _dropdowns(value, found)
+    elif isinstance(node, list):
+        for value in node:
+            _dropdowns(value, found)
+    return found
+
+
+def _definition(**overrides):
+    """A minimal valid two-screen flow."""
+    definition = {
+        "routing_model": {"FIRST": ["LAST"], "LAST": []},
+        "screens": [
+            {"id": "FIRST", "layout": {"type": "SingleColumnLayout", "children": [
+                {"type": "Dropdown", "name": "route", "data-source": [{"id": "DAR_ZNZ", "title": "Dar - Zanzibar"}]},
+                {"type": "Footer", "on-click-action": {"name": "navigate", "next": {"type": "screen", "name": "LAST"},
+                                                       "payload": {}}},
+            ]}},
+            {"id": "LAST", "terminal": True, "layout": {"type": "SingleColumnLayout", "children": [
+                {"type": "Footer", "on-click-action": {"name": "complete",
+                                                       "payload": {"route": "${screen.FIRST.route}"}}},
+            ]}},
+        ],
+    }
+    definition.update(overrides)
+    return definition
+
+
+def test_compiled_tables_match_floww_json(tmp_path):
+    with open(FLOW_JSON, encoding="utf-8") as f:
+        definition = json.load(f)
+    flow = load_flows([FLOW_JSON], str(tmp_path / "flow_tables.marshal"))["floww"]
+
+    assert list(flow.screens) == [screen["id"] for screen in definition["screens"]]
+    assert {screen: list(targets) for screen, targets in flow.routing.items()} == definition["routing_model"]
+    assert flow.terminal_screens == {screen["id"] for screen in definition["screens"] if screen.get("terminal")}
+    dropdowns = _dropdowns(definition["screens"], {})
+    assert dropdowns
+    assert {field: dict(choices) for field, choices in flow.options.items()} == dropdowns
+    for field, choices in dropdowns.items():
+        option_id, title = next(iter(choices.items()))
+        assert flow.title(field, option_id) == title
+        assert flow.data_source(field) == [{"id": i, "title": t} for i, t in choices.items()]
+    first, second = definition["screens"][0]["id"], definition["screens"][1]["id"]
+    assert flow.previous_screen(second) == first
+
+
+def test_artifact_is_reused_until_the_source_changes(tmp_path):
+    source = tmp_path / "booking.json"
+    artifact = tmp_path / "flow_tables.marshal"
+    source.write_text(json.dumps(_definition()))
+    assert load_flows([str(source)], str(artifact))["booking"].title("route", "DAR_ZNZ") == "Dar - Zanzibar"
+    written = artifact.stat().st_mtime_ns
+
+    load_flows([str(source)], str(artifact))
+    assert artifact.stat().st_mtime_ns == written
+
+    changed = _definition()
+    changed["screens"][0]["layout"]["children"][0]["data-source"][0]["title"] = "Dar es Salaam - Zanzibar"
+    source.write_text(json.dumps(changed))
+    assert load_flows([str(source)], str(artifact))["booking"].title("route", "DAR_ZNZ") == "Dar es Salaam - Zanzibar"
+
+
+def _break(mutate):
+    definition = _definition()
+    mutate(definition)
+    return definition
+
+
+@pytest.mark.parametrize("definition, problem", [
+    (_definition(routing_model={"FIRST": ["MISSING"], "LAST": []}), "routing_model FIRST -> unknown screen MISSING"),
+    (_definition(routing_model={"FIRST": [], "LAST": []}), "FIRST navigates to LAST, which is not in its routing_model"),
+    (_break(lambda d: d["screens"][1].pop("terminal")), "LAST completes the flow but is not marked terminal"),
+    (_break(lambda d: d["screens"][1]["layout"]["children"][0]["on-click-action"]["payload"].update(
+        seat="${screen.FIRST.seat}")), "LAST references FIRST.seat, which that screen does not define"),
+    (_definition(routing_model={"FIRST": ["LAST"], "LAST": ["FIRST"]}), "terminal screen LAST has outgoing routes"),
+    (_break(lambda d: d["screens"][1]["layout"]["children"].append(
+        {"type": "Dropdown", "name": "route", "data-source": [{"id": "DAR_ZNZ", "title": "Other"}]})),
+     "route: conflicting titles for option DAR_ZNZ"),
+])
+def test_inconsistent_definitions_are_rejected(definition, problem):
+    with pytest.raises(FlowCompileError) as error:
+        compile_definition("booking", definition)
+    assert problem in error.value.problems
+
+
+def test_valid_definition_compiles():
+    tables = compile_definition("booking", _definition())
+    assert tables["completion_fields"] == ["route"]
+    assert tables["field_screens"]["route"] == "FIRST"
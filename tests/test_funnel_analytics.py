@@ -0,0 +1,66 @@
+import time
+
+from funnel_analytics import START, FunnelAnalytics, MinuteRing
+
+PATH = [(START, "PERSONAL_INFO"), ("PERSONAL_INFO", "AVAILABILITY"), ("AVAILABILITY", "SEATS"),
+        ("SEATS", "DETAILS"), ("DETAILS", "PAYMENT"), ("PAYMENT", "SUCCESS")]
+NOW = 1_752_660_000.0
+
+
+def _journey(funnel, token, steps, route="DAR_ZNZ", now=NOW):
+    session = {"user_data": {"travel_details": {"going_route": route}}}
+    for from_screen, to_screen in PATH[:steps]:
+        request = {"action": "INIT", "flow_token": token} if from_screen == START else \
+            {"action": "data_exchange", "flow_token": token, "screen": from_screen}
+        funnel.observe(session, request, {"screen": to_screen}, now)
+    return session
+
+
+def test_funnel_counts_conversion_and_validation_failures():
+    funnel = FunnelAnalytics()
+    funnel.journey_started("t1", "swahili")
+    _journey(funnel, "t1", 6)
+    _journey(funnel, "t2", 3)
+    session = _journey(funnel, "t3", 3, route="ZNZ_PEM")
+    for passengers in (3, 4):
+        failed = {"screen": "SEATS", "data": {"validation": "failed", "errors": [
+            f"Total adult and child passengers ({passengers}) must match going passengers (2)"]}}
+        funnel.observe(session, {"action": "data_exchange", "screen": "SEATS"}, failed, NOW)
+
+    report = funnel.funnel(minutes=60, end=NOW + 60)
+    entered = {step["screen"]: step["entered"] for step in report["steps"]}
+    assert entered == {"PERSONAL_INFO": 3, "AVAILABILITY": 3, "SEATS": 3, "DETAILS": 1, "PAYMENT": 1, "SUCCESS": 1}
+    assert report["steps"][3]["conversion_from_previous"] == round(1 / 3, 4)
+    assert report["top_validation_failures"] == [{
+        "screen": "SEATS", "count": 2,
+        "reason": "Total adult and child passengers (#) must match going passengers (#)",
+    }]
+    assert funnel.funnel(minutes=60, end=NOW + 60, route="ZNZ_PEM")["steps"][0]["entered"] == 1
+    assert funnel.funnel(minutes=60, end=NOW + 60, language="swahili")["completed"] == 1
+
+
+def test_expired_unfinished_journeys_are_abandoned():
+    funnel = FunnelAnalytics()
+    unfinished = _journey(funnel, "t1", 3, now=time.time())
+    finished = _journey(funnel, "t2", 6, now=time.time())
+    funnel.on_session_expired("t1", unfinished)
+    funnel.on_session_expired("t2", finished)
+    report = funnel.funnel(minutes=5)
+    assert report["abandoned"] == 1
+    assert report["steps"][2]["abandoned"] == 1
+
+
+def test_minute_ring_forgets_old_minutes():
+    ring = MinuteRing(minutes=10, max_keys=2)
+    ring.add(("a",), 100)
+    ring.add(("a",), 105, 2)
+    ring.add(("b",), 105)
+    ring.add(("c",), 105)
+    assert ring.totals(100, 109) == {("a",): 3, ("b",): 1}
+    assert ring.dropped == 1
+    # Minute 110 reuses the slot of minute 100
+    ring.add(("a",), 110)
+    assert ring.totals(100, 110) == {("a",): 3, ("b",): 1}
+    assert ring.totals(100, 100) == {}
+    ring.add(("a",), 100)
+    assert ring.totals(100, 110) == {("a",): 3, ("b",): 1}
@@ -0,0 +1,70 @@
+import asyncio
+
+from language_preferences import REPLY_ID_LANGUAGES, LanguagePreferenceStore
+
+
+def test_choice_persists_across_stores(tmp_path):
+    path = str(tmp_path / "language_preferences.db")
+
+    async def run():
+        store = LanguagePreferenceStore(path)
+        assert await store.get("255712345678") is None
+        await store.set("255712345678", REPLY_ID_LANGUAGES["swahili_lang"])
+        cached = await store.get("255712345678")
+        # A restarted worker reads it back from SQLite
+        restarted = LanguagePreferenceStore(path)
+        return cached, await restarted.get("255712345678"), store.stats(), restarted.stats()
+
+    cached, restored, stats, restarted_stats = asyncio.run(run())
+    assert cached == restored == "swahili"
+    assert (stats["hits"], stats["misses"], stats["known_user_rate"]) == (1, 1, 0.5)
+    assert (restarted_stats["misses"], restarted_stats["cached"]) == (1, 1)
+
+
+def test_changing_the_language_overwrites_it(tmp_path):
+    path = str(tmp_path / "language_preferences.db")
+
+    async def run():
+        store = LanguagePreferenceStore(path)
+        await store.set("255712345678", "english")
+        await store.set("255712345678", "swahili")
+        return await LanguagePreferenceStore(path).get("255712345678")
+
+    assert asyncio.run(run()) == "swahili"
+
+
+def test_misses_expire_so_other_workers_choices_are_seen(tmp_path):
+    path = str(tmp_path / "language_preferences.db")
+
+    async def run():
+        store = LanguagePreferenceStore(path, miss_ttl=0.05)
+        other_worker = LanguagePreferenceStore(path)
+        assert await store.get("255712345678") is None
+        await other_worker.set("255712345678", "english")
+        # Still answered from the remembered miss...
+        remembered = await store.get("255712345678")
+        await asyncio.sleep(0.06)
+        # ...until it expires
+        return remembered, await store.get("255712345678"), store.stats()
+
+    remembered, found, stats = asyncio.run(run())
+    assert (remembered, found) == (None, "english")
+    assert (stats["hits"], stats["misses"], stats["cached_misses"]) == (1, 2, 0)
+
+
+def test_cache_is_bounded_lru(tmp_path):
+    async def run():
+        store = LanguagePreferenceStore(str(tmp_path / "language_preferences.db"), capacity=2)
+        await store.set("255700000001", "english")
+        await store.set("255700000002", "swahili")
+        await store.get("255700000001")  # most recently used now
+        await store.set("255700000003", "english")
+        for wa_id in ("255700000004", "255700000005", "255700000006"):
+            await store.get(wa_id)
+        return list(store._cache), len(store._misses), await store.get("255700000002")
+
+    cached, misses, evicted = asyncio.run(run())
+    assert cached == ["255700000001", "255700000003"]
+    assert misses == 2
+    # Evicted from memory, not from the database
+    assert evicted == "swahili"
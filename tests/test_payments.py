@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+
+from payments import EXPIRED, FAILED, SUCCEEDED, MockPaymentProvider, PaymentError, PaymentOrchestrator
+from utils.deadline import Deadline, check_deadline, current_deadline, deadline_scope
+
+
+def test_mock_provider_callback_settles_the_payment(tmp_path):
+    async def run():
+        settled = asyncio.Event()
+        payments = PaymentOrchestrator(MockPaymentProvider(latency=(0.01, 0.01)), db_path=str(tmp_path / "payments.db"))
+        payments.on_settled(lambda payment: settled.set())
+        payment = await payments.start("BK1", "SIMU", 45_000, "TZS", account="255712345678")
+        assert payment.state == "pending"
+        await asyncio.wait_for(settled.wait(), 5)
+        stored = await asyncio.to_thread(payments.get, payment.reference)
+        await payments.close()
+        return payment, stored
+
+    payment, stored = asyncio.run(run())
+    assert payment.reference.startswith("PAY") and len(payment.reference) == 23
+    assert stored.state == SUCCEEDED
+    assert stored.provider_reference.startswith("MOCK")
+
+
+def test_callback_settles_once_on_any_worker(tmp_path):
+    async def run():
+        path = str(tmp_path / "payments.db")
+        # The callback never comes from the mock: the provider is slower than the test
+        starter = PaymentOrchestrator(MockPaymentProvider(latency=(60, 60)), db_path=path)
+        other = PaymentOrchestrator(None, db_path=path)
+        settled = []
+        other.on_settled(lambda payment: settled.append((payment.reference, payment.state, payment.details)))
+
+        payment = await starter.start("BK1", "SIMU", 45_000, "TZS", details={"seat": "4A"})
+        again = await starter.start("BK1", "SIMU", 45_000, "TZS")
+        assert again.reference == payment.reference
+
+        first = await other.handle_callback(payment.reference, SUCCEEDED)
+        late = await other.handle_callback(payment.reference, FAILED)
+        unknown = await other.handle_callback("PAYUNKNOWN", SUCCEEDED)
+        # Settled: the booking may be charged again
+        retry = await starter.start("BK1", "SIMU", 45_000, "TZS")
+        await starter.close()
+        await other.close()
+        return payment, first, late, unknown, retry, settled, starter.stats(), other.stats()
+
+    payment, first, late, unknown, retry, settled, starter_stats, other_stats = asyncio.run(run())
+    assert first.state == SUCCEEDED
+    assert late.state == SUCCEEDED
+    assert unknown is None
+    assert retry.reference != payment.reference
+    assert settled == [(payment.reference, SUCCEEDED, {"seat": "4A"})]
+    assert (starter_stats["started"], starter_stats["duplicate_starts"]) == (2, 1)
+    assert (other_stats["callbacks"], other_stats["unknown_callbacks"], other_stats[SUCCEEDED]) == (3, 1, 1)
+
+
+def test_payments_without_a_callback_expire(tmp_path):
+    async def run():
+        path = str(tmp_path / "payments.db")
+        starter = PaymentOrchestrator(MockPaymentProvider(lost_rate=1.0), db_path=path, timeout=0.05, tick=0.02)
+        payment = await starter.start("BK1", "KADI", 45_000, "TZS")
+        await starter.close()
+        # A later process (or another worker) expires what the first one left behind
+        sweeper = PaymentOrchestrator(None, db_path=path, timeout=0.05, tick=0.02)
+        expired = asyncio.Event()
+        sweeper.on_settled(lambda payment: expired.set())
+        sweeper.start_expiring()
+        await asyncio.wait_for(expired.wait(), 5)
+        stored = await asyncio.to_thread(sweeper.get, payment.reference)
+        await sweeper.close()
+        return stored, sweeper.stats()
+
+    stored, stats = asyncio.run(run())
+    assert stored.state == EXPIRED
+    assert (stats[EXPIRED], stats["pending"]) == (1, 0)
+
+
+@pytest.mark.parametrize("provider, method, amount, message", [
+    (None, "SIMU", 45_000, "not available"),
+    (MockPaymentProvider(), "CASH", 45_000, "Unknown payment method"),
+    (MockPaymentProvider(), "SIMU", 0, "Nothing to charge"),
+])
+def test_start_rejects(tmp_path, provider, method, amount, message):
+    async def run():
+        payments = PaymentOrchestrator(provider, db_path=str(tmp_path / "payments.db"))
+        try:
+            await payments.start("BK1", method, amount, "TZS")
+        finally:
+            await payments.close()
+
+    with pytest.raises(PaymentError, match=message):
+        asyncio.run(run())
+
+
+def test_payment_started_under_a_short_deadline_still_settles(tmp_path):
+    async def run():
+        settled = asyncio.Event()
+        seen = []
+        payments = PaymentOrchestrator(MockPaymentProvider(latency=(0.05, 0.05)), db_path=str(tmp_path / "payments.db"))
+
+        def listener(payment):
+            # Runs long after the request's budget is spent
+            check_deadline("notify")
+            seen.append((payment.state, current_deadline()))
+            settled.set()
+
+        payments.on_settled(listener)
+        async with deadline_scope(Deadline.from_now(0.01)):
+            payment = await payments.start("BK1", "SIMU", 45_000, "TZS")
+        await asyncio.wait_for(settled.wait(), 5)
+        stored = await asyncio.to_thread(payments.get, payment.reference)
+        await payments.close()
+        return stored, seen
+
+    stored, seen = asyncio.run(run())
+    assert stored.state == SUCCEEDED
+    assert seen == [(SUCCEEDED, None)]
+
+
+def test_callback_endpoint_rejects_malformed_signed_bodies(tmp_path, monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "payment_callback_secret", "s3cret")
+    monkeypatch.setattr(main, "payments", PaymentOrchestrator(None, db_path=str(tmp_path / "payments.db")))
+    client = TestClient(main.app)
+
+    def post(body):
+        signature = hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+        return client.post("/payments/callback", content=body, headers={"X-Payment-Signature": signature})
+
+    assert client.post("/payments/callback", content=b"{}", headers={"X-Payment-Signature": "0"}).status_code == 403
+    assert post(b"{not json").status_code == 400
+    assert post(b"[1, 2]").status_code == 400
+    assert post(b'{"reference": "PAYUNKNOWN", "status": "succeeded"}').status_code == 404
@@ -0,0 +1,36 @@
+import time
+
+from pending_prompts import PendingPromptIndex
+
+
+def test_reply_resolves_its_prompt_by_context_id():
+    index = PendingPromptIndex()
+    index.add("wamid.1", "255712345678", "language", {"screen": "WELCOME"})
+    index.add("wamid.2", "255798765432", "language")
+    prompt = index.resolve("wamid.1", "255712345678")
+    assert (prompt.wamid, prompt.kind, prompt.context) == ("wamid.1", "language", {"screen": "WELCOME"})
+    # Resolved once only
+    assert index.resolve("wamid.1", "255712345678") is None
+    assert index.stats() == {"pending": 1, "registered": 2, "resolved": 1, "expired": 0, "unmatched": 1}
+
+
+def test_reply_without_context_falls_back_to_the_latest_prompt():
+    index = PendingPromptIndex()
+    index.add("wamid.1", "255712345678", "language")
+    index.add("wamid.2", "255712345678", "confirm")
+    assert index.resolve(None, "255712345678").wamid == "wamid.2"
+    # The earlier prompt is still pending, but only reachable by its own id
+    assert index.resolve(None, "255712345678") is None
+    assert index.resolve("wamid.1", "255712345678").kind == "language"
+    assert index.resolve("wamid.unknown", "255700000000") is None
+
+
+def test_unanswered_prompts_expire():
+    index = PendingPromptIndex(ttl=0.05, tick=0.01)
+    index.add("wamid.1", "255712345678", "language")
+    time.sleep(0.1)
+    assert index.resolve("wamid.1", "255712345678") is None
+    index.add("wamid.2", "255712345678", "language")
+    stats = index.stats()
+    assert (stats["expired"], stats["pending"], len(index)) == (1, 1, 1)
+    assert index.resolve(None, "255712345678").wamid == "wamid.2"
@@ -0,0 +1,44 @@
+import pytest
+
+from utils.phone import InvalidPhoneNumber, normalize_batch, normalize_phone, to_wa_id
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("0712 345 678", "+255712345678"),
+    ("+254 712-345-678", "+254712345678"),
+    ("255712345678", "+255712345678"),
+    ("00255712345678", "+255712345678"),
+    ("712345678", "+255712345678"),
+    ("+1 415 555 2671", "+14155552671"),
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+@pytest.mark.parametrize("raw", ["12345", "0812345678", "+2557123", "abc", "+0123456789"])
+def test_invalid_numbers_are_rejected(raw):
+    with pytest.raises(InvalidPhoneNumber):
+        normalize_phone(raw)
+
+
+def test_default_country_applies_to_national_numbers():
+    assert normalize_phone("0712345678", default_country="KE") == "+254712345678"
+
+
+def test_normalize_batch_deduplicates_and_reports_invalid():
+    unique, invalid = normalize_batch(["0712345678", "+255 712 345 678", "0712345678", "abc", "0798765432"])
+    assert unique == ["+255712345678", "+255798765432"]
+    assert list(invalid) == ["abc"]
+
+
+def test_to_wa_id():
+    assert to_wa_id("+255712345678") == "255712345678"
+    assert to_wa_id("255712345678") == "255712345678"
+
+
+def test_unknown_default_country_is_a_caller_error():
+    with pytest.raises(ValueError, match="Unknown default country 'XX'") as error:
+        normalize_phone("+255712345678", default_country="XX")
+    assert not isinstance(error.value, InvalidPhoneNumber)
+    with pytest.raises(ValueError, match="Unknown default country"):
+        normalize_batch(["0712345678"], default_country="tz")
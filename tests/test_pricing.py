@@ -0,0 +1,64 @@
+import json
+import os
+from datetime import date
+
+import pytest
+
+from pricing import FareTable, PricingEngine, PricingError, parse_travel_date
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fares.example.json")
+
+
+def test_fares_follow_the_travel_date():
+    table = PricingEngine(EXAMPLE).table
+    assert table.fare("DAR_ZNZ", "economy", date(2025, 6, 30))["adult"] == 3_500_000
+    assert table.fare("DAR_ZNZ", "economy", date(2025, 7, 1))["adult"] == 4_500_000
+    assert table.fare("DAR_ZNZ", "economy", date(2025, 9, 1))["child"] == 2_250_000
+    # Routes without their own fare use the "*" fare
+    assert table.fare("DAR_PEM", "economy", date(2025, 7, 1))["adult"] == 5_000_000
+
+
+def test_round_trip_quote_prices_each_leg_on_its_date():
+    engine = PricingEngine(EXAMPLE)
+    quote = engine.quote({"trip_type": "round_trip", "going_route": "DAR_ZNZ", "going_date": "2025-06-30",
+                          "return_route": "ZNZ_DAR", "return_date": "2025-07-08"}, "economy", 2, 1)
+    assert quote.total_minor == 2 * 3_500_000 + 2_000_000 + 2 * 5_000_000 + 2_500_000
+    assert quote.display == "TZS 215,000"
+    assert quote.to_dict()["legs_minor"] == {"going": 9_000_000, "return": 12_500_000}
+
+
+def test_seat_categories_are_cached_per_route_and_date():
+    engine = PricingEngine(EXAMPLE)
+    categories = engine.seat_categories("ZNZ_PEM", "2025-07-01")
+    assert categories[1] == {"id": "vip", "title": "💺 VIP Class · TZS 60,000", "description": "Child TZS 30,000"}
+    assert engine.seat_categories("ZNZ_PEM", "2025-07-01") is categories
+
+
+def test_invalid_tables_are_rejected():
+    classes = [{"id": "economy"}]
+    with pytest.raises(PricingError):
+        FareTable({"classes": classes, "fares": [{"class": "economy", "adult": "1.005"}]})
+    with pytest.raises(PricingError):
+        FareTable({"classes": classes, "fares": [
+            {"class": "economy", "adult": "1", "until": "2025-07-31"},
+            {"class": "economy", "adult": "2", "from": "2025-07-01"},
+        ]})
+    with pytest.raises(PricingError):
+        FareTable({"classes": classes, "fares": [{"class": "vip", "adult": "1"}]})
+
+
+def test_invalid_reload_keeps_the_previous_table(tmp_path):
+    path = tmp_path / "fares.json"
+    path.write_text(json.dumps({"classes": [{"id": "economy"}], "fares": [{"class": "economy", "adult": "10"}]}))
+    engine = PricingEngine(str(path))
+    path.write_text("{")
+    assert not engine.reload()
+    assert engine.table.version == 1
+    assert engine.quote({"going_route": "DAR_ZNZ", "going_date": "2025-07-01"}, "economy", 1, 0).total_minor == 1000
+
+
+def test_parse_travel_date():
+    assert parse_travel_date("2025-07-01") == date(2025, 7, 1)
+    assert parse_travel_date("1751328000000") == date(2025, 7, 1)
+    with pytest.raises(PricingError):
+        parse_travel_date("tomorrow")
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from reminders import ReminderJob, ReminderScheduler
+
+
+def test_due_jobs_fire_and_future_jobs_wait(tmp_path):
+    async def run():
+        fired = []
+
+        async def sender(job):
+            fired.append(job.job_id)
+
+        scheduler = ReminderScheduler(str(tmp_path / "reminders.db"), sender=sender)
+        now = time.time()
+        scheduler.schedule(ReminderJob("BK2:24h", now - 10, "255712345678", payload={"booking_id": "BK2"}))
+        scheduler.schedule(ReminderJob("BK1:24h", now - 20, "255712345678", payload={"booking_id": "BK1"}))
+        scheduler.schedule(ReminderJob("BK3:24h", now + 3600, "255712345678"))
+        scheduler.schedule(ReminderJob("BK4:24h", now - 5, "255712345678"))
+        scheduler.cancel(["BK4:24h", "unknown"])
+        assert await scheduler.run_once(now) == 2
+        assert scheduler.pending_count() == 1
+        assert await scheduler.run_once(now) == 0
+        await scheduler.close()
+        return fired
+
+    assert sorted(asyncio.run(run())) == ["BK1:24h", "BK2:24h"]
+
+
+def test_schedule_survives_a_restart(tmp_path):
+    path = str(tmp_path / "reminders.db")
+
+    async def first():
+        scheduler = ReminderScheduler(path)
+        scheduler.schedule(ReminderJob("BK1:24h", time.time() + 60, "255712345678", payload={"seat": "4A"}))
+        await scheduler.close()
+
+    async def second():
+        jobs = []
+
+        async def sender(job):
+            jobs.append(job)
+
+        scheduler = ReminderScheduler(path, sender=sender)
+        await scheduler.run_once(time.time() + 120)
+        await scheduler.close()
+        return jobs
+
+    asyncio.run(first())
+    [job] = asyncio.run(second())
+    assert (job.job_id, job.payload, job.attempts) == ("BK1:24h", {"seat": "4A"}, 1)
+
+
+def test_failed_sends_are_retried_then_dropped(tmp_path):
+    async def run():
+        async def sender(job):
+            raise RuntimeError("Graph API unavailable")
+
+        scheduler = ReminderScheduler(str(tmp_path / "reminders.db"), sender=sender, max_attempts=2, retry_delay=10)
+        now = time.time()
+        scheduler.schedule(ReminderJob("BK1:24h", now - 1, "255712345678"))
+        await scheduler.run_once(now)
+        # Backed off: not due again until the retry delay has passed
+        assert await scheduler.run_once(now) == 0
+        assert await scheduler.run_once(now + 3600) == 1
+        count = scheduler.pending_count()
+        await scheduler.close()
+        return count, scheduler.stats()
+
+    count, stats = asyncio.run(run())
+    assert count == 0
+    assert (stats["retried"], stats["failed"], stats["sent"]) == (1, 1, 0)
+
+
+def test_expired_jobs_are_dropped_unsent(tmp_path):
+    async def run():
+        fired = []
+
+        async def sender(job):
+            fired.append(job.job_id)
+
+        scheduler = ReminderScheduler(str(tmp_path / "reminders.db"), sender=sender)
+        now = time.time()
+        scheduler.schedule(ReminderJob("BK1:24h", now - 10, "255712345678", expires_at=now - 1))
+        await scheduler.run_once(now)
+        await scheduler.close()
+        return fired, scheduler.stats()["expired"]
+
+    assert asyncio.run(run()) == ([], 1)
+
+
+def test_background_task_wakes_for_an_earlier_job(tmp_path):
+    async def run():
+        sent = asyncio.Event()
+
+        async def sender(job):
+            sent.set()
+
+        scheduler = ReminderScheduler(str(tmp_path / "reminders.db"), sender=sender, poll_interval=60)
+        scheduler.start()
+        await asyncio.sleep(0.05)  # idle, sleeping for the whole poll interval
+        scheduler.schedule(ReminderJob("BK1:24h", time.time(), "255712345678"))
+        await asyncio.wait_for(sent.wait(), 5)
+        await scheduler.close()
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert stats["sent"] == 1
+    assert not stats["running"]
@@ -0,0 +1,107 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import reports
+from reports import BookingReports
+
+
+@pytest.fixture(params=["numpy", "python"])
+def engine(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+        # Fold every batch with NumPy, not only bulk loads
+        monkeypatch.setattr(reports, "_NUMPY_MIN_ROWS", 0)
+    else:
+        monkeypatch.setattr(reports, "_numpy", lambda: None)
+    return request.param
+
+
+def _booking(route="DAR_ZNZ", going="2025_07_01$08_00", round_trip=False, seat_class="economy",
+             adults=1, children=0, total=4_500_000, method="SIMU"):
+    return {
+        "travel_details": {"trip_type": "round_trip" if round_trip else "one_way", "going_route": route,
+                           "return_route": "ZNZ_DAR"},
+        "time_selections": {"going_time": going, "return_time": "2025_07_04$16_00"},
+        "seat_selections": {"seat_class": seat_class, "adult_passengers": str(adults),
+                            "child_passengers": str(children)},
+        "fare": {"currency": "TZS", "total_minor": total},
+        "payment": {"method": method},
+    }
+
+
+def test_reports_cover_every_worker(tmp_path, engine):
+    writer = BookingReports(str(tmp_path), "w000", seats_per_departure=10)
+    writer.load()
+    assert writer.record(_booking(adults=2, children=1), tenant_id="255700000001") == 1
+    assert writer.record(_booking(round_trip=True, total=9_000_001, method="KADI")) == 2
+    writer.record(_booking(route="ZNZ_PEM", going="2025_07_02$12_00", seat_class="vip"))
+    writer.flush()
+
+    reader = BookingReports(str(tmp_path), "w001", seats_per_departure=10)
+    reader.load()
+    reader.record(_booking(going="2025_07_01$16_00"))
+    assert reader.rows == 5
+
+    by_route = {row["route"]: row for row in reader.report(("route",))["rows"]}
+    assert by_route["DAR_ZNZ"]["bookings"] == 3
+    assert by_route["DAR_ZNZ"]["legs"] == 3
+    assert by_route["DAR_ZNZ"]["passengers"] == 5
+    # A round trip's total is split between its legs
+    assert by_route["DAR_ZNZ"]["revenue_minor"] == 4_500_000 + 4_500_001 + 4_500_000
+    assert by_route["ZNZ_DAR"]["bookings"] == 0
+    assert by_route["ZNZ_DAR"]["revenue_minor"] == 4_500_000
+    # Two DAR_ZNZ departures (08:00 and 16:00) of 10 seats each
+    assert (by_route["DAR_ZNZ"]["departures"], by_route["DAR_ZNZ"]["load_factor"]) == (2, 0.25)
+
+    daily = reader.report(("day", "route"), start=date(2025, 7, 2), end=date(2025, 7, 2))["rows"]
+    assert [(row["day"], row["route"], row["passengers"]) for row in daily] == [("2025-07-02", "ZNZ_PEM", 1)]
+
+    [kadi] = reader.report(("payment_method",), route="DAR_ZNZ", payment_method="KADI")["rows"]
+    assert (kadi["legs"], kadi["revenue_share"]) == (1, 1.0)
+    assert reader.report(("route",), route="NOWHERE")["rows"] == []
+
+
+def test_reload_after_restart(tmp_path, engine):
+    writer = BookingReports(str(tmp_path), "w000")
+    writer.record(_booking())  # before load(): kept until the previous rows are read
+    writer.load()
+    writer.flush()
+
+    restarted = BookingReports(str(tmp_path), "w000")
+    assert restarted.load()["rows"] == 1
+    [row] = restarted.report(("seat_class",))["rows"]
+    assert (row["seat_class"], row["legs"], row["currency"]) == ("economy", 1, "TZS")
+
+
+def test_unknown_dimension_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        BookingReports(str(tmp_path), "w000").report(("colour",))
+    with pytest.raises(ValueError):
+        BookingReports(str(tmp_path), "w000").report(("route",), colour="red")
+
+
+def test_numpy_and_python_reports_agree(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    rng = random.Random(7)
+    writer = BookingReports(str(tmp_path), "w000")
+    writer.load()
+    for _ in range(3000):
+        going = date(2025, 7, 1) + timedelta(days=rng.randrange(60))
+        writer.record(_booking(route=rng.choice(("DAR_ZNZ", "ZNZ_PEM", "PEM_DAR")),
+                               going=going.strftime("%Y_%m_%d$") + rng.choice(("08_00", "16_00")),
+                               round_trip=rng.random() < 0.3, seat_class=rng.choice(("economy", "vip")),
+                               adults=rng.randint(1, 3), children=rng.randint(0, 2),
+                               method=rng.choice(("SIMU", "KADI"))))
+    writer.flush()
+
+    def run():
+        reader = BookingReports(str(tmp_path), "w001")
+        reader.load()
+        return [reader.report(group_by, start=date(2025, 7, 10), end=date(2025, 8, 10))["rows"]
+                for group_by in (("day", "route"), ("month", "seat_class"), ("payment_method", "leg"))]
+
+    with_numpy = run()
+    monkeypatch.setattr(reports, "_numpy", lambda: None)
+    assert run() == with_numpy
@@ -0,0 +1,155 @@
+import asyncio
+
+import httpx
+import pytest
+
+from utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from utils.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilientClient,
+    RetryBudget,
+    RetryPolicy,
+    parse_retry_after,
+)
+
+
+def _client(handler, **kwargs) -> ResilientClient:
+    rc = ResilientClient(RetryPolicy(max_attempts=4, base_delay=0.001), **kwargs)
+    rc._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return rc
+
+
+def _scripted(codes):
+    """Answer with ``codes`` in turn (the last one repeats); counts the calls."""
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        code = codes[min(len(calls), len(codes)) - 1]
+        if isinstance(code, Exception):
+            raise code
+        headers = {"Retry-After": "0"} if code == 429 else {}
+        return httpx.Response(code, json={"messages": [{"id": f"wamid.{len(calls)}"}]}, headers=headers)
+
+    return handler, calls
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+def test_429_and_connect_errors_are_retried():
+    handler, calls = _scripted([429, httpx.ConnectError("refused"), 200])
+
+    async def run():
+        rc = _client(handler)
+        response = await rc.request("POST", "https://graph.test/messages", "messages", json={})
+        await rc.aclose()
+        return response, rc.stats()
+
+    response, stats = asyncio.run(run())
+    assert response.status_code == 200
+    assert len(calls) == 3
+    assert stats["retries"] == 2
+
+
+def test_5xx_and_read_timeouts_are_not_resent():
+    handler, calls = _scripted([503])
+
+    async def run():
+        rc = _client(handler)
+        response = await rc.request("POST", "https://graph.test/messages", "messages", json={})
+        rc._client = httpx.AsyncClient(transport=httpx.MockTransport(
+            _scripted([httpx.ReadTimeout("read")])[0]))
+        with pytest.raises(httpx.ReadTimeout):
+            await rc.request("POST", "https://graph.test/messages", "messages", json={})
+        await rc.aclose()
+        return response, rc.stats()
+
+    response, stats = asyncio.run(run())
+    assert response.status_code == 503
+    assert len(calls) == 1
+    assert stats["retries"] == 0
+
+
+def test_breaker_opens_and_fails_fast():
+    handler, calls = _scripted([500])
+
+    async def run():
+        rc = _client(handler, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            assert (await rc.request("POST", "https://graph.test/messages", "messages")).status_code == 500
+        with pytest.raises(CircuitOpenError):
+            await rc.request("POST", "https://graph.test/messages", "messages")
+        await rc.aclose()
+        return rc.stats()
+
+    stats = asyncio.run(run())
+    assert len(calls) == 2
+    assert stats["breakers"]["messages"] == {"state": "open", "failures": 2, "rejected": 1}
+
+
+def test_half_open_probe_is_released_when_cancelled():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.before_call("messages") is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("messages")
+    breaker.end_call()
+    assert breaker.before_call("messages") is True
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_idempotency_key_sends_once():
+    handler, calls = _scripted([200])
+
+    async def run():
+        rc = _client(handler)
+        send = lambda: rc.request("POST", "https://graph.test/messages", "messages", idempotency_key="k1")
+        first, second = await asyncio.gather(send(), send())
+        third = await send()
+        await rc.aclose()
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first is second is third
+    assert len(calls) == 1
+
+
+def test_retry_budget_caps_retries():
+    budget = RetryBudget(ratio=0.5, min_tokens=1.0)
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.try_withdraw()
+    assert budget.exhausted == 1
+
+
+def test_deadline_caps_timeout_and_stops_retries():
+    seen = []
+
+    def handler(request):
+        seen.append(request.extensions["timeout"]["read"])
+        return httpx.Response(429, headers={"Retry-After": "5"})
+
+    async def run():
+        rc = _client(handler)
+        rc.policy.max_delay = 10
+        async with deadline_scope(Deadline.from_now(1.0)):
+            response = await rc.request("POST", "https://graph.test/messages", "messages")
+        async with deadline_scope(Deadline.from_now(0)):
+            with pytest.raises(DeadlineExceeded):
+                await rc.request("POST", "https://graph.test/messages", "messages")
+        await rc.aclose()
+        return response
+
+    response = asyncio.run(run())
+    assert response.status_code == 429
+    assert len(seen) == 1 and seen[0] <= 1.0
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from session_store import SessionStore
+from utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from utils.timer_wheel import TimerWheel
+
+
+def _session(token, status="in_progress"):
+    return {"flow_token": token, "status": status, "user_data": {"travel_details": {"going_route": "DAR_ZNZ"}}}
+
+
+def test_sessions_survive_a_restart_and_load_lazily(tmp_path):
+    async def populate():
+        store = SessionStore(str(tmp_path), flush_interval=3600)
+        for i in range(100):
+            store.put(f"token-{i}", _session(f"token-{i}"))
+        store.flush()
+        await store.compact()
+        store.put("token-10", _session("token-10", "updated"))
+        store.delete("token-20")
+        await store.close()
+
+    asyncio.run(populate())
+    store = SessionStore(str(tmp_path))
+    store.restore()
+    assert len(store) == 99
+    assert store.stats()["decoded"] == 0
+    assert store.get("token-10")["status"] == "updated"
+    assert store.get("token-11")["status"] == "in_progress"
+    assert store.get("token-20") is None
+    assert store.stats()["lazy_loads"] == 2
+
+
+def test_torn_log_tail_is_ignored(tmp_path):
+    store = SessionStore(str(tmp_path))
+    store.put("a", _session("a"))
+    store.put("b", _session("b"))
+    store.flush()
+    store._log.close()
+    path = tmp_path / "sessions.log"
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.get("a")["flow_token"] == "a"
+    assert reopened.get("b") is None
+
+
+def test_expired_sessions_are_deleted_on_disk(tmp_path):
+    now = [0.0]
+    expired = []
+    store = SessionStore(str(tmp_path), ttl=5)
+    store._wheel = TimerWheel(tick=1.0, slots=64, clock=lambda: now[0])
+    store.on_expire(lambda token, session: expired.append((token, session["status"])))
+    store.put("a", _session("a"))
+    store.flush()
+    now[0] = 10.0
+    assert store.get("a") is None
+    assert expired == [("a", "in_progress")]
+    store.flush()
+
+    assert SessionStore(str(tmp_path)).get("a") is None
+
+
+def test_restore_is_not_started_for_a_late_request(tmp_path):
+    async def run():
+        store = SessionStore(str(tmp_path))
+        async with deadline_scope(Deadline.from_now(0)):
+            with pytest.raises(DeadlineExceeded):
+                store.get("a")
+        return store.stats()
+
+    assert asyncio.run(run())["restored"] == 0
+
+
+def test_close_waits_for_a_compaction_in_progress(tmp_path):
+    async def run():
+        # Compact after every flush, and slowly
+        store = SessionStore(str(tmp_path), flush_interval=0.01, compact_ratio=0)
+        write_snapshot = store._write_snapshot
+        writing = threading.Event()
+
+        def slow_write_snapshot(encoded, raw):
+            writing.set()
+            time.sleep(0.2)
+            return write_snapshot(encoded, raw)
+
+        store._write_snapshot = slow_write_snapshot
+        store.put("a", _session("a"))
+        while not writing.is_set():
+            await asyncio.sleep(0.005)
+        store.put("b", _session("b"))
+        await store.close()
+        return store.stats()
+
+    stats = asyncio.run(run())
+    assert stats["compactions"] == 1
+    reopened = SessionStore(str(tmp_path))
+    assert reopened.get("a")["flow_token"] == "a"
+    assert reopened.get("b")["flow_token"] == "b"
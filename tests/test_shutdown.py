@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+import pytest
+
+from utils.shutdown import DrainMiddleware, GracefulShutdown
+
+
+def _app(started, release):
+    async def app(scope, receive, send):
+        if scope["path"] == "/slow":
+            started.set()
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": scope["path"].encode()})
+
+    return app
+
+
+def test_in_flight_requests_finish_and_new_ones_get_503():
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        shutdown = GracefulShutdown(timeout=5)
+        order = []
+        shutdown.add_step("bookings", lambda: order.append(("bookings", shutdown.in_flight)) or 0)
+
+        async def close_clients():
+            order.append(("graph_clients", shutdown.in_flight))
+
+        shutdown.add_step("graph_clients", close_clients)
+        transport = httpx.ASGITransport(app=DrainMiddleware(_app(started, release), shutdown))
+        async with httpx.AsyncClient(transport=transport, base_url="http://worker") as client:
+            slow = asyncio.ensure_future(client.get("/slow"))
+            await started.wait()
+            stopping = asyncio.ensure_future(shutdown.run())
+            await asyncio.sleep(0.01)
+            rejected = await client.post("/flow-data")
+            probe = await client.get("/ready")
+            # Nothing is flushed while the request is still running
+            flushed_early = list(order)
+            release.set()
+            report = await stopping
+            return (await slow), rejected, probe, flushed_early, order, report
+
+    slow, rejected, probe, flushed_early, order, report = asyncio.run(run())
+    assert (slow.status_code, slow.text) == (200, "/slow")
+    assert rejected.status_code == 503
+    assert rejected.headers["retry-after"] == "5"
+    assert rejected.json()["reason"] == "draining"
+    assert probe.status_code == 200
+    assert flushed_early == []
+    assert order == [("bookings", 0), ("graph_clients", 0)]
+    assert report["requests_in_flight_at_start"] == 1
+    assert report["requests_rejected"] == 1
+    assert report["requests_outstanding"] == []
+    assert report["clean"]
+
+
+def test_stuck_requests_and_failed_steps_are_reported():
+    async def run():
+        started, release = asyncio.Event(), asyncio.Event()
+        shutdown = GracefulShutdown(timeout=0.05, step_floor=0.05)
+
+        async def hangs():
+            await asyncio.sleep(10)
+
+        def fails():
+            raise OSError("disk full")
+
+        shutdown.add_step("hangs", hangs)
+        shutdown.add_step("fails", fails)
+        shutdown.add_step("sessions", lambda: {"unflushed": 0})
+        app = DrainMiddleware(_app(started, release), shutdown)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://worker") as client:
+            slow = asyncio.ensure_future(client.get("/slow"))
+            await started.wait()
+            report = await shutdown.run()
+            release.set()
+            await slow
+        return report
+
+    report = asyncio.run(run())
+    assert [entry["path"] for entry in report["requests_outstanding"]] == ["/slow"]
+    hangs, fails, sessions = report["steps"]
+    assert not hangs["ok"] and hangs["error"].startswith("timed out")
+    assert (fails["ok"], fails["error"]) == (False, "OSError: disk full")
+    # Later steps still run
+    assert sessions == {"step": "sessions", "ok": True, "left": {"unflushed": 0}, "ms": sessions["ms"]}
+    assert not report["clean"]
+
+
+def test_main_flushes_producers_before_what_they_depend_on():
+    pytest.importorskip("fastapi")
+    import main
+
+    steps = main.shutdown.stats()["steps"]
+    position = {name: i for i, name in enumerate(steps)}
+    # Consumers finish before their logs close
+    assert position["webhook_consumer"] < position["webhook_log"]
+    # Everything that may still send a message goes before the Graph clients close
+    for sender in ("webhook_consumer", "payments", "tickets", "reminders"):
+        assert position[sender] < position["graph_clients"]
+    # Payment settlements update flow sessions, which are flushed after them
+    assert position["payments"] < position["sessions"]
+    assert steps[-1] == "tracing"
+    # The drain middleware is the outermost layer, so it sees every request
+    assert main.app.user_middleware[0].cls is main.DrainMiddleware
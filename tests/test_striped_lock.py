@@ -0,0 +1,86 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+from utils.striped_lock import FileStripedLock, LockTimeout, StripedLock, fcntl
+
+
+async def _updates(lock, store, tokens=50, updates=20):
+    """Concurrent read-modify-write of per-token counters with an await in between, like a flow handler."""
+    async def update(token):
+        async with lock.hold(token):
+            value = store.get(token, 0)
+            await asyncio.sleep(0)
+            store[token] = value + 1
+
+    await asyncio.gather(*(update(f"tok{t}") for _ in range(updates) for t in range(tokens)))
+
+
+def test_no_lost_updates_per_key():
+    store = {}
+    lock = StripedLock(stripes=16)
+    asyncio.run(_updates(lock, store))
+    assert sum(store.values()) == 50 * 20
+    assert lock.stats()["contended"] > 0
+    assert lock.stats()["held"] == 0
+
+
+def test_wait_is_bounded_by_the_timeout():
+    async def run():
+        lock = StripedLock()
+        async with lock.hold("token-1"):
+            with pytest.raises(LockTimeout):
+                async with lock.hold("token-1", timeout=0.01):
+                    pass
+            # Other keys are not held up (unless they share the stripe)
+            other = next(f"token-{i}" for i in range(2, 100) if lock.stripe_of(f"token-{i}") != lock.stripe_of("token-1"))
+            async with lock.hold(other, timeout=0.01):
+                pass
+        async with lock.hold(None):
+            pass
+        return lock.stats()
+
+    assert asyncio.run(run())["timeouts"] == 1
+
+
+def _hold_in_other_process(path, key, held, release):
+    async def run():
+        lock = FileStripedLock(path)
+        async with lock.hold(key):
+            held.set()
+            release.wait()
+        lock.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(fcntl is None, reason="needs POSIX record locks")
+def test_file_lock_serializes_processes(tmp_path):
+    path = str(tmp_path / "flow_tokens.lock")
+    context = multiprocessing.get_context("fork")
+    held, release = context.Event(), context.Event()
+    other = context.Process(target=_hold_in_other_process, args=(path, "token-1", held, release))
+    other.start()
+    try:
+        assert held.wait(5)
+
+        async def run():
+            lock = FileStripedLock(path)
+            with pytest.raises(LockTimeout):
+                async with lock.hold("token-1", timeout=0.05):
+                    pass
+            release.set()
+            async with lock.hold("token-1", timeout=5):
+                pass
+            lock.close()
+            return lock.stats()
+
+        stats = asyncio.run(run())
+    finally:
+        release.set()
+        other.join(5)
+    # The second attempt waits too unless the other process has already let go
+    assert stats["cross_worker_waits"] >= 1
+    assert stats["timeouts"] == 1
+    assert stats["acquired"] == 1
@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+
+from template_catalog import TemplateCatalog, TemplateNotFound, TemplateParameterError, TemplateSkeleton
+
+REMINDER = {
+    "name": "ferry_reminder",
+    "language": "en_US",
+    "components": [
+        {"type": "HEADER", "format": "TEXT", "text": "Trip {{1}}"},
+        {"type": "BODY", "text": "Hi {{1}}, your ferry leaves at {{2}}."},
+        {"type": "FOOTER", "text": "Azam Marine"},
+    ],
+}
+
+
+def test_render_matches_the_payload_dict():
+    body = TemplateSkeleton(REMINDER).render("255712345678", ["DAR_ZNZ", "Asha \"A\"", " 08:00 "])
+    assert json.loads(body) == {
+        "messaging_product": "whatsapp",
+        "to": "255712345678",
+        "type": "template",
+        "template": {
+            "name": "ferry_reminder",
+            "language": {"code": "en_US"},
+            "components": [
+                {"type": "header", "parameters": [{"type": "text", "text": "DAR_ZNZ"}]},
+                {"type": "body", "parameters": [{"type": "text", "text": "Asha \"A\""},
+                                                {"type": "text", "text": "08:00"}]},
+            ],
+        },
+    }
+
+
+def test_template_without_parameters():
+    skeleton = TemplateSkeleton({"name": "hello_world", "language": "en_US",
+                                 "components": [{"type": "BODY", "text": "Hello"}]})
+    assert skeleton.param_count == 0
+    assert "components" not in json.loads(skeleton.render("255712345678"))["template"]
+
+
+def test_parameter_count_is_checked():
+    with pytest.raises(TemplateParameterError):
+        TemplateSkeleton(REMINDER).render("255712345678", ["DAR_ZNZ"])
+
+
+def test_offline_catalog_serves_approved_templates(tmp_path):
+    path = tmp_path / "templates.json"
+    path.write_text(json.dumps({"data": [REMINDER, {**REMINDER, "language": "sw", "status": "REJECTED"}]}))
+
+    async def run():
+        catalog = TemplateCatalog(offline_file=str(path))
+        skeleton = await catalog.get("ferry_reminder", "en_US")
+        with pytest.raises(TemplateNotFound):
+            await catalog.get("ferry_reminder", "sw")
+        return skeleton, catalog.stats()
+
+    skeleton, stats = asyncio.run(run())
+    assert skeleton.param_count == 3
+    assert stats["templates"] == 1
+    assert stats["refreshes"] == 1
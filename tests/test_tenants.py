@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from tenants import TenantConfig, TenantRegistry, UnknownTenant
+
+FALLBACK = TenantConfig(tenant_id="default", phone_number_id="100", access_token="fallback-token", api_version="v22.0")
+
+
+def _tenant(tenant_id, phone_number_id, **extra):
+    return {"tenant_id": tenant_id, "phone_number_id": phone_number_id, "access_token": f"{tenant_id}-token", **extra}
+
+
+def _write(path, tenants, default=None):
+    raw = {"tenants": tenants}
+    if default:
+        raw["default"] = default
+    path.write_text(json.dumps(raw))
+
+
+def test_without_a_file_the_config_tenant_is_used(tmp_path):
+    registry = TenantRegistry(str(tmp_path / "tenants.json"), FALLBACK)
+    assert registry.default().config is FALLBACK
+    assert registry.for_phone_number_id("999").tenant_id == "default"
+    with pytest.raises(UnknownTenant):
+        registry.get("azam")
+
+
+def test_tenants_file_is_loaded(tmp_path, monkeypatch):
+    monkeypatch.setenv("KILI_TOKEN", "from-env")
+    path = tmp_path / "tenants.json"
+    _write(path, [_tenant("azam", "111"), {"tenant_id": "kili", "phone_number_id": 222,
+                                           "access_token_env": "KILI_TOKEN", "private_key_path": "keys/kili.pem"}],
+           default="kili")
+    registry = TenantRegistry(str(path), FALLBACK)
+    kili = registry.default()
+    assert kili.tenant_id == "kili"
+    assert kili.config.access_token == "from-env"
+    assert kili.config.api_version == "v22.0"
+    assert kili.config.private_key_path == str(tmp_path / "keys" / "kili.pem")
+    assert registry.for_phone_number_id("111").tenant_id == "azam"
+    assert registry.get("azam").config.api_url == "https://graph.facebook.com/v22.0/111"
+
+
+@pytest.mark.parametrize("tenants, default, error", [
+    ([], None, "defines no tenants"),
+    ([_tenant("azam", "111"), _tenant("azam", "222")], None, "duplicate tenant_id azam"),
+    ([_tenant("azam", "111"), _tenant("kili", "111")], None, "used by several tenants"),
+    ([_tenant("azam", "111")], "kili", "default tenant kili is not defined"),
+    ([{"tenant_id": "azam", "phone_number_id": "111"}], None, "missing access_token"),
+    ([_tenant("azam", "111", colour="blue")], None, "unknown settings colour"),
+])
+def test_invalid_reload_keeps_the_previous_snapshot(tmp_path, tenants, default, error):
+    path = tmp_path / "tenants.json"
+    _write(path, [_tenant("azam", "111")])
+    registry = TenantRegistry(str(path), FALLBACK)
+    before = registry.snapshot
+    _write(path, tenants, default)
+    assert not registry.reload()
+    assert registry.snapshot is before
+    assert error in registry.last_error
+    assert registry.stats()["reload_errors"] == 1
+
+
+def test_reload_swaps_the_snapshot_and_keeps_unchanged_tenants(tmp_path):
+    path = tmp_path / "tenants.json"
+    _write(path, [_tenant("azam", "111"), _tenant("kili", "222")])
+    registry = TenantRegistry(str(path), FALLBACK)
+    azam, kili = registry.get("azam"), registry.get("kili")
+
+    _write(path, [_tenant("azam", "111"), _tenant("kili", "222", rate_limit_per_second=20), _tenant("pemba", "333")])
+    assert registry.reload()
+    assert registry.snapshot.version == 2
+    # Unchanged: same pool, limiter and breakers
+    assert registry.get("azam") is azam
+    assert registry.get("kili") is not kili
+    assert registry.get("kili").limiter.rate == 20
+    assert registry.for_phone_number_id("333").tenant_id == "pemba"
+
+
+def test_retired_clients_are_closed_after_the_grace_period(tmp_path):
+    path = tmp_path / "tenants.json"
+    _write(path, [_tenant("azam", "111"), _tenant("kili", "222")])
+
+    async def run():
+        registry = TenantRegistry(str(path), FALLBACK, close_grace=0.05)
+        kept = registry.get("azam").client.client
+        retired = registry.get("kili").client.client
+        _write(path, [_tenant("azam", "111")])
+        registry.reload()
+        # In-flight sends of the removed tenant may still finish
+        during_grace = retired.is_closed
+        await asyncio.sleep(0.1)
+        closed = retired.is_closed, kept.is_closed
+        await registry.aclose()
+        return during_grace, closed, kept.is_closed
+
+    during_grace, closed, kept_after_close = asyncio.run(run())
+    assert not during_grace
+    assert closed == (True, False)
+    assert kept_after_close
+
+
+def test_watcher_reloads_a_changed_file(tmp_path):
+    path = tmp_path / "tenants.json"
+    _write(path, [_tenant("azam", "111")])
+
+    async def run():
+        registry = TenantRegistry(str(path), FALLBACK, reload_interval=0.01)
+        registry.start_watching()
+        _write(path, [_tenant("azam", "111"), _tenant("kili", "222")])
+        # Modified within the same clock tick is still a change
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+        for _ in range(100):
+            if registry.snapshot.version > 1:
+                break
+            await asyncio.sleep(0.01)
+        await registry.aclose()
+        return registry
+
+    registry = asyncio.run(run())
+    assert [tenant.tenant_id for tenant in registry] == ["azam", "kili"]
+
+
+def test_tenant_endpoints_require_the_admin_token(tmp_path, monkeypatch):
+    pytest.importorskip("fastapi")
+    from fastapi.testclient import TestClient
+
+    import main
+
+    path = tmp_path / "tenants.json"
+    _write(path, [_tenant("azam", "111")])
+    monkeypatch.setattr(main, "tenant_registry", TenantRegistry(str(path), FALLBACK))
+    client = TestClient(main.app)
+
+    monkeypatch.setattr(main, "admin_token", None)
+    assert client.get("/tenants").status_code == 404
+
+    monkeypatch.setattr(main, "admin_token", "s3cret")
+    assert client.get("/tenants").status_code == 403
+    assert client.post("/tenants/reload", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    admin = {"Authorization": "Bearer s3cret"}
+    assert list(client.get("/tenants", headers=admin).json()["tenants"]) == ["azam"]
+
+    _write(path, [_tenant("azam", "111"), _tenant("kili", "222")])
+    assert client.post("/tenants/reload", headers=admin).json() == {"status": "reloaded", "version": 2}
+    _write(path, [])
+    response = client.post("/tenants/reload", headers=admin)
+    assert (response.status_code, response.json()["detail"]) == (400, f"{path} defines no tenants")
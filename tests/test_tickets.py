@@ -0,0 +1,90 @@
+import asyncio
+from dataclasses import asdict
+
+from tickets import LocalMediaUploader, MediaCache, Ticket, TicketPipeline, render_ticket_pdf
+
+
+def _ticket(passenger=1):
+    return Ticket(booking_id="BK-1MSW-CMYC-00001", passenger=passenger, passengers=2, passenger_name="Asha Juma Said",
+                  route="DAR_ZNZ", departure="2026-12-01 08:00", seat_class="Economy", total="TZS 150,000")
+
+
+def test_render_is_a_deterministic_pdf():
+    ticket = _ticket()
+    pdf, _, seconds = render_ticket_pdf(asdict(ticket))
+    again, _, _ = render_ticket_pdf(asdict(ticket))
+    assert pdf.startswith(b"%PDF-") and pdf.rstrip().endswith(b"%%EOF")
+    assert pdf == again
+    assert seconds > 0
+    assert ticket.code == "BK-1MSW-CMYC-00001/G1"
+    assert render_ticket_pdf(asdict(_ticket(2)))[0] != pdf
+
+
+def test_media_cache_persists_and_expires(tmp_path):
+    async def run():
+        path = str(tmp_path / "media_cache.db")
+        cache = MediaCache(path)
+        assert await cache.get("255700000001", "abc") is None
+        await cache.put("255700000001", "abc", "media-1")
+        cache.close()
+
+        reopened = MediaCache(path)
+        found = await reopened.get("255700000001", "abc")
+        other_tenant = await reopened.get("255700000002", "abc")
+        reopened.ttl = -1
+        expired = await reopened.get("255700000001", "abc")
+        reopened.close()
+        return found, other_tenant, expired
+
+    assert asyncio.run(run()) == ("media-1", None, None)
+
+
+def test_media_cache_lookups_and_stores_from_many_threads(tmp_path):
+    async def run():
+        cache = MediaCache(str(tmp_path / "media_cache.db"), max_memory=0)
+        await asyncio.gather(*(cache.put("255700000001", f"hash-{i}", f"media-{i}") for i in range(200)))
+        found = await asyncio.gather(*(cache.get("255700000001", f"hash-{i}") for i in range(200)))
+        cache.close()
+        return found
+
+    assert asyncio.run(run()) == [f"media-{i}" for i in range(200)]
+
+
+def test_pipeline_uploads_once_and_sends_every_ticket(tmp_path):
+    async def run():
+        sent = []
+
+        async def send(to, media_id, **kwargs):
+            sent.append((to, media_id, kwargs["idempotency_key"]))
+            return {"messages": [{"id": f"wamid.{len(sent)}"}]}
+
+        pipeline = TicketPipeline(LocalMediaUploader(str(tmp_path / "media")), send,
+                                  MediaCache(str(tmp_path / "media_cache.db")), workers=1)
+        await pipeline.deliver(_ticket(1), "255712345678")
+        # Resending the first ticket reuses its upload
+        pipeline.enqueue([_ticket(1), _ticket(2)], "255712345678")
+        closed = await pipeline.close()
+        return sent, closed, pipeline.stats()
+
+    sent, closed, stats = asyncio.run(run())
+    assert closed == {"sent": 3, "failed": 0}
+    assert sorted(key for _, _, key in sent) == [
+        "BK-1MSW-CMYC-00001/G1:ticket", "BK-1MSW-CMYC-00001/G1:ticket", "BK-1MSW-CMYC-00001/G2:ticket",
+    ]
+    assert stats["rendered"] == 3
+    assert stats["uploads"] == 2
+    assert len({media_id for _, media_id, _ in sent}) == 2
+    assert list((tmp_path / "media").iterdir())
+
+
+def test_failed_sends_are_counted(tmp_path):
+    async def run():
+        async def send(to, media_id, **kwargs):
+            raise RuntimeError("Graph API unavailable")
+
+        pipeline = TicketPipeline(LocalMediaUploader(str(tmp_path / "media")), send,
+                                  MediaCache(":memory:"), workers=1)
+        pipeline.enqueue([_ticket(1)], "255712345678")
+        return await pipeline.close()
+
+    assert asyncio.run(run()) == {"sent": 0, "failed": 1}
@@ -0,0 +1,63 @@
+from utils.timer_wheel import TimerWheel
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_at_most_one_tick_late():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=1.0, slots=8, clock=clock)
+    wheel.schedule("a", 2.5)
+    wheel.schedule("b", 1)
+    clock.now += 1
+    assert wheel.advance() == ["b"]
+    clock.now += 1
+    assert wheel.advance() == []
+    clock.now += 1
+    assert wheel.advance() == ["a"]
+    assert len(wheel) == 0
+
+
+def test_delays_longer_than_a_revolution_roll_over():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=1.0, slots=8, clock=clock)
+    # Same bucket as "short", but a revolution later
+    wheel.schedule("long", 11)
+    wheel.schedule("short", 3)
+    clock.now += 3
+    assert wheel.advance() == ["short"]
+    assert "long" in wheel
+    clock.now += 7
+    assert wheel.advance() == []
+    clock.now += 1
+    assert wheel.advance() == ["long"]
+
+
+def test_long_pause_visits_each_bucket_once():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=1.0, slots=8, clock=clock)
+    wheel.schedule_many([f"k{i}" for i in range(100)], 5)
+    wheel.schedule("later", 50)
+    clock.now += 30
+    assert sorted(wheel.advance()) == sorted(f"k{i}" for i in range(100))
+    clock.now += 20
+    assert wheel.advance() == ["later"]
+
+
+def test_reschedule_and_cancel():
+    clock = FakeClock()
+    wheel = TimerWheel(tick=1.0, slots=8, clock=clock)
+    wheel.schedule("token", 2)
+    wheel.schedule("token", 5)  # replaces the first timer
+    wheel.schedule("gone", 1)
+    assert wheel.cancel("gone")
+    assert not wheel.cancel("gone")
+    clock.now += 3
+    assert wheel.advance() == []
+    clock.now += 2
+    assert wheel.advance() == ["token"]
@@ -0,0 +1,54 @@
+import asyncio
+import json
+
+from utils.tracing import NOOP_SPAN, Tracer, current_span, trace_id_for
+
+
+def _spans(path):
+    with open(path) as f:
+        return [span for line in f for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+
+
+def test_spans_of_a_journey_share_its_trace(tmp_path):
+    path = tmp_path / "spans.otlp.jsonl"
+
+    async def run():
+        tracer = Tracer(str(path), sample_ratio=1.0)
+        with tracer.span("flow_data", key="token-1", attributes={"screen": "SEATS", "matched": True}) as root:
+            with tracer.span("session.get") as child:
+                assert current_span() is child
+            root.link("wamid.1")
+        try:
+            with tracer.span("flow_data", key="token-1"):
+                raise ValueError("bad screen")
+        except ValueError:
+            pass
+        await tracer.flush()
+        return tracer.stats()
+
+    stats = asyncio.run(run())
+    assert stats["spans_exported"] == 3
+    child, root, failed = _spans(path)
+    assert root["traceId"] == child["traceId"] == failed["traceId"] == trace_id_for("token-1")
+    assert child["parentSpanId"] == root["spanId"]
+    assert root["links"] == [{"traceId": trace_id_for("wamid.1"), "spanId": "0" * 16}]
+    assert {"key": "matched", "value": {"boolValue": True}} in root["attributes"]
+    assert failed["status"] == {"code": 2, "message": "ValueError: bad screen"}
+
+
+def test_sampling_is_decided_per_trace():
+    tracer = Tracer("unused.jsonl", sample_ratio=0.5)
+    keys = [f"token-{i}" for i in range(1000)]
+    sampled = [key for key in keys if tracer.span("flow_data", key=key) is not NOOP_SPAN]
+    assert 350 < len(sampled) < 650
+    # Every worker makes the same decision for a journey
+    assert sampled == [key for key in keys if Tracer("other.jsonl", sample_ratio=0.5).sampled(trace_id_for(key))]
+
+
+def test_unsampled_and_disabled_tracers_return_the_noop_span():
+    assert Tracer(None, sample_ratio=1.0).span("flow_data", key="token-1") is NOOP_SPAN
+    tracer = Tracer("unused.jsonl", sample_ratio=0.0)
+    with tracer.span("flow_data", key="token-1") as span:
+        assert span is NOOP_SPAN
+        assert tracer.span("child") is NOOP_SPAN
+    assert tracer.stats()["spans_started"] == 0
@@ -0,0 +1,384 @@
+"""Ticket pipeline: render PDF tickets with a QR code off the event loop, upload once, send.
+
+Once a booking is paid every passenger gets a one-page PDF ticket with the
+journey details and a QR code of ``<booking_id>/<leg><passenger>``. Encoding the
+QR code (eight masks scored) and compressing the page is pure-Python CPU
+work of about ten milliseconds, so it runs in a process pool (``spawn``, so
+the server process is never forked) and the event loop serving
+``/flow-data`` only awaits the result.
+
+Rendering is deterministic, so the SHA-256 of the PDF identifies its content:
+``MediaCache`` maps (tenant, content hash) to the media id returned by the
+upload and keeps it in SQLite for a little less than the 30 days a WhatsApp
+media id stays valid. Resending a ticket (a retried confirmation, a repeated
+request) reuses the upload.
+
+``TicketPipeline.enqueue`` returns at once; the tickets are rendered,
+uploaded and sent in a background task, with at most ``max_pending`` tickets
+waiting for the pool. Render time and queue latency (submission until a
+worker picks the ticket up) are kept as histograms for ``/metrics``.
+``LocalMediaUploader`` stands in for the Graph API upload in development.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from delivery_status import LatencyHistogram
+from utils import qr
+
+logger = logging.getLogger(__name__)
+
+PDF_MIME_TYPE = "application/pdf"
+
+# A6 portrait in points
+_PAGE_WIDTH = 298
+_PAGE_HEIGHT = 420
+
+
+@dataclass
+class Ticket:
+    booking_id: str
+    passenger: int
+    passengers: int
+    passenger_name: str
+    route: str
+    departure: str
+    seat_class: str
+    total: str = ""
+    leg: str = "going"
+
+    @property
+    def code(self) -> str:
+        """Content of the QR code, checked at boarding, e.g. ``BK-.../G1``."""
+        return f"{self.booking_id}/{self.leg[0].upper()}{self.passenger}"
+
+    @property
+    def filename(self) -> str:
+        return f"ticket-{self.booking_id}-{self.leg[0].upper()}{self.passenger}.pdf"
+
+
+# ---------------------------------------------------------------- rendering
+
+def _pdf_text(text: str) -> bytes:
+    encoded = str(text).encode("cp1252", errors="replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _pdf_document(content: bytes) -> bytes:
+    stream = zlib.compress(content, 6)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+        b"/Resources << /Font << /F1 4 0 R /F2 5 0 R >> >> /Contents 6 0 R >>" % (_PAGE_WIDTH, _PAGE_HEIGHT),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _qr_drawing(code: str, x: float, y: float, size: float) -> bytes:
+    """Fill the dark modules of a QR code, one rectangle per horizontal run."""
+    modules = qr.encode(code.encode("utf-8"))
+    count = len(modules)
+    unit = size / count
+    parts = [b"0 0 0 rg\n"]
+    for row_index, row in enumerate(modules):
+        top = y + size - (row_index + 1) * unit
+        column = 0
+        while column < count:
+            if not row[column]:
+                column += 1
+                continue
+            start = column
+            while column < count and row[column]:
+                column += 1
+            parts.append(b"%.2f %.2f %.2f %.2f re\n" % (x + start * unit, top, (column - start) * unit, unit))
+    parts.append(b"f\n")
+    return b"".join(parts)
+
+
+def render_ticket_pdf(ticket: Dict) -> Tuple[bytes, float, float]:
+    """
+    Render one ticket as a PDF (runs in a pool worker).
+
+    Args:
+        ticket (Dict): ``Ticket`` fields.
+
+    Returns:
+        Tuple[bytes, float, float]: The PDF, the epoch time the worker started
+        on it and the render time in seconds.
+    """
+    started_at = time.time()
+    started = time.perf_counter()
+    ticket = Ticket(**ticket)
+    lines = [
+        (b"F2", 11, "Booking", ticket.booking_id),
+        (b"F1", 11, "Passenger", f"{ticket.passenger_name} ({ticket.passenger} of {ticket.passengers})"),
+        (b"F1", 11, "Route", ticket.route.replace("_", " - ")),
+        (b"F1", 11, "Departure", ticket.departure),
+        (b"F1", 11, "Class", ticket.seat_class),
+    ]
+    if ticket.total:
+        lines.append((b"F1", 11, "Total paid", ticket.total))
+    content = [
+        b"0.05 0.30 0.55 rg\n0 %d %d 48 re\nf\n" % (_PAGE_HEIGHT - 48, _PAGE_WIDTH),
+        b"BT 1 1 1 rg /F2 16 Tf 20 %d Td (FERRY TICKET) Tj ET\n" % (_PAGE_HEIGHT - 31),
+    ]
+    y = _PAGE_HEIGHT - 76
+    for font, size, label, value in lines:
+        content.append(b"BT 0.4 0.4 0.4 rg /F1 8 Tf 20 %d Td (%s) Tj ET\n" % (y + 11, _pdf_text(label.upper())))
+        content.append(b"BT 0 0 0 rg /%s %d Tf 20 %d Td (%s) Tj ET\n" % (font, size, y - 2, _pdf_text(value)))
+        y -= 30
+    qr_size = 130
+    content.append(_qr_drawing(ticket.code, (_PAGE_WIDTH - qr_size) / 2, 28, qr_size))
+    content.append(b"BT 0 0 0 rg /F1 8 Tf %d 16 Td (%s) Tj ET\n" % ((_PAGE_WIDTH - qr_size) // 2, _pdf_text(ticket.code)))
+    return _pdf_document(b"".join(content)), started_at, time.perf_counter() - started
+
+
+# ---------------------------------------------------------------- media ids
+
+class MediaCache:
+    """
+    Media ids by (tenant, content hash), persisted in SQLite with a TTL.
+
+    Args:
+        db_path (str): SQLite database file (``":memory:"`` for tests).
+        ttl (float): Seconds a media id is reused (WhatsApp keeps media 30 days).
+        max_memory (int): Entries also kept in memory.
+    """
+
+    def __init__(self, db_path: str = "media_cache.db", ttl: float = 29 * 86400, max_memory: int = 10000):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        # Lookups and stores run in worker threads; one at a time on the shared connection
+        self._db_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS media (tenant_id TEXT NOT NULL, content_hash TEXT NOT NULL, "
+                "media_id TEXT NOT NULL, uploaded_at REAL NOT NULL, PRIMARY KEY (tenant_id, content_hash))"
+            )
+            self._db.commit()
+        return self._db
+
+    def _load(self, tenant_id: str, content_hash: str) -> Optional[Tuple[str, float]]:
+        with self._db_lock:
+            return self._connect().execute(
+                "SELECT media_id, uploaded_at FROM media WHERE tenant_id = ? AND content_hash = ?",
+                (tenant_id, content_hash),
+            ).fetchone()
+
+    def _store(self, tenant_id: str, content_hash: str, media_id: str, uploaded_at: float) -> None:
+        with self._db_lock:
+            db = self._connect()
+            with db:
+                db.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)", (tenant_id, content_hash, media_id, uploaded_at))
+
+    def _remember(self, key: Tuple[str, str], entry: Tuple[str, float]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    async def get(self, tenant_id: str, content_hash: str) -> Optional[str]:
+        key = (tenant_id, content_hash)
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._load, tenant_id, content_hash)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    async def put(self, tenant_id: str, content_hash: str, media_id: str) -> None:
+        uploaded_at = time.time()
+        self._remember((tenant_id, content_hash), (media_id, uploaded_at))
+        await asyncio.to_thread(self._store, tenant_id, content_hash, media_id, uploaded_at)
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class LocalMediaUploader:
+    """
+    Stand-in for ``whatsapp.upload_media`` that keeps files in a directory.
+
+    Args:
+        directory (str): Where uploaded files are written.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def __call__(self, content: bytes, mime_type: str, filename: str, tenant=None) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        media_id = f"local-{hashlib.sha256(content).hexdigest()[:24]}"
+        path = os.path.join(self.directory, f"{media_id}-{filename}")
+        await asyncio.to_thread(_write_file, path, content)
+        return media_id
+
+
+def _write_file(path: str, content: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+# ---------------------------------------------------------------- pipeline
+
+class TicketPipeline:
+    """
+    Args:
+        upload (Callable): ``async upload(content, mime_type, filename, tenant) -> media_id``.
+        send (Callable): ``async send(to, media_id, media_type=..., caption=..., filename=...,
+            idempotency_key=..., tenant=...) -> Dict``.
+        cache (MediaCache): Media ids by content hash.
+        workers (int): Render processes.
+        max_pending (int): Tickets submitted to the pool and not yet rendered at most.
+    """
+
+    def __init__(self, upload: Callable[..., Awaitable[str]], send: Callable[..., Awaitable[Dict]],
+                 cache: MediaCache, workers: int = 2, max_pending: int = 64):
+        self.upload = upload
+        self.send = send
+        self.cache = cache
+        self.workers = workers
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: set = set()
+        self.on_sent: Optional[Callable[[Dict, str], None]] = None
+
+        self.render_time = LatencyHistogram()
+        self.queue_time = LatencyHistogram()
+        self.rendered = 0
+        self.rendered_bytes = 0
+        self.uploads = 0
+        self.sent = 0
+        self.failed = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def warm_up(self) -> None:
+        """Start every render process (blocking; a readiness step) so the first tickets do not wait for spawn."""
+        pool = self._executor()
+        for future in [pool.submit(time.sleep, 0.05) for _ in range(self.workers)]:
+            future.result()
+
+    async def render(self, ticket: Ticket) -> bytes:
+        """Render one ticket in the pool; waits while ``max_pending`` tickets are queued."""
+        async with self._slots:
+            submitted_at = time.time()
+            pdf, started_at, seconds = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), render_ticket_pdf, asdict(ticket)
+            )
+        self.queue_time.add(started_at - submitted_at)
+        self.render_time.add(seconds)
+        self.rendered += 1
+        self.rendered_bytes += len(pdf)
+        return pdf
+
+    async def media_id(self, content: bytes, filename: str, tenant=None) -> str:
+        """Media id of ``content`` for the tenant, uploading it the first time."""
+        tenant_id = tenant.tenant_id if tenant is not None else ""
+        content_hash = hashlib.sha256(content).hexdigest()
+        media_id = await self.cache.get(tenant_id, content_hash)
+        if media_id is None:
+            media_id = await self.upload(content, PDF_MIME_TYPE, filename, tenant)
+            self.uploads += 1
+            await self.cache.put(tenant_id, content_hash, media_id)
+        return media_id
+
+    async def deliver(self, ticket: Ticket, to: str, tenant=None) -> Dict:
+        """Render, upload (once) and send one ticket."""
+        pdf = await self.render(ticket)
+        media_id = await self.media_id(pdf, ticket.filename, tenant)
+        result = await self.send(
+            to,
+            media_id,
+            media_type="document",
+            caption=f"Ticket {ticket.passenger} of {ticket.passengers} for booking {ticket.booking_id}",
+            filename=ticket.filename,
+            idempotency_key=f"{ticket.code}:ticket",
+            tenant=tenant,
+        )
+        if self.on_sent is not None:
+            self.on_sent(result, to)
+        self.sent += 1
+        return result
+
+    async def _deliver_all(self, tickets: List[Ticket], to: str, tenant) -> None:
+        results = await asyncio.gather(*(self.deliver(ticket, to, tenant) for ticket in tickets),
+                                       return_exceptions=True)
+        for ticket, result in zip(tickets, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                logger.error(f"Ticket {ticket.code} was not sent: {type(result).__name__}: {result}")
+
+    def enqueue(self, tickets: List[Ticket], to: str, tenant=None) -> None:
+        """Deliver tickets in the background; returns at once."""
+        task = asyncio.get_running_loop().create_task(self._deliver_all(tickets, to, tenant))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> Dict:
+        """Finish the tickets in progress, then stop the render processes."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, True, cancel_futures=True)
+            self._pool = None
+        self.cache.close()
+        return {"sent": self.sent, "failed": self.failed}
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "in_progress": len(self._tasks),
+            "rendered": self.rendered,
+            "rendered_bytes": self.rendered_bytes,
+            "render_time": self.render_time.summary(),
+            "queue_time": self.queue_time.summary(),
+            "uploads": self.uploads,
+            "media_cache": {"hits": self.cache.hits, "misses": self.cache.misses},
+            "sent": self.sent,
+            "failed": self.failed,
+        }
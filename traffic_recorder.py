@@ -0,0 +1,217 @@
+"""Record real flow traffic for replay-based performance testing.
+
+Decrypted ``/flow-data`` requests and raw ``/webhook`` events are appended
+to a JSON lines log so ``traffic_replay.py`` can later drive the app with
+the real mix of screens, actions and timings.
+
+Recording never slows a request down: ``record`` is a non-blocking
+``put_nowait`` onto a bounded queue (events are dropped, and counted, when it
+is full). A background task redacts the events, serializes them and appends
+them in batches from a worker thread. The log rotates by size
+(``traffic.jsonl`` → ``traffic.jsonl.1`` → ...).
+
+Personal data is pseudonymized before anything touches the disk: names,
+emails, phone and ID numbers and message texts are replaced character by
+character (digits by digits, letters by letters, punctuation kept) using a
+keyed hash; phone numbers keep their country and operator prefix. Values
+keep their shape, so replayed requests still pass validation, and the same
+person maps to the same pseudonym throughout a log.
+``flow_token`` is kept so journeys can be replayed in order.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Flow fields and webhook keys that hold personal data
+PII_FIELDS = frozenset({
+    # flow screens (floww.json and the booking flow)
+    "jina_la_kwanza", "jina_la_kati", "jina_la_mwisho", "barua_pepe", "namba_ya_simu",
+    "namba_ya_malipo", "wasafiri_wengine", "full_name", "email_input", "phone_input", "id_number",
+    # webhook payloads
+    "from", "to", "wa_id", "recipient_id", "name", "body", "display_phone_number", "caption",
+})
+
+# Identifiers replay depends on; never redacted even if they look like phone numbers
+KEEP_FIELDS = frozenset({"phone_number_id", "flow_token", "flow_id", "id", "timestamp", "version"})
+
+_PHONE_LIKE = re.compile(r"^\+?\d{9,15}$")
+_DIGITS = "0123456789"
+_LOWER = "abcdefghijklmnopqrstuvwxyz"
+
+
+class Redactor:
+    """
+    Shape-preserving keyed pseudonymization.
+
+    Args:
+        salt (Optional[bytes]): Key of the hash; random per process when omitted,
+            so pseudonyms cannot be reversed by hashing guessed values.
+        fields (frozenset): Keys whose string values are always redacted.
+    """
+
+    def __init__(self, salt: Optional[bytes] = None, fields: frozenset = PII_FIELDS):
+        self.salt = salt or os.urandom(16)
+        self.fields = fields
+
+    def pseudonym(self, value: str, keep: int = 0) -> str:
+        """Replace the characters of ``value`` after the first ``keep`` ones."""
+        digest = hmac.new(self.salt, value.encode("utf-8"), hashlib.sha256).digest()
+        out = [value[:keep]]
+        for i, char in enumerate(value[keep:]):
+            b = digest[i % len(digest)] ^ (i >> 5)
+            if char.isdigit():
+                out.append(_DIGITS[b % 10])
+            elif char.isalpha():
+                letter = _LOWER[b % 26]
+                out.append(letter.upper() if char.isupper() else letter)
+            else:
+                out.append(char)
+        return "".join(out)
+
+    def redact(self, node, key: Optional[str] = None):
+        """Return a redacted copy of a JSON-like structure."""
+        if isinstance(node, dict):
+            return {k: self.redact(v, k) for k, v in node.items()}
+        if isinstance(node, list):
+            return [self.redact(v, key) for v in node]
+        if not isinstance(node, str) or key in KEEP_FIELDS:
+            return node
+        if _PHONE_LIKE.match(node):
+            # Keep country code and operator prefix so the number still normalizes; the
+            # subscriber number (last 7 digits) is replaced
+            return self.pseudonym(node, keep=max(0, len(node) - 7))
+        if key in self.fields:
+            return self.pseudonym(node)
+        return node
+
+
+class TrafficRecorder:
+    """
+    Args:
+        path (Optional[str]): JSON lines log; recording is disabled when None.
+        max_bytes (int): Size at which the log is rotated.
+        backups (int): Rotated files kept (``path.1`` is the most recent).
+        sample_ratio (float): Fraction of events recorded.
+        redactor (Optional[Redactor]): Pseudonymizes personal data.
+        max_queue (int): Events waiting for the writer at most; the excess is dropped.
+        batch_size (int): Events written per batch.
+    """
+
+    def __init__(self, path: Optional[str], max_bytes: int = 50 * 1024 * 1024, backups: int = 5,
+                 sample_ratio: float = 1.0, redactor: Optional[Redactor] = None,
+                 max_queue: int = 10000, batch_size: int = 500):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.sample_ratio = sample_ratio
+        self.redactor = redactor or Redactor()
+        self.batch_size = batch_size
+        self._queue: "asyncio.Queue[Dict]" = asyncio.Queue(maxsize=max_queue)
+        self._writer: Optional[asyncio.Task] = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.sample_ratio > 0
+
+    def record(self, kind: str, body: Dict, **meta) -> bool:
+        """
+        Queue one event. Never blocks.
+
+        Args:
+            kind (str): "flow_data" or "webhook".
+            body (Dict): Decrypted flow request or webhook body; it must not be
+                mutated afterwards, because redaction happens in the background.
+            **meta: Extra fields stored with the event (tenant, latency_ms, ...).
+
+        Returns:
+            bool: False if the event was not recorded (disabled, sampled out or queue full).
+        """
+        if not self.enabled or (self.sample_ratio < 1.0 and random.random() >= self.sample_ratio):
+            return False
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait({"ts": time.time(), "kind": kind, **meta, "body": body})
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.recorded += 1
+        return True
+
+    def _ensure_writer(self) -> None:
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_loop())
+
+    def _serialize(self, events: List[Dict]) -> str:
+        lines = []
+        for event in events:
+            event["body"] = self.redactor.redact(event["body"])
+            lines.append(json.dumps(event, separators=(",", ":"), default=str))
+        return "\n".join(lines) + "\n"
+
+    def _rotate(self) -> None:
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def _append(self, events: List[Dict]) -> None:
+        data = self._serialize(events).encode("utf-8")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+        self.written += len(events)
+
+    async def _write_batch(self, events: List[Dict]) -> None:
+        try:
+            # Redaction and serialization happen in the worker thread too
+            await asyncio.to_thread(self._append, events)
+        except Exception as e:
+            self.dropped += len(events)
+            logger.error(f"Traffic recording batch failed: {str(e)}")
+
+    async def _write_loop(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write_batch(batch)
+
+    async def flush(self) -> None:
+        """Write everything queued so far (used on shutdown)."""
+        batch: List[Dict] = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._write_batch(batch)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "written": self.written,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+        }
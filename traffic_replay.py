@@ -0,0 +1,327 @@
+"""Replay recorded flow traffic and compare latency against a baseline.
+
+Reads logs written by ``TrafficRecorder`` (``TRAFFIC_RECORD_FILE``), encrypts
+every ``/flow-data`` request again with a test key exactly as Meta would, and
+drives the events at the app with their original spacing (or faster). Events
+of the same ``flow_token`` stay in order, so journeys see the session state
+they expect. Latency is reported per event group (``flow_data:<action>:<screen>``,
+``webhook:<type>``) and can be stored as a baseline or compared with one::
+
+    # in-process: throwaway key, temp stores, Graph API answered locally
+    python traffic_replay.py traffic.jsonl* --speed 10 --save-baseline baseline.json
+    python traffic_replay.py traffic.jsonl* --speed 10 --baseline baseline.json
+
+    # against a running (staging) worker that holds the test private key
+    python traffic_replay.py traffic.jsonl --url http://localhost:8000 --public-key test_public.pem
+
+The exit status is 1 when any group's p95 regressed by more than
+``--tolerance`` (and by at least ``--min-delta-ms``).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from base64 import b64decode, b64encode
+from typing import Dict, List, Optional, Tuple
+
+
+# ---------------------------------------------------------------- events
+
+def load_events(paths: List[str], kinds: Tuple[str, ...]) -> List[Dict]:
+    """Read recorded events from (possibly rotated) logs, ordered by time."""
+    events = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue  # torn last line of a live log
+                if event.get("kind") in kinds:
+                    events.append(event)
+    events.sort(key=lambda e: e["ts"])
+    return events
+
+
+def group_of(event: Dict) -> str:
+    body = event["body"]
+    if event["kind"] == "flow_data":
+        return f"flow_data:{body.get('action')}:{body.get('screen') or '-'}"
+    try:
+        value = body["entry"][0]["changes"][0]["value"]
+    except (KeyError, IndexError, TypeError):
+        return "webhook:unknown"
+    messages = value.get("messages")
+    return f"webhook:{messages[0].get('type')}" if messages else "webhook:statuses"
+
+
+def ordering_key(event: Dict) -> Optional[str]:
+    """Events sharing this key are replayed strictly one after another."""
+    if event["kind"] == "flow_data":
+        return event["body"].get("flow_token")
+    return None
+
+
+# ---------------------------------------------------------------- crypto
+
+class FlowCipher:
+    """Encrypts flow requests for the app's public key and decrypts its responses."""
+
+    def __init__(self, public_key_pem: bytes):
+        from cryptography.hazmat.primitives.serialization import load_pem_public_key
+
+        self.public_key = load_pem_public_key(public_key_pem)
+
+    def encrypt(self, body: Dict) -> Tuple[Dict, bytes, bytes]:
+        from cryptography.hazmat.primitives.asymmetric.padding import MGF1, OAEP, hashes
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        aes_key, iv = os.urandom(16), os.urandom(12)
+        encryptor = Cipher(algorithms.AES(aes_key), modes.GCM(iv)).encryptor()
+        data = encryptor.update(json.dumps(body).encode("utf-8")) + encryptor.finalize() + encryptor.tag
+        encrypted_key = self.public_key.encrypt(
+            aes_key, OAEP(mgf=MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+        )
+        return {
+            "encrypted_flow_data": b64encode(data).decode(),
+            "encrypted_aes_key": b64encode(encrypted_key).decode(),
+            "initial_vector": b64encode(iv).decode(),
+        }, aes_key, iv
+
+    @staticmethod
+    def decrypt(text: str, aes_key: bytes, iv: bytes) -> Dict:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        raw = b64decode(text)
+        flipped_iv = bytes(b ^ 0xFF for b in iv)
+        decryptor = Cipher(algorithms.AES(aes_key), modes.GCM(flipped_iv, raw[-16:])).decryptor()
+        return json.loads(decryptor.update(raw[:-16]) + decryptor.finalize())
+
+
+# ---------------------------------------------------------------- targets
+
+def _prepare_in_process(workdir: str) -> bytes:
+    """Point the app at throwaway state and a fresh test key; return the public key."""
+    from utils.security import generate_rsa_key_pair
+
+    public_pem, private_pem = generate_rsa_key_pair()
+    key_path = os.path.join(workdir, "replay_private.pem")
+    with open(key_path, "w") as f:
+        f.write(private_pem)
+    os.environ.update({
+        "FLOW_PRIVATE_KEY_PATH": key_path,
+        "TENANTS_FILE": os.path.join(workdir, "no-tenants.json"),
+        "SESSION_STORE_DIR": os.path.join(workdir, "sessions"),
+        "DELIVERY_DB_PATH": os.path.join(workdir, "delivery.db"),
+        "BOOKINGS_DB_PATH": os.path.join(workdir, "bookings.db"),
+        "LANGUAGE_PREFERENCES_DB_PATH": os.path.join(workdir, "language.db"),
+        "BOOKING_ID_SLOT_DIR": os.path.join(workdir, "booking_id_slots"),
+        "REMINDERS_DB_PATH": os.path.join(workdir, "reminders.db"),
+        "MEDIA_CACHE_DB_PATH": os.path.join(workdir, "media_cache.db"),
+        "PAYMENTS_DB_PATH": os.path.join(workdir, "payments.db"),
+        # Recorded PAYMENT screens are charged against the local stand-in provider
+        "MOCK_PAYMENTS": "true",
+        "WEBHOOK_LOG_DIR": os.path.join(workdir, "webhook_log"),
+        "REPORTS_DIR": os.path.join(workdir, "reports"),
+        "TRACE_FILE": "",
+        "TRAFFIC_RECORD_FILE": "",
+        "ACCESS_TOKEN": os.getenv("ACCESS_TOKEN") or "replay",
+        "PHONE_NUMBER_ID": os.getenv("PHONE_NUMBER_ID") or "replay",
+        "WHATSAPP_API_VERSION": os.getenv("WHATSAPP_API_VERSION") or "v22.0",
+    })
+    return public_pem.encode()
+
+
+def _local_graph_api(main_module, latency: float) -> None:
+    """Answer outbound Graph API calls locally so a replay never messages real users."""
+    import httpx
+
+    counter = iter(range(1, 1 << 62))
+
+    async def handler(request):
+        if latency:
+            await asyncio.sleep(latency)
+        return httpx.Response(200, json={"messages": [{"id": f"wamid.replay.{next(counter)}"}]})
+
+    for tenant in main_module.tenant_registry:
+        tenant.client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+# ---------------------------------------------------------------- replay
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int]) -> Dict[str, Dict]:
+    groups = {}
+    for group in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(group, []))
+        stats = {"count": len(values), "errors": errors.get(group, 0)}
+        if values:
+            stats.update({
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(_percentile(values, 50), 3),
+                "p95_ms": round(_percentile(values, 95), 3),
+                "p99_ms": round(_percentile(values, 99), 3),
+            })
+        groups[group] = stats
+    return groups
+
+
+async def replay(events: List[Dict], client, cipher: FlowCipher, speed: float, concurrency: int) -> Dict[str, Dict]:
+    """
+    Send the events and measure their latency.
+
+    Args:
+        events (List[Dict]): Recorded events in time order.
+        client (httpx.AsyncClient): Client bound to the target app.
+        cipher (FlowCipher): Encrypts flow requests for the target's key.
+        speed (float): Time compression (1 = original spacing, 0 = as fast as possible).
+        concurrency (int): Maximum requests in flight.
+
+    Returns:
+        Dict[str, Dict]: Latency summary per event group.
+    """
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    previous: Dict[str, asyncio.Task] = {}
+
+    async def send(event: Dict, after: Optional[asyncio.Task]) -> None:
+        if after is not None:
+            await asyncio.wait([after])
+        group = group_of(event)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                if event["kind"] == "flow_data":
+                    payload, aes_key, iv = cipher.encrypt(event["body"])
+                    response = await client.post("/flow-data", json=payload)
+                    ok = response.status_code == 200
+                    if ok:
+                        cipher.decrypt(response.text, aes_key, iv)
+                else:
+                    response = await client.post("/webhook", json=event["body"])
+                    ok = response.status_code == 200 and response.json().get("status") != "error"
+            except Exception:
+                ok = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        if ok:
+            latencies.setdefault(group, []).append(elapsed_ms)
+        else:
+            errors[group] = errors.get(group, 0) + 1
+
+    tasks = []
+    first_ts = events[0]["ts"] if events else 0.0
+    started_at = time.perf_counter()
+    for event in events:
+        if speed > 0:
+            delay = (event["ts"] - first_ts) / speed - (time.perf_counter() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        key = ordering_key(event)
+        task = asyncio.create_task(send(event, previous.get(key) if key else None))
+        if key:
+            previous[key] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    return summarize(latencies, errors)
+
+
+def compare(current: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float, min_delta_ms: float) -> List[str]:
+    """Return a description of every group whose p95 regressed beyond the tolerance."""
+    regressions = []
+    for group, stats in current.items():
+        base = baseline.get(group)
+        if not base or "p95_ms" not in base or "p95_ms" not in stats:
+            continue
+        delta = stats["p95_ms"] - base["p95_ms"]
+        if delta > min_delta_ms and stats["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{group}: p95 {base['p95_ms']:.2f} -> {stats['p95_ms']:.2f} ms (+{delta:.2f})")
+    return regressions
+
+
+def print_report(current: Dict[str, Dict], baseline: Optional[Dict[str, Dict]]) -> None:
+    print(f"{'group':<42} {'count':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'base p95':>9}")
+    for group, stats in current.items():
+        base_p95 = (baseline or {}).get(group, {}).get("p95_ms")
+        print(f"{group:<42} {stats['count']:>6} {stats['errors']:>4} "
+              f"{stats.get('p50_ms', float('nan')):>8.2f} {stats.get('p95_ms', float('nan')):>8.2f} "
+              f"{stats.get('p99_ms', float('nan')):>8.2f} "
+              f"{base_p95 if base_p95 is not None else '-':>9}")
+
+
+async def run(args) -> int:
+    import httpx
+
+    events = load_events(args.logs, tuple(args.kinds.split(",")))
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        print("no events to replay")
+        return 2
+
+    if args.url:
+        if not args.public_key:
+            print("--public-key is required with --url")
+            return 2
+        with open(args.public_key, "rb") as f:
+            cipher = FlowCipher(f.read())
+        async with httpx.AsyncClient(base_url=args.url, timeout=30.0) as client:
+            current = await replay(events, client, cipher, args.speed, args.concurrency)
+    else:
+        workdir = tempfile.mkdtemp(prefix="replay-")
+        cipher = FlowCipher(_prepare_in_process(workdir))
+        import main
+
+        _local_graph_api(main, args.graph_latency_ms / 1000)
+        async with main.lifespan(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=30.0) as client:
+                current = await replay(events, client, cipher, args.speed, args.concurrency)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["groups"]
+    print(f"replayed {len(events)} events")
+    print_report(current, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "events": len(events), "speed": args.speed, "groups": current}, f, indent=2)
+        print(f"baseline written to {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare(current, baseline, args.tolerance, args.min_delta_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded flow traffic and compare per-screen latency.")
+    parser.add_argument("logs", nargs="+", help="Recorded JSONL logs (rotated files included)")
+    parser.add_argument("--url", help="Target base URL; replays in-process when omitted")
+    parser.add_argument("--public-key", help="Public key matching the target's flow private key (with --url)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Time compression; 0 replays as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--kinds", default="flow_data,webhook")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N events")
+    parser.add_argument("--graph-latency-ms", type=float, default=50.0, help="Simulated Graph API latency (in-process)")
+    parser.add_argument("--save-baseline", help="Write the latency summary to this file")
+    parser.add_argument("--baseline", help="Compare against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95 increase")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="Ignore p95 increases smaller than this")
+    sys.exit(asyncio.run(run(parser.parse_args())))
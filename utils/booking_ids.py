@@ -0,0 +1,265 @@
+"""Snowflake-style booking reference generator.
+
+Booking references are minted locally instead of waiting on a database
+sequence inside the flow response deadline. Each ID packs three fields into
+60 bits:
+
+- 40 bits: milliseconds since ``EPOCH`` (2025-01-01, good for ~34 years),
+- 8 bits: worker id (256 concurrently running workers),
+- 12 bits: per-millisecond sequence (4096 IDs per millisecond and worker).
+
+The number is written as 12 Crockford base32 characters (no I, L, O or U, so
+nothing is misread on a printed ticket), grouped as ``BK-XXXX-XXXX-XXXX``,
+with an optional Crockford check symbol appended.
+
+IDs are unique across uvicorn workers without any coordination on the hot
+path: at startup each process claims a worker id by taking an exclusive
+``flock`` on one of the slot files in a shared directory (released
+automatically when the process dies), or uses a fixed id from the
+environment. The slot file holds a high-water mark the worker reserves ahead of
+the timestamps it hands out (``reserve_ms`` at a time, so it is rewritten only
+that often), and the next holder of the slot starts after it. A restarted
+worker therefore does not reuse a millisecond even after a crash, or if the
+clock went back meanwhile. ``hold_idle_slot`` lets another process lock the
+slot of a worker that is not running, e.g. to finish the files it left.
+Within a process IDs are strictly increasing: when the clock steps backwards
+or a millisecond's sequence is exhausted, the generator keeps counting on the
+last timestamp instead of sleeping.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, a fixed worker id is required there
+    fcntl = None
+
+EPOCH_MS = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+TIME_BITS = 40
+WORKER_BITS = 8
+SEQUENCE_BITS = 12
+MAX_WORKERS = 1 << WORKER_BITS
+_SEQUENCE_MASK = (1 << SEQUENCE_BITS) - 1
+_WORKER_MASK = MAX_WORKERS - 1
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Crockford check symbols: value mod 37, the extra symbols cover 32..36
+CHECK_ALPHABET = ALPHABET + "*~$=U"
+_DECODE = {c: i for i, c in enumerate(ALPHABET)}
+_DECODE.update({"O": 0, "I": 1, "L": 1})
+_ID_CHARS = 12
+PREFIX = "BK"
+
+
+class InvalidBookingId(ValueError):
+    """Raised for malformed booking references or a wrong check symbol."""
+
+
+class BookingIdParts(NamedTuple):
+    created_at: datetime
+    worker_id: int
+    sequence: int
+
+
+def encode(value: int, check: bool = True) -> str:
+    """Format a 60-bit ID as ``BK-XXXX-XXXX-XXXX[C]``."""
+    chars = []
+    for _ in range(_ID_CHARS):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    body = "".join(reversed(chars))
+    text = f"{PREFIX}-{body[0:4]}-{body[4:8]}-{body[8:12]}"
+    if check:
+        text += CHECK_ALPHABET[_numeric(body) % 37]
+    return text
+
+
+def _numeric(body: str) -> int:
+    value = 0
+    for char in body:
+        value = value * 32 + _DECODE[char]
+    return value
+
+
+def decode(text: str, check: Optional[bool] = None) -> int:
+    """
+    Parse a booking reference back into its 60-bit value.
+
+    Case, dashes and the letters O/I/L (read as 0/1/1) are tolerated.
+
+    Args:
+        text (str): Booking reference as printed or typed by a passenger.
+        check (Optional[bool]): Whether a check symbol is expected; detected
+            from the length when None.
+
+    Raises:
+        InvalidBookingId: If the reference is malformed or the check symbol does not match.
+    """
+    compact = text.strip().upper().replace("-", "").replace(" ", "")
+    if compact.startswith(PREFIX):
+        compact = compact[len(PREFIX):]
+    if check is None:
+        check = len(compact) == _ID_CHARS + 1
+    if len(compact) != _ID_CHARS + (1 if check else 0):
+        raise InvalidBookingId(f"Invalid booking reference: {text}")
+    body = compact[:_ID_CHARS]
+    if any(char not in _DECODE for char in body):
+        raise InvalidBookingId(f"Invalid booking reference: {text}")
+    value = _numeric(body)
+    if check and CHECK_ALPHABET[value % 37] != compact[-1]:
+        raise InvalidBookingId(f"Booking reference check symbol mismatch: {text}")
+    return value
+
+
+def parse(text: str) -> BookingIdParts:
+    """Split a booking reference into creation time, worker id and sequence."""
+    value = decode(text)
+    millis = (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return BookingIdParts(
+        created_at=datetime.fromtimestamp(millis / 1000, tz=timezone.utc),
+        worker_id=(value >> SEQUENCE_BITS) & _WORKER_MASK,
+        sequence=value & _SEQUENCE_MASK,
+    )
+
+
+class BookingIdGenerator:
+    """
+    Args:
+        worker_id (Optional[int]): Fixed worker id (0-255). When None a free
+            slot is claimed in ``slot_dir``.
+        slot_dir (Optional[str]): Directory shared by the workers of a host
+            (or a shared volume for several hosts) holding the slot files.
+        check_symbol (bool): Append a Crockford check symbol to references.
+        reserve_ms (int): How far ahead of the IDs handed out the slot file's
+            high-water mark is written.
+    """
+
+    def __init__(self, worker_id: Optional[int] = None, slot_dir: Optional[str] = None,
+                 check_symbol: bool = True, reserve_ms: int = 10_000):
+        self.check_symbol = check_symbol
+        self.slot_dir = slot_dir
+        self.reserve_ms = reserve_ms
+        self._slot_file = None
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._reserved_ms = 0
+        self._sequence = 0
+        self.generated = 0
+        self.borrowed_ms = 0
+        self.worker_id = self._claim(worker_id)
+
+    # ------------------------------------------------------------ worker slots
+
+    def _claim(self, worker_id: Optional[int]) -> int:
+        if worker_id is not None:
+            if not 0 <= worker_id < MAX_WORKERS:
+                raise ValueError(f"worker_id must be between 0 and {MAX_WORKERS - 1}")
+            if self.slot_dir and fcntl is not None:
+                if not self._try_slot(worker_id):
+                    raise RuntimeError(f"Booking ID worker slot {worker_id} is held by another process")
+            return worker_id
+        if not self.slot_dir or fcntl is None:
+            raise RuntimeError("Booking IDs need a worker id or a slot directory (flock)")
+        os.makedirs(self.slot_dir, exist_ok=True)
+        for candidate in range(MAX_WORKERS):
+            if self._try_slot(candidate):
+                return candidate
+        raise RuntimeError(f"All {MAX_WORKERS} booking ID worker slots in {self.slot_dir} are taken")
+
+    def _try_slot(self, worker_id: int) -> bool:
+        f = hold_idle_slot(self.slot_dir, worker_id)
+        if f is None:
+            return False
+        f.seek(0)
+        high_water = f.read().strip()
+        # The previous holder of this slot may have handed out IDs up to and including
+        # this millisecond (any sequence), so start on the next one
+        self._last_ms = int(high_water) + 1 if high_water.isdigit() else 0
+        self._sequence = 0
+        self._slot_file = f
+        self._reserve(self._last_ms)
+        return True
+
+    def _reserve(self, millis: int) -> None:
+        """Persist a high-water mark ahead of ``millis`` before IDs past it are handed out."""
+        self._reserved_ms = millis + self.reserve_ms
+        self._save_high_water(self._reserved_ms)
+
+    def _save_high_water(self, millis: int) -> None:
+        if self._slot_file is None:
+            return
+        self._slot_file.seek(0)
+        self._slot_file.truncate()
+        self._slot_file.write(str(millis))
+        self._slot_file.flush()
+        os.fsync(self._slot_file.fileno())
+
+    def close(self) -> None:
+        """Give back the unused part of the reservation and release the worker slot."""
+        if self._slot_file is not None:
+            with self._lock:
+                self._save_high_water(self._last_ms)
+            self._slot_file.close()
+            self._slot_file = None
+
+    # ------------------------------------------------------------ IDs
+
+    def next_value(self) -> int:
+        """Next 60-bit ID of this worker, strictly greater than the previous one."""
+        now = int(time.time() * 1000) - EPOCH_MS
+        with self._lock:
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting on the
+                # last timestamp, moving on to the next millisecond when exhausted
+                self._sequence = (self._sequence + 1) & _SEQUENCE_MASK
+                if self._sequence == 0:
+                    self._last_ms += 1
+                    self.borrowed_ms += 1
+            if self._last_ms >= self._reserved_ms:
+                self._reserve(self._last_ms)
+            self.generated += 1
+            return (self._last_ms << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self) -> str:
+        """Next booking reference, e.g. ``BK-1MSV-N731-003J9``."""
+        return encode(self.next_value(), check=self.check_symbol)
+
+    def stats(self) -> Dict:
+        return {
+            "worker_id": self.worker_id,
+            "generated": self.generated,
+            "borrowed_ms": self.borrowed_ms,
+            "check_symbol": self.check_symbol,
+        }
+
+
+def hold_idle_slot(slot_dir: str, worker_id: int):
+    """
+    Lock the slot of a worker that is not running.
+
+    Args:
+        slot_dir (str): Directory of the slot files.
+        worker_id (int): Worker whose slot to lock.
+
+    Returns:
+        The open slot file, which holds the lock until it is closed, or None if
+        a running process holds the slot (or there is no ``flock``).
+    """
+    if fcntl is None:
+        return None
+    os.makedirs(slot_dir, exist_ok=True)
+    f = open(os.path.join(slot_dir, f"worker-{worker_id:03d}.slot"), "a+")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
@@ -0,0 +1,283 @@
+"""Deadline propagation and admission control for the flow endpoint.
+
+Meta drops a data exchange request that has not been answered within its
+response window, so work that cannot finish in time is wasted. A ``Deadline``
+is stamped when the request arrives and travels with it (via a context
+variable) through decrypt, the screen handler and encrypt. The deadline
+belongs to the task that opened the scope: tasks spawned while handling the
+request (flushers, payment charges, ticket sends) copy the context variable
+but are not bound by it. The ``AdmissionController`` bounds how many requests
+run at once and sheds new work early when the expected queueing delay would
+push it past its deadline.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+# The deadline and the task it applies to
+_current_deadline: contextvars.ContextVar[Optional[Tuple["Deadline", asyncio.Task]]] = contextvars.ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has run out of its time budget."""
+
+    def __init__(self, phase: str, overrun: float):
+        super().__init__(f"Deadline exceeded during {phase} (over by {overrun * 1000:.1f} ms)")
+        self.phase = phase
+        self.overrun = overrun
+
+
+class LoadShed(Exception):
+    """Raised by admission control when a request is rejected early."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+
+
+class Deadline:
+    """Absolute point in (monotonic) time by which a request must be answered."""
+
+    __slots__ = ("arrival", "expires_at")
+
+    def __init__(self, arrival: float, budget: float):
+        self.arrival = arrival
+        self.expires_at = arrival + budget
+
+    @classmethod
+    def from_now(cls, budget: float) -> "Deadline":
+        return cls(time.monotonic(), budget)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.arrival
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, phase: str) -> None:
+        """
+        Raise if the deadline has already passed.
+
+        Args:
+            phase (str): Name of the phase about to start, used in the error.
+
+        Raises:
+            DeadlineExceeded: If no time budget is left.
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(phase, -remaining)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """
+    Return the deadline of the request being handled, if any.
+
+    Only the task that opened the ``deadline_scope`` sees it: background tasks
+    created inside the scope inherit the context variable, but their work
+    outlives the request and must not fail on its deadline. Worker threads
+    (``asyncio.to_thread``) are not bound either.
+    """
+    entry = _current_deadline.get()
+    if entry is None:
+        return None
+    deadline, owner = entry
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:  # no running loop: a worker thread
+        return None
+    return deadline if task is owner else None
+
+
+def check_deadline(phase: str) -> None:
+    """Check the current request's deadline; a no-op outside a request."""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check(phase)
+
+
+@asynccontextmanager
+async def deadline_scope(deadline: Deadline):
+    """Make ``deadline`` the current deadline of this task for the enclosed block."""
+    token = _current_deadline.set((deadline, asyncio.current_task()))
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class AdmissionController:
+    """
+    Bounded-concurrency gate that sheds requests which cannot finish in time.
+
+    ``max_concurrent`` slots are shared by all requests, but ``reserved_high``
+    of them are only available to high priority work (pings and the final
+    PAYMENT step), so a burst of ordinary screen traffic cannot starve them.
+    Waiters are served in priority order, then FIFO.
+
+    A request is rejected up front when the estimated wait for a slot plus the
+    typical service time exceeds its remaining budget, or later if its
+    deadline passes while it is still queued.
+    """
+
+    def __init__(self, max_concurrent: int = 32, reserved_high: int = 4, max_queue: int = 256):
+        self.max_concurrent = max_concurrent
+        self.reserved_high = min(reserved_high, max_concurrent - 1)
+        self.max_queue = max_queue
+        self._in_flight = 0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        # Exponentially weighted moving average of handler service time (seconds)
+        self._service_ewma = 0.01
+        self._alpha = 0.2
+
+        self.admitted = 0
+        self.shed: Dict[str, int] = {}
+        self.deadline_misses: Dict[str, int] = {}
+        self.queue_delay_count = 0
+        self.queue_delay_total = 0.0
+        self.queue_delay_max = 0.0
+
+    def _limit(self, priority: int) -> int:
+        if priority == PRIORITY_HIGH:
+            return self.max_concurrent
+        return self.max_concurrent - self.reserved_high
+
+    def _estimated_wait(self, priority: int) -> float:
+        ahead = sum(1 for p, _, _ in self._waiters if p <= priority)
+        if self._in_flight < self._limit(priority) and ahead == 0:
+            return 0.0
+        return (ahead + 1) * self._service_ewma / max(self._limit(priority), 1)
+
+    def shed_early(self, deadline: Deadline) -> None:
+        """
+        Reject a request before any work is spent on it (decrypting it is the
+        costliest step) if it would be shed on admission even at high priority.
+        Its real priority is only known once it is decrypted, so ``admit``
+        still decides for the requests that pass.
+
+        Raises:
+            LoadShed: If the request cannot be admitted in time.
+        """
+        if deadline.expired():
+            self._record_shed("expired_on_arrival")
+            raise LoadShed("expired_on_arrival")
+        wait = self._estimated_wait(PRIORITY_HIGH)
+        if wait and wait + self._service_ewma > deadline.remaining():
+            self._record_shed("predicted_late")
+            raise LoadShed("predicted_late")
+
+    def _record_shed(self, reason: str) -> None:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+
+    def record_deadline_miss(self, phase: str) -> None:
+        """Count a request that was admitted but ran out of time in ``phase``."""
+        self.deadline_misses[phase] = self.deadline_misses.get(phase, 0) + 1
+
+    def _record_queue_delay(self, delay: float) -> None:
+        self.queue_delay_count += 1
+        self.queue_delay_total += delay
+        if delay > self.queue_delay_max:
+            self.queue_delay_max = delay
+
+    def _wake_next(self) -> None:
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._in_flight >= self._limit(priority):
+                return
+            heapq.heappop(self._waiters)
+            self._in_flight += 1
+            future.set_result(None)
+
+    async def _acquire(self, deadline: Deadline, priority: int) -> None:
+        if self._in_flight < self._limit(priority) and not any(
+            p <= priority for p, _, f in self._waiters if not f.done()
+        ):
+            self._in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue and priority != PRIORITY_HIGH:
+            self._record_shed("queue_full")
+            raise LoadShed("queue_full")
+
+        if self._estimated_wait(priority) + self._service_ewma > deadline.remaining():
+            self._record_shed("predicted_late")
+            raise LoadShed("predicted_late")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await asyncio.wait_for(future, timeout=max(deadline.remaining(), 0))
+        except asyncio.TimeoutError:
+            self._record_shed("expired_in_queue")
+            raise LoadShed("expired_in_queue")
+        except BaseException:
+            # Slot was granted just as we were cancelled: hand it back
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._wake_next()
+
+    @asynccontextmanager
+    async def admit(self, deadline: Deadline, priority: int = PRIORITY_NORMAL):
+        """
+        Hold a concurrency slot for the duration of the block.
+
+        Args:
+            deadline (Deadline): Deadline of the request asking for admission.
+            priority (int): ``PRIORITY_HIGH`` or ``PRIORITY_NORMAL``.
+
+        Raises:
+            LoadShed: If the request is rejected instead of admitted.
+        """
+        if deadline.expired():
+            self._record_shed("expired_on_arrival")
+            raise LoadShed("expired_on_arrival")
+
+        queued_at = time.monotonic()
+        await self._acquire(deadline, priority)
+        self.admitted += 1
+        self._record_queue_delay(time.monotonic() - queued_at)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            service = time.monotonic() - started
+            self._service_ewma += self._alpha * (service - self._service_ewma)
+            self._release()
+
+    def stats(self) -> Dict:
+        """Return admission counters for the metrics endpoint."""
+        count = self.queue_delay_count
+        return {
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "shed_total": sum(self.shed.values()),
+            "deadline_misses": dict(self.deadline_misses),
+            "queue_delay_ms": {
+                "avg": (self.queue_delay_total / count * 1000) if count else 0.0,
+                "max": self.queue_delay_max * 1000,
+            },
+            "service_time_ewma_ms": self._service_ewma * 1000,
+        }
@@ -0,0 +1,71 @@
+"""Check how long ``import main`` takes against a budget.
+
+Runs the import in a fresh interpreter with ``-X importtime``, prints the
+slowest modules by cumulative time and exits non-zero when the total is over
+budget, so a heavy top-level import is caught before it slows every worker
+start and every deploy::
+
+    python -m utils.import_budget                # budget from IMPORT_TIME_BUDGET_MS
+    python -m utils.import_budget --budget-ms 600 --top 15
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str = "main", cwd: str = None) -> Tuple[float, List[Tuple[float, float, str]]]:
+    """
+    Import ``module`` in a fresh interpreter and collect per-module timings.
+
+    Args:
+        module (str): Module to import.
+        cwd (str): Directory to run in (defaults to the repository root).
+
+    Returns:
+        Tuple[float, List[Tuple[float, float, str]]]: Total milliseconds for
+        ``module`` and ``(cumulative_ms, self_ms, name)`` for every top-level
+        import it triggered.
+
+    Raises:
+        RuntimeError: If the import fails.
+    """
+    cwd = cwd or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    total = 0.0
+    top_level: List[Tuple[float, float, str]] = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if name == module:
+            total = int(cumulative_us) / 1000
+        elif len(indent) <= 3:
+            top_level.append((int(cumulative_us) / 1000, int(self_us) / 1000, name))
+    return total, sorted(top_level, reverse=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail when importing the app exceeds a time budget.")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "800")))
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    total_ms, modules = measure(args.module)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_ms, self_ms, name in modules[:args.top]:
+        print(f"{cumulative_ms:>14.1f} {self_ms:>9.1f}  {name}")
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    sys.exit(0 if total_ms <= args.budget_ms else 1)
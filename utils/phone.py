@@ -0,0 +1,148 @@
+"""E.164 phone number normalization for outbound WhatsApp recipients.
+
+Numbers arrive as ``+255712345678``, ``255 712 345 678``, ``0712-345-678``
+or as bare WhatsApp ids. Everything is normalized to E.164 (``+`` followed by
+country code and subscriber number) before it reaches the Graph API, so
+malformed numbers are rejected locally instead of burning quota.
+
+Tanzania and its neighbours have explicit rules (national significant number
+length and valid leading digits for mobile numbers). Other countries are
+accepted in international format with a generic 8-15 digit length check.
+"""
+
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+
+class InvalidPhoneNumber(ValueError):
+    """Raised when a number cannot be normalized to a valid E.164 number."""
+
+
+class CountryRule(NamedTuple):
+    dial_code: str
+    nsn_length: int
+    mobile_prefixes: Tuple[str, ...]
+
+
+COUNTRY_RULES: Dict[str, CountryRule] = {
+    "TZ": CountryRule("255", 9, ("6", "7")),
+    "KE": CountryRule("254", 9, ("1", "7")),
+    "UG": CountryRule("256", 9, ("7",)),
+    "RW": CountryRule("250", 9, ("7",)),
+    "BI": CountryRule("257", 8, ("6", "7")),
+    "CD": CountryRule("243", 9, ("8", "9")),
+    "ZM": CountryRule("260", 9, ("7", "9")),
+    "MW": CountryRule("265", 9, ("8", "9")),
+    "MZ": CountryRule("258", 9, ("8",)),
+}
+
+_RULES_BY_DIAL_CODE = {rule.dial_code: rule for rule in COUNTRY_RULES.values()}
+# All supported dial codes are three digits long.
+_DIAL_CODE_LENGTH = 3
+
+# Separators people type inside numbers; removed in one C-level pass.
+_STRIP = str.maketrans("", "", " -().\t/")
+
+
+def _check_country(country: str) -> None:
+    if country not in COUNTRY_RULES:
+        raise ValueError(f"Unknown default country {country!r}; expected one of {', '.join(COUNTRY_RULES)}")
+
+
+def _check_nsn(nsn: str, rule: CountryRule, raw: str) -> str:
+    if len(nsn) != rule.nsn_length or not nsn.startswith(rule.mobile_prefixes):
+        raise InvalidPhoneNumber(f"Invalid mobile number for +{rule.dial_code}: {raw}")
+    return f"+{rule.dial_code}{nsn}"
+
+
+def _normalize(raw: str, default_country: str) -> str:
+    number = raw.strip().translate(_STRIP)
+    if number.startswith("+"):
+        digits = number[1:]
+    elif number.startswith("00"):
+        digits = number[2:]
+    else:
+        digits = None
+
+    if digits is None:
+        if not number.isdigit():
+            raise InvalidPhoneNumber(f"Phone number must contain only digits: {raw}")
+        rule = COUNTRY_RULES[default_country]
+        if number.startswith("0"):
+            # National format, e.g. 0712345678
+            return _check_nsn(number[1:], rule, raw)
+        if number.startswith(rule.dial_code) and len(number) == _DIAL_CODE_LENGTH + rule.nsn_length:
+            # International format without "+", e.g. WhatsApp ids
+            return _check_nsn(number[_DIAL_CODE_LENGTH:], rule, raw)
+        if len(number) == rule.nsn_length:
+            return _check_nsn(number, rule, raw)
+        digits = number
+
+    if not digits.isdigit():
+        raise InvalidPhoneNumber(f"Phone number must contain only digits: {raw}")
+    rule = _RULES_BY_DIAL_CODE.get(digits[:_DIAL_CODE_LENGTH])
+    if rule is not None:
+        return _check_nsn(digits[_DIAL_CODE_LENGTH:], rule, raw)
+    if not 8 <= len(digits) <= 15 or digits[0] == "0":
+        raise InvalidPhoneNumber(f"Not a valid international number: {raw}")
+    return f"+{digits}"
+
+
+@lru_cache(maxsize=65536)
+def normalize_phone(raw: str, default_country: str = "TZ") -> str:
+    """
+    Normalize a phone number to E.164.
+
+    Args:
+        raw (str): Number as typed, in national or international format.
+        default_country (str): ISO country used for numbers without a country code.
+
+    Returns:
+        str: The number in E.164 format, e.g. "+255712345678".
+
+    Raises:
+        InvalidPhoneNumber: If the number is malformed or not a valid mobile number.
+        ValueError: If ``default_country`` has no rules here.
+    """
+    _check_country(default_country)
+    return _normalize(raw, default_country)
+
+
+def to_wa_id(e164: str) -> str:
+    """Graph API ids (webhook ``from``/``wa_id``) are E.164 without the ``+``."""
+    return e164[1:] if e164.startswith("+") else e164
+
+
+def normalize_batch(numbers: Iterable[str], default_country: str = "TZ") -> Tuple[List[str], Dict[str, str]]:
+    """
+    Normalize and deduplicate a recipient list for a broadcast.
+
+    Skips the LRU cache (broadcast lists are mostly distinct numbers and
+    would only evict the hot single-lookup entries) and deduplicates on both
+    the raw and the normalized form.
+
+    Args:
+        numbers (Iterable[str]): Raw recipient numbers.
+        default_country (str): ISO country used for numbers without a country code.
+
+    Returns:
+        Tuple[List[str], Dict[str, str]]: Unique E.164 numbers in first-seen
+        order, and a map of rejected raw numbers to the reason.
+
+    Raises:
+        ValueError: If ``default_country`` has no rules here.
+    """
+    _check_country(default_country)
+    seen_raw = set()
+    unique: Dict[str, None] = {}
+    invalid: Dict[str, str] = {}
+    normalize = _normalize
+    for raw in numbers:
+        if raw in seen_raw:
+            continue
+        seen_raw.add(raw)
+        try:
+            unique[normalize(raw, default_country)] = None
+        except InvalidPhoneNumber as e:
+            invalid[raw] = str(e)
+    return list(unique), invalid
@@ -0,0 +1,301 @@
+"""On-demand profiling of a running worker.
+
+Nothing here runs unless asked for, so the cost when profiling is off is a
+header scan per request:
+
+- ``SamplingProfiler`` samples the stacks of every thread (``sys._current_frames``)
+  at a fixed interval for N seconds from a background thread and writes them
+  as collapsed stacks (``frame;frame;frame count``), the input format of
+  flamegraph.pl, speedscope and inferno. The event loop keeps serving while
+  it runs.
+- ``RequestProfilerMiddleware`` runs one request under ``cProfile`` when it
+  carries a valid signed ``X-Debug-Profile`` header and dumps a ``.pstats``
+  file (open with ``python -m pstats`` or snakeviz). The profiler is enabled
+  on the event loop thread, so other requests interleaved with the profiled
+  one show up too; only one request is profiled at a time.
+- ``MemoryProfiler`` wraps ``tracemalloc``: snapshots are dumped in the
+  standard tracemalloc format and diffed against the previous snapshot to
+  show what grew (e.g. the flow session store).
+
+Sign a debug header with ``python -m utils.profiling sign``.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional
+
+DEBUG_PROFILE_HEADER = b"x-debug-profile"
+PROFILE_FILE_HEADER = b"x-profile-file"
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile of the same kind is already running in this worker."""
+
+
+def _timestamped(directory: str, kind: str, suffix: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(directory, f"{kind}-{stamp}-pid{os.getpid()}-{os.urandom(2).hex()}{suffix}")
+
+
+# ---------------------------------------------------------------- CPU sampling
+
+class SamplingProfiler:
+    """
+    Args:
+        directory (str): Where collapsed-stack files are written.
+        max_depth (int): Frames kept per stack, innermost first.
+    """
+
+    def __init__(self, directory: str, max_depth: int = 64):
+        self.directory = directory
+        self.max_depth = max_depth
+        self._running = threading.Lock()
+        self.profiles = 0
+
+    def _stack(self, frame) -> str:
+        names: List[str] = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def run(self, seconds: float, interval: float = 0.005) -> Dict:
+        """
+        Sample all threads for ``seconds`` and write a collapsed-stacks file.
+
+        Blocking; call it from a worker thread (``asyncio.to_thread``).
+
+        Returns:
+            Dict: Output path, sample count and the hottest stacks.
+
+        Raises:
+            ProfilerBusy: If a CPU profile is already running in this worker.
+        """
+        if not self._running.acquire(blocking=False):
+            raise ProfilerBusy("a CPU profile is already running in this worker")
+        try:
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            counts: Counter = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        counts[f"{names.get(ident, ident)};{self._stack(frame)}"] += 1
+                samples += 1
+                time.sleep(interval)
+            path = _timestamped(self.directory, "cpu", ".collapsed")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.profiles += 1
+            return {
+                "file": path,
+                "samples": samples,
+                "seconds": seconds,
+                "top": [{"stack": stack.rsplit(";", 3)[-3:], "samples": count} for stack, count in counts.most_common(10)],
+            }
+        finally:
+            self._running.release()
+
+
+# ---------------------------------------------------------------- request cProfile
+
+class DebugHeaderSigner:
+    """
+    Signs and verifies ``X-Debug-Profile`` values of the form ``<expiry>.<hmac-sha256 hex>``.
+
+    Args:
+        key (Optional[str]): Shared secret; without it every header is rejected.
+    """
+
+    def __init__(self, key: Optional[str]):
+        self.key = key.encode("utf-8") if key else None
+
+    def _mac(self, expiry: str) -> str:
+        return hmac.new(self.key, expiry.encode("ascii"), hashlib.sha256).hexdigest()
+
+    def sign(self, ttl: float = 300.0) -> str:
+        if self.key is None:
+            raise ValueError("no profiling signing key configured")
+        expiry = str(int(time.time() + ttl))
+        return f"{expiry}.{self._mac(expiry)}"
+
+    def verify(self, value: str) -> bool:
+        if self.key is None:
+            return False
+        expiry, _, mac = value.partition(".")
+        if not expiry.isdigit() or int(expiry) < time.time():
+            return False
+        return hmac.compare_digest(mac, self._mac(expiry))
+
+
+class RequestProfilerMiddleware:
+    """
+    ASGI middleware that profiles requests carrying a valid signed debug header.
+
+    The profile file name is returned in the ``X-Profile-File`` response header.
+
+    Args:
+        app: The wrapped ASGI application.
+        signer (DebugHeaderSigner): Verifies the header value.
+        directory (str): Where ``.pstats`` files are written.
+    """
+
+    def __init__(self, app, signer: DebugHeaderSigner, directory: str):
+        self.app = app
+        self.signer = signer
+        self.directory = directory
+        self._busy = False
+        self.profiled = 0
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        value = None
+        for name, header_value in scope["headers"]:
+            if name == DEBUG_PROFILE_HEADER:
+                value = header_value.decode("latin-1")
+                break
+        if value is None:
+            return await self.app(scope, receive, send)
+        if self._busy or not self.signer.verify(value):
+            self.rejected += 1
+            return await self.app(scope, receive, send)
+
+        path = _timestamped(self.directory, "request" + scope["path"].replace("/", "_"), ".pstats")
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (PROFILE_FILE_HEADER, os.path.basename(path).encode())]}
+            await send(message)
+
+        self._busy = True
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            profiler.disable()
+            self._busy = False
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(path)
+            self.profiled += 1
+
+    def stats(self) -> Dict:
+        return {"profiled": self.profiled, "rejected": self.rejected, "busy": self._busy}
+
+
+# ---------------------------------------------------------------- memory
+
+class MemoryProfiler:
+    """
+    tracemalloc snapshots with diffs against the previous snapshot.
+
+    Args:
+        directory (str): Where snapshot files are written.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._started_here = False
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 25) -> Dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._started_here = True
+        self._previous = None
+        return self.stats()
+
+    def stop(self) -> Dict:
+        if tracemalloc.is_tracing() and self._started_here:
+            tracemalloc.stop()
+            self._started_here = False
+        self._previous = None
+        return self.stats()
+
+    def snapshot(self, top: int = 20, key_type: str = "lineno") -> Dict:
+        """
+        Dump a snapshot and compare it with the previous one.
+
+        Args:
+            top (int): Number of entries in the returned statistics.
+            key_type (str): Grouping: "lineno", "filename" or "traceback".
+
+        Returns:
+            Dict: Snapshot path, current/peak traced memory and the top
+            allocation sites (or growth since the previous snapshot).
+
+        Raises:
+            RuntimeError: If tracing has not been started.
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("memory tracing is not started")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        path = _timestamped(self.directory, "memory", ".tracemalloc")
+        snapshot.dump(path)
+        current, peak = tracemalloc.get_traced_memory()
+        if self._previous is None:
+            entries = [
+                {"site": str(stat.traceback), "size_kib": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.statistics(key_type)[:top]
+            ]
+            compared_to_previous = False
+        else:
+            entries = [
+                {
+                    "site": str(stat.traceback),
+                    "size_kib": round(stat.size / 1024, 1),
+                    "growth_kib": round(stat.size_diff / 1024, 1),
+                    "count_growth": stat.count_diff,
+                }
+                for stat in snapshot.compare_to(self._previous, key_type)[:top]
+            ]
+            compared_to_previous = True
+        self._previous = snapshot
+        return {
+            "file": path,
+            "traced_kib": round(current / 1024, 1),
+            "peak_kib": round(peak / 1024, 1),
+            "compared_to_previous": compared_to_previous,
+            "top": entries,
+        }
+
+    def stats(self) -> Dict:
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "traced_kib": round(current / 1024, 1),
+            "peak_kib": round(peak / 1024, 1),
+            "has_baseline": self._previous is not None,
+        }
+
+
+if __name__ == "__main__":
+    # Print a debug header value: python -m utils.profiling sign [ttl_seconds]
+    if len(sys.argv) >= 2 and sys.argv[1] == "sign":
+        from config import profile_signing_key as key
+        ttl = float(sys.argv[2]) if len(sys.argv) > 2 else 300.0
+        print(f"X-Debug-Profile: {DebugHeaderSigner(key).sign(ttl)}")
+    else:
+        print("usage: python -m utils.profiling sign [ttl_seconds]")
+        sys.exit(2)
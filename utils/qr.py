@@ -0,0 +1,292 @@
+"""QR code encoder for ticket codes (byte mode, error correction level M).
+
+Only what tickets need is implemented: 8-bit byte mode, level M (about 15%
+of the code may be damaged), versions 1 to 10 (up to 213 bytes). The version
+is the smallest that fits and the mask is chosen by the standard penalty
+rules. The result is a square matrix of booleans (True is dark), without the
+quiet zone, for the renderer to draw.
+"""
+
+from typing import List, Tuple
+
+MAX_VERSION = 10
+
+# Level M, per version (index 0 unused)
+_ECC_CODEWORDS_PER_BLOCK = (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26)
+_NUM_BLOCKS = (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5)
+_FORMAT_ECC_BITS = 0  # level M
+
+_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+
+class QrDataTooLong(ValueError):
+    """Raised when the data does not fit the largest supported version."""
+
+
+def _gf_multiply(x: int, y: int) -> int:
+    """Multiply in GF(2^8) modulo x^8 + x^4 + x^3 + x^2 + 1."""
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _rs_divisor(degree: int) -> List[int]:
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_multiply(root, 0x02)
+    return result
+
+
+def _rs_remainder(data: List[int], divisor: List[int]) -> List[int]:
+    result = [0] * len(divisor)
+    for byte in data:
+        factor = byte ^ result.pop(0)
+        result.append(0)
+        for i, coefficient in enumerate(divisor):
+            result[i] ^= _gf_multiply(coefficient, factor)
+    return result
+
+
+def _raw_data_modules(version: int) -> int:
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        alignments = version // 7 + 2
+        result -= (25 * alignments - 10) * alignments - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+
+def _data_codewords(version: int) -> int:
+    return _raw_data_modules(version) // 8 - _ECC_CODEWORDS_PER_BLOCK[version] * _NUM_BLOCKS[version]
+
+
+def _alignment_positions(version: int) -> List[int]:
+    if version == 1:
+        return []
+    count = version // 7 + 2
+    size = version * 4 + 17
+    step = (version * 8 + count * 3 + 5) // (count * 4 - 4) * 2
+    return [6] + sorted(size - 7 - i * step for i in range(count - 1))
+
+
+class _Matrix:
+    def __init__(self, version: int):
+        self.version = version
+        self.size = version * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.function = [[False] * self.size for _ in range(self.size)]
+
+    def set_function(self, x: int, y: int, dark: bool) -> None:
+        self.modules[y][x] = dark
+        self.function[y][x] = True
+
+    def draw_function_patterns(self) -> None:
+        size = self.size
+        for i in range(size):
+            self.set_function(6, i, i % 2 == 0)
+            self.set_function(i, 6, i % 2 == 0)
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self.set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+        positions = _alignment_positions(self.version)
+        last = len(positions) - 1
+        for i, cx in enumerate(positions):
+            for j, cy in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue  # overlaps a finder pattern
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set_function(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+        self.draw_format_bits(0)  # reserves the area; redrawn with the chosen mask
+        self.draw_version()
+
+    def draw_format_bits(self, mask: int) -> None:
+        data = _FORMAT_ECC_BITS << 3 | mask
+        remainder = data
+        for _ in range(10):
+            remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+        bits = (data << 10 | remainder) ^ 0x5412
+        size = self.size
+
+        def bit(i: int) -> bool:
+            return (bits >> i) & 1 != 0
+
+        for i in range(6):
+            self.set_function(8, i, bit(i))
+        self.set_function(8, 7, bit(6))
+        self.set_function(8, 8, bit(7))
+        self.set_function(7, 8, bit(8))
+        for i in range(9, 15):
+            self.set_function(14 - i, 8, bit(i))
+        for i in range(8):
+            self.set_function(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self.set_function(8, size - 15 + i, bit(i))
+        self.set_function(8, size - 8, True)  # always dark
+
+    def draw_version(self) -> None:
+        if self.version < 7:
+            return
+        remainder = self.version
+        for _ in range(12):
+            remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+        bits = self.version << 12 | remainder
+        for i in range(18):
+            dark = (bits >> i) & 1 != 0
+            a, b = self.size - 11 + i % 3, i // 3
+            self.set_function(a, b, dark)
+            self.set_function(b, a, dark)
+
+    def draw_codewords(self, codewords: List[int]) -> None:
+        size = self.size
+        i = 0
+        total = len(codewords) * 8
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5  # skip the vertical timing pattern
+            upward = ((right + 1) & 2) == 0
+            for vertical in range(size):
+                y = size - 1 - vertical if upward else vertical
+                for x in (right, right - 1):
+                    if not self.function[y][x] and i < total:
+                        self.modules[y][x] = (codewords[i >> 3] >> (7 - (i & 7))) & 1 != 0
+                        i += 1
+            right -= 2
+
+    def apply_mask(self, mask: int) -> None:
+        condition = _MASKS[mask]
+        for y in range(self.size):
+            row, function = self.modules[y], self.function[y]
+            for x in range(self.size):
+                if not function[x] and condition(x, y):
+                    row[x] = not row[x]
+
+
+def _penalty(modules: List[List[bool]]) -> int:
+    size = len(modules)
+    score = 0
+    columns = [[modules[y][x] for y in range(size)] for x in range(size)]
+    finder_like = ((True, False, True, True, True, False, True, False, False, False, False),
+                   (False, False, False, False, True, False, True, True, True, False, True))
+    for line in modules + columns:
+        run = 1
+        for i in range(1, size):
+            if line[i] == line[i - 1]:
+                run += 1
+            else:
+                if run >= 5:
+                    score += 3 + run - 5
+                run = 1
+        if run >= 5:
+            score += 3 + run - 5
+        for i in range(size - 10):
+            if tuple(line[i:i + 11]) in finder_like:
+                score += 40
+    for y in range(size - 1):
+        for x in range(size - 1):
+            color = modules[y][x]
+            if color == modules[y][x + 1] == modules[y + 1][x] == modules[y + 1][x + 1]:
+                score += 3
+    dark = sum(sum(row) for row in modules)
+    total = size * size
+    score += ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+    return score
+
+
+def _codewords(data: bytes, version: int) -> List[int]:
+    capacity = _data_codewords(version)
+    bits: List[int] = []
+
+    def append(value: int, length: int) -> None:
+        bits.extend((value >> i) & 1 for i in reversed(range(length)))
+
+    append(0b0100, 4)  # byte mode
+    append(len(data), 8 if version < 10 else 16)
+    for byte in data:
+        append(byte, 8)
+    append(0, min(4, capacity * 8 - len(bits)))
+    append(0, -len(bits) % 8)
+    codewords = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(codewords) < capacity:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+
+    # Split into blocks, add error correction and interleave
+    blocks_count = _NUM_BLOCKS[version]
+    ecc_len = _ECC_CODEWORDS_PER_BLOCK[version]
+    raw = _raw_data_modules(version) // 8
+    short_blocks = blocks_count - raw % blocks_count
+    short_len = raw // blocks_count
+    divisor = _rs_divisor(ecc_len)
+    blocks = []
+    k = 0
+    for i in range(blocks_count):
+        length = short_len - ecc_len + (0 if i < short_blocks else 1)
+        block = codewords[k:k + length]
+        k += length
+        ecc = _rs_remainder(block, divisor)
+        if i < short_blocks:
+            block.append(0)  # placeholder, skipped when interleaving
+        blocks.append(block + ecc)
+    result = []
+    for i in range(len(blocks[0])):
+        for j, block in enumerate(blocks):
+            if i != short_len - ecc_len or j >= short_blocks:
+                result.append(block[i])
+    return result
+
+
+def encode(data: bytes, mask: int = -1) -> List[List[bool]]:
+    """
+    Encode bytes as a QR code.
+
+    Args:
+        data (bytes): Payload, e.g. a booking reference.
+        mask (int): Mask pattern 0-7, or -1 to pick the one with the lowest penalty.
+
+    Returns:
+        List[List[bool]]: Rows of modules, True for dark, without quiet zone.
+
+    Raises:
+        QrDataTooLong: If ``data`` does not fit version 10 at level M.
+    """
+    for version in range(1, MAX_VERSION + 1):
+        count_bits = 8 if version < 10 else 16
+        if 4 + count_bits + len(data) * 8 <= _data_codewords(version) * 8:
+            break
+    else:
+        raise QrDataTooLong(f"{len(data)} bytes do not fit a version {MAX_VERSION} QR code")
+    codewords = _codewords(data, version)
+    best: Tuple[int, List[List[bool]]] = (-1, [])
+    for candidate in (range(8) if mask == -1 else (mask,)):
+        matrix = _Matrix(version)
+        matrix.draw_function_patterns()
+        matrix.draw_codewords(codewords)
+        matrix.apply_mask(candidate)
+        matrix.draw_format_bits(candidate)
+        score = _penalty(matrix.modules) if mask == -1 else 0
+        if best[0] < 0 or score < best[0]:
+            best = (score, matrix.modules)
+    return best[1]
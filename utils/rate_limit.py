@@ -0,0 +1,80 @@
+"""Token bucket rate limiter for outbound sends.
+
+Meta enforces a messages-per-second throughput limit per business phone
+number; sending faster only produces 429s that burn the retry budget. The
+bucket is refilled lazily from the elapsed time on every call, so it needs no
+timer task. It is meant to be used from a single event loop and takes no
+lock: there is no ``await`` between reading and updating the token count.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict
+
+
+class TokenBucket:
+    """
+    Args:
+        rate (float): Tokens added per second.
+        burst (float): Bucket capacity, i.e. the largest instantaneous burst.
+        clock (Callable[[], float]): Monotonic time source (injectable for tests).
+    """
+
+    def __init__(self, rate: float, burst: float = None, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self.acquired = 0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take ``tokens`` if they are available right now."""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            self.acquired += 1
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take ``tokens``, sleeping until the bucket has refilled enough.
+
+        The tokens are reserved before sleeping (the count may go negative),
+        so concurrent callers queue up behind each other instead of waking
+        together and racing for the same refill.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        self._refill()
+        self._tokens -= tokens
+        self.acquired += 1
+        if self._tokens >= 0:
+            return 0.0
+        wait = -self._tokens / self.rate
+        self.throttled += 1
+        self.waited_seconds += wait
+        await asyncio.sleep(wait)
+        return wait
+
+    def stats(self) -> Dict:
+        self._refill()
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
@@ -0,0 +1,79 @@
+"""Background warm-up of expensive components and readiness reporting.
+
+The app accepts connections as soon as the module is imported; the costly
+one-time work (parsing the private key, loading the compiled flow tables,
+indexing persisted sessions, opening the Graph client) runs in the
+background after startup. Every component is also loaded on first use, so a
+request that arrives before warm-up finishes is still served, just slower.
+
+``/ready`` reports which components are still warming up so a load balancer
+or orchestrator can hold traffic until the worker is fully warm.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class Readiness:
+    """Registry of named warm-up steps and their state."""
+
+    def __init__(self):
+        self._steps: Dict[str, Callable[[], object]] = {}
+        self._state: Dict[str, str] = {}
+        self._errors: Dict[str, str] = {}
+        self._durations: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.started_at = time.time()
+
+    def register(self, name: str, step: Callable[[], object]) -> None:
+        """
+        Add a warm-up step.
+
+        Args:
+            name (str): Component name reported by ``/ready``.
+            step (Callable[[], object]): Blocking callable; it runs in a worker thread.
+        """
+        self._steps[name] = step
+        self._state[name] = PENDING
+
+    async def _run(self, name: str, step: Callable[[], object]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(step)
+            self._state[name] = READY
+        except Exception as e:
+            self._state[name] = FAILED
+            self._errors[name] = str(e)
+            logger.error(f"Warm-up of {name} failed: {str(e)}")
+        self._durations[name] = time.perf_counter() - started
+
+    def start(self) -> asyncio.Task:
+        """Run all registered steps concurrently in the background (idempotent)."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_all())
+        return self._task
+
+    async def _run_all(self) -> None:
+        await asyncio.gather(*(self._run(name, step) for name, step in self._steps.items()))
+
+    @property
+    def ready(self) -> bool:
+        return all(state == READY for state in self._state.values())
+
+    def stats(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "components": dict(self._state),
+            "pending": [name for name, state in self._state.items() if state == PENDING],
+            "errors": dict(self._errors),
+            "warmup_ms": {name: round(seconds * 1000, 2) for name, seconds in self._durations.items()},
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+        }
@@ -0,0 +1,362 @@
+"""Retry, backoff and circuit breaking for outbound Graph API calls.
+
+Every sender in ``whatsapp.py`` goes through a single ``ResilientClient`` so
+that they share one pooled HTTP connection set, one retry budget and one
+circuit breaker per Graph API endpoint:
+
+- only failures where the request provably never reached Meta (connection
+  errors, 429) are retried, with full jitter exponential backoff honouring
+  ``Retry-After``; timeouts, resets after sending and 5xx are reported, since
+  Graph has no idempotency key and a resend could deliver a message twice;
+- a circuit breaker per endpoint fails fast while Meta is degraded instead
+  of queueing more doomed requests;
+- a retry budget caps retries to a fraction of normal traffic so retries
+  cannot amplify an outage;
+- inside a request with a deadline (see ``utils.deadline``) each attempt's
+  timeout is capped at the time left and no retry is started that could not
+  finish before it;
+- local idempotency keys stop this process from repeating a logical send:
+  concurrent calls with the same key share one attempt and a completed send
+  is answered from cache. The key is never sent to Meta, so it does not
+  protect against duplicates across processes or restarts.
+"""
+
+import asyncio
+import email.utils
+import random
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+from utils.deadline import current_deadline
+
+if TYPE_CHECKING:
+    import httpx
+
+# Meta rejected the request without acting on it. A 5xx may come after the
+# message was accepted, so it is reported rather than retried.
+RETRYABLE_STATUS_CODES = frozenset({429})
+
+
+@lru_cache(maxsize=None)
+def _transport_errors() -> Tuple[tuple, type]:
+    """Exception classes by retry safety; httpx is only imported on first use."""
+    import httpx
+
+    # The request never left this process: always safe to retry. Anything else
+    # (read/write timeouts, resets after sending) may already have been delivered.
+    unsent = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+    return unsent, httpx.HTTPError
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit open for {endpoint}, retry in {retry_in:.1f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a ``Retry-After`` header into seconds.
+
+    Args:
+        value (Optional[str]): Header value, either delta-seconds or an HTTP date.
+
+    Returns:
+        Optional[float]: Seconds to wait, or None if absent or unparsable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0.0)
+
+
+class RetryPolicy:
+    """Full-jitter exponential backoff (``sleep = U(0, min(cap, base * 2**n))``)."""
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.2, max_delay: float = 5.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number ``attempt`` (1-based)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after is not None:
+            # Meta told us when to come back; never retry earlier than that.
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of first attempts.
+
+    Each first attempt deposits ``ratio`` tokens and each retry withdraws one,
+    so in steady state at most ``ratio`` of traffic is retries. ``min_tokens``
+    lets a quiet process still retry occasional failures.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = min_tokens
+        self.exhausted = 0
+
+    def deposit(self) -> None:
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def try_withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.exhausted += 1
+        return False
+
+
+class CircuitBreaker:
+    """
+    Classic closed / open / half-open breaker for one endpoint.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    rejects calls for ``reset_timeout`` seconds. It then lets a single probe
+    through; success closes it again, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+
+    def before_call(self, endpoint: str) -> bool:
+        """
+        Raise if calls to the endpoint are currently not allowed.
+
+        Returns:
+            bool: True if this call is the half-open probe; the caller must
+            then call ``end_call`` once it finishes, however it finishes.
+
+        Raises:
+            CircuitOpenError: If the breaker is open (or a probe is already running).
+        """
+        if self.state == self.CLOSED:
+            return False
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            retry_in = self.opened_at + self.reset_timeout - now
+            if retry_in > 0:
+                self.rejected += 1
+                raise CircuitOpenError(endpoint, retry_in)
+            self.state = self.HALF_OPEN
+        if self._probe_in_flight:
+            self.rejected += 1
+            raise CircuitOpenError(endpoint, 0.0)
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def end_call(self) -> None:
+        """Release the half-open probe slot, e.g. when the probe was cancelled."""
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ResilientClient:
+    """Pooled HTTP client with retries, per-endpoint breakers and idempotency keys."""
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        budget: Optional[RetryBudget] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        timeout: float = 30.0,
+        idempotency_cache_size: int = 10000,
+        max_connections: Optional[int] = None,
+    ):
+        self.policy = policy or RetryPolicy()
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._completed: "OrderedDict[str, httpx.Response]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._idempotency_cache_size = idempotency_cache_size
+        self.stats_counters = {"requests": 0, "attempts": 0, "retries": 0, "deduplicated": 0}
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        if self._client is None or self._client.is_closed:
+            import httpx
+
+            limits = httpx.Limits(max_connections=self.max_connections) if self.max_connections else httpx.Limits()
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        endpoint: str,
+        idempotency_key: Optional[str] = None,
+        **kwargs,
+    ) -> "httpx.Response":
+        """
+        Send a request with retries and circuit breaking.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Full request URL.
+            endpoint (str): Logical endpoint name; one circuit breaker per name.
+            idempotency_key (Optional[str]): Key identifying this logical call.
+                Calls sharing a key are sent once per process (the key stays local).
+            **kwargs: Passed through to ``httpx.AsyncClient.request``.
+
+        Returns:
+            httpx.Response: The final response (possibly a non-retryable error status).
+
+        Raises:
+            CircuitOpenError: If the endpoint's breaker is open.
+            httpx.HTTPError: If the last attempt failed at the transport level.
+        """
+        if idempotency_key is None:
+            return await self._send(method, url, endpoint, kwargs)
+
+        cached = self._completed.get(idempotency_key)
+        if cached is not None:
+            self.stats_counters["deduplicated"] += 1
+            return cached
+        pending = self._in_flight.get(idempotency_key)
+        if pending is not None:
+            self.stats_counters["deduplicated"] += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[idempotency_key] = future
+        try:
+            response = await self._send(method, url, endpoint, kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            # Only the waiters should see this exception, not the event loop.
+            future.exception()
+            raise
+        else:
+            future.set_result(response)
+            if response.status_code < 400:
+                self._completed[idempotency_key] = response
+                if len(self._completed) > self._idempotency_cache_size:
+                    self._completed.popitem(last=False)
+            return response
+        finally:
+            del self._in_flight[idempotency_key]
+
+    async def _send(self, method: str, url: str, endpoint: str, kwargs: Dict) -> "httpx.Response":
+        unsent_errors, http_error = _transport_errors()
+        breaker = self.breaker(endpoint)
+        deadline = current_deadline()
+        self.stats_counters["requests"] += 1
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            if deadline is not None:
+                deadline.check(endpoint)
+                kwargs["timeout"] = min(kwargs.get("timeout", self.timeout), deadline.remaining())
+            probe = breaker.before_call(endpoint)
+            self.stats_counters["attempts"] += 1
+            retry_after = None
+            response = last_error = None
+            try:
+                response = await self.client.request(method, url, **kwargs)
+            except unsent_errors as e:
+                breaker.record_failure()
+                if not self._may_retry(attempt, breaker):
+                    raise
+                last_error = e
+            except http_error:
+                # The request may have reached Meta; resending could deliver the message twice.
+                breaker.record_failure()
+                raise
+            else:
+                if response.status_code < 500 and response.status_code not in RETRYABLE_STATUS_CODES:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if response.status_code not in RETRYABLE_STATUS_CODES or not self._may_retry(attempt, breaker):
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            finally:
+                # A cancelled probe records neither outcome; don't leave the breaker half-open forever
+                if probe:
+                    breaker.end_call()
+
+            delay = self.policy.backoff(attempt, retry_after)
+            if deadline is not None and delay >= deadline.remaining():
+                # The retry could not be answered in time; report the last outcome instead
+                if response is None:
+                    raise last_error
+                return response
+            self.stats_counters["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def _may_retry(self, attempt: int, breaker: CircuitBreaker) -> bool:
+        # Once our own failures have tripped the breaker, stop and report the last outcome.
+        if breaker.state == CircuitBreaker.OPEN:
+            return False
+        return attempt < self.policy.max_attempts and self.budget.try_withdraw()
+
+    def stats(self) -> Dict:
+        """Return counters and breaker states for the metrics endpoint."""
+        return {
+            **self.stats_counters,
+            "retry_budget_tokens": round(self.budget.tokens, 2),
+            "retry_budget_exhausted": self.budget.exhausted,
+            "breakers": {
+                name: {"state": b.state, "failures": b.failures, "rejected": b.rejected}
+                for name, b in self.breakers.items()
+            },
+        }
@@ -1,15 +1,12 @@
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-
 def save_key_to_file(key_str: str, filename: str):
     with open(filename, 'w') as f:
         f.write(key_str)
 
 
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-
 def generate_rsa_key_pair():
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives import serialization
+
     private_key = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048
@@ -36,13 +33,10 @@ def generate_rsa_key_pair():
 """Security Module."""
 
 import json
+import threading
 from base64 import b64decode, b64encode
 from pathlib import Path
 
-from cryptography.hazmat.primitives.asymmetric.padding import MGF1, OAEP, hashes
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives.serialization import load_pem_private_key
-
 
 """ 
 requirements
@@ -51,14 +45,59 @@ requirements
 - fastapi
 - base64
 
+The cryptography backend and the private key are loaded on first use rather
+than at import, so workers start fast and a missing private.pem is reported
+by /ready instead of crashing the process.
 """
 
 private_key = Path(__file__).parent.parent / "private.pem"
 
-PRIVATE_KEY = private_key.read_text(encoding="utf-8")
-
 password=""
 
+_key_lock = threading.Lock()
+# Parsed private keys by file path; each tenant may have its own key
+_loaded_private_keys = {}
+
+
+def load_private_key(path=None, key_password=None):
+    """
+    Parse a private key file once and cache the key object for every request.
+
+    Args:
+        path (Optional[Path]): PEM file; defaults to the repository's private.pem.
+        key_password (Optional[str]): Passphrase if the key is encrypted.
+
+    Raises:
+        FileNotFoundError: If the key file does not exist.
+    """
+    path = str(path or private_key)
+    key = _loaded_private_keys.get(path)
+    if key is None:
+        with _key_lock:
+            key = _loaded_private_keys.get(path)
+            if key is None:
+                from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+                if not Path(path).exists():
+                    raise FileNotFoundError(
+                        f"{path} not found; register business encryption to create it"
+                    )
+                key = _loaded_private_keys[path] = load_pem_private_key(
+                    Path(path).read_text(encoding="utf-8").encode("utf-8"),
+                    password=key_password.encode("utf-8") if key_password else None,
+                )
+    return key
+
+
+def forget_private_key(path=None):
+    """Drop a cached key (all keys if ``path`` is None), e.g. after a new key pair has been registered."""
+    with _key_lock:
+        if path is None:
+            _loaded_private_keys.clear()
+        else:
+            _loaded_private_keys.pop(str(path), None)
+
+
 class Security:
     """Security class for encryption and decryption."""
 
@@ -67,15 +106,16 @@ class Security:
         encrypted_flow_data_b64,
         encrypted_aes_key_b64,
         initial_vector_b64,
+        private_key=None,
     ):
+        from cryptography.hazmat.primitives.asymmetric.padding import MGF1, OAEP, hashes
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
         flow_data = b64decode(encrypted_flow_data_b64)
         iv = b64decode(initial_vector_b64)
 
         # Decrypt the AES encryption key
-        private_key = load_pem_private_key(
-            PRIVATE_KEY.encode("utf-8"),
-            password=None,
-        )
+        private_key = private_key or load_private_key()
         encrypted_aes_key = b64decode(encrypted_aes_key_b64)
         aes_key = private_key.decrypt(
             encrypted_aes_key,
@@ -101,6 +141,8 @@ class Security:
 
     @staticmethod
     def encrypt_response(response, aes_key, iv):
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
         # Flip the initialization vector
         flipped_iv = bytearray()
         for byte in iv:
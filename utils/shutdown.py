@@ -0,0 +1,204 @@
+"""Graceful shutdown: drain in-flight requests, flush write-behind buffers, report.
+
+Shutdown runs in three phases within one time budget:
+
+1. **Drain.** ``DrainMiddleware`` counts in-flight HTTP requests. Once
+   draining starts, new requests are answered ``503`` with ``Retry-After``
+   and ``Connection: close`` (Meta retries flow requests and webhooks), and
+   shutdown waits for the in-flight ones to finish. Probes listed in
+   ``exempt_paths`` keep working so the load balancer sees ``/ready`` fail.
+2. **Flush.** Registered steps run in order: write-behind queues (bookings,
+   delivery statuses, recorded traffic, spans), the flow session log, then
+   the outbound HTTP clients. Flushing is more important than the budget, so
+   every step gets at least ``step_floor`` seconds even when draining ran late.
+3. **Report.** What was still outstanding (requests by path and age, steps
+   that failed or timed out, what each step left behind) is logged and kept
+   in ``last_report``.
+
+Uvicorn stops accepting connections and waits for open requests before it
+runs the lifespan shutdown; run it with ``--timeout-graceful-shutdown`` below
+the orchestrator's kill timeout. For rolling deploys, start draining first
+(``POST /admin/drain``) so the load balancer moves traffic away while the
+worker is still serving, then send SIGTERM.
+"""
+
+import asyncio
+import inspect
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+StepResult = Union[None, int, Dict]
+
+
+class GracefulShutdown:
+    """
+    Args:
+        timeout (float): Seconds for draining and flushing together.
+        step_floor (float): Seconds every flush step gets even past the timeout.
+        retry_after (int): ``Retry-After`` seconds sent with rejected requests.
+        exempt_paths (Tuple[str, ...]): Paths still served while draining (probes, metrics).
+    """
+
+    def __init__(self, timeout: float = 25.0, step_floor: float = 2.0, retry_after: int = 5,
+                 exempt_paths: Tuple[str, ...] = ("/ready", "/metrics")):
+        self.timeout = timeout
+        self.step_floor = step_floor
+        self.retry_after = retry_after
+        self.exempt_paths = exempt_paths
+        self.draining = False
+        self.draining_since: Optional[float] = None
+        self._requests: Dict[int, Tuple[str, float]] = {}
+        self._ids = itertools.count()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._steps: List[Tuple[str, Callable[[], Union[StepResult, Awaitable[StepResult]]]]] = []
+        self.rejected = 0
+        self.last_report: Optional[Dict] = None
+
+    # ------------------------------------------------------------ requests
+
+    def _request_started(self, path: str) -> int:
+        request_id = next(self._ids)
+        self._requests[request_id] = (path, time.monotonic())
+        self._idle.clear()
+        return request_id
+
+    def _request_finished(self, request_id: int) -> None:
+        self._requests.pop(request_id, None)
+        if not self._requests:
+            self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._requests)
+
+    def start_draining(self) -> None:
+        """Reject new requests from now on (idempotent)."""
+        if not self.draining:
+            self.draining = True
+            self.draining_since = time.time()
+            logger.info(f"Draining: {self.in_flight} requests in flight, new requests are rejected")
+
+    # ------------------------------------------------------------ steps
+
+    def add_step(self, name: str, step: Callable[[], Union[StepResult, Awaitable[StepResult]]]) -> None:
+        """
+        Register a flush/close step; steps run in registration order.
+
+        Args:
+            name (str): Name used in the report.
+            step (Callable): Sync or async callable. It may return what it left
+                behind (e.g. a queue size or a stats dict) for the report.
+        """
+        self._steps.append((name, step))
+
+    async def _run_step(self, name: str, step, timeout: float) -> Dict:
+        started = time.monotonic()
+        entry: Dict = {"step": name}
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                result = await asyncio.wait_for(result, timeout)
+            entry["ok"] = True
+            if result is not None:
+                entry["left"] = result
+        except asyncio.TimeoutError:
+            entry.update(ok=False, error=f"timed out after {timeout:.1f}s")
+        except Exception as e:
+            entry.update(ok=False, error=f"{type(e).__name__}: {e}")
+        entry["ms"] = round((time.monotonic() - started) * 1000, 1)
+        return entry
+
+    # ------------------------------------------------------------ shutdown
+
+    async def run(self) -> Dict:
+        """
+        Drain, flush and report. Called once from the application lifespan.
+
+        Returns:
+            Dict: The shutdown report (also logged and kept in ``last_report``).
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        self.start_draining()
+        in_flight_at_start = self.in_flight
+        try:
+            await asyncio.wait_for(self._idle.wait(), max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            pass
+        now = time.monotonic()
+        outstanding = [
+            {"path": path, "age_s": round(now - since, 3)} for path, since in self._requests.values()
+        ]
+        drained_s = now - started
+
+        steps = []
+        for name, step in self._steps:
+            timeout = max(deadline - time.monotonic(), self.step_floor)
+            steps.append(await self._run_step(name, step, timeout))
+
+        report = {
+            "drain_seconds": round(drained_s, 3),
+            "total_seconds": round(time.monotonic() - started, 3),
+            "requests_in_flight_at_start": in_flight_at_start,
+            "requests_outstanding": outstanding,
+            "requests_rejected": self.rejected,
+            "steps": steps,
+            "clean": not outstanding and all(entry["ok"] for entry in steps),
+        }
+        self.last_report = report
+        if report["clean"]:
+            logger.info(f"Graceful shutdown completed in {report['total_seconds']}s: {report}")
+        else:
+            logger.warning(f"Graceful shutdown left work outstanding: {report}")
+        return report
+
+    def stats(self) -> Dict:
+        return {
+            "draining": self.draining,
+            "draining_since": self.draining_since,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "steps": [name for name, _ in self._steps],
+        }
+
+
+class DrainMiddleware:
+    """
+    ASGI middleware counting in-flight requests and rejecting new ones while draining.
+
+    Args:
+        app: The wrapped ASGI application.
+        shutdown (GracefulShutdown): Coordinator the requests are reported to.
+    """
+
+    def __init__(self, app, shutdown: GracefulShutdown):
+        self.app = app
+        self.shutdown = shutdown
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        shutdown = self.shutdown
+        if shutdown.draining and scope["path"] not in shutdown.exempt_paths:
+            shutdown.rejected += 1
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"retry-after", str(shutdown.retry_after).encode()),
+                    (b"connection", b"close"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": b'{"error":"Service shutting down","reason":"draining"}'})
+            return
+        request_id = shutdown._request_started(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            shutdown._request_finished(request_id)
@@ -0,0 +1,194 @@
+"""Serialize work per key (flow_token) with a fixed array of striped locks.
+
+Two ``/flow-data`` requests for the same flow_token (a double tap, a Meta
+retry) must not interleave their read-modify-write of the flow session.
+Creating and garbage-collecting one lock per token would cost a dict entry
+per journey and need cleanup; instead a key is hashed (crc32, stable across
+processes) onto one of a fixed number of stripes. Requests for the same
+token always meet on the same stripe; different tokens only wait for each
+other when they collide on a stripe, which with 1024 stripes is rare.
+
+``FileStripedLock`` extends this across uvicorn workers: after taking the
+in-process stripe, it takes an exclusive POSIX byte-range lock on byte
+``stripe`` of a shared lock file. Locks are polled non-blockingly, so the
+event loop never blocks and a wait can be bounded by the request deadline;
+the kernel drops them if a worker dies.
+"""
+
+import asyncio
+import os
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process variant is available
+    fcntl = None
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a stripe could not be acquired within the timeout."""
+
+    def __init__(self, key: str, stripe: int):
+        super().__init__(f"Timed out waiting for the lock of {key} (stripe {stripe})")
+        self.key = key
+        self.stripe = stripe
+
+
+class StripedLock:
+    """
+    Args:
+        stripes (int): Number of locks keys are spread over.
+    """
+
+    def __init__(self, stripes: int = 1024):
+        self.stripes = stripes
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.max_wait = 0.0
+
+    def stripe_of(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % self.stripes
+
+    async def _acquire_local(self, key: str, stripe: int, timeout: Optional[float]) -> None:
+        lock = self._locks[stripe]
+        if not lock.locked():
+            await lock.acquire()
+            return
+        self.contended += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LockTimeout(key, stripe)
+        self.max_wait = max(self.max_wait, time.monotonic() - started)
+
+    @asynccontextmanager
+    async def hold(self, key: Optional[str], timeout: Optional[float] = None):
+        """
+        Hold the stripe of ``key`` for the duration of the block; a no-op for a None key.
+
+        Args:
+            key (Optional[str]): Key to serialize on, e.g. a flow_token.
+            timeout (Optional[float]): Seconds to wait at most (None waits forever).
+
+        Raises:
+            LockTimeout: If the stripe was not acquired in time.
+        """
+        if key is None:
+            yield
+            return
+        stripe = self.stripe_of(key)
+        await self._acquire_local(key, stripe, timeout)
+        self.acquired += 1
+        try:
+            yield
+        finally:
+            self._locks[stripe].release()
+
+    def close(self) -> None:
+        """Nothing to release for in-process locks."""
+
+    def stats(self) -> Dict:
+        return {
+            "stripes": self.stripes,
+            "held": sum(1 for lock in self._locks if lock.locked()),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "timeouts": self.timeouts,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class FileStripedLock(StripedLock):
+    """
+    Striped lock shared by every process that opens the same lock file.
+
+    Args:
+        path (str): Lock file (one byte per stripe is locked, nothing is written).
+        stripes (int): Number of stripes; must be the same in every worker.
+        poll_interval (float): First delay between attempts on a stripe held by another worker.
+        max_poll_interval (float): Longest delay between attempts.
+    """
+
+    def __init__(self, path: str, stripes: int = 1024, poll_interval: float = 0.001,
+                 max_poll_interval: float = 0.02):
+        if fcntl is None:
+            raise RuntimeError("cross-worker flow_token locks need fcntl (POSIX)")
+        super().__init__(stripes)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._fd: Optional[int] = None
+        self.cross_worker_waits = 0
+
+    def _file(self) -> int:
+        if self._fd is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # POSIX record locks belong to the process and are all dropped when any
+            # descriptor of the file is closed, so one descriptor is kept open
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        return self._fd
+
+    def _try_lock(self, stripe: int) -> bool:
+        try:
+            fcntl.lockf(self._file(), fcntl.LOCK_EX | fcntl.LOCK_NB, 1, stripe)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self, stripe: int) -> None:
+        fcntl.lockf(self._file(), fcntl.LOCK_UN, 1, stripe)
+
+    async def _acquire_file(self, key: str, stripe: int, timeout: Optional[float]) -> None:
+        if self._try_lock(stripe):
+            return
+        self.cross_worker_waits += 1
+        started = time.monotonic()
+        delay = self.poll_interval
+        while True:
+            if timeout is not None and time.monotonic() - started + delay > timeout:
+                self.timeouts += 1
+                raise LockTimeout(key, stripe)
+            await asyncio.sleep(delay)
+            if self._try_lock(stripe):
+                self.max_wait = max(self.max_wait, time.monotonic() - started)
+                return
+            delay = min(delay * 2, self.max_poll_interval)
+
+    @asynccontextmanager
+    async def hold(self, key: Optional[str], timeout: Optional[float] = None):
+        if key is None:
+            yield
+            return
+        stripe = self.stripe_of(key)
+        started = time.monotonic()
+        # One coroutine per process competes for the file lock of a stripe
+        await self._acquire_local(key, stripe, timeout)
+        try:
+            remaining = None if timeout is None else max(timeout - (time.monotonic() - started), 0.0)
+            await self._acquire_file(key, stripe, remaining)
+        except BaseException:
+            self._locks[stripe].release()
+            raise
+        self.acquired += 1
+        try:
+            yield
+        finally:
+            self._unlock(stripe)
+            self._locks[stripe].release()
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "cross_worker_waits": self.cross_worker_waits, "path": self.path}
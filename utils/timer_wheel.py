@@ -0,0 +1,93 @@
+"""Hashed timing wheel for cheap expiry of many short-lived entries.
+
+Scheduling and cancelling are O(1). Expiry work is proportional to the number
+of ticks elapsed plus the entries that actually expire, never to the total
+number of entries, so there are no periodic full scans. Each entry stores
+its absolute expiry tick, so delays longer than one revolution simply stay in
+their bucket until the right pass.
+
+The wheel is driven by calling ``advance()``; it has no thread or task of its
+own, so owners can advance it lazily on every access or from a timer.
+"""
+
+import math
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set
+
+
+class TimerWheel:
+    """
+    Args:
+        tick (float): Resolution in seconds; entries expire at most one tick late.
+        slots (int): Number of buckets in one revolution.
+        clock (Callable[[], float]): Monotonic time source (injectable for tests).
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, clock: Callable[[], float] = time.monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.clock = clock
+        self._buckets: List[Set[Hashable]] = [set() for _ in range(slots)]
+        # key -> absolute tick at which it expires; bucket is deadline % slots
+        self._deadlines: Dict[Hashable, int] = {}
+        self._current = int(clock() / tick)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: Hashable, delay: float) -> None:
+        """Expire ``key`` after ``delay`` seconds, replacing any existing timer for it."""
+        self.cancel(key)
+        deadline = self._current + max(1, math.ceil(delay / self.tick))
+        self._buckets[deadline % self.slots].add(key)
+        self._deadlines[key] = deadline
+
+    def schedule_many(self, keys, delay: float) -> None:
+        """Schedule new ``keys`` (not already in the wheel) with the same delay in one step."""
+        deadline = self._current + max(1, math.ceil(delay / self.tick))
+        keys = list(keys)
+        self._buckets[deadline % self.slots].update(keys)
+        self._deadlines.update(dict.fromkeys(keys, deadline))
+
+    def cancel(self, key: Hashable) -> bool:
+        """Remove the timer for ``key``; returns False if there was none."""
+        deadline = self._deadlines.pop(key, None)
+        if deadline is None:
+            return False
+        self._buckets[deadline % self.slots].discard(key)
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """
+        Move the wheel up to ``now`` and return the keys that expired.
+
+        Only the buckets for the elapsed ticks are visited; entries in them
+        that belong to a later revolution are left in place.
+
+        Args:
+            now (Optional[float]): Current time; defaults to the wheel's clock.
+
+        Returns:
+            List[Hashable]: Expired keys.
+        """
+        target = int((self.clock() if now is None else now) / self.tick)
+        if target <= self._current:
+            return []
+        first = self._current + 1
+        self._current = target
+        # After a long pause every bucket is due for a visit, but only once.
+        ticks = range(first, target + 1) if target - first < self.slots else range(target - self.slots + 1, target + 1)
+        expired: List[Hashable] = []
+        for tick in ticks:
+            bucket = self._buckets[tick % self.slots]
+            if not bucket:
+                continue
+            due = [key for key in bucket if self._deadlines[key] <= target]
+            for key in due:
+                bucket.discard(key)
+                del self._deadlines[key]
+            expired.extend(due)
+        return expired
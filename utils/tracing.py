@@ -0,0 +1,283 @@
+"""Lightweight tracing for passenger journeys.
+
+A journey is spread over many independent HTTP requests: ``/webhook`` →
+``send_flow_message`` → several ``/flow-data`` calls → ``/flow-callback``.
+Instead of propagating trace headers (Meta would not echo them back), the
+trace id is derived from the identifier those requests already share: the
+``flow_token`` for the flow data exchange and callback, the prompt ``wamid``
+for webhook replies. Spans of one journey therefore land in the same trace
+even when they are handled by different workers, and spans that bridge two
+identifiers (e.g. the webhook reply that sends a flow) carry a link to the
+other trace.
+
+Head sampling is decided once per trace from the trace id itself, so every
+worker makes the same decision for a journey and unsampled requests pay only
+for a hash and a comparison; their spans are a shared no-op object.
+
+Sampled spans are buffered and appended to a file in the OpenTelemetry
+OTLP/JSON format (one ``ExportTraceServiceRequest`` per line, the same
+layout the OpenTelemetry Collector file exporter writes), so they can be
+loaded into any OTLP-compatible backend.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+_STATUS_OK = 1
+_STATUS_ERROR = 2
+
+
+def trace_id_for(key: str) -> str:
+    """128-bit trace id (hex) derived from a journey identifier such as a flow_token."""
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+class _NoopSpan:
+    """Returned for unsampled traces; every operation does nothing."""
+
+    sampled = False
+    trace_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key: str, value) -> None:
+        pass
+
+    def link(self, key: str) -> None:
+        pass
+
+    def end(self, error: Optional[BaseException] = None, end_time: Optional[float] = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "start", "finish",
+                 "attributes", "links", "error", "_token")
+
+    sampled = True
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str],
+                 start: Optional[float] = None, attributes: Optional[Dict] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.finish: Optional[float] = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.links: List[str] = []
+        self.error: Optional[str] = None
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _current_span.reset(self._token)
+            self._token = None
+        self.end(exc)
+        return False
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def link(self, key: str) -> None:
+        """Link this span to the trace of another journey identifier (flow_token or wamid)."""
+        trace_id = trace_id_for(key)
+        if trace_id != self.trace_id:
+            self.links.append(trace_id)
+
+    def end(self, error: Optional[BaseException] = None, end_time: Optional[float] = None) -> None:
+        if self.finish is not None:
+            return
+        self.finish = end_time if end_time is not None else time.time()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.tracer._export(self)
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int(self.finish * 1e9)),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": _STATUS_ERROR, "message": self.error} if self.error else {"code": _STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.links:
+            span["links"] = [{"traceId": trace_id, "spanId": "0" * 16} for trace_id in self.links]
+        return span
+
+
+class Tracer:
+    """
+    Args:
+        path (Optional[str]): OTLP/JSON lines file; tracing is disabled when None.
+        sample_ratio (float): Fraction of journeys (traces) recorded, 0.0 to 1.0.
+        service_name (str): ``service.name`` resource attribute.
+        batch_size (int): Spans buffered before a write is triggered.
+        flush_interval (float): Seconds between background flushes.
+        max_queue (int): Spans kept in memory at most; the excess is dropped.
+    """
+
+    def __init__(self, path: Optional[str], sample_ratio: float = 0.1, service_name: str = "whatsapp-flows",
+                 batch_size: int = 512, flush_interval: float = 2.0, max_queue: int = 20000):
+        self.path = path
+        self.sample_ratio = max(0.0, min(1.0, sample_ratio)) if path else 0.0
+        self._threshold = int(self.sample_ratio * (1 << 64))
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._buffer: List[Span] = []
+        self._write_lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.started = 0
+        self.exported = 0
+        self.dropped = 0
+
+    # ------------------------------------------------------------ spans
+
+    def sampled(self, trace_id: str) -> bool:
+        return int(trace_id[:16], 16) < self._threshold
+
+    def span(self, name: str, key: Optional[str] = None, start: Optional[float] = None,
+             attributes: Optional[Dict] = None):
+        """
+        Start a span, as a child of the current span if there is one.
+
+        Args:
+            name (str): Phase name, e.g. "flow_data.decrypt".
+            key (Optional[str]): Journey identifier (flow_token or wamid) that
+                picks the trace of a root span; ignored for child spans.
+            start (Optional[float]): Epoch start time, for phases measured
+                before their trace was known (e.g. decrypting a flow request).
+            attributes (Optional[Dict]): Initial span attributes.
+
+        Returns:
+            A span usable as a context manager, or ``NOOP_SPAN`` if the trace
+            is not sampled.
+        """
+        parent = _current_span.get()
+        if parent is not None:
+            if not parent.sampled:
+                return NOOP_SPAN
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            if key is None or not self._threshold:
+                return NOOP_SPAN
+            trace_id, parent_id = trace_id_for(key), None
+            if not self.sampled(trace_id):
+                return NOOP_SPAN
+        self.started += 1
+        return Span(self, name, trace_id, parent_id, start, attributes)
+
+    # ------------------------------------------------------------ export
+
+    def _export(self, span: Span) -> None:
+        if len(self._buffer) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._buffer.append(span)
+        if len(self._buffer) >= self.batch_size:
+            self._schedule_flush()
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        if self._flusher is None or self._flusher.done():
+            try:
+                self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                pass
+
+    def _schedule_flush(self) -> None:
+        try:
+            asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            self._write(self._take())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _take(self) -> List[Span]:
+        spans, self._buffer = self._buffer, []
+        return spans
+
+    def _write(self, spans: List[Span]) -> None:
+        if not spans:
+            return
+        line = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", self.service_name),
+                                            _attribute("process.pid", os.getpid())]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [s.to_otlp() for s in spans]}],
+            }]
+        }, separators=(",", ":"))
+        with self._write_lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.exported += len(spans)
+            except OSError as e:
+                self.dropped += len(spans)
+                logger.error(f"Failed to write spans to {self.path}: {str(e)}")
+
+    async def flush(self) -> None:
+        """Write buffered spans to the file (in a worker thread)."""
+        spans = self._take()
+        if spans:
+            await asyncio.to_thread(self._write, spans)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": bool(self._threshold),
+            "sample_ratio": self.sample_ratio,
+            "spans_started": self.started,
+            "spans_exported": self.exported,
+            "spans_buffered": len(self._buffer),
+            "spans_dropped": self.dropped,
+        }
+
+
+def current_span():
+    """The span of the current task, or ``NOOP_SPAN``."""
+    return _current_span.get() or NOOP_SPAN
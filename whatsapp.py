@@ -1,26 +1,105 @@
-
-from typing import List, Optional, Dict
-from config import access_token, phone_number_id, whatsapp_api_version
-from utils.security import generate_rsa_key_pair,save_key_to_file
-import httpx
+import asyncio
+import os
+import uuid
+from typing import TYPE_CHECKING, List, Optional, Dict, Union
+from config import (
+    access_token,
+    phone_number_id,
+    flow_private_key_path,
+    whatsapp_api_version,
+    flow_config,
+    graph_max_attempts,
+    graph_breaker_failure_threshold,
+    graph_breaker_reset_timeout,
+    whatsapp_business_account_id,
+    template_catalog_file,
+    template_catalog_ttl,
+    tenants_file,
+    tenants_reload_interval,
+    trace_file,
+    trace_sample_ratio,
+)
+from utils.security import generate_rsa_key_pair,save_key_to_file,forget_private_key
+from tenants import Tenant, TenantConfig, TenantRegistry
+from utils.tracing import Tracer
 from fastapi import HTTPException
 
-# Base URL for WhatsApp API
-API_URL = f"https://graph.facebook.com/{whatsapp_api_version}/{phone_number_id}"
-
-# Headers for API requests
-HEADERS = {
-    "Authorization": f"Bearer {access_token}",
-    "Content-Type": "application/json"
-}
+if TYPE_CHECKING:
+    # httpx is imported lazily by the shared client to keep worker startup fast
+    import httpx
+
+# Every business number we serve. Each tenant has its own connection pool,
+# retry budget, circuit breakers and send rate limiter; without a tenants
+# file the single number configured by the environment is the only tenant.
+tenant_registry = TenantRegistry(
+    path=tenants_file,
+    fallback=TenantConfig(
+        tenant_id="default",
+        phone_number_id=phone_number_id,
+        access_token=access_token,
+        api_version=whatsapp_api_version,
+        flows=flow_config,
+        business_account_id=whatsapp_business_account_id,
+        template_catalog_file=template_catalog_file,
+        private_key_path=flow_private_key_path,
+    ),
+    reload_interval=tenants_reload_interval,
+    graph_max_attempts=graph_max_attempts,
+    breaker_failure_threshold=graph_breaker_failure_threshold,
+    breaker_reset_timeout=graph_breaker_reset_timeout,
+    template_catalog_ttl=template_catalog_ttl,
+)
+
+# Journey tracing shared by the senders and the endpoints in main.py
+tracer = Tracer(path=trace_file, sample_ratio=trace_sample_ratio)
+
+
+async def _post_message(
+    payload: Union[Dict, bytes],
+    idempotency_key: Optional[str] = None,
+    timeout: float = 30.0,
+    tenant: Optional[Tenant] = None
+) -> "httpx.Response":
+    """
+    POST a message payload to a tenant's Graph API messages endpoint.
+
+    Sends are paced by the tenant's rate limiter. Failures where the request
+    never reached Meta are retried and a degraded endpoint fails fast with
+    ``CircuitOpenError``. Passing an ``idempotency_key`` stops this process from
+    sending the message again when the caller retries. ``payload`` may be an already serialized JSON
+    body (e.g. a rendered template skeleton). Without ``tenant`` the default
+    tenant sends.
+    """
+    tenant = tenant or tenant_registry.default()
+    with tracer.span("graph.messages", attributes={"tenant": tenant.tenant_id}) as span:
+        span.set("rate_limit_wait_ms", round(await tenant.limiter.acquire() * 1000, 3))
+        body = {"content": payload} if isinstance(payload, bytes) else {"json": payload}
+        response = await tenant.client.request(
+            "POST",
+            f"{tenant.config.api_url}/messages",
+            endpoint="messages",
+            idempotency_key=idempotency_key,
+            headers=tenant.config.headers,
+            timeout=timeout,
+            **body,
+        )
+        span.set("http.status_code", response.status_code)
+        return response
 
-async def send_text_message(to: str, message: str) -> Dict:
+async def send_text_message(
+    to: str,
+    message: str,
+    idempotency_key: Optional[str] = None,
+    tenant: Optional[Tenant] = None
+) -> Dict:
     """
     Send a text message via WhatsApp API.
 
     Args:
         to (str): Recipient phone number with country code (e.g., "+1234567890").
         message (str): The text message content.
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
 
     Returns:
         Dict: JSON response from the WhatsApp API.
@@ -35,14 +114,15 @@ async def send_text_message(to: str, message: str) -> Dict:
         "text": {"body": message}
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{API_URL}/messages", headers=HEADERS, json=payload)
-        return response.json()
+    response = await _post_message(payload, idempotency_key, tenant=tenant)
+    return response.json()
 
 async def send_template_message_with_no_params(
     to: str,
     template_name: str,
-    lang_code: str
+    lang_code: str,
+    idempotency_key: Optional[str] = None,
+    tenant: Optional[Tenant] = None
 ) -> Dict:
     """
     Send a WhatsApp template message without parameters.
@@ -51,6 +131,8 @@ async def send_template_message_with_no_params(
         to (str): Recipient phone number with country code.
         template_name (str): Name of the approved WhatsApp template.
         lang_code (str): Language code for the template (e.g., "en_US").
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
 
     Returns:
         Dict: JSON response from the WhatsApp API.
@@ -68,15 +150,14 @@ async def send_template_message_with_no_params(
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{API_URL}/messages", headers=HEADERS, json=payload, timeout=30.0)
-        return response.json()
+    response = await _post_message(payload, idempotency_key, tenant=tenant)
+    return response.json()
 
 
 
 # ============================ STARTING FROM HERE==============================
 
-async def send_language_selection_prompt(to: str,text:str):
+async def send_language_selection_prompt(to: str,text:str, idempotency_key: Optional[str] = None, tenant: Optional[Tenant] = None):
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
@@ -106,24 +187,20 @@ async def send_language_selection_prompt(to: str,text:str):
             }
         }
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            API_URL,
-            headers=HEADERS,
-            json=payload,             
-            timeout=30.0
-        )
-        # if not response:
-        #     return random("swahili","english")
-        # else:
-        return response.json()
+    response = await _post_message(payload, idempotency_key, tenant=tenant)
+    # if not response:
+    #     return random("swahili","english")
+    # else:
+    return response.json()
 
 async def send_template_message(
     to: str,
     template_name: str,
     lang_code: str,
     parameters: Optional[List[str]] = None,
-    expected_params: int = 0
+    expected_params: int = 0,
+    idempotency_key: Optional[str] = None,
+    tenant: Optional[Tenant] = None
 ) -> Dict:
     """
     Send a WhatsApp template message with optional parameters and validation.
@@ -134,6 +211,8 @@ async def send_template_message(
         lang_code (str): Language code for the template (e.g., "en_US").
         parameters (Optional[List[str]]): List of parameter values for the template.
         expected_params (int): Number of parameters the template expects.
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
 
     Returns:
         Dict: JSON response from the WhatsApp API or error details.
@@ -178,9 +257,8 @@ async def send_template_message(
         }]
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(API_URL, headers=HEADERS, json=payload, timeout=30.0)
-            return response.json()
+        response = await _post_message(payload, idempotency_key, tenant=tenant)
+        return response.json()
     except Exception as e:
         return {
             "error": {
@@ -190,12 +268,106 @@ async def send_template_message(
             }
         }
 
+async def send_catalog_template(
+    to: str,
+    template_name: str,
+    lang_code: str,
+    parameters: Optional[List[str]] = None,
+    idempotency_key: Optional[str] = None,
+    tenant: Optional[Tenant] = None
+) -> Dict:
+    """
+    Send a template using its compiled skeleton from the template catalog.
+
+    The parameter count is derived from the approved template definition, so
+    callers no longer pass ``expected_params``.
+
+    Args:
+        to (str): Recipient phone number with country code.
+        template_name (str): Name of the approved WhatsApp template.
+        lang_code (str): Language code for the template (e.g., "en_US").
+        parameters (Optional[List[str]]): Header then body parameter values.
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
+
+    Returns:
+        Dict: JSON response from the WhatsApp API.
+
+    Raises:
+        TemplateNotFound: If the template is not in the catalog.
+        TemplateParameterError: If the parameter count does not match.
+    """
+    tenant = tenant or tenant_registry.default()
+    skeleton = await tenant.template_catalog.get(template_name, lang_code)
+    response = await _post_message(skeleton.render(to, parameters), idempotency_key, tenant=tenant)
+    return response.json()
+
+async def send_template_bulk(
+    recipients: List[str],
+    template_name: str,
+    lang_code: str,
+    parameters: Optional[List[str]] = None,
+    per_recipient_parameters: Optional[Dict[str, List[str]]] = None,
+    concurrency: int = 20,
+    idempotency_prefix: Optional[str] = None,
+    tenant: Optional[Tenant] = None
+) -> List[Dict]:
+    """
+    Send one catalog template to many recipients.
+
+    The template is looked up and validated once; each message only renders
+    its skeleton. ``concurrency`` workers take recipients in order, so at most
+    that many requests (and tasks) are in flight however long the list is, and
+    the tenant's rate limiter paces them to its messaging throughput.
+
+    Args:
+        recipients (List[str]): Recipient phone numbers.
+        template_name (str): Name of the approved WhatsApp template.
+        lang_code (str): Language code for the template.
+        parameters (Optional[List[str]]): Parameters shared by all recipients.
+        per_recipient_parameters (Optional[Dict[str, List[str]]]): Overrides keyed by recipient.
+        concurrency (int): Maximum simultaneous Graph API calls.
+        idempotency_prefix (Optional[str]): If set, each send uses
+            ``{prefix}:{recipient}`` as idempotency key so a re-run skips sent messages.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
+
+    Returns:
+        List[Dict]: One result per recipient, in input order: ``{"to", "response"}``
+        when Graph accepted the message, ``{"to", "error"}`` otherwise
+        (including Graph error bodies).
+    """
+    tenant = tenant or tenant_registry.default()
+    skeleton = await tenant.template_catalog.get(template_name, lang_code)
+    per_recipient_parameters = per_recipient_parameters or {}
+    results: List[Optional[Dict]] = [None] * len(recipients)
+    pending = iter(enumerate(recipients))
+
+    async def send_one(to: str) -> Dict:
+        try:
+            body = skeleton.render(to, per_recipient_parameters.get(to, parameters))
+            key = f"{idempotency_prefix}:{to}" if idempotency_prefix else None
+            response = (await _post_message(body, key, tenant=tenant)).json()
+        except Exception as e:
+            return {"to": to, "error": {"message": str(e), "type": type(e).__name__}}
+        if "error" in response:
+            return {"to": to, "error": response["error"]}
+        return {"to": to, "response": response}
+
+    async def worker() -> None:
+        # Workers share one iterator, so each recipient is sent exactly once
+        for i, to in pending:
+            results[i] = await send_one(to)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(recipients)))))
+    return results
+
 async def send_flow_message(
     to: str,
     flow_name: str = "jenga survey",
     flow_id: str = "",
-    flow_token: str =""
-    
+    flow_token: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    tenant: Optional[Tenant] = None
 ) -> Dict:
     """
     Send an interactive WhatsApp flow message.
@@ -204,6 +376,10 @@ async def send_flow_message(
         to (str): Recipient phone number with country code.
         flow_name (str): Name of the flow (default: "jenga survey").
         flow_id (str): ID of the WhatsApp flow.
+        flow_token (Optional[str]): Token echoed back on every data exchange request;
+            a new unique token is minted if omitted.
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
 
     Returns:
         Dict: JSON response from the WhatsApp API.
@@ -211,6 +387,7 @@ async def send_flow_message(
     Raises:
         httpx.HTTPError: If the API request fails.
     """
+    flow_token = flow_token or uuid.uuid4().hex
     # This was testing if things are working if we could modify them from the backend
     if flow_name == "azam_v1": # this 
         flow_cta="Kata ticketi"
@@ -246,29 +423,118 @@ async def send_flow_message(
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{API_URL}/messages", headers=HEADERS, json=payload)
-        if response.status_code != 200:
-            print("Failed response:", response.status_code, response.text)
-            response.raise_for_status()  # This will show detailed error
+    # Starts the flow_token journey, or links the current one (e.g. a webhook reply) to it
+    with tracer.span("whatsapp.send_flow", key=flow_token, attributes={"flow_name": flow_name}) as span:
+        span.link(flow_token)
+        response = await _post_message(payload, idempotency_key, tenant=tenant)
+    if response.status_code != 200:
+        print("Failed response:", response.status_code, response.text)
+        response.raise_for_status()  # This will show detailed error
 
-        return response.json()
+    return response.json()
 
 # register business encryption
 
-async def register_business_encryption():
+async def upload_media(
+    content: bytes,
+    mime_type: str,
+    filename: str,
+    tenant: Optional[Tenant] = None
+) -> str:
+    """
+    Upload a file to the Graph API so it can be sent by media id.
+
+    Media ids belong to the business number that uploaded them and stay valid
+    for 30 days.
+
+    Args:
+        content (bytes): File content.
+        mime_type (str): MIME type, e.g. "application/pdf".
+        filename (str): File name shown to the recipient.
+        tenant (Optional[Tenant]): Business number to upload for (default tenant if None).
+
+    Returns:
+        str: The media id.
+
+    Raises:
+        HTTPException: If the upload is rejected.
+        httpx.HTTPError: If the API request fails.
+    """
+    tenant = tenant or tenant_registry.default()
+    with tracer.span("graph.media", attributes={"tenant": tenant.tenant_id, "media.bytes": len(content)}):
+        response = await tenant.client.request(
+            "POST",
+            f"{tenant.config.api_url}/media",
+            endpoint="media",
+            # multipart body: the JSON content type of the shared headers must not be sent
+            headers={"Authorization": tenant.config.headers["Authorization"]},
+            data={"messaging_product": "whatsapp", "type": mime_type},
+            files={"file": (filename, content, mime_type)},
+            timeout=60.0,
+        )
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()["id"]
+
+async def send_media_message(
+    to: str,
+    media_id: str,
+    media_type: str = "document",
+    caption: Optional[str] = None,
+    filename: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+    tenant: Optional[Tenant] = None
+) -> Dict:
+    """
+    Send an uploaded image, document, audio or video by media id.
+
+    Args:
+        to (str): Recipient phone number with country code.
+        media_id (str): Id returned by ``upload_media``.
+        media_type (str): "document", "image", "audio" or "video".
+        caption (Optional[str]): Caption (documents, images and videos only).
+        filename (Optional[str]): File name shown for documents.
+        idempotency_key (Optional[str]): Key that stops this process from repeating the send.
+        tenant (Optional[Tenant]): Business number to send from (default tenant if None).
+
+    Returns:
+        Dict: JSON response from the WhatsApp API.
+
+    Raises:
+        httpx.HTTPError: If the API request fails.
+    """
+    media: Dict = {"id": media_id}
+    if caption and media_type != "audio":
+        media["caption"] = caption
+    if filename and media_type == "document":
+        media["filename"] = filename
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to,
+        "type": media_type,
+        media_type: media,
+    }
+    response = await _post_message(payload, idempotency_key, tenant=tenant)
+    return response.json()
+
+async def register_business_encryption(tenant: Optional[Tenant] = None):
+    tenant = tenant or tenant_registry.default()
     public_key, private_key = generate_rsa_key_pair()
     
-    # save the keys into loacalfiles
-    save_key_to_file(public_key, "public.pem")
-    save_key_to_file(private_key, "private.pem")
-
-    url = f"{API_URL}/{phone_number_id}/whatsapp_business_encryption"
+    # save the keys into loacalfiles (tenants with their own key path get "<name>.pub.pem" next to it)
+    private_key_path = tenant.config.private_key_path or "private.pem"
+    public_key_path = f"{os.path.splitext(private_key_path)[0]}.pub.pem" if tenant.config.private_key_path else "public.pem"
+    save_key_to_file(public_key, public_key_path)
+    save_key_to_file(private_key, private_key_path)
+    forget_private_key(tenant.config.private_key_path)
+
+    url = f"{tenant.config.api_url}/whatsapp_business_encryption"
     data = {
         "business_public_key": public_key
     }
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(url, data=data, headers=HEADERS)
+    response = await tenant.client.request(
+        "POST", url, endpoint="whatsapp_business_encryption", data=data, headers=tenant.config.headers
+    )
 
     
 